@@ -0,0 +1,113 @@
+#!/usr/bin/env python3
+"""Нагрузочный тест HTTP API: создание и удаление N потоков на fake ffmpeg, задержки p50/p99.
+
+Поднимает `python -m rtmp_to_rtsp_converter.api` отдельным процессом (FFMPEG_PATH -> fake_ffmpeg.py)
+и прогоняет фазы: поштучное создание, список, метрики, поштучная остановка, удаление,
+затем массовое создание/остановку одним запросом.
+
+    python benchmarks/bench_api.py --streams 500 --concurrency 16
+"""
+import os
+import sys
+import json
+import time
+import socket
+import argparse
+import subprocess
+import http.client
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+ROOT_DIR = os.path.dirname(BENCH_DIR)
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def percentile(values, p):
+    ordered = sorted(values)
+    if not ordered:
+        return float("nan")
+    return ordered[min(len(ordered) - 1, int(round(p / 100.0 * (len(ordered) - 1))))]
+
+
+class Client:
+    """HTTP-клиент с keep-alive соединением на поток."""
+    def __init__(self, port):
+        self.port = port
+        self._local = threading.local()
+
+    def request(self, method, path, payload=None):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = self._local.conn = http.client.HTTPConnection("127.0.0.1", self.port, timeout=120)
+        body = json.dumps(payload).encode() if payload is not None else None
+        started = time.perf_counter()
+        conn.request(method, path, body=body, headers={"Content-Type": "application/json"})
+        response = conn.getresponse()
+        data = response.read()
+        elapsed_ms = 1000 * (time.perf_counter() - started)
+        return response.status, (json.loads(data) if data else None), elapsed_ms
+
+
+def run_phase(client, name, calls, concurrency):
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        results = list(pool.map(lambda call: client.request(*call), calls))
+    wall = time.perf_counter() - started
+    latencies = [r[2] for r in results]
+    errors = sum(1 for r in results if r[0] >= 400)
+    print(f"{name:>28}: {len(calls):>5} запросов, p50 {percentile(latencies, 50):8.1f} мс, "
+          f"p99 {percentile(latencies, 99):8.1f} мс, ошибок {errors:>3}, всего {wall:6.2f} с")
+    return results
+
+
+def spec(i, prefix):
+    return {"stream_id": f"{prefix}_{i}", "rtmp_url": f"rtmp://127.0.0.1/live/{i}",
+            "rtsp_server_host": "127.0.0.1", "rtsp_port": 8554, "rtsp_path": f"{prefix}_{i}"}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--streams", type=int, default=500)
+    parser.add_argument("--concurrency", type=int, default=16)
+    args = parser.parse_args()
+
+    port = free_port()
+    env = dict(os.environ, FFMPEG_PATH=os.environ.get("FFMPEG_PATH", os.path.join(BENCH_DIR, "fake_ffmpeg.py")),
+               KAZSTREAMLINK_ADMISSION="0") # Нагрузка задается числом потоков, контроль допуска ее бы срезал
+    server = subprocess.Popen(
+        [sys.executable, "-m", "rtmp_to_rtsp_converter.api", "--host", "127.0.0.1", "--port", str(port)],
+        cwd=ROOT_DIR, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+    )
+    try:
+        client = Client(port)
+        for _ in range(100): # Ждем, пока сервер начнет принимать соединения
+            try:
+                client.request("GET", "/health")
+                break
+            except OSError:
+                client._local.conn = None
+                time.sleep(0.1)
+
+        n, c = args.streams, args.concurrency
+        run_phase(client, "создание (по одному)", [("POST", "/streams", spec(i, "one")) for i in range(n)], c)
+        run_phase(client, "список потоков", [("GET", "/streams")] * 20, c)
+        run_phase(client, "метрики всех потоков", [("GET", "/streams/metrics")] * 20, c)
+        run_phase(client, "остановка (по одному)", [("POST", f"/streams/one_{i}/stop") for i in range(n)], c)
+        run_phase(client, "удаление (по одному)", [("DELETE", f"/streams/one_{i}") for i in range(n)], c)
+
+        bulk = run_phase(client, "массовое создание", [("POST", "/streams", {"streams": [spec(i, "bulk") for i in range(n)]})], 1)
+        print(f"{'':>28}  создано {bulk[0][1]['created']} из {n}")
+        run_phase(client, "массовая остановка", [("POST", "/streams/stop", {})], 1)
+    finally:
+        server.terminate()
+        server.wait(timeout=10)
+
+
+if __name__ == "__main__":
+    main()
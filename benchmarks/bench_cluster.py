@@ -0,0 +1,133 @@
+#!/usr/bin/env python3
+"""Кластер на одной машине: координатор и несколько узлов с заменителем FFmpeg (fake_ffmpeg.py).
+
+Сценарий:
+  1. запуск координатора (cluster.py) и --workers узлов (api.py --coordinator), у каждого свой реестр и NODE_ID;
+  2. массовое создание --streams потоков через координатор и распределение по узлам;
+  3. drain первого узла: потоки переносятся на остальные (остановка, затем запуск);
+  4. отказ второго узла (SIGKILL его группы процессов вместе с FFmpeg): координатор замечает
+     пропавший heartbeat и создает потоки на оставшихся узлах.
+Для каждого шага печатается время до того, как все потоки снова работают, и распределение.
+
+Запуск из корня проекта:
+    python benchmarks/bench_cluster.py --workers 3 --streams 30 --placement least_loaded
+"""
+import os
+import sys
+import time
+import json
+import signal
+import argparse
+import tempfile
+import subprocess
+import urllib.request
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+ROOT_DIR = os.path.dirname(BENCH_DIR)
+
+
+def call(url, method="GET", body=None):
+    data = json.dumps(body).encode("utf-8") if body is not None else None
+    request = urllib.request.Request(url, data=data, method=method, headers={"Content-Type": "application/json"})
+    with urllib.request.urlopen(request, timeout=60) as response:
+        return json.loads(response.read() or b"null")
+
+
+def spawn(args, env, log_path):
+    log = open(log_path, "wb")
+    return subprocess.Popen([sys.executable, "-m", *args], cwd=ROOT_DIR, env=env, stdout=log, stderr=subprocess.STDOUT,
+                            start_new_session=True) # Своя группа процессов: SIGKILL группы = отказ узла с его FFmpeg
+
+
+def wait_for(predicate, timeout=60, step=0.2):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            if predicate():
+                return True
+        except OSError:
+            pass
+        time.sleep(step)
+    return False
+
+
+def distribution(coordinator):
+    counts = {}
+    for stream in call(f"{coordinator}/streams")["streams"]:
+        counts[stream["node_id"]] = counts.get(stream["node_id"], 0) + 1
+    return dict(sorted(counts.items()))
+
+
+def all_running(coordinator, count):
+    streams = call(f"{coordinator}/streams")["streams"]
+    return len(streams) == count and all(s["status"] == "запущен" for s in streams)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--workers", type=int, default=3)
+    parser.add_argument("--streams", type=int, default=30)
+    parser.add_argument("--max-streams", type=int, default=0, help="KAZSTREAMLINK_NODE_MAX_STREAMS узлов (0 - без предела)")
+    parser.add_argument("--placement", default="least_loaded", choices=["least_loaded", "binpack"])
+    parser.add_argument("--base-port", type=int, default=18090)
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="kazstreamlink_cluster_")
+    coordinator = f"http://127.0.0.1:{args.base_port}"
+    env = dict(os.environ, FFMPEG_PATH=os.path.join(BENCH_DIR, "fake_ffmpeg.py"), KAZSTREAMLINK_PROBE_CACHE="0",
+               KAZSTREAMLINK_HEARTBEAT="1", KAZSTREAMLINK_NODE_TIMEOUT="3", KAZSTREAMLINK_STOP_TIMEOUT="2",
+               KAZSTREAMLINK_NODE_MAX_STREAMS=str(args.max_streams), KAZSTREAMLINK_PACK_SIZE="1",
+               KAZSTREAMLINK_ADMISSION="0") # Емкость узлов здесь ограничивает --max-streams
+    processes = [spawn(["rtmp_to_rtsp_converter.cluster", "--host", "127.0.0.1", "--port", str(args.base_port),
+                        "--placement", args.placement], env, os.path.join(workdir, "coordinator.log"))]
+    workers = []
+    try:
+        for i in range(args.workers):
+            port = args.base_port + 1 + i
+            worker_env = dict(env, KAZSTREAMLINK_NODE_ID=f"worker_{i}",
+                              KAZSTREAMLINK_REGISTRY=os.path.join(workdir, f"worker_{i}.sqlite3"))
+            process = spawn(["rtmp_to_rtsp_converter.api", "--host", "127.0.0.1", "--port", str(port),
+                             "--coordinator", coordinator, "--advertise-url", f"http://127.0.0.1:{port}"],
+                            worker_env, os.path.join(workdir, f"worker_{i}.log"))
+            processes.append(process)
+            workers.append(process)
+        if not wait_for(lambda: call(f"{coordinator}/health")["nodes_up"] == args.workers):
+            sys.exit(f"Узлы не подключились к координатору, логи: {workdir}")
+        print(f"Узлов: {args.workers}, политика: {args.placement}, логи: {workdir}")
+        print(f"{'шаг':>10} {'время, с':>9} {'перенесено':>11}  распределение")
+
+        specs = [{"rtmp_url": f"rtmp://127.0.0.1/live/{i}", "rtsp_server_host": "127.0.0.1", "rtsp_port": 8554,
+                  "rtsp_path": f"cluster_{i}"} for i in range(args.streams)]
+        started = time.perf_counter()
+        result = call(f"{coordinator}/streams", "POST", {"streams": specs})
+        created = result["created"]
+        wait_for(lambda: all_running(coordinator, created))
+        print(f"{'создание':>10} {time.perf_counter() - started:>9.2f} {'-':>11}  {distribution(coordinator)}")
+
+        started = time.perf_counter()
+        moved = call(f"{coordinator}/nodes/worker_0/drain", "POST")["moved"]
+        wait_for(lambda: all_running(coordinator, created))
+        print(f"{'drain':>10} {time.perf_counter() - started:>9.2f} {moved:>11}  {distribution(coordinator)}")
+
+        if args.workers > 2:
+            moves_before = call(f"{coordinator}/health")["moves"]
+            started = time.perf_counter()
+            os.killpg(workers[1].pid, signal.SIGKILL)
+            wait_for(lambda: call(f"{coordinator}/health")["moves"] > moves_before and all_running(coordinator, created))
+            moved = call(f"{coordinator}/health")["moves"] - moves_before
+            print(f"{'отказ':>10} {time.perf_counter() - started:>9.2f} {moved:>11}  {distribution(coordinator)}")
+    finally:
+        for process in processes:
+            try:
+                os.killpg(process.pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+        for process in processes:
+            try:
+                process.wait(timeout=15)
+            except subprocess.TimeoutExpired:
+                os.killpg(process.pid, signal.SIGKILL)
+
+
+if __name__ == "__main__":
+    main()
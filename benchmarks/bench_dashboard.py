@@ -0,0 +1,104 @@
+#!/usr/bin/env python3
+"""Бенчмарк отрисовки дашборда Streamlit: время полного прогона скрипта при 10/100/500 потоках.
+
+Скрипт приложения выполняется через streamlit.testing.v1.AppTest в этом же процессе, поэтому
+он видит тот же менеджер конвертеров (get_manager), который бенчмарк заполняет потоками.
+Потоки запускаются на заменителе FFmpeg (fake_ffmpeg.py) и упаковываются в группы
+(KAZSTREAMLINK_PACK_SIZE), чтобы 500 потоков не требовали 500 процессов.
+
+Замеряются:
+  * постраничный список (10 и 100 потоков на странице);
+  * --baseline-ref: версия streamlit_app.py из указанной ревизии git (например, до перехода
+    на фрагменты), которая рисует все потоки за один прогон.
+
+Запуск из корня проекта:
+    python benchmarks/bench_dashboard.py --streams 10 100 500 --baseline-ref HEAD~1
+"""
+import os
+import sys
+import time
+import argparse
+import tempfile
+import statistics
+import subprocess
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+ROOT_DIR = os.path.dirname(BENCH_DIR)
+APP_PATH = os.path.join(ROOT_DIR, "streamlit_app.py")
+
+os.environ.setdefault("FFMPEG_PATH", os.path.join(BENCH_DIR, "fake_ffmpeg.py"))
+os.environ.setdefault("KAZSTREAMLINK_PACK_SIZE", "50")
+os.environ.setdefault("KAZSTREAMLINK_REGISTRY", "") # Потоки бенчмарка не сохраняются в реестр
+os.environ.setdefault("KAZSTREAMLINK_ADMISSION", "0") # Нагрузка задается числом потоков, контроль допуска ее бы срезал
+sys.path.insert(0, ROOT_DIR)
+
+
+def _resize_fleet(manager, count):
+    """Доводит число потоков в менеджере до count (новые добавляются, лишние останавливаются и удаляются)."""
+    existing = manager.converters()
+    if len(existing) > count:
+        extra = [c.stream_id for c in existing[count:]]
+        manager.stop_many(extra)
+        for stream_id in extra:
+            manager.remove(stream_id)
+    elif len(existing) < count:
+        specs = [{"rtmp_url": f"rtmp://127.0.0.1/live/{i}", "rtsp_server_host": "127.0.0.1", "rtsp_port": 8554,
+                  "rtsp_path": f"bench_{i}"} for i in range(len(existing), count)]
+        manager.create_many(specs)
+    time.sleep(2.0) # Первые блоки -progress и замеры CPU
+
+
+def _time_runs(app_test, repeat, page_size=None):
+    if page_size is not None:
+        app_test.session_state["page_size"] = page_size
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        app_test.run()
+        timings.append(time.perf_counter() - started)
+        if app_test.exception:
+            raise RuntimeError(app_test.exception[0].message)
+    return statistics.median(timings), len(app_test.button)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--streams", type=int, nargs="+", default=[10, 100, 500])
+    parser.add_argument("--repeat", type=int, default=5, help="Прогонов на замер (берется медиана)")
+    parser.add_argument("--baseline-ref", help="Ревизия git, streamlit_app.py из которой замерить для сравнения")
+    args = parser.parse_args()
+
+    from streamlit.testing.v1 import AppTest
+    from rtmp_to_rtsp_converter.manager import get_manager
+
+    baseline_path = None
+    if args.baseline_ref:
+        source = subprocess.run(["git", "show", f"{args.baseline_ref}:streamlit_app.py"], cwd=ROOT_DIR,
+                                capture_output=True, text=True, check=True).stdout
+        handle, baseline_path = tempfile.mkstemp(suffix="_streamlit_app.py")
+        with os.fdopen(handle, "w") as f:
+            f.write(source)
+
+    manager = get_manager()
+    print(f"{'потоков':>8} {'вариант':>26} {'прогон, мс':>11} {'кнопок':>7}")
+    try:
+        for stream_count in args.streams:
+            _resize_fleet(manager, stream_count)
+            app_test = AppTest.from_file(APP_PATH, default_timeout=120)
+            for page_size in (10, 100):
+                elapsed, buttons = _time_runs(app_test, args.repeat, page_size)
+                print(f"{stream_count:>8} {f'фрагменты, {page_size} на странице':>26} {elapsed * 1000:>11.1f} {buttons:>7}")
+            if baseline_path:
+                elapsed, buttons = _time_runs(AppTest.from_file(baseline_path, default_timeout=600), args.repeat)
+                print(f"{stream_count:>8} {args.baseline_ref:>26} {elapsed * 1000:>11.1f} {buttons:>7}")
+            started = time.perf_counter()
+            manager.snapshot(max_age=0)
+            print(f"{stream_count:>8} {'снимок менеджера':>26} {(time.perf_counter() - started) * 1000:>11.1f} {'-':>7}")
+    finally:
+        manager.stop_many()
+        if baseline_path:
+            os.unlink(baseline_path)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,82 @@
+#!/usr/bin/env python3
+"""Бенчмарк дедупликации источников (dedup.py) на заменителе FFmpeg: процессы, память и входящий трафик.
+
+Создается --streams потоков на --sources источников (поток i тянет источник i % sources, URL записаны
+по-разному: регистр хоста, порт по умолчанию, лишние "/"). Один и тот же набор запускается дважды:
+с дедупликацией и без нее (ConverterManager(dedup=False)), после --seconds работы сравниваются:
+  число процессов FFmpeg и подключений к источникам;
+  суммарный RSS и CPU процессов (по замерам сборщика метрик);
+  входящий трафик источников, Мбит/с (битрейт процесса на каждое подключение);
+  время массового создания потоков.
+
+Запуск из корня проекта:
+    python benchmarks/bench_dedup.py --streams 24 --sources 6 --seconds 5
+"""
+import os
+import sys
+import time
+import argparse
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(BENCH_DIR))
+
+# Варианты записи одного источника, которые normalise_source сводит к одному ключу
+URL_VARIANTS = ("rtmp://127.0.0.1/live/src{}", "RTMP://127.0.0.1:1935/live/src{}", "rtmp://127.0.0.1//live/src{}/")
+
+
+def run(manager_class, args, dedup):
+    manager = manager_class(pack_size=1, dedup=dedup)
+    specs = [{"rtmp_url": URL_VARIANTS[(i // args.sources) % len(URL_VARIANTS)].format(i % args.sources),
+              "rtsp_server_host": "127.0.0.1", "rtsp_port": 8554, "rtsp_path": f"cam{i}"}
+             for i in range(args.streams)]
+    started = time.perf_counter()
+    results = manager.create_many(specs)
+    create_seconds = time.perf_counter() - started
+    time.sleep(args.seconds)
+    processes = {}
+    for converter in manager.converters():
+        owner = getattr(converter, "group", converter) # Процесс общей группы считается один раз
+        if owner.process is not None and owner.process.poll() is None:
+            processes[id(owner)] = owner
+    memory = sum(p.metrics.memory_mb for p in processes.values() if isinstance(p.metrics.memory_mb, (int, float)))
+    cpu = sum(p.metrics.cpu_percent for p in processes.values() if isinstance(p.metrics.cpu_percent, (int, float)))
+    ingest = sum(p.metrics.bitrate_kbit for p in processes.values() if isinstance(p.metrics.bitrate_kbit, (int, float)))
+    report = manager.dedup_report()
+    manager.shutdown()
+    return {
+        "ok": sum(1 for r in results if r["ok"]),
+        "processes": len(processes),
+        "memory_mb": memory,
+        "cpu_percent": cpu,
+        "ingest_mbit": ingest / 1000,
+        "create_s": create_seconds,
+        "saved_pulls": report["saved"]["source_pulls"],
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--streams", type=int, default=24)
+    parser.add_argument("--sources", type=int, default=6)
+    parser.add_argument("--seconds", type=float, default=5.0, help="Сколько работать перед замером")
+    parser.add_argument("--progress-period", type=float, default=0.2, help="Период блоков -progress заменителя FFmpeg")
+    args = parser.parse_args()
+
+    os.environ.setdefault("FFMPEG_PATH", os.path.join(BENCH_DIR, "fake_ffmpeg.py"))
+    os.environ["KAZSTREAMLINK_REGISTRY"] = ""
+    os.environ["KAZSTREAMLINK_ADMISSION"] = "0"
+    os.environ["FAKE_FFMPEG_PROGRESS_PERIOD"] = str(args.progress_period)
+    from rtmp_to_rtsp_converter.manager import ConverterManager
+
+    print(f"потоков: {args.streams}, источников: {args.sources}, замер через {args.seconds:g} с")
+    print(f"{'режим':<18}{'потоков':>8}{'процессов':>10}{'RSS, МБ':>10}{'CPU, %':>8}{'вход, Мбит/с':>14}{'создание, с':>13}")
+    for title, dedup in (("без дедупликации", False), ("с дедупликацией", True)):
+        row = run(ConverterManager, args, dedup)
+        print(f"{title:<18}{row['ok']:>8}{row['processes']:>10}{row['memory_mb']:>10.1f}{row['cpu_percent']:>8.1f}"
+              f"{row['ingest_mbit']:>14.1f}{row['create_s']:>13.2f}")
+        if dedup:
+            print(f"не тянутся повторно (GET /dedup): {row['saved_pulls']} подключений к источникам")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,91 @@
+#!/usr/bin/env python3
+"""Бенчмарк индекса записи (recording.py): поиск сегмента по времени bisect против линейного просмотра.
+
+Для каждого числа сегментов из --segments индекс заполняется сегментами по --segment-sec секунд
+(как после суток записи с 6-секундными сегментами - 14400 сегментов), затем замеряются:
+  add    - добавление сегмента в память и в index.tsv, мкс;
+  find   - поиск сегмента, содержащего случайный момент, мкс (bisect, O(log n));
+  linear - тот же поиск просмотром списка, мкс (O(n));
+  load   - чтение index.tsv при старте сервиса, мс;
+  expire - удаление по сроку хранения половины индекса с перезаписью index.tsv, мс.
+
+Запуск из корня проекта:
+    python benchmarks/bench_dvr.py --segments 1000 14400 100000
+"""
+import os
+import sys
+import time
+import random
+import shutil
+import argparse
+import tempfile
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(BENCH_DIR))
+
+from rtmp_to_rtsp_converter.recording import SegmentIndex
+
+
+def linear_find(entries, at):
+    for start, duration, size, name in entries:
+        if start <= at < start + duration:
+            return name
+    return None
+
+
+def run(count, segment_sec, lookups):
+    directory = tempfile.mkdtemp(prefix="kazstreamlink_dvr_")
+    try:
+        index = SegmentIndex(directory)
+        base = 1_700_000_000.0
+        started = time.perf_counter()
+        for i in range(count):
+            start = base + i * segment_sec
+            index.add(start, segment_sec, 4_500_000, f"{int(start)}.ts")
+        index.flush()
+        add_us = (time.perf_counter() - started) / count * 1e6
+
+        rng = random.Random(0)
+        moments = [base + rng.uniform(0, count * segment_sec) for _ in range(lookups)]
+        started = time.perf_counter()
+        for at in moments:
+            index.find(at)
+        find_us = (time.perf_counter() - started) / lookups * 1e6
+
+        entries = list(index._entries)
+        linear_lookups = max(lookups // 100, 10)
+        started = time.perf_counter()
+        for at in moments[:linear_lookups]:
+            linear_find(entries, at)
+        linear_us = (time.perf_counter() - started) / linear_lookups * 1e6
+
+        index.close()
+        reloaded = SegmentIndex(directory)
+        started = time.perf_counter()
+        reloaded.load()
+        load_ms = (time.perf_counter() - started) * 1e3
+
+        started = time.perf_counter()
+        reloaded.expire(base + count * segment_sec, count * segment_sec / 2, 0)
+        expire_ms = (time.perf_counter() - started) * 1e3
+        reloaded.close()
+        return add_us, find_us, linear_us, load_ms, expire_ms
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--segments", type=int, nargs="+", default=[1000, 14400, 100000])
+    parser.add_argument("--segment-sec", type=float, default=6.0)
+    parser.add_argument("--lookups", type=int, default=20000)
+    args = parser.parse_args()
+
+    print(f"{'сегментов':>10} {'add, мкс':>9} {'find, мкс':>10} {'linear, мкс':>12} {'load, мс':>9} {'expire, мс':>11}")
+    for count in args.segments:
+        add_us, find_us, linear_us, load_ms, expire_ms = run(count, args.segment_sec, args.lookups)
+        print(f"{count:>10} {add_us:>9.2f} {find_us:>10.2f} {linear_us:>12.1f} {load_ms:>9.1f} {expire_ms:>11.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,111 @@
+#!/usr/bin/env python3
+"""Бенчмарк оценки здоровья узла: один векторный проход HealthEngine.evaluate против цикла Python по потокам.
+
+Для --streams потоков заполняется полное окно истории (часть потоков зависает, замедляется,
+теряет кадры или битрейт), затем замеряется один тик оценки. Эталонный вариант проверяет
+те же правила по каждому потоку отдельно, как это делал бы код внутри конвертера.
+
+Запуск из корня проекта:
+    python benchmarks/bench_health.py --streams 100 1000 10000
+"""
+import os
+import sys
+import time
+import argparse
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(BENCH_DIR))
+
+from rtmp_to_rtsp_converter.health import HealthEngine, HealthRules, STALLED, SLOW, DROPS, COLLAPSE
+
+
+class _Stream:
+    def _restart_unhealthy(self, reasons):
+        pass
+
+
+def _fill(engine, streams):
+    """Полное окно замеров: каждый пятый поток чем-то болен."""
+    for t in range(engine.window):
+        for i, stream in enumerate(streams):
+            kind = i % 20
+            out_time = t * 1_000_000 if not (kind == 1 and t > engine.window // 2) else engine.window // 2 * 1_000_000
+            speed = 0.5 if kind == 2 else 1.0
+            drops = t * 20 if kind == 3 else 0
+            sent = t * 250_000 if not (kind == 4 and t > engine.window - 5) else (engine.window - 5) * 250_000
+            engine.record(stream, {"out_time_us": out_time, "speed": speed, "dropped_frames": drops, "total_size": sent})
+        if t < engine.window - 1:
+            engine.evaluate()
+
+
+def per_stream_loop(engine):
+    """Те же правила, но по одному потоку за раз (списки значений окна из тех же массивов)."""
+    r, p = engine.rules, engine.period
+    flags = []
+    for row in range(len(engine._converters)):
+        if not engine._active[row]:
+            flags.append(0)
+            continue
+        value = 0
+        out_time = list(engine._last(engine._out_time[row:row + 1], engine._k_stall + 1)[0])
+        if all(x == x for x in out_time) and max(out_time) == min(out_time):
+            value |= STALLED
+        speed = [x for x in engine._last(engine._speed[row:row + 1], engine._k_slow)[0] if x == x]
+        if len(speed) * 2 >= engine._k_slow and sum(speed) / len(speed) < r.slow_speed:
+            value |= SLOW
+        drops = engine._last(engine._drops[row:row + 1], engine._k_drop + 1)[0]
+        if (drops[0] - drops[-1]) / (engine._k_drop * p) > r.max_drop_rate:
+            value |= DROPS
+        sent = engine._last(engine._bytes[row:row + 1], engine._k_collapse + engine._k_baseline + 1)[0]
+        recent = (sent[0] - sent[engine._k_collapse]) * 8 / 1000 / (engine._k_collapse * p)
+        baseline = (sent[engine._k_collapse] - sent[-1]) * 8 / 1000 / (engine._k_baseline * p)
+        if baseline >= r.min_baseline_kbit and recent < r.collapse_ratio * baseline:
+            value |= COLLAPSE
+        flags.append(value)
+    return flags
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--streams", type=int, nargs="+", default=[100, 1000, 10000])
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args()
+
+    print(f"{'потоков':>8} {'вектор, мс':>11} {'цикл, мс':>9} {'ускорение':>10} {'degraded':>9} {'stalled':>8}")
+    for count in args.streams:
+        engine = HealthEngine(HealthRules(restart=False), period=1.0, capacity=count)
+        streams = [_Stream() for _ in range(count)]
+        for stream in streams:
+            engine.register(stream)
+        _fill(engine, streams)
+        expected = per_stream_loop(engine)
+
+        # evaluate сдвигает курсор и очищает самую старую колонку - перед каждым повтором окно восстанавливается
+        cursor = engine._cursor
+        saved = [array.copy() for array in (engine._out_time, engine._speed, engine._drops, engine._bytes)]
+        vector = 0.0
+        for _ in range(args.repeat):
+            engine._cursor = cursor
+            for array, copy in zip((engine._out_time, engine._speed, engine._drops, engine._bytes), saved):
+                array[:] = copy
+            started = time.perf_counter()
+            engine.evaluate()
+            vector += time.perf_counter() - started
+        vector /= args.repeat
+        engine._cursor = cursor
+        for array, copy in zip((engine._out_time, engine._speed, engine._drops, engine._bytes), saved):
+            array[:] = copy
+
+        started = time.perf_counter()
+        for _ in range(max(args.repeat // 10, 1)):
+            per_stream_loop(engine)
+        loop = (time.perf_counter() - started) / max(args.repeat // 10, 1)
+
+        assert list(engine.flags[:count]) == expected, "векторная оценка расходится с циклом"
+        states = engine.counts_by_state()
+        print(f"{count:>8} {vector * 1e3:>11.3f} {loop * 1e3:>9.2f} {loop / vector:>9.0f}x "
+              f"{states['degraded']:>9} {states['stalled']:>8}")
+
+
+if __name__ == "__main__":
+    main()
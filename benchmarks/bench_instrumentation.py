@@ -0,0 +1,87 @@
+#!/usr/bin/env python3
+"""Бенчмарк накладных расходов инструментации и профилировщика (profiling.py).
+
+Замеряется стоимость одного вызова, нс:
+  handler   - обработчик строки stderr как есть (так он вызывается при выключенной инструментации);
+  timed     - тот же обработчик в обертке timed() с гистограммой;
+  lock      - захват и освобождение threading.Lock;
+  contended - то же для ContendedLock (без конкуренции - самый частый случай);
+и стоимость одной выборки профилировщика (стеки всех потоков), мкс, при --threads занятых потоках.
+
+Запуск из корня проекта:
+    python benchmarks/bench_instrumentation.py --calls 1000000 --threads 8
+"""
+import os
+import sys
+import time
+import argparse
+import threading
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(BENCH_DIR))
+
+from rtmp_to_rtsp_converter.profiling import Instrumentation, ContendedLock, SamplingProfiler
+
+LINE = b"[tcp @ 0x55d1c2a3f240] Connection to tcp://10.0.0.7:1935 failed: Connection refused"
+
+
+def handler(line):
+    return line.decode("utf-8", errors="replace").strip()
+
+
+def per_call_ns(fn, calls):
+    started = time.perf_counter()
+    for _ in range(calls):
+        fn(LINE)
+    return (time.perf_counter() - started) / calls * 1e9
+
+
+def lock_ns(lock, calls):
+    started = time.perf_counter()
+    for _ in range(calls):
+        with lock:
+            pass
+    return (time.perf_counter() - started) / calls * 1e9
+
+
+def busy(stop_event, depth=12):
+    if depth:
+        return busy(stop_event, depth - 1)
+    while not stop_event.is_set():
+        sum(range(100))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--calls", type=int, default=1_000_000)
+    parser.add_argument("--threads", type=int, default=8)
+    parser.add_argument("--profile-sec", type=float, default=2.0)
+    args = parser.parse_args()
+
+    disabled = Instrumentation(enabled=False)
+    enabled = Instrumentation(enabled=True)
+    assert disabled.timed("ffmpeg.stderr_line", handler) is handler
+    raw = per_call_ns(handler, args.calls)
+    timed = per_call_ns(enabled.timed("ffmpeg.stderr_line", handler), args.calls)
+    plain_lock = lock_ns(threading.Lock(), args.calls)
+    contended_lock = lock_ns(ContendedLock(), args.calls)
+    print(f"{'handler, нс':>12} {'timed, нс':>10} {'lock, нс':>9} {'contended, нс':>14}")
+    print(f"{raw:>12.0f} {timed:>10.0f} {plain_lock:>9.0f} {contended_lock:>14.0f}")
+
+    stop_event = threading.Event()
+    workers = [threading.Thread(target=busy, args=(stop_event,), daemon=True) for _ in range(args.threads)]
+    for worker in workers:
+        worker.start()
+    profiler = SamplingProfiler()
+    profiler.start(hz=100, duration=args.profile_sec)
+    time.sleep(args.profile_sec)
+    profiler.stop()
+    stop_event.set()
+    status = profiler.status()
+    print(f"\nвыборок: {status['samples']}, стеков: {status['stacks']}, "
+          f"выборка: {1e6 * profiler.sampling_seconds / max(status['samples'], 1):.0f} мкс, "
+          f"доля времени профилировщика: {status['overhead_percent']}%")
+
+
+if __name__ == "__main__":
+    main()
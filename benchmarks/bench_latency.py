@@ -0,0 +1,97 @@
+#!/usr/bin/env python3
+"""Бенчмарк зонда задержки (latency.py): задержка выхода RTSP по меткам источника, полностью офлайн.
+
+Стенд RTSP-сервера (rtsp_standin.py) принимает публикации и раздает их зрителям. Заменитель FFmpeg
+с FAKE_FFMPEG_PUSH=1 и FAKE_FFMPEG_TIMECODE=1 - тестовый источник: перед каждым кадром он вставляет
+SEI с временем захвата кадра, на --source-lag-ms раньше отправки (кодер и RTMP до FFmpeg). Для каждого
+профиля создается --streams потоков с включенными зондами (KAZSTREAMLINK_LATENCY_PROBE=1); через --seconds
+сравниваются:
+  зонд p50/p95/p99     - квантили из метрик потока (get_metrics: latency_*), как их видят API и /metrics;
+  на сервере p50/p95   - эталон стенда: приход SEI на сервер минус метка (путь до сервера, без раздачи);
+  режим                - timecode (метки найдены) или jitter (с --no-timecode: колебания без меток).
+Зонд должен показывать задержку на сервере плюс раздачу зрителю (на одном хосте - доли миллисекунды).
+
+Перегрузку сети имитирует стенд: --stall-ms/--stall-every - паузы чтения публикаций (см. bench_profiles.py).
+
+Запуск из корня проекта:
+    python benchmarks/bench_latency.py --streams 4 --seconds 10 --source-lag-ms 200 --stall-ms 150
+"""
+import os
+import sys
+import time
+import argparse
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(BENCH_DIR))
+
+
+def run_profile(profile, args):
+    # Импорт после настройки окружения в main(): модули читают KAZSTREAMLINK_LATENCY_* при загрузке
+    from rtsp_standin import RtspStandIn, percentile
+    from rtmp_to_rtsp_converter.manager import ConverterManager
+
+    stand_in = RtspStandIn(args.rcvbuf, args.stall_ms, args.stall_every)
+    manager = ConverterManager(pack_size=1, dedup=False)
+    specs = [{"rtmp_url": f"rtmp://127.0.0.1/live/{profile}_{i}", "rtsp_server_host": "127.0.0.1",
+              "rtsp_port": stand_in.port, "rtsp_path": f"{profile}_{i}", "profile": profile}
+             for i in range(args.streams)]
+    results = manager.create_many(specs)
+    time.sleep(args.seconds)
+    metrics = [converter.get_metrics() for converter in manager.converters()]
+    probes = manager.latency_report()["probes"]
+    manager.shutdown()
+    stand_in.close()
+
+    measured = [m for m in metrics if m.get("latency_mode") not in (None, "N/A")]
+    server = [delay * 1000 for session in stand_in.sessions.values() for delay in session.timecode_delays]
+    return {
+        "ok": sum(1 for r in results if r["ok"]),
+        "probed": len(measured),
+        "modes": sorted({m["latency_mode"] for m in measured}),
+        # Медиана квантилей по потокам: у всех потоков профиля одни условия
+        "probe_ms": [percentile([m[f"latency_p{q}_ms"] for m in measured], 0.5) for q in (50, 95, 99)],
+        "server_ms": [percentile(server, q) for q in (0.5, 0.95)],
+        "frames": sum(m["latency_samples"] for m in measured),
+        "connects": sum(probe["connects"] for probe in probes),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--streams", type=int, default=4)
+    parser.add_argument("--seconds", type=float, default=10.0)
+    parser.add_argument("--profiles", default="balanced,low_latency", help="Через запятую (profiles.py)")
+    parser.add_argument("--kbit", type=float, default=4000, help="Битрейт публикации заменителя FFmpeg")
+    parser.add_argument("--source-lag-ms", type=float, default=200, help="Задержка источника до FFmpeg (метка раньше отправки)")
+    parser.add_argument("--no-timecode", action="store_true", help="Источник без меток: зонд в режиме jitter")
+    parser.add_argument("--rcvbuf", type=int, default=65536, help="Буфер приема сокетов стенда, байт")
+    parser.add_argument("--stall-ms", type=float, default=0, help="Пауза чтения стенда (0 - без перегрузки)")
+    parser.add_argument("--stall-every", type=float, default=1.0, help="Период пауз чтения, сек")
+    args = parser.parse_args()
+
+    os.environ.setdefault("FFMPEG_PATH", os.path.join(BENCH_DIR, "fake_ffmpeg.py"))
+    os.environ["KAZSTREAMLINK_REGISTRY"] = ""
+    os.environ["KAZSTREAMLINK_ADMISSION"] = "0"
+    os.environ["KAZSTREAMLINK_LATENCY_PROBE"] = "1"
+    os.environ["KAZSTREAMLINK_LATENCY_RETRY"] = "0.5"
+    os.environ["KAZSTREAMLINK_LATENCY_WINDOW"] = str(args.seconds)
+    os.environ["FAKE_FFMPEG_PUSH"] = "1"
+    os.environ["FAKE_FFMPEG_PUSH_KBIT"] = str(args.kbit)
+    os.environ["FAKE_FFMPEG_TIMECODE"] = "0" if args.no_timecode else "1"
+    os.environ["FAKE_FFMPEG_SOURCE_LAG_MS"] = str(args.source_lag_ms)
+
+    names = [name.strip() for name in args.profiles.split(",") if name.strip()]
+    print(f"потоков: {args.streams} по {args.kbit:g} кбит/с, {args.seconds:g} с; задержка источника {args.source_lag_ms:g} мс"
+          f"{', без меток' if args.no_timecode else ''}; пауза чтения {args.stall_ms:g} мс каждые {args.stall_every:g} с")
+    print(f"{'профиль':<17}{'режим':>10}{'зонд p50/p95/p99, мс':>23}{'на сервере p50/p95, мс':>25}{'кадров':>8}{'зондов':>8}")
+    for name in names:
+        row = run_profile(name, args)
+        probe = " / ".join(f"{value:.0f}" if value is not None else "-" for value in row["probe_ms"])
+        server = " / ".join(f"{value:.0f}" if value is not None else "-" for value in row["server_ms"])
+        print(f"{name:<17}{','.join(row['modes']) or '-':>10}{probe:>23}{server:>25}{row['frames']:>8}"
+              f"{row['probed']:>5}/{args.streams:<2}"
+              + ("" if row["connects"] <= args.streams else f"  (переподключений: {row['connects'] - args.streams})"))
+
+
+if __name__ == "__main__":
+    main()
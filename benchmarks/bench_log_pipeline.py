@@ -0,0 +1,107 @@
+#!/usr/bin/env python3
+"""Бенчмарк обработки stderr FFmpeg: прежний путь (logging.error на каждую строку) против StderrPipeline.
+
+Строки подаются так же, как их подает цикл ввода-вывода, для --streams потоков с битым источником
+(половина строк уникальные, половина - серия одинаковых). Лог пишется в файл, а --sink-delay
+имитирует медленный сборщик логов (задержка на каждую запись в обработчике).
+
+Замеряются время обработки строки в вызывающем потоке и число записей, дошедших до лога.
+
+Запуск из корня проекта:
+    python benchmarks/bench_log_pipeline.py --lines 200000 --streams 20 --sink-delay 0.0002
+"""
+import os
+import sys
+import time
+import logging
+import argparse
+import tempfile
+from collections import deque
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(BENCH_DIR))
+
+from rtmp_to_rtsp_converter.log_pipeline import StderrPipeline, DroppingQueueHandler, install_queue_logging
+
+
+class SlowFileHandler(logging.FileHandler):
+    """Файловый обработчик с задержкой на запись (сетевой сборщик логов)."""
+
+    def __init__(self, path, delay):
+        super().__init__(path)
+        self.delay = delay
+        self.records = 0
+
+    def emit(self, record):
+        self.records += 1
+        if self.delay:
+            time.sleep(self.delay)
+        super().emit(record)
+
+
+def _lines(count, streams):
+    batch = 50
+    for n in range(count // (batch * streams)):
+        for stream in range(streams):
+            for i in range(batch):
+                line = (f"[h264 @ 0x0] error while decoding MB {i} {n}" if i < batch // 2
+                        else "[h264 @ 0x0] Packet corrupt (stream = 0, dts = 0).")
+                yield stream, line
+
+
+def old_path(lines, logs):
+    """Прежний _handle_output_line: запись в лог и четыре поиска по line.lower() на каждую строку."""
+    for stream, line in lines:
+        entry = f"[FFmpeg stream_{stream} STDERR]: {line}"
+        logging.error(entry)
+        logs[stream].append(entry)
+        if "error" in line.lower() or "failed" in line.lower() or "corrupt" in line.lower() or "unable" in line.lower():
+            pass
+
+
+def new_path(lines, logs, pipelines):
+    emitted = 0
+    for stream, line in lines:
+        category, entries = pipelines[stream].feed(line)
+        logs[stream].extend(entries)
+        emitted += len(entries)
+    return emitted
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--lines", type=int, default=200000)
+    parser.add_argument("--streams", type=int, default=20)
+    parser.add_argument("--sink-delay", type=float, default=0.0002, help="Задержка обработчика лога на запись, с")
+    args = parser.parse_args()
+
+    root = logging.getLogger()
+    root.setLevel(logging.INFO)
+    handle, path = tempfile.mkstemp(suffix=".log")
+    os.close(handle)
+    sink = SlowFileHandler(path, args.sink_delay)
+    root.addHandler(sink)
+    print(f"{'вариант':>28} {'строк':>8} {'мкс/строку':>11} {'записей в лог':>14}")
+    try:
+        logs = [deque(maxlen=100) for _ in range(args.streams)]
+        started = time.perf_counter()
+        old_path(_lines(args.lines, args.streams), logs)
+        elapsed = time.perf_counter() - started
+        print(f"{'logging.error на строку':>28} {args.lines:>8} {elapsed / args.lines * 1e6:>11.2f} {sink.records:>14}")
+
+        sink.records = 0
+        queue_handler = install_queue_logging(root)
+        pipelines = [StderrPipeline(f"stream_{i}") for i in range(args.streams)]
+        started = time.perf_counter()
+        emitted = new_path(_lines(args.lines, args.streams), logs, pipelines)
+        elapsed = time.perf_counter() - started
+        print(f"{'StderrPipeline + очередь':>28} {args.lines:>8} {elapsed / args.lines * 1e6:>11.2f} {emitted:>14}")
+        if isinstance(queue_handler, DroppingQueueHandler):
+            print(f"Отброшено при переполнении очереди: {queue_handler.dropped_records}")
+    finally:
+        logging.shutdown()
+        os.unlink(path)
+
+
+if __name__ == "__main__":
+    main()
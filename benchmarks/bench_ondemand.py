@@ -0,0 +1,102 @@
+#!/usr/bin/env python3
+"""Бенчмарк потоков по запросу (ondemand.py) на заменителе FFmpeg: холодный старт и экономия.
+
+Создается --streams потоков с "on_demand": true. Вместо mediamtx зрителей изображают потоки скрипта:
+у каждого потока сеансы просмотра приходят в среднем раз в --arrival-sec секунд (пуассоновский поток)
+и длятся в среднем --watch-sec секунд; начало сеанса - read() (как хук runOnDemand), конец - unread()
+(как runOnUnDemand). Через --idle-sec без зрителей FFmpeg останавливается.
+
+Итог:
+  холодные старты - число и p50/p95/p99 задержки от запроса зрителя до первого пакета (точные, по замерам);
+  теплые подключения - зритель пришел к уже работающему процессу (задержки запуска нет);
+  доля времени работы процессов и сэкономленные процесс-секунды против круглосуточной работы.
+Меньший --idle-sec экономит больше, но чаще заставляет зрителей ждать холодного старта.
+
+Запуск из корня проекта:
+    python benchmarks/bench_ondemand.py --streams 20 --seconds 60 --arrival-sec 20 --watch-sec 5 --idle-sec 3
+"""
+import os
+import sys
+import time
+import random
+import argparse
+import threading
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(BENCH_DIR))
+
+
+def percentile(values, q):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))] if ordered else None
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--streams", type=int, default=20)
+    parser.add_argument("--seconds", type=float, default=60.0)
+    parser.add_argument("--arrival-sec", type=float, default=20.0, help="Средний интервал между сеансами зрителей потока")
+    parser.add_argument("--watch-sec", type=float, default=5.0, help="Средняя длительность сеанса")
+    parser.add_argument("--idle-sec", type=float, default=3.0, help="KAZSTREAMLINK_ONDEMAND_IDLE_SEC")
+    parser.add_argument("--progress-period", type=float, default=0.2, help="Период блоков -progress заменителя FFmpeg")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    os.environ.setdefault("FFMPEG_PATH", os.path.join(BENCH_DIR, "fake_ffmpeg.py"))
+    os.environ["KAZSTREAMLINK_REGISTRY"] = ""
+    os.environ["KAZSTREAMLINK_ADMISSION"] = "0"
+    os.environ["KAZSTREAMLINK_ONDEMAND_IDLE_SEC"] = str(args.idle_sec)
+    os.environ["FAKE_FFMPEG_PROGRESS_PERIOD"] = str(args.progress_period)
+    from rtmp_to_rtsp_converter.manager import ConverterManager
+
+    manager = ConverterManager(pack_size=1)
+    results = manager.create_many([
+        {"rtmp_url": f"rtmp://127.0.0.1/live/cam{i}", "rtsp_server_host": "127.0.0.1", "rtsp_port": 8554,
+         "rtsp_path": f"cam{i}", "on_demand": True}
+        for i in range(args.streams)
+    ])
+    stream_ids = [r["stream_id"] for r in results if r["ok"]]
+    cold, warm, failed = [], [], []
+    lock = threading.Lock()
+    stop = threading.Event()
+
+    def viewers(stream_id, seed):
+        rng = random.Random(seed)
+        while not stop.wait(rng.expovariate(1 / args.arrival_sec)):
+            started = time.monotonic()
+            try:
+                info = manager.on_demand.read(stream_id=stream_id)
+            except Exception as e:
+                with lock:
+                    failed.append(str(e))
+                continue
+            waited = time.monotonic() - started
+            with lock:
+                (cold if info["cold_start"] else warm).append(waited)
+            stop.wait(rng.expovariate(1 / args.watch_sec))
+            manager.on_demand.unread(stream_id=stream_id)
+
+    threads = [threading.Thread(target=viewers, args=(sid, args.seed * 1000 + i)) for i, sid in enumerate(stream_ids)]
+    for thread in threads:
+        thread.start()
+    time.sleep(args.seconds)
+    stop.set()
+    for thread in threads:
+        thread.join()
+    report = manager.on_demand.report()
+    manager.shutdown()
+
+    print(f"потоков: {len(stream_ids)}, {args.seconds:.0f} с, сеанс раз в {args.arrival_sec:g} с по {args.watch_sec:g} с, "
+          f"простой до остановки: {args.idle_sec:g} с")
+    if cold:
+        print(f"холодных стартов: {len(cold)}, ожидание зрителя p50/p95/p99: "
+              + " / ".join(f"{percentile(cold, q):.3f}" for q in (0.5, 0.95, 0.99)) + " с")
+    print(f"теплых подключений: {len(warm)}, ошибок: {len(failed)}")
+    savings = report["savings"]
+    print(f"остановок по простою: {sum(row['idle_stops'] for row in report['per_stream'])}, "
+          f"доля времени работы FFmpeg: {savings['duty_cycle']:.1%}, "
+          f"сэкономлено процесс-секунд: {savings['process_seconds']:.0f} из {len(stream_ids) * args.seconds:.0f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,99 @@
+#!/usr/bin/env python3
+"""Бенчмарк упаковки: RSS и CPU на поток для упакованных групп и для процесса на каждый поток.
+
+Каждая конфигурация выполняется в отдельном процессе Python (свой менеджер и pack_size).
+Считаются RSS и CPU всех дочерних процессов FFmpeg, а также самого хост-процесса.
+По умолчанию используется заменитель FFmpeg (fake_ffmpeg.py): его процесс легче настоящего
+FFmpeg, поэтому абсолютные числа занижены, но соотношение накладных расходов на процесс сохраняется.
+
+Запуск из корня проекта:
+    python benchmarks/bench_packing.py --streams 50 200 --pack-size 25 --window 10
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import subprocess
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+ROOT_DIR = os.path.dirname(BENCH_DIR)
+
+
+def _proc_totals(pids):
+    """(cpu_ticks, rss_bytes) суммарно по живым PID."""
+    from rtmp_to_rtsp_converter.sampler import read_proc_sample
+    cpu = rss = 0
+    for pid in pids:
+        sample = read_proc_sample(pid)
+        if sample:
+            cpu += sample[0]
+            rss += sample[2]
+    return cpu, rss
+
+
+def worker(stream_count, pack_size, window):
+    sys.path.insert(0, ROOT_DIR)
+    from rtmp_to_rtsp_converter.manager import ConverterManager
+    from rtmp_to_rtsp_converter.sampler import read_proc_sample
+
+    manager = ConverterManager(pack_size=pack_size)
+    specs = [{"stream_id": f"bench_{i}", "rtmp_url": f"rtmp://127.0.0.1/live/{i}", "rtsp_server_host": "127.0.0.1",
+              "rtsp_port": 8554, "rtsp_path": f"bench_{i}"} for i in range(stream_count)]
+    manager.create_many(specs)
+    time.sleep(3.0) # Даем процессам стартовать и начать выдавать -progress
+    pids = {c.process.pid for c in manager.converters() if c.process}
+    clk_tck = os.sysconf("SC_CLK_TCK")
+
+    children_cpu_before, _ = _proc_totals(pids)
+    host_before = read_proc_sample(os.getpid())
+    wall_before = time.monotonic()
+    time.sleep(window)
+    wall = time.monotonic() - wall_before
+    children_cpu_after, children_rss = _proc_totals(pids)
+    host_after = read_proc_sample(os.getpid())
+
+    result = {
+        "streams": stream_count,
+        "pack_size": pack_size,
+        "ffmpeg_processes": len(pids),
+        "running": sum(1 for c in manager.converters() if c.get_status() == "запущен"),
+        "ffmpeg_rss_mb_per_stream": round(children_rss / (1024 * 1024) / stream_count, 2),
+        "ffmpeg_cpu_percent_per_stream": round(100.0 * (children_cpu_after - children_cpu_before) / clk_tck / wall / stream_count, 3),
+        "host_rss_mb": round(host_after[2] / (1024 * 1024), 1),
+        "host_cpu_percent": round(100.0 * (host_after[0] - host_before[0]) / clk_tck / wall, 2),
+    }
+    manager.stop_many()
+    print(json.dumps(result))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--streams", type=int, nargs="+", default=[50, 200])
+    parser.add_argument("--pack-size", type=int, default=25, help="Потоков в одном процессе FFmpeg в режиме упаковки")
+    parser.add_argument("--window", type=float, default=10.0, help="Длительность замера CPU, сек")
+    parser.add_argument("--worker", nargs=2, type=int, metavar=("STREAMS", "PACK_SIZE"), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker:
+        worker(args.worker[0], args.worker[1], args.window)
+        return
+
+    env = dict(os.environ, FFMPEG_PATH=os.environ.get("FFMPEG_PATH", os.path.join(BENCH_DIR, "fake_ffmpeg.py")),
+               KAZSTREAMLINK_ADMISSION="0") # Нагрузка задается числом потоков, контроль допуска ее бы срезал
+    print(f"{'потоков':>8} {'режим':>16} {'процессов':>10} {'запущено':>9} {'RSS/поток, МБ':>14} "
+          f"{'CPU/поток, %':>13} {'хост RSS, МБ':>13} {'хост CPU, %':>12}")
+    for stream_count in args.streams:
+        for pack_size in (1, args.pack_size):
+            output = subprocess.run(
+                [sys.executable, os.path.abspath(__file__), "--worker", str(stream_count), str(pack_size), "--window", str(args.window)],
+                cwd=ROOT_DIR, env=env, capture_output=True, text=True, check=True
+            ).stdout
+            r = json.loads(output.strip().splitlines()[-1])
+            mode = "процесс на поток" if pack_size == 1 else f"группы по {pack_size}"
+            print(f"{r['streams']:>8} {mode:>16} {r['ffmpeg_processes']:>10} {r['running']:>9} {r['ffmpeg_rss_mb_per_stream']:>14} "
+                  f"{r['ffmpeg_cpu_percent_per_stream']:>13} {r['host_rss_mb']:>13} {r['host_cpu_percent']:>12}")
+
+
+if __name__ == "__main__":
+    main()
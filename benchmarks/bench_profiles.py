@@ -0,0 +1,107 @@
+#!/usr/bin/env python3
+"""Бенчмарк профилей передачи (profiles.py): задержка, потери и CPU ноги RTSP на локальном стенде.
+
+Скрипт поднимает стенд RTSP-сервера (rtsp_standin.py, вместо mediamtx): он принимает публикацию
+(ANNOUNCE/SETUP/RECORD) по TCP (interleaved) и UDP и разбирает заголовки RTP. Для каждого профиля создается --streams потоков,
+которые публикуют на стенд --seconds секунд. Заменитель FFmpeg запускается с FAKE_FFMPEG_PUSH=1 и
+отправляет настоящий RTP с опциями профиля (транспорт, pkt_size, buffer_size). С настоящим FFmpeg
+(FFMPEG_PATH) и живыми источниками (--source, шаблон с {profile} и {i}) стенд измеряет так же.
+
+Сеть с перегрузкой имитирует сам стенд: каждые --stall-every секунд он перестает читать сокеты на
+--stall-ms мс. По UDP пакеты сверх буфера приема (--rcvbuf) теряются ядром, по TCP - копятся в буферах,
+и растет задержка.
+
+Для каждого профиля:
+  старт - от создания потока до первого пакета на стенде (анализ входа профиля, p50);
+  задержка p50/p95/p99 - время прихода кадра минус его время RTP, за вычетом минимума по потоку:
+                         очереди и повторы сверх лучшего случая (абсолютную задержку без меток
+                         источника не измерить);
+  потери - пропуски номеров RTP;
+  пакетов/с и CPU процессов FFmpeg (сборщик метрик, среднее по потокам).
+
+Запуск из корня проекта:
+    python benchmarks/bench_profiles.py --streams 4 --seconds 10 --stall-ms 150 --stall-every 1
+"""
+import os
+import sys
+import time
+import argparse
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(BENCH_DIR))
+
+from rtsp_standin import RtspStandIn, percentile
+
+
+def run_profile(profile, args):
+    from rtmp_to_rtsp_converter.manager import ConverterManager
+
+    stand_in = RtspStandIn(args.rcvbuf, args.stall_ms, args.stall_every)
+    manager = ConverterManager(pack_size=1, dedup=False)
+    created = {}
+    specs = []
+    for i in range(args.streams):
+        path = f"{profile}_{i}"
+        # Свой URL источника у каждого профиля: первый запуск идет с полным анализом профиля, а не из кэша
+        specs.append({"rtmp_url": args.source.format(profile=profile, i=i), "rtsp_server_host": "127.0.0.1",
+                      "rtsp_port": stand_in.port, "rtsp_path": path, "profile": profile})
+        created[path] = time.monotonic()
+    results = manager.create_many(specs)
+    cpu = []
+    deadline = time.monotonic() + args.seconds
+    while time.monotonic() < deadline:
+        time.sleep(1.0)
+        cpu += [c.metrics.cpu_percent for c in manager.converters() if isinstance(c.metrics.cpu_percent, (int, float))]
+    manager.shutdown()
+    stand_in.close()
+
+    sessions = [stand_in.sessions[path] for path in created if path in stand_in.sessions]
+    starts = [s.first_arrival - created[s.path] for s in sessions if s.first_arrival is not None]
+    delays = [delay * 1000 for s in sessions for delay in s.relative_delays()]
+    lost = sum(s.lost()[0] for s in sessions)
+    expected = sum(s.lost()[1] for s in sessions)
+    return {
+        "ok": sum(1 for r in results if r["ok"]),
+        "sessions": sum(1 for s in sessions if s.packets),
+        "start_s": percentile(starts, 0.5),
+        "delay_ms": [percentile(delays, q) for q in (0.5, 0.95, 0.99)],
+        "loss": lost / expected if expected else 0.0,
+        "pps": sum(s.packets for s in sessions) / args.seconds,
+        "cpu": sum(cpu) / len(cpu) if cpu else None,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--streams", type=int, default=4)
+    parser.add_argument("--seconds", type=float, default=10.0)
+    parser.add_argument("--profiles", default="", help="Через запятую (по умолчанию все из profiles.py)")
+    parser.add_argument("--kbit", type=float, default=4000, help="Битрейт публикации заменителя FFmpeg")
+    parser.add_argument("--rcvbuf", type=int, default=65536, help="Буфер приема сокетов стенда, байт")
+    parser.add_argument("--stall-ms", type=float, default=150, help="Пауза чтения стенда (0 - без перегрузки)")
+    parser.add_argument("--stall-every", type=float, default=1.0, help="Период пауз чтения, сек")
+    parser.add_argument("--source", default="rtmp://127.0.0.1/live/{profile}_{i}", help="Шаблон URL источника")
+    args = parser.parse_args()
+
+    os.environ.setdefault("FFMPEG_PATH", os.path.join(BENCH_DIR, "fake_ffmpeg.py"))
+    os.environ["KAZSTREAMLINK_REGISTRY"] = ""
+    os.environ["KAZSTREAMLINK_ADMISSION"] = "0"
+    os.environ["FAKE_FFMPEG_PUSH"] = "1"
+    os.environ["FAKE_FFMPEG_PUSH_KBIT"] = str(args.kbit)
+    from rtmp_to_rtsp_converter.profiles import PROFILES
+
+    names = [name.strip() for name in args.profiles.split(",") if name.strip()] or list(PROFILES)
+    print(f"потоков: {args.streams} по {args.kbit:g} кбит/с, {args.seconds:g} с; буфер приема {args.rcvbuf} Б, "
+          f"пауза чтения {args.stall_ms:g} мс каждые {args.stall_every:g} с")
+    print(f"{'профиль':<17}{'транспорт':>10}{'старт, с':>10}{'задержка p50/p95/p99, мс':>27}{'потери':>9}{'пакетов/с':>11}{'CPU, %':>8}")
+    for name in names:
+        row = run_profile(name, args)
+        delay = " / ".join(f"{value:.0f}" if value is not None else "-" for value in row["delay_ms"])
+        start = f"{row['start_s']:.2f}" if row["start_s"] is not None else "-"
+        cpu = f"{row['cpu']:.1f}" if row["cpu"] is not None else "-"
+        print(f"{name:<17}{PROFILES[name].rtsp_transport:>10}{start:>10}{delay:>27}{row['loss']:>9.2%}{row['pps']:>11.0f}{cpu:>8}"
+              + ("" if row["sessions"] == args.streams else f"  (публиковали {row['sessions']} из {args.streams})"))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,133 @@
+#!/usr/bin/env python3
+"""Микробенчмарк парсера -progress: строк/сек и временные выделения памяти на блок.
+
+Воспроизводит записанный вывод FFmpeg (benchmarks/data/progress_capture.txt) и сравнивает
+блочный парсер с прежним построчным разбором (split('=') + обновление словаря на каждой строке).
+
+    python benchmarks/bench_progress_parser.py --repeat 2000
+"""
+import io
+import os
+import sys
+import time
+import argparse
+import tracemalloc
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(BENCH_DIR))
+
+from rtmp_to_rtsp_converter.progress_parser import ProgressParser
+
+CAPTURE_PATH = os.path.join(BENCH_DIR, "data", "progress_capture.txt")
+
+
+def legacy_parse(metrics, line):
+    """Прежний построчный разбор из converter.py (для сравнения)."""
+    parts = line.split('=')
+    if len(parts) == 2:
+        key = parts[0].strip()
+        value = parts[1].strip()
+        if key == "bitrate":
+            if "kbits/s" in value:
+                try:
+                    metrics["bitrate_kbit"] = round(float(value.replace("kbits/s", "").strip()), 2)
+                except ValueError:
+                    metrics["bitrate_kbit"] = "N/A (parse)"
+            else:
+                try:
+                    metrics["bitrate_kbit"] = round(float(value) / 1000, 2)
+                except ValueError:
+                    pass
+        elif key == "fps":
+            try:
+                metrics["fps"] = round(float(value), 2)
+            except ValueError:
+                metrics["fps"] = "N/A (parse)"
+        elif key == "drop_frames":
+            try:
+                metrics["dropped_frames"] = int(value)
+            except ValueError:
+                pass
+
+
+def run_legacy(raw, repeat):
+    """Прежний путь: readline() -> decode -> разбор строки -> запись в словарь на каждой строке."""
+    metrics = {}
+    for _ in range(repeat):
+        pipe = io.BytesIO(raw) # Имитация pipe.readline() из прежнего потока чтения
+        for line_bytes in iter(pipe.readline, b''):
+            legacy_parse(metrics, line_bytes.decode('utf-8', errors='replace').strip())
+
+
+def run_block(raw, repeat):
+    """Новый путь: сырые фрагменты os.read() -> ProgressParser.feed -> один снимок на блок."""
+    metrics = {}
+    parser = ProgressParser(metrics.update)
+    feed = parser.feed
+    chunks = split_chunks(raw)
+    for _ in range(repeat):
+        for chunk in chunks:
+            feed(chunk)
+    return parser.blocks
+
+
+def split_chunks(raw, size=4096):
+    """Режет запись на фрагменты как os.read() из канала (строки могут разрываться)."""
+    return [raw[i:i + size] for i in range(0, len(raw), size)]
+
+
+def split_blocks(raw):
+    """Делит запись на блоки -progress (каждый заканчивается строкой progress=...)."""
+    blocks, current = [], []
+    for line in raw.splitlines(keepends=True):
+        current.append(line)
+        if line.startswith(b"progress="):
+            blocks.append(b"".join(current))
+            current = []
+    return blocks
+
+
+def transient_bytes_per_block(raw, use_block_parser):
+    """Средний пик временных выделений памяти (байт) при обработке одного блока."""
+    metrics = {}
+    parser = ProgressParser(metrics.update)
+    if use_block_parser:
+        process_block = parser.feed
+    else:
+        def process_block(block):
+            for line_bytes in block.splitlines():
+                legacy_parse(metrics, line_bytes.decode('utf-8', errors='replace').strip())
+    blocks = split_blocks(raw)
+    for block in blocks: # Прогрев: ключи словаря метрик уже созданы
+        process_block(block)
+    total = 0
+    tracemalloc.start()
+    for block in blocks:
+        base, _ = tracemalloc.get_traced_memory()
+        tracemalloc.reset_peak()
+        process_block(block)
+        total += tracemalloc.get_traced_memory()[1] - base
+    tracemalloc.stop()
+    return total / len(blocks)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--repeat", type=int, default=2000, help="Сколько раз воспроизвести запись")
+    args = parser.parse_args()
+
+    with open(CAPTURE_PATH, "rb") as f:
+        raw = f.read()
+    total_lines = raw.count(b"\n") * args.repeat
+    total_blocks = len(split_blocks(raw)) * args.repeat
+
+    for name, runner, use_block in (("построчный (прежний)", run_legacy, False), ("блочный", run_block, True)):
+        started = time.perf_counter()
+        runner(raw, args.repeat)
+        elapsed = time.perf_counter() - started
+        print(f"{name:>22}: {total_lines / elapsed:>12,.0f} строк/сек, {total_blocks / elapsed:>10,.0f} блоков/сек, "
+              f"{transient_bytes_per_block(raw, use_block):>7.0f} байт временных выделений/блок")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,64 @@
+#!/usr/bin/env python3
+"""Бенчмарк хост-процесса Python: потоки, RSS и CPU при 10/100/500 имитированных потоках.
+
+Запуск из корня проекта:
+    python benchmarks/bench_reactor.py --streams 10 100 500 --window 10
+"""
+import os
+import sys
+import time
+import argparse
+import threading
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(BENCH_DIR))
+os.environ.setdefault("FFMPEG_PATH", os.path.join(BENCH_DIR, "fake_ffmpeg.py"))
+os.environ.setdefault("KAZSTREAMLINK_ADMISSION", "0") # Нагрузка задается числом потоков, контроль допуска ее бы срезал
+
+import psutil
+from rtmp_to_rtsp_converter.converter import create_and_start_conversion, stop_specific_conversion
+from rtmp_to_rtsp_converter.sampler import get_sampler
+
+
+def measure(stream_count, window):
+    host = psutil.Process()
+    converters = []
+    try:
+        for i in range(stream_count):
+            converters.append(create_and_start_conversion(f"bench_{i}", f"rtmp://127.0.0.1/live/{i}", "127.0.0.1", 8554, f"bench_{i}"))
+        time.sleep(2.0) # Даем процессам стартовать и начать выдавать -progress
+        cpu_before = host.cpu_times()
+        wall_before = time.monotonic()
+        time.sleep(window)
+        cpu_after = host.cpu_times()
+        wall = time.monotonic() - wall_before
+        result = {
+            "streams": stream_count,
+            "threads": threading.active_count(),
+            "legacy_threads": 1 + 3 * stream_count, # Прежняя схема: 3 потока на каждый конвертер
+            "rss_mb": round(host.memory_info().rss / (1024 * 1024), 1),
+            "cpu_percent": round(100.0 * ((cpu_after.user - cpu_before.user) + (cpu_after.system - cpu_before.system)) / wall, 2),
+            "running": sum(1 for c in converters if c.get_status() == "запущен"),
+            # Стоимость одного прохода общего сборщика CPU/RSS в пересчете на поток
+            "sample_us_per_stream": round(1e6 * get_sampler().last_pass_duration / max(stream_count, 1), 1),
+        }
+    finally: # Прерванный замер не оставляет процессы FFmpeg сиротами
+        for converter in converters:
+            stop_specific_conversion(converter)
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--streams", type=int, nargs="+", default=[10, 100, 500])
+    parser.add_argument("--window", type=float, default=10.0, help="Длительность замера CPU, сек")
+    args = parser.parse_args()
+
+    print(f"{'потоков':>8} {'threads':>8} {'было':>8} {'RSS, МБ':>9} {'CPU, %':>8} {'запущено':>9} {'сбор, мкс/поток':>16}")
+    for stream_count in args.streams:
+        r = measure(stream_count, args.window)
+        print(f"{r['streams']:>8} {r['threads']:>8} {r['legacy_threads']:>8} {r['rss_mb']:>9} {r['cpu_percent']:>8} {r['running']:>9} {r['sample_us_per_stream']:>16}")
+
+
+if __name__ == "__main__":
+    main()
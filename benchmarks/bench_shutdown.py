@@ -0,0 +1,92 @@
+#!/usr/bin/env python3
+"""Бенчмарк остановки узла: массовая остановка (stop_many) против остановки потоков по одному.
+
+Потоки запускаются на заменителе FFmpeg (fake_ffmpeg.py) в трех сценариях:
+  * graceful - после SIGINT процесс "дописывает выход" FAKE_FFMPEG_STOP_DELAY секунд;
+  * sigterm  - SIGINT игнорируется, процесс завершается по SIGTERM через KAZSTREAMLINK_STOP_TIMEOUT;
+  * sigkill  - игнорируются SIGINT и SIGTERM, нужен SIGKILL еще через KAZSTREAMLINK_KILL_TIMEOUT.
+Массовая остановка должна занимать время одного самого медленного потока, последовательная - сумму.
+Последовательная замеряется на --sequential-sample потоках и пересчитывается на весь узел.
+
+Запуск из корня проекта:
+    python benchmarks/bench_shutdown.py --streams 100 --stop-timeout 2 --kill-timeout 1
+"""
+import os
+import sys
+import time
+import argparse
+import logging
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+ROOT_DIR = os.path.dirname(BENCH_DIR)
+
+SCENARIOS = {
+    "graceful": {"FAKE_FFMPEG_IGNORE_SIGNALS": ""},
+    "sigterm": {"FAKE_FFMPEG_IGNORE_SIGNALS": "INT"},
+    "sigkill": {"FAKE_FFMPEG_IGNORE_SIGNALS": "INT,TERM"},
+}
+
+
+def _start_fleet(manager, count, offset):
+    specs = [{"rtmp_url": f"rtmp://127.0.0.1/live/{i}", "rtsp_server_host": "127.0.0.1", "rtsp_port": 8554,
+              "rtsp_path": f"bench_{i}"} for i in range(offset, offset + count)]
+    results = manager.create_many(specs)
+    ids = [r["stream_id"] for r in results if r["ok"]]
+    deadline = time.monotonic() + 30
+    while time.monotonic() < deadline: # Ждем, пока все процессы пройдут "анализ входа"
+        if all(manager.get(sid).get_metrics().get("time_to_first_packet_s") != "N/A" for sid in ids):
+            break
+        time.sleep(0.2)
+    return ids
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--streams", type=int, default=100)
+    parser.add_argument("--sequential-sample", type=int, default=5, help="Потоков для замера остановки по одному")
+    parser.add_argument("--stop-delay", type=float, default=1.0, help="FAKE_FFMPEG_STOP_DELAY для сценария graceful")
+    parser.add_argument("--stop-timeout", type=float, default=2.0, help="KAZSTREAMLINK_STOP_TIMEOUT")
+    parser.add_argument("--kill-timeout", type=float, default=1.0, help="KAZSTREAMLINK_KILL_TIMEOUT")
+    parser.add_argument("--scenarios", nargs="+", default=list(SCENARIOS), choices=list(SCENARIOS))
+    args = parser.parse_args()
+
+    # Настройки читаются при импорте модулей, поэтому задаются до него
+    os.environ.setdefault("FFMPEG_PATH", os.path.join(BENCH_DIR, "fake_ffmpeg.py"))
+    os.environ["KAZSTREAMLINK_REGISTRY"] = ""
+    os.environ["KAZSTREAMLINK_PROBE_CACHE"] = "0"
+    os.environ["KAZSTREAMLINK_ADMISSION"] = "0" # Нагрузка задается числом потоков, контроль допуска ее бы срезал
+    os.environ["KAZSTREAMLINK_STOP_TIMEOUT"] = str(args.stop_timeout)
+    os.environ["KAZSTREAMLINK_KILL_TIMEOUT"] = str(args.kill_timeout)
+    os.environ["FAKE_FFMPEG_STOP_DELAY"] = str(args.stop_delay)
+    sys.path.insert(0, ROOT_DIR)
+    logging.disable(logging.WARNING)
+    from rtmp_to_rtsp_converter.manager import ConverterManager
+
+    manager = ConverterManager(pack_size=1)
+    offset = 0
+    print(f"{'сценарий':>9} {'потоков':>8} {'массово, с':>11} {'по одному, с':>13} {'сигнал':>8} {'не остановлено':>15}")
+    try:
+        for name in args.scenarios:
+            os.environ.update(SCENARIOS[name]) # Наследуется процессами FFmpeg при запуске
+            ids = _start_fleet(manager, args.sequential_sample, offset)
+            offset += len(ids)
+            started = time.perf_counter()
+            for stream_id in ids:
+                manager.stop(stream_id)
+            per_stream = (time.perf_counter() - started) / max(len(ids), 1)
+
+            ids = _start_fleet(manager, args.streams, offset)
+            offset += len(ids)
+            started = time.perf_counter()
+            results = manager.stop_many(ids)
+            bulk = time.perf_counter() - started
+            signals = {r.get("signal") for r in results if r["ok"]}
+            failed = sum(1 for r in results if not r["ok"])
+            print(f"{name:>9} {len(ids):>8} {bulk:>11.2f} {per_stream * len(ids):>13.1f} "
+                  f"{','.join(sorted(s for s in signals if s)):>8} {failed:>15}")
+    finally:
+        manager.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,353 @@
+#!/usr/bin/env python3
+"""Заменитель FFmpeg для бенчмарков: печатает блоки -progress в stdout, пока не получит SIGINT.
+
+Вывод детерминирован: колебания битрейта, FPS и скорости и выбор строк stderr берутся из
+генератора, зависящего только от FAKE_FFMPEG_SEED и URL входа. SIGUSR1 - падение "по команде"
+(код 1, как при обрыве источника). Нога tee с f=segment пишет файлы сегментов и строки списка
+segment_list, как segment muxer (запись, см. recording.py).
+
+С FAKE_FFMPEG_PUSH=1 первый выход RTSP получает настоящий поток RTP (видео H.264-подобного размера,
+FAKE_FFMPEG_PUSH_KBIT, 25 кадров/с): ANNOUNCE/SETUP/RECORD и пакеты по TCP (interleaved) или UDP
+с учетом опций -rtsp_transport, -pkt_size и -buffer_size (стенд RTSP-сервера - rtsp_standin.py).
+С FAKE_FFMPEG_TIMECODE=1 это тестовый источник с метками времени: перед каждым кадром идет NAL SEI
+с временем его захвата (rtmp_to_rtsp_converter/latency.py), на FAKE_FFMPEG_SOURCE_LAG_MS раньше
+отправки - задержка кодера и RTMP до FFmpeg.
+"""
+import os
+import sys
+import time
+import socket
+import struct
+import random
+import signal
+import threading
+from urllib.parse import urlsplit
+
+PROGRESS_PERIOD = float(os.environ.get("FAKE_FFMPEG_PROGRESS_PERIOD", "0.5"))
+EXIT_AFTER = float(os.environ.get("FAKE_FFMPEG_EXIT_AFTER", "0")) # > 0: завершиться с кодом 1 через N секунд (обрыв источника)
+FAIL_LEG = os.environ.get("FAKE_FFMPEG_FAIL_LEG") # Номер ноги tee, об отказе которой сообщить в stderr
+FAIL_INPUT = os.environ.get("FAKE_FFMPEG_FAIL_INPUT") # Номер входа, который через EXIT_AFTER секунд сообщит об ошибке чтения
+STOP_DELAY = float(os.environ.get("FAKE_FFMPEG_STOP_DELAY", "0")) # Секунд на "дописывание выхода" после SIGINT
+# Зависший FFmpeg: игнорируемые сигналы через запятую (INT - только SIGTERM/SIGKILL, INT,TERM - только SIGKILL)
+IGNORE_SIGNALS = set(filter(None, os.environ.get("FAKE_FFMPEG_IGNORE_SIGNALS", "").upper().split(",")))
+STALL_AFTER = float(os.environ.get("FAKE_FFMPEG_STALL_AFTER", "0")) # > 0: через N секунд перестать выдавать прогресс (зависание)
+STDERR_RATE = float(os.environ.get("FAKE_FFMPEG_STDERR_RATE", "0")) # Строк "шума" stderr в секунду (смесь реальных сообщений)
+DROP_RATE = float(os.environ.get("FAKE_FFMPEG_DROP_RATE", "0")) # Отброшенных кадров в секунду (drop_frames)
+SEED = os.environ.get("FAKE_FFMPEG_SEED", "0")
+ERROR_FLOOD = int(os.environ.get("FAKE_FFMPEG_ERROR_FLOOD", "0")) # Строк ошибок декодирования в stderr на каждый блок -progress
+PUSH = os.environ.get("FAKE_FFMPEG_PUSH", "0") == "1" # Отправлять RTP на первый выход RTSP
+PUSH_KBIT = float(os.environ.get("FAKE_FFMPEG_PUSH_KBIT", "4000"))
+PUSH_FPS = 25
+PUSH_GOP = 50 # Ключевой кадр раз в 2 с, в 5 раз больше остальных
+TIMECODE = os.environ.get("FAKE_FFMPEG_TIMECODE", "0") == "1" # Метки времени источника в SEI перед кадрами
+SOURCE_LAG = float(os.environ.get("FAKE_FFMPEG_SOURCE_LAG_MS", "0")) / 1000 # Путь источник -> FFmpeg, с
+RTP_DEFAULT_PKT_SIZE = 1472 # Как у RTSP-мультиплексора FFmpeg
+RTSP_OUTPUT_OPTIONS = ("rtsp_transport", "buffer_size", "pkt_size", "max_delay")
+
+if TIMECODE: # Формат меток - общий с зондом задержки
+    sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    from rtmp_to_rtsp_converter.latency import timecode_sei
+
+_stop_at = None
+
+# Типичные сообщения FFmpeg при -loglevel error для нестабильного источника
+STDERR_NOISE = (
+    "[flv @ 0x0] Non-monotonous DTS in output stream 0:0; previous: {n}, current: {m}; changing to {n}.",
+    "[h264 @ 0x0] error while decoding MB {n} {m}, bytestream -5",
+    "[h264 @ 0x0] concealing {n} DC, {n} AC, {n} MV errors in P frame",
+    "[aac @ 0x0] Queue input is backward in time",
+    "[rtsp @ 0x0] Packet corrupt (stream = 0, dts = {m}).",
+    "[flv @ 0x0] Packet mismatch {n} {m} {n}",
+)
+
+
+def _write(stream, text):
+    """Пишет в канал хоста. После его завершения (EPIPE) процесс продолжает работу, как настоящий FFmpeg,
+    игнорирующий SIGPIPE: так его можно принять после перезапуска сервиса (см. registry.py)."""
+    try:
+        stream.write(text)
+        stream.flush()
+    except (BrokenPipeError, ValueError):
+        pass
+
+
+def _option(name, default=None):
+    return sys.argv[sys.argv.index(name) + 1] if name in sys.argv[:-1] else default
+
+
+def probe_input():
+    """Имитирует анализ входа: ждет -analyzeduration и печатает состав потоков на уровне info."""
+    time.sleep(min(int(_option("-analyzeduration", "5000000")), 5000000) / 1e6)
+    if "info" in _option("-loglevel", ""):
+        url = _option("-i", "")
+        _write(
+            sys.stderr,
+            f"[info] Input #0, flv, from '{url}':\n"
+            "[info]   Stream #0:0: Video: h264 (High), yuv420p(progressive), 1280x720, 25 fps, 25 tbr, 1k tbn\n"
+            "[info]   Stream #0:1: Audio: aac (LC), 44100 Hz, stereo, fltp, 128 kb/s\n"
+            f"[info] Output #0, rtsp, to '{sys.argv[-1]}':\n"
+        )
+
+
+def _split_escaped(text, delimiters):
+    """Делит строку по неэкранированным разделителям, снимая один уровень экранирования (как av_get_token)."""
+    parts, current, i = [], "", 0
+    while i < len(text):
+        char = text[i]
+        if char == "\\" and i + 1 < len(text):
+            current += text[i + 1]
+            i += 2
+            continue
+        if char in delimiters:
+            parts.append((current, char))
+            current = ""
+        else:
+            current += char
+        i += 1
+    parts.append((current, None))
+    return parts
+
+
+def segment_leg():
+    """Нога tee с segment muxer: (шаблон файла, segment_time, путь списка) или None."""
+    if "tee" not in sys.argv:
+        return None
+    for leg, _ in _split_escaped(sys.argv[-1], "|"):
+        if not leg.startswith("["):
+            continue
+        options_text, _, pattern = leg[1:].partition("]")
+        options = {}
+        for item, _ in _split_escaped(options_text, ":"):
+            key, _, value = item.partition("=")
+            options[key] = value
+        if options.get("f") == "segment":
+            return pattern, float(options.get("segment_time", "2")), options.get("segment_list")
+    return None
+
+
+class SegmentWriter:
+    """Имитация segment muxer: каждые segment_time секунд закрывает файл и дописывает строку в список."""
+
+    def __init__(self, pattern, segment_time, list_path):
+        self.pattern, self.segment_time, self.list_path = pattern, segment_time, list_path
+        self.opened_at = time.time()
+        self.pts = 0.0
+        self.buffered = 0
+
+    def write(self, size, now):
+        self.buffered += size
+        if now - self.opened_at >= self.segment_time:
+            self.close(now)
+
+    def close(self, now):
+        duration = now - self.opened_at
+        name = self.pattern.replace("%s", str(int(self.opened_at)))
+        with open(name, "wb") as f:
+            f.write(b"\0" * self.buffered)
+        if self.list_path:
+            with open(self.list_path, "a") as f:
+                f.write(f"{os.path.basename(name)},{self.pts:.6f},{self.pts + duration:.6f}\n")
+        self.pts += duration
+        self.opened_at, self.buffered = now, 0
+
+
+def rtsp_output():
+    """(url, {опция: значение}) первого выхода RTSP: прямого (-rtsp_transport udp ... URL) или ноги tee."""
+    if "tee" in sys.argv:
+        for leg, _ in _split_escaped(sys.argv[-1], "|"):
+            options_text, _, url = leg[1:].partition("]")
+            options = dict(item.partition("=")[::2] for item, _ in _split_escaped(options_text, ":"))
+            if options.get("f") == "rtsp":
+                return url, options
+        return None
+    if not sys.argv[-1].startswith("rtsp://"):
+        return None
+    last_input = len(sys.argv) - 1 - sys.argv[::-1].index("-i")
+    args = sys.argv[last_input + 2:-1]
+    return sys.argv[-1], {key[1:]: value for key, value in zip(args, args[1:]) if key[1:] in RTSP_OUTPUT_OPTIONS}
+
+
+class RtspPusher(threading.Thread):
+    """Публикация RTSP (как RTSP-мультиплексор FFmpeg): ANNOUNCE, SETUP, RECORD и пакеты RTP в реальном времени."""
+
+    def __init__(self, url, options):
+        super().__init__(daemon=True)
+        self.url = url
+        self.transport = options.get("rtsp_transport", "tcp")
+        self.pkt_size = int(options.get("pkt_size") or RTP_DEFAULT_PKT_SIZE)
+        self.buffer_size = int(options["buffer_size"]) if options.get("buffer_size") else None
+        self.cseq = 0
+        self.session = None
+
+    def run(self):
+        try:
+            self._publish()
+        except OSError as e:
+            _write(sys.stderr, f"[rtsp @ 0x0] Error writing to {self.url}: {e}\n")
+
+    def _request(self, sock, method, url, headers=(), body=b""):
+        self.cseq += 1
+        lines = [f"{method} {url} RTSP/1.0", f"CSeq: {self.cseq}", *headers]
+        if self.session:
+            lines.append(f"Session: {self.session}")
+        if body:
+            lines.append(f"Content-Length: {len(body)}")
+        sock.sendall(("\r\n".join(lines) + "\r\n\r\n").encode() + body)
+        response = b""
+        while b"\r\n\r\n" not in response:
+            chunk = sock.recv(4096)
+            if not chunk:
+                raise ConnectionResetError("RTSP-сервер закрыл соединение")
+            response += chunk
+        head = response.split(b"\r\n\r\n", 1)[0].decode(errors="replace").split("\r\n")
+        if " 200 " not in head[0] + " ":
+            raise ConnectionRefusedError(f"{method}: {head[0]}")
+        return {name.strip().lower(): value.strip() for name, _, value in (line.partition(":") for line in head[1:])}
+
+    def _publish(self):
+        parts = urlsplit(self.url)
+        sock = socket.create_connection((parts.hostname, parts.port or 554), timeout=10)
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        if self.buffer_size:
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, self.buffer_size)
+        sdp = ("v=0\r\no=- 0 0 IN IP4 127.0.0.1\r\ns=fake_ffmpeg\r\nt=0 0\r\n"
+               "m=video 0 RTP/AVP 96\r\na=rtpmap:96 H264/90000\r\na=control:streamid=0\r\n").encode()
+        self._request(sock, "ANNOUNCE", self.url, ["Content-Type: application/sdp"], sdp)
+        track = self.url.rstrip("/") + "/streamid=0"
+        udp = None
+        if self.transport == "udp":
+            udp = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+            udp.bind(("0.0.0.0", 0))
+            if self.buffer_size:
+                udp.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, self.buffer_size)
+            port = udp.getsockname()[1]
+            headers = self._request(sock, "SETUP", track, [f"Transport: RTP/AVP/UDP;unicast;client_port={port}-{port + 1};mode=record"])
+            server_port = int(headers["transport"].split("server_port=")[1].split("-")[0].split(";")[0])
+            udp.connect((parts.hostname, server_port))
+        else:
+            headers = self._request(sock, "SETUP", track, ["Transport: RTP/AVP/TCP;unicast;interleaved=0-1;mode=record"])
+        self.session = headers.get("session", "").split(";")[0] or None
+        self._request(sock, "RECORD", self.url, ["Range: npt=0.000-"])
+        sock.settimeout(None)
+
+        payload = self.pkt_size - 12
+        average = PUSH_KBIT * 1000 / 8 / PUSH_FPS
+        p_frame = int(average * PUSH_GOP / (PUSH_GOP + 4))
+        ssrc = random.getrandbits(32)
+        seq = 0
+        started = time.monotonic()
+        wall_started = time.time()
+        frame = 0
+        while True:
+            delay = started + frame / PUSH_FPS - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+            size = p_frame * 5 if frame % PUSH_GOP == 0 else p_frame
+            timestamp = (frame * 90000 // PUSH_FPS) & 0xFFFFFFFF
+            chunks = [bytes(min(payload, size - offset)) for offset in range(0, size, payload)]
+            if TIMECODE: # Кадр захвачен источником по расписанию, SOURCE_LAG до того, как FFmpeg его отправил
+                chunks.insert(0, timecode_sei(wall_started + frame / PUSH_FPS - SOURCE_LAG))
+            for i, chunk in enumerate(chunks):
+                last = i == len(chunks) - 1
+                packet = struct.pack("!BBHI", 0x80, 96 | (0x80 if last else 0), seq & 0xFFFF, timestamp) + struct.pack("!I", ssrc)
+                packet += chunk
+                seq += 1
+                if udp is not None:
+                    try:
+                        udp.send(packet)
+                    except OSError: # Буфер отправки переполнен: пакет теряется, как у FFmpeg по UDP
+                        pass
+                else: # RTSP interleaved: '$', канал, длина
+                    sock.sendall(struct.pack("!cBH", b"$", 0, len(packet)) + packet)
+            frame += 1
+
+
+def _on_sigint(*_):
+    global _stop_at
+    if "INT" in IGNORE_SIGNALS:
+        return
+    if not STOP_DELAY:
+        sys.exit(255)
+    if _stop_at is None:
+        _stop_at = time.monotonic() + STOP_DELAY
+
+
+def _on_sigusr1(*_):
+    _write(sys.stderr, "Connection reset by peer\n")
+    sys.exit(1)
+
+
+def _out_time(us):
+    seconds, micro = divmod(us, 1_000_000)
+    return f"{seconds // 3600:02d}:{seconds // 60 % 60:02d}:{seconds % 60:02d}.{micro:06d}"
+
+
+def main():
+    signal.signal(signal.SIGUSR1, _on_sigusr1)
+    signal.signal(signal.SIGINT, _on_sigint)
+    signal.signal(signal.SIGTERM, signal.SIG_IGN if "TERM" in IGNORE_SIGNALS else lambda *_: sys.exit(255))
+    probe_input()
+    output = rtsp_output() if PUSH else None
+    if output:
+        RtspPusher(*output).start()
+    started = time.monotonic()
+    frame = 0
+    total_size = 0
+    inputs = max(sys.argv.count("-i"), 1) # Несколько входов - упакованная группа потоков
+    stream_q = "".join(f"stream_{i}_0_q=-1.0\n" for i in range(inputs))
+    input_failed = False
+    rng = random.Random(f"{SEED}:{_option('-i', '')}")
+    noise_due = drops_due = 0.0
+    dropped = 0
+    last_block = started
+    leg = segment_leg()
+    segments = SegmentWriter(*leg) if leg else None
+    if FAIL_LEG is not None and "tee" in sys.argv:
+        legs = sys.argv[-1].count("onfail=")
+        _write(sys.stderr, f"[tee @ 0x0] Slave muxer #{FAIL_LEG} failed: Connection refused, continuing with {legs - 1}/{legs} slaves.\n")
+    while True:
+        if frame: # Первый блок - сразу после анализа входа (первый пакет отправлен)
+            time.sleep(PROGRESS_PERIOD if _stop_at is None else max(min(PROGRESS_PERIOD, _stop_at - time.monotonic()), 0))
+        if _stop_at is not None and time.monotonic() >= _stop_at:
+            sys.exit(255)
+        elapsed = time.monotonic() - started
+        if EXIT_AFTER and elapsed >= EXIT_AFTER and not input_failed:
+            if FAIL_INPUT is None:
+                _write(sys.stderr, "Connection reset by peer\n")
+                sys.exit(1)
+            # Ошибка одного входа: настоящий FFmpeg продолжает обслуживать остальные
+            _write(sys.stderr, f"[in#{FAIL_INPUT}/flv @ 0x0] Error during demuxing: Input/output error\n")
+            input_failed = True
+        if STALL_AFTER and elapsed >= STALL_AFTER: # Процесс жив, но out_time больше не растет
+            continue
+        frame = max(int(elapsed * 25), 1)
+        block_seconds, last_block = time.monotonic() - last_block, time.monotonic()
+        if STDERR_RATE:
+            noise_due += STDERR_RATE * block_seconds
+            lines = int(noise_due)
+            noise_due -= lines
+            _write(sys.stderr, "".join(rng.choice(STDERR_NOISE).format(n=rng.randrange(1, 4096), m=frame) + "\n"
+                                       for _ in range(lines)))
+        if DROP_RATE:
+            drops_due += DROP_RATE * block_seconds
+            dropped += int(drops_due)
+            drops_due -= int(drops_due)
+        if ERROR_FLOOD: # Битый источник: половина строк с номером макроблока, затем серия одинаковых
+            _write(sys.stderr, "".join(f"[h264 @ 0x0] error while decoding MB {i} {frame}\n" if i < ERROR_FLOOD // 2 else
+                                       "[h264 @ 0x0] Packet corrupt (stream = 0, dts = 0).\n" for i in range(ERROR_FLOOD)))
+        block_size = int(128 * 1024 * rng.uniform(0.9, 1.1))
+        total_size += block_size
+        if segments:
+            segments.write(block_size, time.time())
+        out_time_us = int(elapsed * 1_000_000)
+        _write(
+            sys.stdout,
+            f"frame={frame}\nfps={rng.uniform(24.8, 25.2):.2f}\n{stream_q}"
+            f"bitrate={total_size * 8 / 1000 / max(elapsed, 0.001):.1f}kbits/s\n"
+            f"total_size={total_size}\nout_time_us={out_time_us}\nout_time_ms={out_time_us}\nout_time={_out_time(out_time_us)}\n"
+            f"dup_frames=0\ndrop_frames={dropped}\nspeed={rng.uniform(0.99, 1.01):.3f}x\nprogress=continue\n"
+        )
+
+
+if __name__ == "__main__":
+    main()
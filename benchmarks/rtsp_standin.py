@@ -0,0 +1,277 @@
+#!/usr/bin/env python3
+"""Стенд RTSP-сервера для бенчмарков (вместо mediamtx): принимает публикацию и раздает ее зрителям.
+
+Публикация - ANNOUNCE/SETUP/RECORD, RTP по TCP (interleaved) или UDP; зрители - DESCRIBE/SETUP/PLAY,
+RTP по TCP (interleaved). Стенд разбирает заголовки RTP публикаций (RtpSession: пакеты, потери, время
+кадров) и метки времени источника в SEI (см. rtmp_to_rtsp_converter/latency.py) - задержку до сервера.
+
+Сеть с перегрузкой имитирует сам стенд: каждые stall_every секунд он перестает читать публикации на
+stall_ms мс. По UDP пакеты сверх буфера приема (rcvbuf) теряются ядром, по TCP - копятся в буферах.
+
+Отдельный запуск (UI или API с заменителем FFmpeg и FAKE_FFMPEG_PUSH=1 без mediamtx):
+    python benchmarks/rtsp_standin.py --port 8554
+"""
+import os
+import sys
+import time
+import socket
+import struct
+import argparse
+import threading
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(BENCH_DIR))
+
+from rtmp_to_rtsp_converter.latency import parse_timecode
+
+READER_SEND_TIMEOUT_SEC = 1 # Зритель, не принимающий данные дольше, отключается (не тормозит публикацию)
+
+
+def percentile(values, q):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))] if ordered else None
+
+
+class RtpSession:
+    """Статистика одной публикации: пакеты, пропуски номеров, время кадров и метки источника."""
+
+    def __init__(self, path):
+        self.path = path
+        self.first_arrival = None
+        self.packets = 0
+        self.bytes = 0
+        self.first_seq = None
+        self.max_seq = None # Расширенный номер (с учетом переполнения 16 бит)
+        self.delays = [] # Время прихода минус время RTP для последнего пакета каждого кадра
+        self.timecode_delays = [] # Время прихода минус метка источника (SEI), с
+        self.lock = threading.Lock()
+
+    def on_packet(self, packet, arrival):
+        if len(packet) < 12:
+            return
+        marker_pt, seq, timestamp = packet[1], *struct.unpack("!HI", packet[2:8])
+        with self.lock:
+            if self.first_arrival is None:
+                self.first_arrival = arrival
+                self.first_seq = self.max_seq = seq
+                self.first_ts = timestamp
+            else:
+                candidate = self.max_seq + ((seq - self.max_seq) & 0xFFFF)
+                if (seq - self.max_seq) & 0xFFFF < 0x8000: # Не опоздавший пакет
+                    self.max_seq = candidate
+            self.packets += 1
+            self.bytes += len(packet)
+            if marker_pt & 0x80:
+                self.delays.append(arrival - ((timestamp - self.first_ts) & 0xFFFFFFFF) / 90000)
+            elif len(packet) > 12 and packet[12] & 0x1F == 6: # Одиночный NAL SEI
+                timecode = parse_timecode(packet[12:])
+                if timecode is not None:
+                    self.timecode_delays.append(time.time() - timecode)
+
+    def lost(self):
+        expected = self.max_seq - self.first_seq + 1 if self.first_seq is not None else 0
+        return max(expected - self.packets, 0), expected
+
+    def relative_delays(self):
+        base = min(self.delays) if self.delays else 0.0
+        return [delay - base for delay in self.delays]
+
+
+class _Connection:
+    """Соединение RTSP: ответы и пакеты зрителям пишут разные потоки, поэтому отправка под блокировкой."""
+
+    def __init__(self, sock):
+        self.sock = sock
+        self.lock = threading.Lock()
+
+    def send(self, data):
+        with self.lock:
+            self.sock.sendall(data)
+
+
+class RtspStandIn:
+    """Минимальный RTSP-сервер: публикация, раздача зрителям по TCP и периодические паузы чтения (перегрузка)."""
+
+    def __init__(self, rcvbuf=65536, stall_ms=0, stall_every=0, host="127.0.0.1", port=0):
+        self.rcvbuf = rcvbuf
+        self.stall = stall_ms / 1000
+        self.stall_every = stall_every
+        self.sessions = {} # {путь: RtpSession}
+        self.descriptions = {} # {путь: SDP публикации} - пока публикация идет
+        self.readers = {} # {путь: [_Connection]}
+        self.started = time.monotonic()
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self._server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self._server.bind((host, port))
+        self._server.listen(128)
+        self.port = self._server.getsockname()[1]
+        self._sockets = []
+        threading.Thread(target=self._accept, daemon=True).start()
+
+    def close(self):
+        self._stop.set()
+        for sock in [self._server, *self._sockets]:
+            try:
+                sock.close()
+            except OSError:
+                pass
+
+    def published(self):
+        """[(путь, пакетов, зрителей)] идущих публикаций."""
+        with self._lock:
+            return [(path, self.sessions[path].packets, len(self.readers.get(path, ()))) for path in self.descriptions]
+
+    def _pause_if_stalled(self):
+        if self.stall and self.stall_every:
+            phase = (time.monotonic() - self.started) % self.stall_every
+            if phase < self.stall:
+                time.sleep(self.stall - phase)
+
+    def _accept(self):
+        while not self._stop.is_set():
+            try:
+                conn, _ = self._server.accept()
+            except OSError:
+                return
+            self._sockets.append(conn)
+            threading.Thread(target=self._serve, args=(conn,), daemon=True).start()
+
+    def _publish(self, path, session, packet):
+        session.on_packet(packet, time.monotonic())
+        with self._lock:
+            readers = list(self.readers.get(path, ()))
+        if not readers:
+            return
+        frame = struct.pack("!cBH", b"$", 0, len(packet)) + packet
+        for reader in readers:
+            try:
+                reader.send(frame)
+            except OSError: # Зритель ушел или не успевает читать
+                self._drop_reader(path, reader)
+
+    def _drop_reader(self, path, reader):
+        with self._lock:
+            if reader in self.readers.get(path, ()):
+                self.readers[path].remove(reader)
+        try:
+            reader.sock.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+
+    def _serve(self, sock):
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, self.rcvbuf)
+        conn = _Connection(sock)
+        reader = sock.makefile("rb")
+        session = None # Публикация этого соединения
+        published = played = None # Путь публикации и путь зрителя
+        try:
+            while not self._stop.is_set():
+                first = reader.read(1)
+                if not first:
+                    return
+                if first == b"$": # Пакет RTP interleaved
+                    if session is not None:
+                        self._pause_if_stalled()
+                    channel, length = struct.unpack("!BH", reader.read(3))
+                    packet = reader.read(length)
+                    if session is not None and channel == 0:
+                        self._publish(published, session, packet)
+                    continue
+                lines = [(first + reader.readline()).decode(errors="replace").strip()]
+                while lines[-1]:
+                    lines.append(reader.readline().decode(errors="replace").strip())
+                headers = {name.strip().lower(): value.strip() for name, _, value in (line.partition(":") for line in lines[1:-1])}
+                body = reader.read(int(headers["content-length"])) if int(headers.get("content-length", 0)) else b""
+                method, url = lines[0].split()[:2]
+                path = url.split("://", 1)[-1].split("/", 1)[-1].split("/streamid=")[0].rstrip("/")
+                status, reply, content = "200 OK", [], b""
+                if method == "ANNOUNCE":
+                    session = self.sessions[path] = RtpSession(path)
+                    published = path
+                    with self._lock:
+                        self.descriptions[path] = body
+                elif method == "DESCRIBE":
+                    with self._lock:
+                        content = self.descriptions.get(path, b"")
+                    if content:
+                        reply += [f"Content-Base: {url.rstrip('/')}/", "Content-Type: application/sdp"]
+                    else:
+                        status = "404 Not Found"
+                elif method == "SETUP":
+                    transport = headers.get("transport", "")
+                    if session is not None and "client_port=" in transport:
+                        port = self._open_udp(path, session)
+                        reply.append(f"Transport: {transport};server_port={port}-{port + 1}")
+                    elif session is None and "interleaved" not in transport:
+                        status = "461 Unsupported Transport" # Зрителям - только TCP
+                    else:
+                        reply.append(f"Transport: {transport}")
+                    reply.append("Session: 1")
+                elif method == "PLAY":
+                    played = path
+                    sock.setsockopt(socket.SOL_SOCKET, socket.SO_SNDTIMEO, struct.pack("ll", READER_SEND_TIMEOUT_SEC, 0))
+                elif method == "OPTIONS":
+                    reply.append("Public: OPTIONS, ANNOUNCE, DESCRIBE, SETUP, RECORD, PLAY, TEARDOWN")
+                if content:
+                    reply.append(f"Content-Length: {len(content)}")
+                conn.send(("\r\n".join([f"RTSP/1.0 {status}", f"CSeq: {headers.get('cseq', '0')}", *reply])
+                           + "\r\n\r\n").encode() + content)
+                if method == "PLAY": # Пакеты - только после ответа на PLAY
+                    with self._lock:
+                        self.readers.setdefault(path, []).append(conn)
+        except (OSError, ValueError, struct.error):
+            return
+        finally:
+            if played is not None:
+                self._drop_reader(played, conn)
+            if published is not None: # Публикация закончилась: зрители пути отключаются, как в mediamtx
+                with self._lock:
+                    if self.sessions.get(published) is session:
+                        self.descriptions.pop(published, None)
+                    readers = self.readers.pop(published, [])
+                for other in readers:
+                    self._drop_reader(published, other)
+
+    def _open_udp(self, path, session):
+        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, self.rcvbuf)
+        sock.bind(("127.0.0.1", 0))
+        self._sockets.append(sock)
+        port = sock.getsockname()[1]
+
+        def receive():
+            while not self._stop.is_set():
+                self._pause_if_stalled()
+                try:
+                    packet = sock.recv(65536)
+                except OSError:
+                    return
+                self._publish(path, session, packet)
+
+        threading.Thread(target=receive, daemon=True).start()
+        return port
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8554)
+    parser.add_argument("--rcvbuf", type=int, default=65536, help="Буфер приема сокетов, байт")
+    parser.add_argument("--stall-ms", type=float, default=0, help="Пауза чтения публикаций (0 - без перегрузки)")
+    parser.add_argument("--stall-every", type=float, default=1.0, help="Период пауз чтения, сек")
+    args = parser.parse_args()
+    stand_in = RtspStandIn(args.rcvbuf, args.stall_ms, args.stall_every, args.host, args.port)
+    print(f"Стенд RTSP-сервера: rtsp://{args.host}:{stand_in.port}/<путь> (Ctrl+C - выход)")
+    try:
+        while True:
+            time.sleep(5)
+            for path, packets, readers in stand_in.published():
+                print(f"  {path}: {packets} пакетов, зрителей: {readers}")
+    except KeyboardInterrupt:
+        stand_in.close()
+
+
+if __name__ == "__main__":
+    main()
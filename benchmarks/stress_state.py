@@ -0,0 +1,217 @@
+#!/usr/bin/env python3
+"""Стресс-тест снимков состояния конвертера (state.py): много читателей и писателей одновременно.
+
+Конвертеры создаются без процессов FFmpeg. На каждый конвертер работают писатели:
+  progress - публикует блоки -progress, где bitrate_kbit = 10 * fps и total_size = 1000 * fps;
+  sampler  - публикует замеры CPU/RSS через _publish_system_metrics, где memory_mb = 2 * cpu_percent;
+  status   - --status-writers потоков гоняют статус по циклу запуск -> работа -> остановка/падение ->
+             перезапуск и пытаются сделать недопустимые переходы.
+Читатели (--readers) без блокировок берут converter.metrics и converter.state и проверяют:
+  - поля одного блока и одного замера согласованы (иначе снимок "разорван");
+  - статус есть в таблице переходов, а у "завершен_с_ошибкой" есть код завершения;
+  - номер снимка (AtomicRef.version) у читателя не убывает.
+Итог: чтения и записи в секунду, принятые и отклоненные переходы и число нарушений (должно быть 0).
+
+С --legacy те же проверки выполняются для прежней схемы (общий словарь метрик, CPU и RSS
+записываются двумя присваиваниями, читатель копирует словарь): разорванные замеры в ней возможны.
+
+Запуск из корня проекта:
+    python benchmarks/stress_state.py --converters 8 --readers 16 --status-writers 2 --seconds 5
+"""
+import os
+import sys
+import time
+import random
+import argparse
+import threading
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(BENCH_DIR))
+os.environ.setdefault("KAZSTREAMLINK_ADMISSION", "0")
+
+from rtmp_to_rtsp_converter.converter import RTMPToRTSPConverter
+from rtmp_to_rtsp_converter.state import (
+    TRANSITIONS, STATUS_STARTING, STATUS_RUNNING, STATUS_STOPPING, STATUS_STOPPED, STATUS_FAILED, STATUS_RESTARTING
+)
+
+# Путь статуса, по которому идут писатели статуса: (статус, код завершения)
+STATUS_CYCLE = (
+    (STATUS_STARTING, None), (STATUS_RUNNING, None), (STATUS_STOPPING, None), (STATUS_STOPPED, None),
+    (STATUS_STARTING, None), (STATUS_RUNNING, None), (STATUS_FAILED, 1), (STATUS_RESTARTING, None),
+)
+INVALID_ATTEMPTS = ((STATUS_RUNNING, None), (STATUS_STOPPING, None), (STATUS_FAILED, 137))
+
+
+class Counters:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.values = {}
+
+    def add(self, **values):
+        with self.lock:
+            for key, value in values.items():
+                self.values[key] = self.values.get(key, 0) + value
+
+
+def check_metrics(metrics):
+    """Число нарушений согласованности в одном снимке (словаре или MetricsSnapshot)."""
+    violations = 0
+    fps = metrics.get("fps")
+    if isinstance(fps, int) and (metrics.get("bitrate_kbit") != fps * 10 or metrics.get("total_size") != fps * 1000):
+        violations += 1
+    cpu = metrics.get("cpu_percent")
+    if isinstance(cpu, int) and metrics.get("memory_mb") != cpu * 2:
+        violations += 1
+    return violations
+
+
+def progress_writer(converter, stop, counters):
+    writes = 0
+    n = 0
+    while not stop.is_set():
+        n += 1
+        converter._apply_progress_block({"fps": n, "bitrate_kbit": n * 10, "total_size": n * 1000, "out_time_us": n * 1_000_000})
+        writes += 1
+    counters.add(writes=writes)
+
+
+def sampler_writer(converter, stop, counters):
+    writes = 0
+    m = 0
+    while not stop.is_set():
+        m += 1
+        converter._publish_system_metrics(m, m * 2, time.time())
+        writes += 1
+        if m % 50 == 0:
+            converter._reset_system_metrics() # Как при остановке: CPU и RSS сбрасываются вместе
+    counters.add(writes=writes)
+
+
+def status_writer(converter, stop, counters, seed):
+    rng = random.Random(seed)
+    accepted = rejected = invalid_accepted = 0
+    position = 0
+    while not stop.is_set():
+        if rng.random() < 0.2: # Недопустимый из текущего статуса переход должен быть отклонен
+            status, exit_code = rng.choice(INVALID_ATTEMPTS)
+            current = converter.state.status
+            expected_ok = status == current or status in TRANSITIONS[current]
+            if converter.transition(status, exit_code):
+                accepted += 1
+                # Переход мог стать допустимым, если другой писатель успел сменить статус
+                invalid_accepted += 0 if expected_ok or converter.state.status == status else 1
+            else:
+                rejected += 1
+            continue
+        status, exit_code = STATUS_CYCLE[position % len(STATUS_CYCLE)]
+        position += 1
+        if converter.transition(status, exit_code):
+            accepted += 1
+        else:
+            rejected += 1
+            # Другой писатель увел статус: продолжаем цикл с его текущего статуса
+            current = converter.state.status
+            position = next((i + 1 for i, (s, _) in enumerate(STATUS_CYCLE) if s == current), 0)
+    counters.add(transitions_accepted=accepted, transitions_rejected=rejected, violations=invalid_accepted)
+
+
+def reader(converters, stop, counters, seed):
+    rng = random.Random(seed)
+    reads = violations = 0
+    versions = {}
+    while not stop.is_set():
+        converter = converters[rng.randrange(len(converters))]
+        violations += check_metrics(converter.metrics)
+        state = converter.state
+        if state.status not in TRANSITIONS or (state.status == STATUS_FAILED and state.exit_code is None):
+            violations += 1
+        version = converter._metrics.version
+        if version < versions.get(converter, 0):
+            violations += 1
+        versions[converter] = version
+        reads += 1
+    counters.add(reads=reads, violations=violations)
+
+
+class LegacyConverter:
+    """Прежняя схема: общий словарь метрик, замер CPU/RSS - два присваивания, чтение - копия словаря."""
+
+    def __init__(self):
+        self.metrics = RTMPToRTSPConverter._empty_metrics().as_dict()
+
+    def _apply_progress_block(self, snapshot):
+        self.metrics.update(snapshot)
+
+    def _publish_system_metrics(self, cpu_percent, memory_mb, sample_time):
+        self.metrics["cpu_percent"] = cpu_percent
+        self.metrics["memory_mb"] = memory_mb
+        self.metrics["last_update_time"] = sample_time
+
+    def _reset_system_metrics(self):
+        self.metrics["cpu_percent"] = "N/A"
+        self.metrics["memory_mb"] = "N/A"
+
+
+def legacy_reader(converters, stop, counters, seed):
+    rng = random.Random(seed)
+    reads = violations = 0
+    while not stop.is_set():
+        violations += check_metrics(converters[rng.randrange(len(converters))].metrics.copy())
+        reads += 1
+    counters.add(reads=reads, violations=violations)
+
+
+def run(args):
+    counters = Counters()
+    stop = threading.Event()
+    threads = []
+    if args.legacy:
+        converters = [LegacyConverter() for _ in range(args.converters)]
+        read_target = legacy_reader
+    else:
+        converters = [RTMPToRTSPConverter(f"stress_{i}", f"rtmp://127.0.0.1/live/{i}", "127.0.0.1", 8554, f"stress_{i}")
+                      for i in range(args.converters)]
+        read_target = reader
+        for i, converter in enumerate(converters):
+            for j in range(args.status_writers):
+                threads.append(threading.Thread(target=status_writer, args=(converter, stop, counters, i * 100 + j)))
+    for converter in converters:
+        threads.append(threading.Thread(target=progress_writer, args=(converter, stop, counters)))
+        threads.append(threading.Thread(target=sampler_writer, args=(converter, stop, counters)))
+    for i in range(args.readers):
+        threads.append(threading.Thread(target=read_target, args=(converters, stop, counters, i)))
+
+    sys.setswitchinterval(args.switch_interval) # Частое переключение потоков провоцирует гонки
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    time.sleep(args.seconds)
+    stop.set()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+    return counters.values, elapsed, len(threads)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--converters", type=int, default=8)
+    parser.add_argument("--readers", type=int, default=16)
+    parser.add_argument("--status-writers", type=int, default=2, help="Писателей статуса на конвертер")
+    parser.add_argument("--seconds", type=float, default=5.0)
+    parser.add_argument("--switch-interval", type=float, default=1e-5, help="sys.setswitchinterval, сек")
+    parser.add_argument("--legacy", action="store_true", help="Прежняя схема с общим словарем (для сравнения)")
+    args = parser.parse_args()
+
+    values, elapsed, thread_count = run(args)
+    print(f"схема: {'общий словарь' if args.legacy else 'снимки (state.py)'}, потоков: {thread_count}, {elapsed:.1f} с")
+    print(f"чтений/с: {values.get('reads', 0) / elapsed:,.0f}, записей/с: {values.get('writes', 0) / elapsed:,.0f}")
+    if not args.legacy:
+        print(f"переходов статуса принято: {values.get('transitions_accepted', 0)}, "
+              f"отклонено: {values.get('transitions_rejected', 0)}")
+    print(f"нарушений согласованности: {values.get('violations', 0)}")
+    sys.exit(1 if values.get("violations") and not args.legacy else 0)
+
+
+if __name__ == "__main__":
+    main()
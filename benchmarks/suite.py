@@ -0,0 +1,212 @@
+#!/usr/bin/env python3
+"""Сквозной набор бенчмарков на заменителе FFmpeg (fake_ffmpeg.py) с результатом в JSON.
+
+Для каждого числа потоков из --streams в этом процессе по очереди:
+  start    - массовое создание; время до первого блока -progress у каждого потока и у всех вместе;
+  steady   - --window секунд работы: разобранных блоков -progress в секунду, CPU процесса сервиса
+             на поток (заменители FFmpeg не в счет), прирост RSS на поток, число потоков ОС;
+  recovery - SIGUSR1 всем процессам (падение по команде): время от падения до первого прогресса
+             после перезапуска супервизором (time_to_recover_s), доля восстановившихся потоков;
+  stop     - массовая остановка stop_many.
+
+Результат пишется в --json. С --baseline результат сравнивается с сохраненным прогоном: показатель,
+ухудшившийся больше чем на --tolerance (и больше абсолютного порога из METRICS), считается
+регрессией, и скрипт завершается с кодом 1.
+
+Запуск из корня проекта:
+    python benchmarks/suite.py --streams 1 10 100 --json results.json
+    python benchmarks/suite.py --streams 1 10 100 --baseline results.json
+"""
+import os
+import sys
+import json
+import time
+import signal
+import argparse
+import logging
+import platform
+import resource
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+ROOT_DIR = os.path.dirname(BENCH_DIR)
+
+# Показатели: (больше - лучше, абсолютный порог регрессии)
+METRICS = {
+    "start_all_s": (False, 0.5),
+    "ttfp_p50_s": (False, 0.2),
+    "ttfp_p95_s": (False, 0.3),
+    "parse_blocks_per_s": (True, 0.0),
+    "cpu_percent_per_stream": (False, 0.2),
+    "rss_mb_per_stream": (False, 0.2),
+    "threads": (False, 2),
+    "recovery_p50_s": (False, 0.3),
+    "recovery_p95_s": (False, 0.5),
+    "recovered_ratio": (True, 0.0),
+    "stop_all_s": (False, 0.5),
+}
+
+
+def percentile(values, q):
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(q * (len(values) - 1))))]
+
+
+def process_sample():
+    """(CPU процесса, сек; RSS, МБ; потоков ОС)."""
+    times = os.times()
+    with open("/proc/self/status") as f:
+        status = dict(line.split(":", 1) for line in f if ":" in line)
+    return times.user + times.system, int(status["VmRSS"].split()[0]) / 1024, int(status["Threads"])
+
+
+def wait_until(predicate, timeout, step=0.05):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if predicate():
+            return True
+        time.sleep(step)
+    return False
+
+
+def run_scenario(count, args):
+    from rtmp_to_rtsp_converter.manager import ConverterManager
+
+    manager = ConverterManager(pack_size=1)
+    _, rss_before, _ = process_sample()
+    specs = [{"rtmp_url": f"rtmp://127.0.0.1/live/suite_{count}_{i}", "rtsp_server_host": "127.0.0.1", "rtsp_port": 8554,
+              "rtsp_path": f"suite_{count}_{i}"} for i in range(count)]
+    result = {"streams": count}
+
+    # start: до первого блока -progress у всех потоков
+    started = time.perf_counter()
+    ids = [r["stream_id"] for r in manager.create_many(specs) if r["ok"]]
+    converters = [manager.get(sid) for sid in ids]
+    all_started = wait_until(lambda: all(c.metrics.get("time_to_first_packet_s") != "N/A" for c in converters),
+                             timeout=60 + count * 0.1)
+    result["start_all_s"] = round(time.perf_counter() - started, 3)
+    ttfp = [c.metrics["time_to_first_packet_s"] for c in converters if c.metrics.get("time_to_first_packet_s") != "N/A"]
+    result["started"] = len(ttfp)
+    result["ttfp_p50_s"] = percentile(ttfp, 0.5)
+    result["ttfp_p95_s"] = percentile(ttfp, 0.95)
+    if not all_started:
+        print(f"{count} потоков: до первого пакета дошли только {len(ttfp)}.", file=sys.stderr)
+
+    # steady: разбор -progress и стоимость потока для процесса сервиса
+    blocks_before = sum(c._progress_parser.blocks for c in converters)
+    cpu_before, _, _ = process_sample()
+    wall_before = time.monotonic()
+    time.sleep(args.window)
+    wall = time.monotonic() - wall_before
+    cpu_after, rss_after, threads = process_sample()
+    result["parse_blocks_per_s"] = round((sum(c._progress_parser.blocks for c in converters) - blocks_before) / wall, 1)
+    result["cpu_percent_per_stream"] = round(100.0 * (cpu_after - cpu_before) / wall / max(count, 1), 3)
+    result["rss_mb_per_stream"] = round((rss_after - rss_before) / max(count, 1), 3)
+    result["threads"] = threads
+
+    # recovery: падение по команде и перезапуск супервизором
+    for converter in converters:
+        converter.last_recovery_seconds = None
+    for converter in converters:
+        try:
+            os.kill(converter.process.pid, signal.SIGUSR1)
+        except (AttributeError, ProcessLookupError):
+            pass
+    wait_until(lambda: all(c.last_recovery_seconds is not None for c in converters), timeout=30 + count * 0.1, step=0.1)
+    recovery = [c.last_recovery_seconds for c in converters if c.last_recovery_seconds is not None]
+    result["recovered_ratio"] = round(len(recovery) / max(count, 1), 3)
+    result["recovery_p50_s"] = percentile(recovery, 0.5)
+    result["recovery_p95_s"] = percentile(recovery, 0.95)
+    result["recovery_max_s"] = max(recovery) if recovery else None
+
+    # stop
+    started = time.perf_counter()
+    stop_results = manager.stop_many(ids)
+    result["stop_all_s"] = round(time.perf_counter() - started, 3)
+    result["stop_failed"] = sum(1 for r in stop_results if not r["ok"])
+    for stream_id in ids:
+        try:
+            manager.remove(stream_id)
+        except (KeyError, ValueError):
+            pass
+    return result
+
+
+def compare(results, baseline, tolerance):
+    """Список регрессий относительно baseline (по совпадающим числам потоков)."""
+    regressions = []
+    for count, current in results.items():
+        base = baseline.get("results", {}).get(count)
+        if not base:
+            continue
+        for key, (higher_is_better, slack) in METRICS.items():
+            new, old = current.get(key), base.get(key)
+            if new is None or old is None:
+                continue
+            worse = old - new if higher_is_better else new - old
+            if worse > slack and worse > abs(old) * tolerance:
+                regressions.append(f"{count} потоков: {key} {old} -> {new}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--streams", type=int, nargs="+", default=[1, 10, 100, 1000])
+    parser.add_argument("--window", type=float, default=5.0, help="Длительность замера steady, сек")
+    parser.add_argument("--progress-period", type=float, default=0.5, help="FAKE_FFMPEG_PROGRESS_PERIOD")
+    parser.add_argument("--stderr-rate", type=float, default=1.0, help="FAKE_FFMPEG_STDERR_RATE, строк/с на поток")
+    parser.add_argument("--seed", default="0", help="FAKE_FFMPEG_SEED")
+    parser.add_argument("--json", help="Куда записать результат")
+    parser.add_argument("--baseline", help="JSON прошлого прогона для сравнения")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="Допустимое относительное ухудшение")
+    args = parser.parse_args()
+
+    # Настройки читаются при импорте модулей и наследуются заменителями FFmpeg, поэтому задаются до импорта
+    os.environ.setdefault("FFMPEG_PATH", os.path.join(BENCH_DIR, "fake_ffmpeg.py"))
+    os.environ["KAZSTREAMLINK_REGISTRY"] = ""
+    os.environ["KAZSTREAMLINK_PROBE_CACHE"] = "0"
+    os.environ["KAZSTREAMLINK_ADMISSION"] = "0" # Нагрузка задается числом потоков, контроль допуска ее бы срезал
+    os.environ["FAKE_FFMPEG_PROGRESS_PERIOD"] = str(args.progress_period)
+    os.environ["FAKE_FFMPEG_STDERR_RATE"] = str(args.stderr_rate)
+    os.environ["FAKE_FFMPEG_SEED"] = args.seed
+    sys.path.insert(0, ROOT_DIR)
+    logging.disable(logging.ERROR) # Падения по команде пишут ошибки FFmpeg в лог
+    # По каналу и pidfd на процесс: 1000 потоков не помещаются в стандартные 1024 дескриптора
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))
+
+    results = {}
+    header = f"{'потоков':>8} {'старт, с':>9} {'ttfp p95':>9} {'блоков/с':>9} {'CPU %/пот':>10} {'RSS МБ/пот':>11} " \
+             f"{'нитей':>6} {'восст. p95':>11} {'восст.':>7} {'стоп, с':>8}"
+    print(header)
+    for count in args.streams:
+        r = results[str(count)] = run_scenario(count, args)
+        print(f"{count:>8} {r['start_all_s']:>9.2f} {r['ttfp_p95_s'] or 0:>9.3f} {r['parse_blocks_per_s']:>9.1f} "
+              f"{r['cpu_percent_per_stream']:>10.3f} {r['rss_mb_per_stream']:>11.3f} {r['threads']:>6} "
+              f"{r['recovery_p95_s'] or 0:>11.3f} {r['recovered_ratio']:>7.0%} {r['stop_all_s']:>8.2f}")
+
+    report = {
+        "suite": "kazstreamlink",
+        "version": 1,
+        "created_at": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "host": {"cpu_count": os.cpu_count(), "python": platform.python_version(), "platform": platform.platform()},
+        "config": {"window_s": args.window, "progress_period_s": args.progress_period,
+                   "stderr_rate": args.stderr_rate, "seed": args.seed},
+        "results": results,
+    }
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            regressions = compare(results, json.load(f), args.tolerance)
+        for line in regressions:
+            print(f"РЕГРЕССИЯ: {line}")
+        if regressions:
+            sys.exit(1)
+        print("Регрессий нет.")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,259 @@
+import os
+import time
+import logging
+import threading
+
+# Контроль допуска новых потоков по модели емкости узла.
+#
+# Без ограничения 400 отправок формы запускают 400 процессов FFmpeg: CPU и сеть узла перегружаются,
+# и деградируют сразу все потоки. Модель емкости учится стоимости потока на тех же замерах, что
+# публикует сборщик метрик (sampler.py): CPU и RSS процесса FFmpeg и битрейт выхода. Стоимость
+# (CPU %, RSS МБ, Мбит/с сети) хранится скользящим средним (EWMA) по RTMP URL и по всему узлу;
+# для незнакомого источника берется средняя по узлу, пока замеров нет - PRIOR_COST.
+#
+# Перед запуском нового потока admit() сравнивает прогноз "текущая загрузка + резервы еще не
+# измеренных потоков + стоимость нового" с пределами узла (емкость * доля KAZSTREAMLINK_ADMIT_*):
+#   * помещается - поток допускается, его прогноз резервируется до первого замера;
+#   * не помещается - запрос ждет освобождения емкости до ADMIT_QUEUE_SEC (не больше ADMIT_QUEUE
+#     ожидающих), затем получает отказ AdmissionRejected (503 в HTTP API).
+# Перезапуски супервизором и принятые после перезапуска сервиса процессы не проверяются: поток уже
+# занимает свою долю, и его загрузка учитывается до остановки пользователем.
+
+ADMISSION_ENABLED = os.environ.get("KAZSTREAMLINK_ADMISSION", "1") != "0"
+HEADROOM_CPU = float(os.environ.get("KAZSTREAMLINK_ADMIT_CPU", "0.8")) # Доля всех ядер узла для FFmpeg
+HEADROOM_MEMORY = float(os.environ.get("KAZSTREAMLINK_ADMIT_MEMORY", "0.8")) # Доля памяти узла
+HEADROOM_NIC = float(os.environ.get("KAZSTREAMLINK_ADMIT_NIC", "0.8")) # Доля пропускной способности сети
+ADMIT_QUEUE_SEC = float(os.environ.get("KAZSTREAMLINK_ADMIT_QUEUE_SEC", "10")) # 0 - отказ без ожидания
+ADMIT_QUEUE = int(os.environ.get("KAZSTREAMLINK_ADMIT_QUEUE", "64")) # Сколько запросов может ждать емкости
+NODE_MAX_STREAMS = int(os.environ.get("KAZSTREAMLINK_NODE_MAX_STREAMS", "0")) # 0 - ограничивают только ресурсы
+NODE_NIC_MBIT = float(os.environ.get("KAZSTREAMLINK_NODE_NIC_MBIT", "1000")) # Пропускная способность сети узла
+
+RESOURCES = ("cpu", "memory", "nic", "streams")
+RESOURCE_TITLES = {"cpu": "CPU", "memory": "память", "nic": "сеть", "streams": "число потоков"}
+PRIOR_COST = (3.0, 30.0, 4.0) # (CPU %, RSS МБ, Мбит/с) потока -c copy до первых замеров
+COST_ALPHA = 0.05 # Вес нового замера в EWMA (при замере раз в секунду - около минуты памяти)
+RESERVATION_TTL_SEC = 30.0 # Резерв потока, так и не давшего замеров (не запустился), снимается
+WARMUP_SEC = 5.0 # Первые секунды процесса (анализ входа, битрейт по короткому интервалу) не учат стоимость
+
+
+class AdmissionRejected(RuntimeError):
+    """Узлу не хватает емкости для нового потока."""
+
+    def __init__(self, stream_id, resource, message):
+        super().__init__(message)
+        self.stream_id = stream_id
+        self.resource = resource
+
+
+def read_memory_mb():
+    """Объем памяти узла (MemTotal из /proc/meminfo), МБ, или None."""
+    try:
+        with open("/proc/meminfo", "rb") as f:
+            for line in f:
+                if line.startswith(b"MemTotal:"):
+                    return int(line.split()[1]) / 1024
+    except (OSError, ValueError, IndexError):
+        pass
+    return None
+
+
+def node_capacity():
+    """Полная емкость узла по ресурсам (без запаса)."""
+    memory_mb = read_memory_mb()
+    return {
+        "cpu": (os.cpu_count() or 1) * 100.0, # 100 = одно ядро, как cpu_percent процессов
+        "memory": memory_mb if memory_mb is not None else float("inf"),
+        "nic": NODE_NIC_MBIT,
+        "streams": NODE_MAX_STREAMS or float("inf"),
+    }
+
+
+class CapacityModel:
+    """Стоимость потоков, текущая загрузка узла и решение о допуске новых потоков."""
+
+    def __init__(self, capacity=None, headroom=None, queue_sec=ADMIT_QUEUE_SEC, queue_max=ADMIT_QUEUE,
+                 enabled=ADMISSION_ENABLED):
+        self.capacity = capacity or node_capacity()
+        headroom = headroom or {"cpu": HEADROOM_CPU, "memory": HEADROOM_MEMORY, "nic": HEADROOM_NIC, "streams": 1.0}
+        self.limits = {resource: self.capacity[resource] * headroom[resource] for resource in RESOURCES}
+        self.queue_sec = queue_sec
+        self.queue_max = queue_max
+        self.enabled = enabled
+        self._cond = threading.Condition()
+        self._actual = {} # {конвертер: (cpu, memory, mbit, [rtmp_url входов])} - последний замер
+        self._first_seen = {} # {конвертер: time.monotonic() первого замера}
+        self._reserved = {} # {stream_id: ((cpu, memory, mbit), rtmp_url, срок)} - допущены, замеров еще нет
+        self._url_cost = {} # {rtmp_url: [cpu, memory, mbit, замеров]} - EWMA стоимости входа
+        self._fleet_cost = list(PRIOR_COST) # EWMA стоимости любого потока узла
+        self._fleet_samples = 0
+        self.waiting = 0
+        self.decisions = {"admitted": 0, "queued": 0, "rejected": 0}
+
+    # --- Обучение ---
+
+    def record(self, converter, cpu_percent, memory_mb, network_mbit):
+        """Замер процесса FFmpeg конвертера (группа делит его поровну между входами).
+
+        Пока нет битрейта (network_mbit is None), замер неполон: резерв потока сохраняется.
+        """
+        if not isinstance(cpu_percent, (int, float)) or not isinstance(memory_mb, (int, float)) or network_mbit is None:
+            return
+        inputs = converter._capacity_inputs()
+        if not inputs:
+            return
+        share = len(inputs)
+        sample = (cpu_percent / share, memory_mb / share, network_mbit / share)
+        with self._cond:
+            released = False
+            learn = time.monotonic() - self._first_seen.setdefault(converter, time.monotonic()) >= WARMUP_SEC
+            for stream_id, rtmp_url in inputs:
+                released |= self._reserved.pop(stream_id, None) is not None
+                if not learn:
+                    continue
+                # Первые замеры усредняются поровну (1/n), затем EWMA: оценка быстро уходит от начального значения
+                cost = self._url_cost.setdefault(rtmp_url, [0.0, 0.0, 0.0, 0])
+                cost[3] += 1
+                alpha = max(COST_ALPHA, 1.0 / cost[3])
+                for i, value in enumerate(sample):
+                    cost[i] += alpha * (value - cost[i])
+                self._fleet_samples += 1
+                alpha = max(COST_ALPHA, 1.0 / self._fleet_samples)
+                for i, value in enumerate(sample):
+                    self._fleet_cost[i] += alpha * (value - self._fleet_cost[i])
+            self._actual[converter] = (cpu_percent, memory_mb, network_mbit, [url for _, url in inputs])
+            if released and self.waiting:
+                self._cond.notify_all()
+
+    def forget(self, converter):
+        """Поток остановлен пользователем или удален: его загрузка больше не учитывается."""
+        with self._cond:
+            self._first_seen.pop(converter, None)
+            if self._actual.pop(converter, None) is not None and self.waiting:
+                self._cond.notify_all()
+
+    def release(self, stream_id):
+        """Снимает резерв потока, который не запустился."""
+        with self._cond:
+            if self._reserved.pop(stream_id, None) is not None and self.waiting:
+                self._cond.notify_all()
+
+    def cost(self, rtmp_url):
+        """Прогноз стоимости потока: (CPU %, RSS МБ, Мбит/с)."""
+        with self._cond:
+            return self._cost(rtmp_url)
+
+    def _cost(self, rtmp_url):
+        cost = self._url_cost.get(rtmp_url)
+        return tuple(cost[:3]) if cost else tuple(self._fleet_cost)
+
+    # --- Допуск ---
+
+    def _usage(self, now):
+        """Загрузка узла: измеренная (actual) и с резервами (для допуска), по ресурсам."""
+        for stream_id in [sid for sid, (_, _, expires) in self._reserved.items() if expires < now]:
+            del self._reserved[stream_id]
+        actual = dict.fromkeys(RESOURCES, 0.0)
+        for cpu_percent, memory_mb, network_mbit, urls in self._actual.values():
+            actual["cpu"] += cpu_percent
+            actual["memory"] += memory_mb
+            actual["nic"] += network_mbit
+            actual["streams"] += len(urls)
+        committed = dict(actual)
+        for cost, _, _ in self._reserved.values():
+            committed["cpu"] += cost[0]
+            committed["memory"] += cost[1]
+            committed["nic"] += cost[2]
+            committed["streams"] += 1
+        return actual, committed
+
+    def _blocking_resource(self, cost):
+        """Ресурс, предел которого превысит новый поток, или None."""
+        if not self._actual and not self._reserved:
+            return None # На пустом узле допускается любой поток, иначе дорогой источник не запустится никогда
+        _, committed = self._usage(time.monotonic())
+        for resource, extra in zip(RESOURCES, (*cost, 1)):
+            if committed[resource] + extra > self.limits[resource]:
+                return resource
+        return None
+
+    def admit(self, stream_id, rtmp_url, wait=True):
+        """Допускает поток (резервируя его прогноз) или ждет емкости; AdmissionRejected - отказ."""
+        if not self.enabled:
+            return
+        with self._cond:
+            cost = self._cost(rtmp_url)
+            resource = self._blocking_resource(cost)
+            if resource is not None:
+                if not wait or self.queue_sec <= 0 or self.waiting >= self.queue_max:
+                    self._reject(stream_id, resource)
+                self.decisions["queued"] += 1
+                self.waiting += 1
+                deadline = time.monotonic() + self.queue_sec
+                try:
+                    while resource is not None:
+                        remaining = deadline - time.monotonic()
+                        if remaining <= 0:
+                            self._reject(stream_id, resource)
+                        # Емкость освобождают замеры и остановки; раз в секунду проверяем и истекшие резервы
+                        self._cond.wait(min(remaining, 1.0))
+                        cost = self._cost(rtmp_url)
+                        resource = self._blocking_resource(cost)
+                finally:
+                    self.waiting -= 1
+            self._reserved[stream_id] = (cost, rtmp_url, time.monotonic() + RESERVATION_TTL_SEC)
+            self.decisions["admitted"] += 1
+
+    def _reject(self, stream_id, resource):
+        self.decisions["rejected"] += 1
+        message = (f"Недостаточно емкости узла для потока {stream_id}: "
+                   f"{RESOURCE_TITLES[resource]} выше {self.limits[resource]:g} с учетом нового потока.")
+        logging.warning(message)
+        raise AdmissionRejected(stream_id, resource, message)
+
+    # --- Отчет ---
+
+    def report(self):
+        """Емкость, пределы, измеренная и прогнозная загрузка узла, стоимость потока и счетчики решений."""
+        with self._cond:
+            actual, committed = self._usage(time.monotonic())
+            # Прогноз модели для тех же потоков: сравнение с actual показывает точность стоимости
+            predicted = dict.fromkeys(RESOURCES, 0.0)
+            for _, _, _, urls in self._actual.values():
+                for url in urls:
+                    for resource, value in zip(RESOURCES, (*self._cost(url), 1)):
+                        predicted[resource] += value
+            for cost, _, _ in self._reserved.values():
+                for resource, value in zip(RESOURCES, (*cost, 1)):
+                    predicted[resource] += value
+            utilisation = {
+                resource: {
+                    "actual": round(actual[resource] / self.capacity[resource], 4),
+                    "predicted": round(predicted[resource] / self.capacity[resource], 4),
+                    "limit": round(self.limits[resource] / self.capacity[resource], 4),
+                }
+                for resource in RESOURCES if self.capacity[resource] != float("inf")
+            }
+            return {
+                "enabled": self.enabled,
+                "capacity": {r: v for r, v in self.capacity.items() if v != float("inf")},
+                "actual": {r: round(v, 2) for r, v in actual.items()},
+                "committed": {r: round(v, 2) for r, v in committed.items()},
+                "predicted": {r: round(v, 2) for r, v in predicted.items()},
+                "utilisation": utilisation,
+                "stream_cost": dict(zip(("cpu", "memory", "nic"), (round(v, 3) for v in self._fleet_cost))),
+                "reserved": len(self._reserved),
+                "waiting": self.waiting,
+                "decisions": dict(self.decisions),
+            }
+
+
+_default_model = None
+_default_model_lock = threading.Lock()
+
+def get_capacity_model():
+    """Возвращает общую для процесса модель емкости узла."""
+    global _default_model
+    with _default_model_lock:
+        if _default_model is None:
+            _default_model = CapacityModel()
+        return _default_model
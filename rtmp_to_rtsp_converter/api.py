@@ -0,0 +1,511 @@
+import os
+import sys
+import hmac
+import json
+import time
+import signal
+import socket
+import asyncio
+import logging
+import argparse
+import ipaddress
+import threading
+from urllib.parse import urlsplit, parse_qs
+
+from rtmp_to_rtsp_converter.manager import get_manager
+from rtmp_to_rtsp_converter.exporter import get_exporter
+from rtmp_to_rtsp_converter.log_pipeline import install_queue_logging
+from rtmp_to_rtsp_converter.node import WorkerAgent, node_report, default_node_id, API_TOKEN
+from rtmp_to_rtsp_converter.admission import AdmissionRejected, get_capacity_model
+from rtmp_to_rtsp_converter.profiling import get_instrumentation, get_profiler
+from rtmp_to_rtsp_converter.profiles import PROFILES, DEFAULT_PROFILE
+
+# Headless HTTP API управления конвертерами (только стандартная библиотека, asyncio).
+# Запуск:  python -m rtmp_to_rtsp_converter.api --host 127.0.0.1 --port 8080
+#
+# API запускает процессы FFmpeg и пишет файлы выходов, поэтому по умолчанию слушает только loopback.
+# На другом адресе он требует токен (KAZSTREAMLINK_API_TOKEN): все запросы, кроме GET /health,
+# передают заголовок "Authorization: Bearer <токен>", иначе ответ 401.
+#
+#   GET    /streams                 список потоков со статусами и метриками
+#   GET    /profiles                профили передачи (буферизация входа и транспорт RTSP) для поля "profile" потока
+#   POST   /streams                 создать один ({...}) или много ({"streams": [{...}, ...]}) потоков
+#   POST   /streams/stop            остановить {"stream_ids": [...]} или все ({}), результат по каждому потоку
+#   POST   /streams/start           запустить остановленные {"stream_ids": [...]} или все неработающие ({})
+#   GET    /streams/metrics         метрики всех потоков {stream_id: {...}}
+#   GET    /streams/<id>            один поток (+ логи FFmpeg)
+#   GET    /streams/<id>/recordings сегменты записи (recording.py): ?at=<unix> - сегмент на момент, ?from=&to= - за интервал
+#   POST   /streams/<id>/stop       остановить поток
+#   POST   /streams/<id>/start      запустить остановленный поток
+#   DELETE /streams/<id>            удалить остановленный поток из реестра
+#   POST   /streams/<id>/latency    включить ({"enabled": true}) или выключить зонд задержки выхода RTSP (latency.py)
+#   POST   /demand/read             зритель подключился к пути (?path=... или {"path"/"stream_id"}): запуск потока по запросу
+#   POST   /demand/unread           зрителей пути не осталось: поток остановится по простою (ondemand.py)
+#   GET    /demand                  зрители, холодные старты и экономия потоков по запросу
+#   GET    /dedup                   источники с общим процессом FFmpeg и экономия от дедупликации (dedup.py)
+#   GET    /latency                 зонды задержки: состояние, режим (timecode/jitter) и квантили по окну
+#   GET    /metrics                 метрики в формате Prometheus/OpenMetrics (exporter.py)
+#   GET    /health                  проверка работоспособности
+#   GET    /node                    емкость узла для координатора кластера (node.py)
+#   GET    /capacity                модель емкости узла: лимиты, резервы, очередь допуска и стоимость потоков (admission.py)
+#   GET    /debug/instrumentation   замеры горячего пути, блокировок, GIL и CPU по потокам (profiling.py)
+#   POST   /debug/profile/start     запустить выборочный профилировщик ({"hz": 100, "duration": 60})
+#   POST   /debug/profile/stop      остановить профилировщик и получить стеки в формате folded
+#   GET    /debug/profile           состояние профилировщика (?format=folded - стеки, собранные к этому моменту)
+#
+# С --coordinator процесс работает как узел кластера: отправляет координатору (cluster.py) heartbeat
+# с отчетом о емкости, а координатор создает и переносит потоки через этот же API.
+#
+# Запуск/остановка FFmpeg блокируют поток (Popen, ожидание каналов), поэтому выполняются
+# в пуле потоков, а цикл asyncio только принимает запросы.
+
+API_HOST = os.environ.get("KAZSTREAMLINK_API_HOST", "127.0.0.1")
+API_PORT = int(os.environ.get("KAZSTREAMLINK_API_PORT", "8080"))
+MAX_BODY_BYTES = 16 * 1024 * 1024
+MAX_HEADERS = 100 # Строки длиннее лимита StreamReader (64 КиБ) отклоняются самим readline()
+FOLDED_CONTENT_TYPE = "text/plain; charset=utf-8" # Стеки профилировщика для flamegraph.pl / speedscope
+
+_REASONS = {200: "OK", 201: "Created", 204: "No Content", 400: "Bad Request", 401: "Unauthorized", 404: "Not Found",
+            405: "Method Not Allowed", 409: "Conflict", 413: "Payload Too Large",
+            431: "Request Header Fields Too Large", 500: "Internal Server Error",
+            502: "Bad Gateway", 503: "Service Unavailable"}
+
+
+class Request:
+    """Разобранный запрос, передаваемый обработчикам."""
+    __slots__ = ("method", "path", "query", "headers", "body")
+
+    def __init__(self, method, path, query, headers, body):
+        self.method = method
+        self.path = path
+        self.query = query
+        self.headers = headers
+        self.body = body
+
+
+class HTTPError(Exception):
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+        self.message = message
+
+
+def content_length(headers):
+    """Длина тела по заголовку Content-Length (0, если его нет); HTTPError 400 - не целое неотрицательное число."""
+    value = headers.get("content-length") or "0"
+    # Только цифры ASCII: int() принял бы и "-1", "+1", "1_000"
+    if not (value.isascii() and value.isdigit()):
+        raise HTTPError(400, f"Некорректный Content-Length: {value}.")
+    return int(value)
+
+
+def is_loopback(host):
+    """Адрес слушает только локальные подключения (127.0.0.0/8, ::1, localhost)."""
+    if host == "localhost":
+        return True
+    try:
+        return ipaddress.ip_address(host.strip("[]")).is_loopback
+    except ValueError:
+        return False
+
+
+def check_bind(host, token=API_TOKEN):
+    """RuntimeError, если API без токена слушает не только loopback."""
+    if not token and not is_loopback(host):
+        raise RuntimeError(f"HTTP API на адресе {host} доступен по сети: задайте KAZSTREAMLINK_API_TOKEN "
+                           f"или слушайте 127.0.0.1 (KAZSTREAMLINK_API_HOST).")
+
+
+def authorized(headers, path, token=API_TOKEN):
+    """Запрос предъявил токен API (или токен не задан); GET /health доступен без токена."""
+    if not token or path == "/health":
+        return True
+    scheme, _, value = headers.get("authorization", "").partition(" ")
+    return scheme.lower() == "bearer" and hmac.compare_digest(value.strip().encode(), token.encode())
+
+
+def describe_converter(converter, with_logs=False):
+    """Сериализуемое описание конвертера для ответов API."""
+    info = {
+        "stream_id": converter.stream_id,
+        "status": converter.get_status(),
+        "rtmp_url": converter.rtmp_url,
+        "rtsp_server_host": converter.rtsp_server_host,
+        "rtsp_port": converter.rtsp_port,
+        "rtsp_path": converter.rtsp_path,
+        "output_url": converter.output_rtsp_url_for_ffmpeg_push,
+        "outputs": converter.get_output_legs(),
+        "recording_dir": converter.recorder.directory if converter.recorder else None,
+        "on_demand": converter.on_demand,
+        "profile": converter.profile.name,
+        "pid": converter.process.pid if converter.process else None,
+        "last_error": converter.get_last_error(),
+        "metrics": converter.get_metrics(),
+    }
+    if with_logs:
+        info["logs"] = converter.get_ffmpeg_logs()
+    return info
+
+
+class ControlPlaneAPI:
+    def __init__(self, manager=None, node_id=None, token=API_TOKEN):
+        self.manager = manager or get_manager()
+        self.node_id = node_id or default_node_id(API_PORT)
+        self.token = token
+        self._routes = [] # [(method, parts, handler)]
+        self.route("GET", "/health", self.health)
+        self.route("GET", "/node", self.node)
+        self.route("GET", "/capacity", self.capacity)
+        self.route("GET", "/metrics", self.prometheus_metrics)
+        self.route("GET", "/debug/instrumentation", self.instrumentation)
+        self.route("POST", "/debug/profile/start", self.start_profile)
+        self.route("POST", "/debug/profile/stop", self.stop_profile)
+        self.route("GET", "/debug/profile", self.profile)
+        self.route("GET", "/profiles", self.profiles)
+        self.route("GET", "/streams", self.list_streams)
+        self.route("POST", "/streams", self.create_streams)
+        self.route("POST", "/streams/stop", self.stop_streams)
+        self.route("POST", "/streams/start", self.start_streams)
+        self.route("GET", "/streams/metrics", self.streams_metrics)
+        self.route("GET", "/streams/{id}", self.get_stream)
+        self.route("GET", "/streams/{id}/recordings", self.get_recordings)
+        self.route("POST", "/streams/{id}/stop", self.stop_stream)
+        self.route("POST", "/streams/{id}/start", self.start_stream)
+        self.route("DELETE", "/streams/{id}", self.delete_stream)
+        self.route("POST", "/streams/{id}/latency", self.set_latency_probe)
+        self.route("POST", "/demand/read", self.demand_read)
+        self.route("POST", "/demand/unread", self.demand_unread)
+        self.route("GET", "/demand", self.demand)
+        self.route("GET", "/dedup", self.dedup)
+        self.route("GET", "/latency", self.latency)
+
+    def route(self, method, path, handler):
+        """Регистрирует обработчик: handler(request, **path_params) -> (status, payload)."""
+        self._routes.append((method, tuple(path.strip("/").split("/")), handler))
+
+    def _match(self, method, path):
+        parts = tuple(path.strip("/").split("/"))
+        allowed = False
+        for route_method, route_parts, handler in self._routes:
+            if len(route_parts) != len(parts):
+                continue
+            params = {}
+            for pattern, part in zip(route_parts, parts):
+                if pattern.startswith("{"):
+                    params[pattern[1:-1]] = part
+                elif pattern != part:
+                    break
+            else:
+                if route_method == method:
+                    return handler, params
+                allowed = True
+        raise HTTPError(405 if allowed else 404, "Метод не поддерживается." if allowed else "Ресурс не найден.")
+
+    async def dispatch(self, method, target, body, headers=None):
+        """Возвращает (status, payload или (content_type, bytes))."""
+        url = urlsplit(target)
+        handler, params = self._match(method, url.path)
+        payload = None
+        if body:
+            try:
+                payload = json.loads(body)
+            except ValueError:
+                raise HTTPError(400, "Тело запроса должно быть JSON.")
+        query = {k: v[-1] for k, v in parse_qs(url.query).items()}
+        request = Request(method, url.path, query, headers or {}, payload)
+        loop = asyncio.get_running_loop()
+        # Обработчики синхронные и могут блокироваться на запуске/остановке FFmpeg
+        return await loop.run_in_executor(None, lambda: handler(request, **params))
+
+    # --- Обработчики ---
+
+    def health(self, request):
+        return 200, {"ok": True, "streams": len(self.manager.converters()), "restore": self.manager.last_restore}
+
+    def node(self, request):
+        return 200, node_report(self.manager, self.node_id)
+
+    def capacity(self, request):
+        return 200, get_capacity_model().report()
+
+    def prometheus_metrics(self, request):
+        # Prometheus запрашивает OpenMetrics через Accept; иначе отдаем текстовый формат 0.0.4
+        openmetrics = "application/openmetrics-text" in request.headers.get("accept", "")
+        return 200, get_exporter().render(openmetrics)
+
+    def instrumentation(self, request):
+        return 200, get_instrumentation().report()
+
+    def start_profile(self, request):
+        body = request.body if isinstance(request.body, dict) else {}
+        try:
+            return 200, get_profiler().start(hz=body.get("hz"), duration=body.get("duration"))
+        except ValueError as e:
+            raise HTTPError(400, str(e))
+        except RuntimeError as e:
+            raise HTTPError(409, str(e))
+
+    def stop_profile(self, request):
+        return 200, (FOLDED_CONTENT_TYPE, get_profiler().stop().encode("utf-8"))
+
+    def profile(self, request):
+        profiler = get_profiler()
+        if request.query.get("format") == "folded":
+            return 200, (FOLDED_CONTENT_TYPE, profiler.folded().encode("utf-8"))
+        return 200, profiler.status()
+
+    def list_streams(self, request):
+        return 200, {"streams": [describe_converter(c) for c in self.manager.converters()]}
+
+    def streams_metrics(self, request):
+        return 200, {c.stream_id: dict(c.get_metrics(), status=c.get_status()) for c in self.manager.converters()}
+
+    def profiles(self, request):
+        return 200, {"default": DEFAULT_PROFILE, "profiles": [profile.as_dict() for profile in PROFILES.values()]}
+
+    def create_streams(self, request):
+        body = request.body
+        if isinstance(body, dict) and "streams" in body:
+            specs = body["streams"]
+            if not isinstance(specs, list):
+                raise HTTPError(400, "Поле streams должно быть списком.")
+            results = self.manager.create_many(specs)
+            return 200, {"results": results, "created": sum(1 for r in results if r["ok"])}
+        try:
+            converter = self.manager.create(body)
+        except AdmissionRejected as e:
+            raise HTTPError(503, str(e))
+        except ValueError as e:
+            raise HTTPError(409 if "уже существует" in str(e) else 400, str(e))
+        return 201, describe_converter(converter)
+
+    @staticmethod
+    def _stream_ids(request):
+        if request.body is None:
+            return None
+        if not isinstance(request.body, dict):
+            raise HTTPError(400, "Тело запроса должно быть объектом {\"stream_ids\": [...]}.")
+        stream_ids = request.body.get("stream_ids")
+        if stream_ids is not None and not isinstance(stream_ids, list):
+            raise HTTPError(400, "Поле stream_ids должно быть списком.")
+        return stream_ids
+
+    def stop_streams(self, request):
+        results = self.manager.stop_many(self._stream_ids(request))
+        return 200, {"results": results, "stopped": sum(1 for r in results if r["ok"])}
+
+    def start_streams(self, request):
+        results = self.manager.start_many(self._stream_ids(request))
+        return 200, {"results": results, "started": sum(1 for r in results if r["ok"])}
+
+    def _get_or_404(self, stream_id):
+        converter = self.manager.get(stream_id)
+        if converter is None:
+            raise HTTPError(404, f"Поток {stream_id} не найден.")
+        return converter
+
+    def get_stream(self, request, id):
+        return 200, describe_converter(self._get_or_404(id), with_logs=True)
+
+    def get_recordings(self, request, id):
+        converter = self._get_or_404(id)
+        try:
+            bounds = {key: float(request.query[key]) for key in ("at", "from", "to") if key in request.query}
+        except ValueError:
+            raise HTTPError(400, "Параметры at, from и to - время в секундах Unix.")
+        segments = converter.get_recordings(since=bounds.get("from"), until=bounds.get("to"), at=bounds.get("at"))
+        if segments is None:
+            raise HTTPError(404, f"Запись потока {id} не включена.")
+        return 200, {"stream_id": id, "segments": segments}
+
+    def stop_stream(self, request, id):
+        self._get_or_404(id)
+        return 200, describe_converter(self.manager.stop(id))
+
+    def start_stream(self, request, id):
+        converter = self._get_or_404(id)
+        result = self.manager.start_many([id])[0]
+        if result.get("rejected"):
+            raise HTTPError(503, result["error"])
+        return 200, describe_converter(converter)
+
+    def delete_stream(self, request, id):
+        self._get_or_404(id)
+        try:
+            self.manager.remove(id)
+        except ValueError as e:
+            raise HTTPError(409, str(e))
+        return 204, None
+
+    def set_latency_probe(self, request, id):
+        self._get_or_404(id)
+        body = request.body if isinstance(request.body, dict) else {}
+        enabled = body.get("enabled", True)
+        if not isinstance(enabled, bool):
+            raise HTTPError(400, "Поле enabled должно быть true или false.")
+        self.manager.set_latency_probe([id], enabled)
+        return 200, {"stream_id": id, "enabled": enabled}
+
+    @staticmethod
+    def _demand_target(request):
+        """(path, stream_id) из параметров запроса или тела; хуки mediamtx передают путь в ?path=$MTX_PATH."""
+        body = request.body if isinstance(request.body, dict) else {}
+        path = request.query.get("path") or body.get("path")
+        stream_id = request.query.get("stream_id") or body.get("stream_id")
+        if not path and not stream_id:
+            raise HTTPError(400, "Укажите path или stream_id.")
+        return path, stream_id
+
+    def demand_read(self, request):
+        path, stream_id = self._demand_target(request)
+        wait = request.query.get("wait", "1") != "0" # wait=0 - не ждать первого пакета
+        try:
+            return 200, self.manager.on_demand.read(path, stream_id, wait=wait)
+        except KeyError:
+            raise HTTPError(404, f"Поток по запросу {stream_id or path} не найден.")
+        except ValueError as e:
+            raise HTTPError(409, str(e))
+        except AdmissionRejected as e:
+            raise HTTPError(503, str(e))
+        except RuntimeError as e:
+            raise HTTPError(502, str(e))
+
+    def demand_unread(self, request):
+        path, stream_id = self._demand_target(request)
+        try:
+            return 200, self.manager.on_demand.unread(path, stream_id)
+        except KeyError:
+            raise HTTPError(404, f"Поток по запросу {stream_id or path} не найден.")
+
+    def demand(self, request):
+        return 200, self.manager.on_demand.report()
+
+    def dedup(self, request):
+        return 200, self.manager.dedup_report()
+
+    def latency(self, request):
+        return 200, self.manager.latency_report()
+
+    # --- HTTP/1.1 поверх asyncio ---
+
+    async def handle_connection(self, reader, writer):
+        try:
+            while True:
+                try:
+                    request_line = await reader.readline()
+                except ValueError: # Строка запроса длиннее лимита буфера
+                    await self._write_response(writer, 400, {"error": "Слишком длинная строка запроса."}, keep_alive=False)
+                    break
+                if not request_line:
+                    break
+                try:
+                    method, target, version = request_line.decode("latin-1").split()
+                except ValueError:
+                    await self._write_response(writer, 400, {"error": "Некорректная строка запроса."}, keep_alive=False)
+                    break
+                headers = {}
+                try:
+                    for _ in range(MAX_HEADERS + 1):
+                        header_line = await reader.readline()
+                        if header_line in (b"\r\n", b"\n", b""):
+                            break
+                        name, _, value = header_line.decode("latin-1").partition(":")
+                        headers[name.strip().lower()] = value.strip()
+                    else:
+                        raise ValueError("too many headers")
+                except ValueError: # Заголовок длиннее лимита буфера или их слишком много
+                    await self._write_response(writer, 431, {"error": "Слишком большие заголовки запроса."}, keep_alive=False)
+                    break
+                try:
+                    length = content_length(headers)
+                except HTTPError as e: # Где кончается тело, неизвестно - соединение не переиспользуется
+                    await self._write_response(writer, e.status, {"error": e.message}, keep_alive=False)
+                    break
+                keep_alive = headers.get("connection", "").lower() != "close" and version == "HTTP/1.1"
+                if length > MAX_BODY_BYTES:
+                    await self._write_response(writer, 413, {"error": "Слишком большое тело запроса."}, keep_alive=False)
+                    break
+                body = await reader.readexactly(length) if length else b""
+                started = time.perf_counter()
+                try:
+                    if not authorized(headers, urlsplit(target).path, self.token):
+                        raise HTTPError(401, "Нужен токен API: заголовок Authorization: Bearer <KAZSTREAMLINK_API_TOKEN>.")
+                    status, payload = await self.dispatch(method.upper(), target, body, headers)
+                except HTTPError as e:
+                    status, payload = e.status, {"error": e.message}
+                except Exception as e:
+                    logging.error(f"Ошибка обработки запроса API {method} {target}: {e}", exc_info=True)
+                    status, payload = 500, {"error": str(e)}
+                await self._write_response(writer, status, payload, keep_alive)
+                logging.debug(f"API {method} {target} -> {status} за {1000 * (time.perf_counter() - started):.1f} мс")
+                if not keep_alive:
+                    break
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+
+    @staticmethod
+    async def _write_response(writer, status, payload, keep_alive):
+        if isinstance(payload, tuple): # (content_type, bytes) для не-JSON ответов
+            content_type, data = payload
+        elif payload is None:
+            content_type, data = "application/json", b""
+        else:
+            content_type, data = "application/json; charset=utf-8", json.dumps(payload, ensure_ascii=False).encode("utf-8")
+        head = (
+            f"HTTP/1.1 {status} {_REASONS.get(status, 'OK')}\r\n"
+            f"Content-Type: {content_type}\r\nContent-Length: {len(data)}\r\n"
+            f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n\r\n"
+        )
+        writer.write(head.encode("latin-1") + data)
+        await writer.drain()
+
+    async def serve(self, host=API_HOST, port=API_PORT, ready_event=None):
+        check_bind(host, self.token)
+        server = await asyncio.start_server(self.handle_connection, host, port, backlog=1024)
+        logging.info(f"HTTP API KazStreamLink слушает на {host}:{port}")
+        if ready_event:
+            ready_event.set()
+        async with server:
+            await server.serve_forever()
+
+
+def start_api_in_background(host=API_HOST, port=API_PORT, manager=None):
+    """Запускает API в фоновом потоке (например, внутри процесса Streamlit) и ждет готовности."""
+    api = ControlPlaneAPI(manager)
+    check_bind(host, api.token) # Ошибка - в вызывающем потоке, а не в фоновом
+    ready = threading.Event()
+    thread = threading.Thread(target=lambda: asyncio.run(api.serve(host, port, ready)), daemon=True, name="control_plane_api")
+    thread.start()
+    ready.wait(timeout=5.0)
+    return api
+
+
+def main():
+    parser = argparse.ArgumentParser(description="HTTP API управления конвертерами KazStreamLink")
+    parser.add_argument("--host", default=API_HOST)
+    parser.add_argument("--port", type=int, default=API_PORT)
+    parser.add_argument("--coordinator", default=os.environ.get("KAZSTREAMLINK_COORDINATOR", ""),
+                        help="URL координатора кластера (cluster.py); без него узел работает сам по себе")
+    parser.add_argument("--advertise-url", default=os.environ.get("KAZSTREAMLINK_ADVERTISE_URL", ""),
+                        help="URL этого API, по которому его вызывает координатор")
+    args = parser.parse_args()
+    # Вывод логов - в фоновом потоке, цикл ввода-вывода только кладет записи в очередь (см. log_pipeline.py)
+    install_queue_logging()
+    # docker stop и systemd присылают SIGTERM: завершаемся так же, как по Ctrl+C
+    signal.signal(signal.SIGTERM, signal.default_int_handler)
+    api = ControlPlaneAPI(node_id=default_node_id(args.port))
+    if args.coordinator:
+        advertise_url = args.advertise_url or f"http://{socket.gethostname()}:{args.port}"
+        WorkerAgent(api.manager, args.coordinator, api.node_id, advertise_url).start()
+    try:
+        asyncio.run(api.serve(args.host, args.port))
+    except KeyboardInterrupt:
+        logging.info("Остановка HTTP API, завершение всех конвертеров...")
+        get_manager().shutdown() # Желаемое состояние в реестре сохраняется - при старте потоки восстановятся
+        sys.exit(0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,501 @@
+import os
+import sys
+import time
+import signal
+import asyncio
+import logging
+import argparse
+import itertools
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from rtmp_to_rtsp_converter.manager import validate_spec, BULK_MAX_WORKERS
+from rtmp_to_rtsp_converter.node import http_json, HEARTBEAT_SEC, API_TOKEN
+from rtmp_to_rtsp_converter.api import ControlPlaneAPI, HTTPError, API_HOST
+from rtmp_to_rtsp_converter.log_pipeline import install_queue_logging
+
+# Координатор кластера: размещение потоков по узлам-исполнителям.
+#
+# Один хост - жесткий предел: каждый поток - процесс FFmpeg на том же хосте. Узлы (api.py с
+# --coordinator, см. node.py) присылают heartbeat с отчетом о емкости, а координатор:
+#   * размещает новые потоки планировщиком PlacementScheduler: least_loaded - на наименее
+#     загруженный узел, binpack - на самый загруженный из тех, где поток еще помещается.
+#     Загрузка узла - наибольшая из долей: потоки / max_streams, CPU FFmpeg / (ядра * CPU_TARGET),
+#     исходящий трафик / пропускная способность сети. Нагрузку одного потока узел меряет сам
+#     (CPU и трафик на поток), пока потоков нет - берутся DEFAULT_STREAM_CPU и DEFAULT_STREAM_MBIT;
+#   * узел без heartbeat дольше NODE_TIMEOUT_SEC считается отказавшим: его потоки создаются на
+#     других узлах. Вернувшийся узел получает команду удалить потоки, которые уже работают в другом месте;
+#   * с узла, выведенного из работы (drain), потоки переносятся: остановка на старом узле, затем
+#     запуск на новом (два издателя на одном пути RTSP сервер не примет).
+# Размещение хранится только в памяти: после перезапуска координатор восстанавливает его из
+# heartbeat узлов (в отчете есть описания потоков).
+
+COORDINATOR_PORT = int(os.environ.get("KAZSTREAMLINK_COORDINATOR_PORT", "8090"))
+NODE_TIMEOUT_SEC = float(os.environ.get("KAZSTREAMLINK_NODE_TIMEOUT", str(HEARTBEAT_SEC * 3)))
+PLACEMENT = os.environ.get("KAZSTREAMLINK_PLACEMENT", "least_loaded") # least_loaded | binpack
+CPU_TARGET = 0.8 # Доля CPU узла, которую можно отдать FFmpeg
+DEFAULT_STREAM_CPU = 3.0 # % одного ядра на поток (-c copy), пока узел не измерил сам
+DEFAULT_STREAM_MBIT = 4.0
+
+NODE_UP, NODE_DRAINING, NODE_FAILED = "up", "draining", "failed"
+
+
+class NodeState:
+    """Узел-исполнитель глазами координатора."""
+
+    def __init__(self, node_id, url):
+        self.node_id = node_id
+        self.url = url
+        self.report = {}
+        self.last_seen = time.monotonic()
+        self.draining = False
+        self.failed = False
+        self.streams = set() # Потоки, размещенные координатором на этом узле
+        self.egress_mbit = 0.0
+        self._prev_output = None # (output_bytes, time) прошлого отчета
+
+    @property
+    def state(self):
+        return NODE_FAILED if self.failed else NODE_DRAINING if self.draining else NODE_UP
+
+    def update(self, report):
+        output_bytes, now = report.get("output_bytes") or 0.0, report.get("time") or time.time()
+        if self._prev_output is not None and now > self._prev_output[1] and output_bytes >= self._prev_output[0]:
+            self.egress_mbit = (output_bytes - self._prev_output[0]) * 8 / 1e6 / (now - self._prev_output[1])
+        self._prev_output = (output_bytes, now)
+        self.report = report
+        self.url = report.get("url") or self.url
+        self.last_seen = time.monotonic()
+
+    def per_stream(self):
+        """(CPU %, Мбит/с) одного потока по измерениям узла."""
+        measured = len(self.report.get("streams") or ())
+        if not measured:
+            return DEFAULT_STREAM_CPU, DEFAULT_STREAM_MBIT
+        # Трафик делится только на потоки с точным объемом выходов (node_report: output_streams)
+        counted = self.report.get("output_streams") or 0
+        return (max(self.report.get("cpu_percent", 0.0) / measured, 0.1),
+                max(self.egress_mbit / counted, 0.01) if self.egress_mbit and counted else DEFAULT_STREAM_MBIT)
+
+    def load(self, extra=0):
+        """Загрузка узла (1.0 - полный), если на нем будет еще extra потоков."""
+        count = len(self.streams) + extra
+        cpu, mbit = self.per_stream()
+        cpu_capacity = 100.0 * (self.report.get("cpu_count") or 1) * CPU_TARGET
+        fractions = [count * cpu / cpu_capacity, count * mbit / (self.report.get("nic_mbit") or 1000.0)]
+        if self.report.get("max_streams"):
+            fractions.append(count / self.report["max_streams"])
+        return max(fractions)
+
+    def describe(self):
+        return {
+            "node_id": self.node_id,
+            "url": self.url,
+            "state": self.state,
+            "streams": len(self.streams),
+            "load": round(self.load(), 3),
+            "cpu_count": self.report.get("cpu_count"),
+            "cpu_percent": self.report.get("cpu_percent"),
+            "memory_mb": self.report.get("memory_mb"),
+            "egress_mbit": round(self.egress_mbit, 2),
+            "nic_bytes": self.report.get("nic_bytes"),
+            "last_seen_s": round(time.monotonic() - self.last_seen, 1),
+        }
+
+
+class PlacementScheduler:
+    def __init__(self, policy=PLACEMENT):
+        if policy not in ("least_loaded", "binpack"):
+            raise ValueError(f"Неизвестная политика размещения: {policy}")
+        self.policy = policy
+
+    def place(self, nodes, count):
+        """Узлы для count новых потоков (жадно, с учетом уже выбранных); None - потоку нет места."""
+        planned = {node.node_id: 0 for node in nodes}
+        choice = []
+        for _ in range(count):
+            fitting = [(node.load(planned[node.node_id] + 1), node) for node in nodes
+                       if node.state == NODE_UP and node.load(planned[node.node_id] + 1) <= 1.0]
+            if not fitting:
+                choice.append(None)
+                continue
+            if self.policy == "least_loaded":
+                _, node = min(fitting, key=lambda item: item[0])
+            else: # binpack: самый заполненный узел, куда поток еще помещается
+                _, node = max(fitting, key=lambda item: item[0])
+            planned[node.node_id] += 1
+            choice.append(node)
+        return choice
+
+
+class Coordinator:
+    def __init__(self, scheduler=None, node_timeout=NODE_TIMEOUT_SEC, period=HEARTBEAT_SEC):
+        self.scheduler = scheduler or PlacementScheduler()
+        self.node_timeout = node_timeout
+        self.period = period
+        self.nodes = {} # {node_id: NodeState}
+        self.placements = {} # {stream_id: {"node_id", "spec", "desired"}}
+        self._lock = threading.RLock()
+        self._id_counter = itertools.count()
+        self.moves = 0 # Перенесено потоков (drain и отказы узлов)
+        self.last_rebalance = None
+        self._stop_event = threading.Event()
+        self._monitor = threading.Thread(target=self._run_monitor, daemon=True, name="cluster_monitor")
+        self._monitor.start()
+
+    # --- Узлы ---
+
+    def heartbeat(self, report):
+        node_id = report.get("node_id")
+        if not node_id or not report.get("url"):
+            raise ValueError("В отчете узла нужны node_id и url.")
+        duplicates = []
+        with self._lock:
+            node = self.nodes.get(node_id)
+            if node is None:
+                node = self.nodes[node_id] = NodeState(node_id, report["url"])
+                logging.info(f"Узел {node_id} ({report['url']}) подключен к кластеру.")
+            elif node.failed:
+                logging.info(f"Узел {node_id} снова на связи.")
+            node.failed = False
+            node.update(report)
+            for stream in report.get("streams") or ():
+                placement = self.placements.get(stream["stream_id"])
+                if placement is None: # Координатор перезапущен - размещение восстанавливается из отчетов
+                    desired = "running" if stream["status"] not in ("остановлен",) else "stopped"
+                    self.placements[stream["stream_id"]] = {"node_id": node_id, "spec": stream["spec"], "desired": desired}
+                    node.streams.add(stream["stream_id"])
+                elif placement["node_id"] != node_id: # Поток уже перенесен, пока узел был недоступен
+                    duplicates.append(stream["stream_id"])
+        if duplicates:
+            logging.warning(f"Узел {node_id} вернулся с {len(duplicates)} уже перенесенными потоками, удаляем их там.")
+            threading.Thread(target=self._remove_on_node, args=(node, duplicates), daemon=True).start()
+
+    def _run_monitor(self):
+        while not self._stop_event.wait(self.period):
+            try:
+                self._monitor_pass()
+            except Exception as e: # Ошибка одного прохода не должна останавливать обнаружение отказов
+                logging.error(f"Ошибка проверки узлов кластера: {e}", exc_info=True)
+
+    def _monitor_pass(self):
+        failed = []
+        with self._lock:
+            now = time.monotonic()
+            for node in self.nodes.values():
+                if not node.failed and now - node.last_seen > self.node_timeout:
+                    node.failed = True
+                    failed.append(node)
+        for node in failed:
+            logging.error(f"Узел {node.node_id} не присылает heartbeat {self.node_timeout:.0f} с, потоки переносятся.")
+        # Потоки, которым при отказе или drain не хватило места, переносятся, когда место появится
+        with self._lock:
+            stranded = any(node.state != NODE_UP and node.streams for node in self.nodes.values())
+        if stranded:
+            self.rebalance()
+
+    def drain(self, node_id):
+        """Выводит узел из работы: новые потоки туда не размещаются, текущие переносятся."""
+        node = self._node_or_404(node_id)
+        node.draining = True
+        return self.rebalance([node_id])
+
+    def undrain(self, node_id):
+        self._node_or_404(node_id).draining = False
+
+    def _node_or_404(self, node_id):
+        node = self.nodes.get(node_id)
+        if node is None:
+            raise HTTPError(404, f"Узел {node_id} не найден.")
+        return node
+
+    def rebalance(self, node_ids=None):
+        """Переносит потоки с выведенных из работы и отказавших узлов (по умолчанию - со всех таких)."""
+        started = time.monotonic()
+        with self._lock:
+            sources = [node for node in self.nodes.values()
+                       if (node_ids is None or node.node_id in node_ids) and node.state != NODE_UP and node.streams]
+        moved = failed = attempted = 0
+        for node in sources:
+            with self._lock:
+                stream_ids = sorted(node.streams)
+                others = [other for other in self.nodes.values() if other is not node]
+                # Переносим только то, для чего есть место: остальное остается на узле (или ждет места)
+                fits = sum(1 for target in self.scheduler.place(others, len(stream_ids)) if target is not None)
+                specs = [dict(self.placements[sid]["spec"]) for sid in stream_ids[:fits]]
+                stopped = [spec["stream_id"] for spec in specs if self.placements[spec["stream_id"]]["desired"] == "stopped"]
+            failed += len(stream_ids) - fits
+            if not specs:
+                continue
+            attempted += len(specs)
+            alive = node.state == NODE_DRAINING
+            if alive: # Узел жив: сначала освобождаем пути RTSP
+                self._remove_on_node(node, [spec["stream_id"] for spec in specs])
+            results = self._place(specs, exclude=node)
+            lost = [spec for spec, result in zip(specs, results) if not result["ok"]]
+            moved += len(specs) - len(lost)
+            failed += len(lost)
+            with self._lock:
+                node.streams.difference_update(spec["stream_id"] for spec in specs)
+            if lost and alive: # Место пропало во время переноса - возвращаем потоки на прежний узел
+                logging.error(f"{len(lost)} потоков не удалось перенести с узла {node.node_id}, запускаем их там снова.")
+                if self._create_on_node(node, lost) is not None:
+                    with self._lock:
+                        node.streams.update(spec["stream_id"] for spec in lost)
+            for stream_id in stopped: # Остановленный поток на новом узле тоже остается остановленным
+                if self.placements[stream_id]["node_id"] != node.node_id:
+                    try:
+                        self.forward(stream_id, "POST", "/stop")
+                    except (HTTPError, OSError) as e: # Новый узел недоступен - остальные потоки переносятся дальше
+                        logging.error(f"Не удалось остановить перенесенный поток {stream_id}: {e}")
+        result = {"moved": moved, "failed": failed, "seconds": round(time.monotonic() - started, 3)}
+        if attempted:
+            self.moves += moved
+            self.last_rebalance = result
+            logging.info(f"Перенос потоков: {result}")
+        return result
+
+    # --- Потоки ---
+
+    def next_stream_id(self):
+        with self._lock:
+            while True:
+                stream_id = f"stream_{next(self._id_counter)}"
+                if stream_id not in self.placements:
+                    return stream_id
+
+    def create_many(self, specs):
+        results = [None] * len(specs)
+        valid = []
+        for i, spec in enumerate(specs):
+            try:
+                spec = validate_spec(spec)
+                with self._lock:
+                    spec["stream_id"] = spec.get("stream_id") or self.next_stream_id()
+                    if spec["stream_id"] in self.placements:
+                        raise ValueError(f"Поток {spec['stream_id']} уже существует.")
+                valid.append((i, spec))
+            except ValueError as e:
+                results[i] = {"stream_id": spec.get("stream_id") if isinstance(spec, dict) else None, "ok": False, "error": str(e)}
+        for (i, _), result in zip(valid, self._place([spec for _, spec in valid])):
+            results[i] = result
+        return results
+
+    def _place(self, specs, exclude=None):
+        """Размещает и запускает потоки; узлу, не принявшему свою часть, она достается другим (до 3 попыток)."""
+        results = {spec["stream_id"]: None for spec in specs}
+        pending = list(specs)
+        excluded = {exclude.node_id} if exclude else set()
+        for _ in range(3):
+            if not pending:
+                break
+            with self._lock:
+                nodes = [node for node in self.nodes.values() if node.node_id not in excluded]
+                choice = self.scheduler.place(nodes, len(pending))
+                by_node = {}
+                for spec, node in zip(pending, choice):
+                    if node is None:
+                        results[spec["stream_id"]] = {"stream_id": spec["stream_id"], "ok": False, "error": "Нет узла со свободной емкостью."}
+                        continue
+                    node.streams.add(spec["stream_id"]) # Резерв до ответа узла, чтобы параллельное размещение его учло
+                    by_node.setdefault(node, []).append(spec)
+            pending = []
+            if not by_node:
+                break
+            with ThreadPoolExecutor(max_workers=min(BULK_MAX_WORKERS, len(by_node)), thread_name_prefix="cluster_place") as pool:
+                outcomes = list(pool.map(lambda item: (item[0], item[1], self._create_on_node(*item)), by_node.items()))
+            for node, node_specs, node_results in outcomes:
+                if node_results is None: # Узел недоступен - его часть размещается заново без него
+                    excluded.add(node.node_id)
+                    with self._lock:
+                        node.streams.difference_update(spec["stream_id"] for spec in node_specs)
+                    pending.extend(node_specs)
+                    continue
+                for spec, result in zip(node_specs, node_results):
+                    if result.get("rejected"): # Узлу не хватило емкости (admission.py) - поток достается другим
+                        excluded.add(node.node_id)
+                        with self._lock:
+                            node.streams.discard(spec["stream_id"])
+                        pending.append(spec)
+                        results[spec["stream_id"]] = dict(result, node_id=node.node_id)
+                        continue
+                    with self._lock:
+                        if result["ok"]:
+                            self.placements[spec["stream_id"]] = {"node_id": node.node_id, "spec": spec, "desired": "running"}
+                        else:
+                            node.streams.discard(spec["stream_id"])
+                    results[spec["stream_id"]] = dict(result, node_id=node.node_id)
+        for spec in pending:
+            if results[spec["stream_id"]] is None or not results[spec["stream_id"]].get("rejected"):
+                results[spec["stream_id"]] = {"stream_id": spec["stream_id"], "ok": False, "error": "Ни один узел не принял поток."}
+        return [results[spec["stream_id"]] for spec in specs]
+
+    def _create_on_node(self, node, specs):
+        try:
+            status, payload = http_json(f"{node.url}/streams", "POST", {"streams": specs})
+        except OSError as e:
+            logging.error(f"Узел {node.node_id} не принял {len(specs)} потоков: {e}")
+            return None
+        if status != 200:
+            return [{"stream_id": spec["stream_id"], "ok": False, "error": (payload or {}).get("error")} for spec in specs]
+        return payload["results"]
+
+    def _remove_on_node(self, node, stream_ids):
+        """Останавливает и удаляет потоки на узле (перенос или дубликат после возврата узла)."""
+        try:
+            http_json(f"{node.url}/streams/stop", "POST", {"stream_ids": stream_ids})
+            for stream_id in stream_ids:
+                http_json(f"{node.url}/streams/{stream_id}", "DELETE")
+        except OSError as e:
+            logging.warning(f"Не удалось удалить потоки на узле {node.node_id}: {e}")
+        with self._lock:
+            for stream_id in stream_ids:
+                node.streams.discard(stream_id)
+
+    def _owner(self, stream_id):
+        with self._lock:
+            placement = self.placements.get(stream_id)
+            if placement is None:
+                raise HTTPError(404, f"Поток {stream_id} не найден.")
+            return self.nodes[placement["node_id"]], placement
+
+    def forward(self, stream_id, method, action=""):
+        """Передает команду потоку на его узел; возвращает (status, payload) узла."""
+        node, placement = self._owner(stream_id)
+        try:
+            status, payload = http_json(f"{node.url}/streams/{stream_id}{action}", method)
+        except OSError as e:
+            raise HTTPError(502, f"Узел {node.node_id} недоступен: {e}")
+        if status < 300:
+            with self._lock:
+                if action == "/stop":
+                    placement["desired"] = "stopped"
+                elif action == "/start":
+                    placement["desired"] = "running"
+                elif method == "DELETE":
+                    self.placements.pop(stream_id, None)
+                    node.streams.discard(stream_id)
+        return status, payload
+
+    def streams(self):
+        """Потоки кластера с узлом и последним статусом из heartbeat."""
+        with self._lock:
+            reported = {stream["stream_id"]: (node.node_id, stream) for node in self.nodes.values()
+                        for stream in node.report.get("streams") or ()}
+            rows = []
+            for stream_id, placement in self.placements.items():
+                node_id, stream = reported.get(stream_id, (None, {}))
+                if self.nodes[placement["node_id"]].failed:
+                    status = "узел недоступен"
+                else:
+                    status = stream.get("status") if node_id == placement["node_id"] else "размещается"
+                rows.append({"stream_id": stream_id, "node_id": placement["node_id"], "desired": placement["desired"],
+                             "status": status,
+                             "health_state": stream.get("health_state"), "spec": placement["spec"]})
+            return rows
+
+    def nodes_info(self):
+        with self._lock:
+            return [node.describe() for node in self.nodes.values()]
+
+    def close(self):
+        self._stop_event.set()
+
+
+class CoordinatorAPI(ControlPlaneAPI):
+    """HTTP API координатора: тот же сервер, что у узла (api.py), но свои маршруты."""
+
+    def __init__(self, coordinator=None):
+        # ControlPlaneAPI.__init__ не вызывается: у координатора нет своего менеджера конвертеров
+        self.coordinator = coordinator or Coordinator()
+        self.token = API_TOKEN # Тот же токен, что у узлов: он же передается им в запросах (node.http_json)
+        self._routes = []
+        self.route("GET", "/health", self.health)
+        self.route("GET", "/nodes", self.list_nodes)
+        self.route("POST", "/nodes/heartbeat", self.heartbeat)
+        self.route("POST", "/nodes/{id}/drain", self.drain_node)
+        self.route("POST", "/nodes/{id}/undrain", self.undrain_node)
+        self.route("POST", "/rebalance", self.rebalance)
+        self.route("GET", "/streams", self.list_streams)
+        self.route("POST", "/streams", self.create_streams)
+        self.route("GET", "/streams/{id}", self.get_stream)
+        self.route("POST", "/streams/{id}/stop", self.stop_stream)
+        self.route("POST", "/streams/{id}/start", self.start_stream)
+        self.route("DELETE", "/streams/{id}", self.delete_stream)
+
+    def health(self, request):
+        nodes = self.coordinator.nodes_info()
+        return 200, {"ok": True, "nodes": len(nodes), "nodes_up": sum(1 for n in nodes if n["state"] == NODE_UP),
+                     "streams": len(self.coordinator.placements), "moves": self.coordinator.moves}
+
+    def list_nodes(self, request):
+        return 200, {"nodes": self.coordinator.nodes_info(), "policy": self.coordinator.scheduler.policy,
+                     "last_rebalance": self.coordinator.last_rebalance}
+
+    def heartbeat(self, request):
+        try:
+            self.coordinator.heartbeat(request.body if isinstance(request.body, dict) else {})
+        except ValueError as e:
+            raise HTTPError(400, str(e))
+        return 200, {"ok": True}
+
+    def drain_node(self, request, id):
+        return 200, self.coordinator.drain(id)
+
+    def undrain_node(self, request, id):
+        self.coordinator.undrain(id)
+        return 200, {"ok": True}
+
+    def rebalance(self, request):
+        return 200, self.coordinator.rebalance()
+
+    def list_streams(self, request):
+        return 200, {"streams": self.coordinator.streams()}
+
+    def create_streams(self, request):
+        body = request.body
+        specs = body["streams"] if isinstance(body, dict) and "streams" in body else [body]
+        if not isinstance(specs, list):
+            raise HTTPError(400, "Поле streams должно быть списком.")
+        results = self.coordinator.create_many(specs)
+        if not (isinstance(body, dict) and "streams" in body): # Один поток - ответ как у узла
+            result = results[0]
+            if not result["ok"]:
+                raise HTTPError(503 if "емкост" in (result.get("error") or "") else 400, result.get("error"))
+            return 201, result
+        return 200, {"results": results, "created": sum(1 for r in results if r["ok"])}
+
+    def get_stream(self, request, id):
+        return self.coordinator.forward(id, "GET")
+
+    def stop_stream(self, request, id):
+        return self.coordinator.forward(id, "POST", "/stop")
+
+    def start_stream(self, request, id):
+        return self.coordinator.forward(id, "POST", "/start")
+
+    def delete_stream(self, request, id):
+        return self.coordinator.forward(id, "DELETE")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Координатор кластера KazStreamLink")
+    parser.add_argument("--host", default=API_HOST)
+    parser.add_argument("--port", type=int, default=COORDINATOR_PORT)
+    parser.add_argument("--placement", default=PLACEMENT, choices=["least_loaded", "binpack"])
+    args = parser.parse_args()
+    if not logging.getLogger().hasHandlers():
+        logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(threadName)s - %(levelname)s - %(message)s',
+                            handlers=[logging.StreamHandler(sys.stdout)])
+    install_queue_logging()
+    signal.signal(signal.SIGTERM, signal.default_int_handler)
+    api = CoordinatorAPI(Coordinator(PlacementScheduler(args.placement)))
+    try:
+        asyncio.run(api.serve(args.host, args.port))
+    except KeyboardInterrupt:
+        logging.info("Остановка координатора кластера (потоки на узлах продолжают работать).")
+        sys.exit(0)
+
+
+if __name__ == "__main__":
+    main()
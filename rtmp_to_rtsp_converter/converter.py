@@ -6,9 +6,26 @@ import signal
 import sys
 import threading
 import re # Для парсинга логов FFmpeg
-import psutil # Для CPU/Memory usage
 from collections import deque # Для хранения последних значений метрик
 
+from rtmp_to_rtsp_converter.reactor import get_reactor
+from rtmp_to_rtsp_converter.sampler import get_sampler
+from rtmp_to_rtsp_converter.progress_parser import ProgressParser
+from rtmp_to_rtsp_converter.metrics_store import MetricsStore
+from rtmp_to_rtsp_converter.supervisor import get_supervisor, DEFAULT_POLICY
+from rtmp_to_rtsp_converter.probe_cache import get_probe_cache, PROBE_LOG_OPTIONS
+from rtmp_to_rtsp_converter.outputs import OutputLeg, LEG_RUNNING, LEG_IDLE, output_args, output_path, parse_leg_failure
+from rtmp_to_rtsp_converter.log_pipeline import StderrPipeline
+from rtmp_to_rtsp_converter.health import get_health_engine
+from rtmp_to_rtsp_converter.recording import SegmentRecorder
+from rtmp_to_rtsp_converter.admission import get_capacity_model
+from rtmp_to_rtsp_converter.profiling import get_instrumentation
+from rtmp_to_rtsp_converter.profiles import get_profile
+from rtmp_to_rtsp_converter.state import (
+    AtomicRef, ConverterState, MetricsSnapshot, STATUS_IDLE, STATUS_STARTING, STATUS_RUNNING, STATUS_STOPPING,
+    STATUS_STOPPED, STATUS_FAILED, STATUS_START_FAILED, STATUS_UNKNOWN, RUNNING_STATUSES, FINAL_STATUSES
+)
+
 # Настройка логирования
 # Убедимся, что логирование настроено один раз
 if not logging.getLogger().hasHandlers():
@@ -18,8 +35,27 @@ if not logging.getLogger().hasHandlers():
 
 FFMPEG_PATH = os.environ.get("FFMPEG_PATH", "ffmpeg") # Можно переопределить через переменную окружения
 
+# Остановка FFmpeg: SIGINT (FFmpeg дописывает выход и закрывает соединения), через STOP_TIMEOUT_SEC -
+# SIGTERM, еще через KILL_TIMEOUT_SEC - SIGKILL. Эскалация идет на таймерах общего цикла ввода-вывода,
+# поэтому stop(wait=False) не блокирует вызывающий поток.
+STOP_TIMEOUT_SEC = float(os.environ.get("KAZSTREAMLINK_STOP_TIMEOUT", "5"))
+KILL_TIMEOUT_SEC = float(os.environ.get("KAZSTREAMLINK_KILL_TIMEOUT", "2"))
+STOP_DEADLINE_SEC = STOP_TIMEOUT_SEC + KILL_TIMEOUT_SEC + 1.0 # Дольше процесс жить не может (SIGKILL + запас)
+
+# Опции входа (указываются перед каждым -i) задает профиль передачи потока (см. profiles.py);
+# здесь - общие опции процесса FFmpeg
+# Только при KAZSTREAMLINK_PROBE_CACHE=0: с кэшем анализа (по умолчанию) FFmpeg запускается с PROBE_LOG_OPTIONS
+# (-loglevel level+info), и строки info/warning отбрасываются уже в Python (см. probe_cache.py)
+LOG_OPTIONS = ('-loglevel', 'error') # Оставляем только ошибки в stderr, основная инфа через -progress
+PROGRESS_OPTIONS = (
+    '-progress', 'pipe:1', # Направляем вывод прогресса в stdout (pipe:1)
+    '-nostdin',            # Важно при использовании pipe:1
+)
+GLOBAL_OPTIONS = (*LOG_OPTIONS, *PROGRESS_OPTIONS)
+
 class RTMPToRTSPConverter:
-    def __init__(self, stream_id, rtmp_url, rtsp_server_host, rtsp_port, rtsp_path="live"): # Добавлен stream_id
+    def __init__(self, stream_id, rtmp_url, rtsp_server_host, rtsp_port, rtsp_path="live", restart_policy=None, extra_outputs=None, record=False,
+                 on_demand=False, profile=None): # Добавлен stream_id
         self.stream_id = stream_id
         self.rtmp_url = rtmp_url
         self.rtsp_server_host = rtsp_server_host
@@ -27,19 +63,48 @@ class RTMPToRTSPConverter:
         self.rtsp_path = rtsp_path
         self.process = None
         self.ffmpeg_logs = deque(maxlen=100) # Хранение последних 100 логов ffmpeg
+        # Классификация, свертка повторов и ограничение частоты строк stderr (см. log_pipeline.py)
+        self.stderr_pipeline = StderrPipeline(stream_id)
         self.last_error_message = None
-        self.status = "ожидание"
-        self.metrics = {
-            "bitrate_kbit": "N/A",
-            "fps": "N/A",
-            "cpu_percent": "N/A",
-            "memory_mb": "N/A",
-            "dropped_frames": 0, # Счетчик предполагаемых дропов/ошибок
-            "last_update_time": None
-        }
-        self.metrics_history = deque(maxlen=60) # Хранить историю метрик за ~минуту (если обновлять каждую секунду)
-        self._metrics_thread = None
-        self._metrics_thread_stop_event = threading.Event()
+        # Статус и метрики - неизменяемые снимки, которые публикуются заменой ссылки (см. state.py):
+        # читатели (UI, API, экспорт) не берут блокировок и не видят наполовину обновленных метрик
+        self._state = AtomicRef(ConverterState(STATUS_IDLE))
+        self._metrics = AtomicRef(self._empty_metrics())
+        # Парсер вывода -progress (stdout FFmpeg): один снимок метрик на блок
+        self._progress_parser = ProgressParser(self._apply_progress_block)
+        # Типизированная история метрик: 1 с за час, свертки 10 с и 1 мин (см. metrics_store.py)
+        self.metrics_store = MetricsStore()
+        # Каналы FFmpeg и сбор метрик обслуживаются общим циклом ввода-вывода, а не отдельными потоками
+        self._reactor = get_reactor()
+        self._sampler = get_sampler()
+        # Оценка здоровья (зависание, скорость, отброшенные кадры, битрейт) - по всему узлу сразу (см. health.py)
+        self._health = get_health_engine()
+        self.unhealthy_restarts = 0 # Перезапуски из-за зависания FFmpeg
+        # Модель емкости узла учится стоимости потока на замерах сборщика (см. admission.py)
+        self._capacity = get_capacity_model()
+        # Замеры горячего пути (KAZSTREAMLINK_INSTRUMENT=1, см. profiling.py); выключенная ничего не оборачивает
+        self._instrumentation = get_instrumentation()
+        if self._instrumentation.enabled: # Опрос статуса и метрик из UI/API - частые вызовы из чужих потоков
+            self.get_status = self._instrumentation.timed("converter.get_status", self.get_status)
+            self.get_metrics = self._instrumentation.timed("converter.get_metrics", self.get_metrics)
+        self._open_pipes = 0
+        self._exit_watched = False # Завершение процесса отслеживается по pidfd (reactor.add_process_exit)
+        self._exited_event = threading.Event() # Установлено, пока процесса нет или его завершение обработано
+        self._exited_event.set()
+        self._stop_event = threading.Event()
+        self._escalation = None # TimerHandle следующего сигнала остановки
+        self._stop_requested_at = None
+        self._stop_signal = None
+        self.last_stop = None # {"signal", "seconds", "exit_code"} последней остановки
+        self.started_at = None # time.time() последнего успешного запуска FFmpeg
+        self.start_count = 0 # Сколько раз запускался процесс FFmpeg (перезапуски = start_count - 1)
+        # Автоматический перезапуск после неожиданного завершения FFmpeg (см. supervisor.py)
+        self.restart_policy = restart_policy or DEFAULT_POLICY
+        self._supervisor = get_supervisor()
+        self.auto_restarts = 0 # Перезапуски, выполненные супервизором
+        self.last_recovery_seconds = None # Время от падения до первого блока -progress после перезапуска
+        self._awaiting_recovery = False
+        self._exit_handled = False # Завершение текущего процесса уже обработано
 
 
         # URL, на который FFmpeg будет отправлять RTSP поток
@@ -48,219 +113,311 @@ class RTMPToRTSPConverter:
         # URL для клиента
         self.final_rtsp_url_for_client = f"rtsp://{self.rtsp_server_host}:{self.rtsp_port}/{self.rtsp_path}"
 
-    def _parse_ffmpeg_progress_output(self, line):
-        """Парсит строку из stdout FFmpeg (от -progress) для извлечения метрик."""
-        # Пример вывода -progress:
-        # frame=1
-        # fps=0.00
-        # stream_0_0_q=-1.0
-        # bitrate=  -1.0kbits/s
-        # total_size=1337
-        # out_time_us=66666
-        # out_time_ms=66666
-        # out_time=00:00:00.066666
-        # dup_frames=0
-        # drop_frames=0
-        # speed=2.63x
-        # progress=continue
-        parts = line.split('=')
-        if len(parts) == 2:
-            key = parts[0].strip()
-            value = parts[1].strip()
-            
-            if key == "bitrate":
-                if "kbits/s" in value:
-                    val_num_str = value.replace("kbits/s", "").strip()
-                    try:
-                        self.metrics["bitrate_kbit"] = round(float(val_num_str), 2)
-                    except ValueError:
-                        self.metrics["bitrate_kbit"] = "N/A (parse)"
-                else: # Иногда может быть просто число в bits/s
-                    try:
-                        self.metrics["bitrate_kbit"] = round(float(value) / 1000, 2) # Переводим в kbit/s
-                    except ValueError:
-                         pass # Игнорируем, если не число
-            elif key == "fps":
-                try:
-                    self.metrics["fps"] = round(float(value), 2)
-                except ValueError:
-                    self.metrics["fps"] = "N/A (parse)"
-            elif key == "drop_frames": # FFmpeg сам считает дропнутые кадры
-                try:
-                    # Это будет общее количество дропнутых кадров, а не инкремент
-                    self.metrics["dropped_frames"] = int(value)
-                except ValueError:
-                    pass # Игнорируем
-
-    def _log_stream_output(self, pipe, log_type):
-        """Читает вывод из потока (stdout/stderr) FFmpeg, логирует и парсит метрики."""
-        try:
-            for line_bytes in iter(pipe.readline, b''):
-                if line_bytes:
-                    line = line_bytes.decode('utf-8', errors='replace').strip()
-                    
-                    if log_type == "stdout_progress": # Парсим вывод -progress из stdout
-                        self._parse_ffmpeg_progress_output(line)
-                        # Можно не логировать каждую строку прогресса, чтобы не засорять основной лог
-                        # logging.debug(f"[FFmpeg {self.stream_id} PROGRESS]: {line}") 
-                    elif log_type == "stderr_errors": # Логируем ошибки и общий вывод из stderr
-                        log_entry = f"[FFmpeg {self.stream_id} STDERR]: {line}"
-                        logging.error(log_entry) # Логируем все из stderr как error для внимания
-                        self.ffmpeg_logs.append(log_entry) # Добавляем в отображаемые логи только stderr
-                        if "error" in line.lower() or "failed" in line.lower() or "corrupt" in line.lower() or "unable" in line.lower():
-                            self.last_error_message = line
-                            # Можно увеличить счетчик dropped_frames и здесь, если ошибка связана с данными
-                            # self.metrics["dropped_frames"] = self.metrics.get("dropped_frames", 0) + 1
-                    else: # Неожиданный log_type
-                        log_entry = f"[FFmpeg {self.stream_id} {log_type.upper()}]: {line}"
-                        logging.info(log_entry)
-                        self.ffmpeg_logs.append(log_entry)
-                
-                # Проверяем, не завершился ли процесс или не установлен ли флаг остановки потока метрик
-                if (self.process and self.process.poll() is not None) or self._metrics_thread_stop_event.is_set():
-                    break
-        except Exception as e:
-            error_msg = f"Ошибка чтения вывода FFmpeg для {self.stream_id}: {e}"
-            logging.error(error_msg)
-            self.ffmpeg_logs.append(error_msg) # Добавляем ошибку чтения в лог ffmpeg
-            if not self.last_error_message: self.last_error_message = error_msg
-        finally:
-            pipe.close()
-            if self.process and self.process.poll() is not None and self.status not in ["остановлен", "завершен_с_ошибкой", "ошибка_запуска"]:
-                self._update_status_after_process_exit()
+        # Дополнительные выходы (второй RTSP-сервер, RTMP, запись в файл): при наличии FFmpeg
+        # раздает один вход на все выходы через tee muxer (см. outputs.py)
+        self.extra_outputs = list(extra_outputs or [])
+        # Файлы выходов - внутри KAZSTREAMLINK_OUTPUT_DIR (outputs.output_path)
+        self.output_legs = [OutputLeg(url) for url in [self.output_rtsp_url_for_ffmpeg_push] + [output_path(url) for url in self.extra_outputs]]
+        # Запись сегментами (DVR) - еще одна нога tee того же процесса (см. recording.py)
+        self.recorder = SegmentRecorder(stream_id) if record else None
+        if self.recorder:
+            self.output_legs.append(OutputLeg(self.recorder.url))
+        # Кэш анализа входа по RTMP URL: повторные запуски идут с минимальным -probesize (см. probe_cache.py)
+        self._probe_cache = get_probe_cache()
+        self._probe = None # ProbeSession текущего запуска
+        self._spawned_at = None # time.monotonic() запуска процесса (для time_to_first_packet_s)
+        self._adopted = False # Процесс принят от прошлого запуска сервиса (см. registry.py), каналов нет
+        # Поток по запросу: FFmpeg запускается при подключении первого зрителя (см. ondemand.py)
+        self.on_demand = on_demand
+        self.first_packet_at = None # time.monotonic() первого пакета текущего процесса
+        # Буферизация входа и транспорт ноги RTSP (None - профиль по умолчанию, см. profiles.py)
+        self.profile = get_profile(profile)
+        # Зонд задержки выхода RTSP: его назначает монитор менеджера, пока зонд включен (см. latency.py)
+        self.latency_probe = None
+        self._first_packet_event = threading.Event() # Первый пакет отправлен или процесс завершился
+
+    @staticmethod
+    def _empty_metrics():
+        return MetricsSnapshot()
+
+    @property
+    def metrics(self):
+        """Текущий снимок метрик FFmpeg (MetricsSnapshot, читается как словарь и не меняется)."""
+        return self._metrics.get()
+
+    @property
+    def state(self):
+        """Текущий ConverterState: статус, код завершения и время перехода."""
+        return self._state.get()
+
+    @property
+    def status(self):
+        return self._state.get().label
+
+    def transition(self, status, exit_code=None, allowed_from=None):
+        """Переводит конвертер в status по таблице state.TRANSITIONS; False, если переход недопустим."""
+        return self._state.transition(status, exit_code, allowed_from)
+
+    def _apply_progress_block(self, snapshot):
+        """Публикует метрики завершенного блока -progress одним снимком."""
+        if self._spawned_at is not None and (snapshot.get("total_size") or snapshot.get("out_time_us")):
+            snapshot["time_to_first_packet_s"] = self._on_first_packet()
+        self._metrics.update(**snapshot)
+        if len(self.output_legs) == 1 and isinstance(snapshot.get("total_size"), int):
+            self.output_legs[0].bytes = snapshot["total_size"] # Единственный выход: счетчик FFmpeg точный
+        if self._awaiting_recovery: # Первый прогресс после автоматического перезапуска
+            self._awaiting_recovery = False
+            self._supervisor.on_recovered(self)
+
+    def _on_first_packet(self):
+        """Первый блок -progress с ненулевым объемом: FFmpeg начал отправлять поток; возвращает time_to_first_packet_s."""
+        self.first_packet_at = time.monotonic()
+        seconds = round(self.first_packet_at - self._spawned_at, 3)
+        self._spawned_at = None
+        if self._probe:
+            self._probe.on_first_packet()
+        self._first_packet_event.set()
+        return seconds
+
+    def _handle_output_line(self, line_bytes, log_type):
+        """Обрабатывает одну строку из stderr FFmpeg (stdout с -progress разбирает ProgressParser)."""
+        if not line_bytes:
+            return
+        line = line_bytes.decode('utf-8', errors='replace').strip()
+        probe = self._probe
+        if probe and probe.feed(line): # Строка [info] с описанием потоков, а не ошибка
+            if probe.layout is not None and probe.needs_full_probe():
+                self._restart_with_full_probe()
+            return
+
+        if log_type == "stderr_errors": # Логируем ошибки и общий вывод из stderr
+            category, entries = self.stderr_pipeline.feed(line)
+            self.ffmpeg_logs.extend(entries) # В отображаемые логи - то же, что ушло в лог (без повторов и сверх лимита)
+            if category: # Последняя ошибка и отказ ноги tee учитываются для каждой строки, даже не попавшей в лог
+                self.last_error_message = line
+                if len(self.output_legs) > 1:
+                    leg_index = parse_leg_failure(line, self.output_urls())
+                    if leg_index is not None: # Отказала одна нога tee, остальные продолжают работу
+                        self.output_legs[leg_index].mark_failed(line)
+                        logging.warning(f"Выход {self.output_legs[leg_index].url} потока {self.stream_id} отключен: {line}")
+                # Можно увеличить счетчик dropped_frames и здесь, если ошибка связана с данными
+                # self.metrics["dropped_frames"] = self.metrics.get("dropped_frames", 0) + 1
+        else: # Неожиданный log_type
+            log_entry = f"[FFmpeg {self.stream_id} {log_type.upper()}]: {line}"
+            logging.info(log_entry)
+            self.ffmpeg_logs.append(log_entry)
+
+    def _on_output_closed(self, process):
+        """Вызывается циклом ввода-вывода при закрытии канала FFmpeg (EOF)."""
+        if process is not self.process:
+            return # Канал от предыдущего запуска
+        self._open_pipes -= 1
+        if self._open_pipes > 0:
+            return
+        # Оба канала закрыты - процесс завершается, сбор системных метрик больше не нужен
+        self._stop_system_metrics()
+        self.ffmpeg_logs.extend(self.stderr_pipeline.flush()) # Итог свернутых повторов и пропусков
+        # С pidfd завершение придет событием цикла, без опроса
+        self._watch_process_exit(process, attempts=0 if self._exit_watched else 50)
+
+    def _on_process_exited(self, process):
+        """pidfd процесса стал читаемым - процесс завершился (вызывается циклом ввода-вывода)."""
+        if process is not self.process:
+            return
+        if self._open_pipes > 0:
+            # Остаток stderr (последняя ошибка) еще дочитывается - завершение обработает закрытие каналов;
+            # проверка через секунду нужна, если каналы унаследовал другой процесс и они не закроются
+            self._reactor.call_later(1.0, lambda: self._watch_process_exit(process, attempts=0))
+            return
+        self._watch_process_exit(process, attempts=0)
 
-    def _monitor_system_metrics(self):
-        """Периодически собирает CPU и Memory usage для процесса FFmpeg."""
+    def _restart_with_full_probe(self):
+        """Минимальный анализ определил не все потоки: завершаем процесс, супервизор перезапустит его с полным анализом."""
+        process = self.process
+        if process is None or process.poll() is not None or self._stop_event.is_set():
+            return
+        logging.warning(f"Состав потоков {self.stream_id} не совпал с кэшем анализа, перезапуск с полным анализом.")
         try:
-            ffmpeg_psutil_process = psutil.Process(self.process.pid)
-            while not self._metrics_thread_stop_event.is_set() and ffmpeg_psutil_process.is_running():
-                try:
-                    self.metrics["cpu_percent"] = ffmpeg_psutil_process.cpu_percent(interval=1.0) # интервал для расчета CPU
-                    self.metrics["memory_mb"] = round(ffmpeg_psutil_process.memory_info().rss / (1024 * 1024), 2) # RSS в МБ
-                    self.metrics["last_update_time"] = time.time()
-                    self.metrics_history.append(self.metrics.copy()) # Сохраняем копию текущих метрик
-                except (psutil.NoSuchProcess, psutil.AccessDenied):
-                    logging.warning(f"Не удалось получить метрики для процесса FFmpeg {self.process.pid} (возможно, он завершился).")
-                    break
-                except Exception as e:
-                    logging.error(f"Ошибка при сборе системных метрик для {self.stream_id}: {e}")
-                
-                # Пауза перед следующим сбором метрик, но прерываемая событием остановки
-                # Это предотвращает зависание потока надолго, если его нужно остановить
-                self._metrics_thread_stop_event.wait(timeout=1.0) # Ожидание 1 секунду или до события
-            
-            logging.info(f"Поток мониторинга системных метрик для {self.stream_id} завершен.")
-
-        except psutil.NoSuchProcess:
-            logging.info(f"Процесс FFmpeg {self.process.pid} для {self.stream_id} не найден для мониторинга (возможно, уже завершился).")
-        except Exception as e:
-            logging.error(f"Критическая ошибка в потоке мониторинга системных метрик для {self.stream_id}: {e}")
-        finally:
-            # Сбрасываем CPU/Memory, если поток мониторинга завершился
-            self.metrics["cpu_percent"] = "N/A"
-            self.metrics["memory_mb"] = "N/A"
+            process.terminate()
+        except OSError:
+            pass
+
+    def _restart_unhealthy(self, reasons):
+        """Движок здоровья признал процесс зависшим: завершаем его, супервизор перезапустит поток."""
+        process = self.process
+        if process is None or process.poll() is not None or self._stop_event.is_set():
+            return
+        self.unhealthy_restarts += 1
+        log_entry = f"[FFmpeg {self.stream_id}]: процесс завис ({', '.join(reasons)}), перезапуск."
+        logging.warning(log_entry)
+        self.ffmpeg_logs.append(log_entry)
+        self.last_error_message = log_entry
+        # Зависший процесс может не ответить на SIGTERM - через KILL_TIMEOUT_SEC добиваем SIGKILL
+        self._send_stop_signal(process, signal.SIGTERM)
+        self._escalation = self._reactor.call_later(KILL_TIMEOUT_SEC, lambda: self._escalate(process, signal.SIGKILL))
+
+    def _watch_process_exit(self, process, attempts):
+        """Ждет завершения процесса после закрытия каналов (без блокировки цикла ввода-вывода)."""
+        if process is not self.process:
+            return
+        if process.poll() is not None:
+            self._update_status_after_process_exit()
+        elif attempts > 0: # Каналы закрыты, но процесс еще не завершился - проверим позже
+            self._reactor.call_later(0.1, lambda: self._watch_process_exit(process, attempts - 1))
+
+    def _publish_system_metrics(self, cpu_percent, memory_mb, sample_time):
+        """Принимает CPU и Memory usage процесса FFmpeg от общего сборщика метрик."""
+        if self._stop_event.is_set():
+            return
+        metrics = self._metrics.update(cpu_percent=cpu_percent, memory_mb=memory_mb, last_update_time=sample_time)
+        self.metrics_store.append(sample_time, metrics) # Сохраняем замер в историю
+        if self.recorder:
+            self.recorder.poll(sample_time)
+            self.output_legs[-1].bytes = self.recorder.bytes_written # Объем записи известен точно по размерам сегментов
+        self._health.record(self, self._health_metrics(metrics))
+        self._capacity.record(self, cpu_percent, memory_mb, self._network_mbit())
+
+    def _health_metrics(self, metrics):
+        """Замер для оценки здоровья: все метрики процесса относятся к этому потоку."""
+        return metrics
+
+    def _capacity_inputs(self):
+        """[(stream_id, rtmp_url)] входов процесса для модели емкости."""
+        return [(self.stream_id, self.rtmp_url)]
+
+    def _network_mbit(self):
+        """Оценка сетевого трафика процесса, Мбит/с: вход и каждый сетевой выход несут битрейт потока (None - битрейта еще нет)."""
+        bitrate = self.metrics.bitrate_kbit
+        if not isinstance(bitrate, (int, float)):
+            return None
+        network_legs = len(self.output_legs) - (1 if self.recorder else 0)
+        return bitrate * (network_legs + len(self._capacity_inputs())) / 1000
+
+    def _on_system_metrics_lost(self, pid):
+        """Сборщик больше не видит процесс FFmpeg (он завершился)."""
+        logging.info(f"Процесс FFmpeg {pid} для {self.stream_id} больше не отслеживается сборщиком метрик (возможно, он завершился).")
+        self._reset_system_metrics()
+        if self._adopted: # У принятого процесса нет каналов: его завершение видно только по /proc
+            self._watch_process_exit(self.process, attempts=0)
+
+    def _stop_system_metrics(self):
+        if self.process:
+            self._sampler.unregister(self.process.pid)
+        self._reset_system_metrics()
+
+    def _reset_system_metrics(self):
+        # Сбрасываем CPU/Memory, если мониторинг процесса завершился
+        self._metrics.update(cpu_percent="N/A", memory_mb="N/A")
 
 
     def _update_status_after_process_exit(self):
         # Эта функция вызывается, когда self.process.poll() is not None
         if self.process and self.process.returncode is not None: # Убедимся, что returncode есть
+            with self._state.lock: # Завершение видят цикл ввода-вывода, get_status() и stop() из разных потоков
+                if self._exit_handled:
+                    return # Завершение этого процесса уже обработано
+                self._exit_handled = True
             return_code = self.process.returncode
-            if self.status == "останавливается": # Если остановка была инициирована нами
-                self.status = "остановлен"
+            self._health.unregister(self)
+            if self._escalation:
+                self._escalation.cancel()
+                self._escalation = None
+            if self._stop_requested_at is not None:
+                self.last_stop = {"signal": self._stop_signal, "exit_code": return_code,
+                                  "seconds": round(time.monotonic() - self._stop_requested_at, 3)}
+                self._stop_requested_at = None
+            if self._probe and self._spawned_at is not None and not self._stop_event.is_set():
+                self._probe.on_failed_before_first_packet() # Запуск с кэшем не дошел до первого пакета
+            status = self.state.status
+            if status == STATUS_STOPPING or self._stop_event.is_set(): # Если остановка была инициирована нами
+                self._capacity.forget(self) # Остановленный пользователем поток больше не занимает емкость
+                self.transition(STATUS_STOPPED)
                 logging.info(f"Процесс FFmpeg для {self.stream_id} остановлен (код: {return_code}).")
-            elif return_code == 0 and self.status != "ошибка_запуска": # Успешное завершение, не связанное с ошибкой запуска
-                self.status = "остановлен" # Или "завершен_успешно"
+            elif return_code == 0 and status != STATUS_START_FAILED: # Успешное завершение, не связанное с ошибкой запуска
+                self.transition(STATUS_STOPPED) # Или "завершен_успешно"
                 logging.info(f"Процесс FFmpeg для {self.stream_id} завершился успешно (код: 0).")
-            elif self.status != "ошибка_запуска": # Завершение с ошибкой, но не ошибка при самом запуске
+            elif status != STATUS_START_FAILED: # Завершение с ошибкой, но не ошибка при самом запуске
                 error_msg = f"Процесс FFmpeg для {self.stream_id} завершился с кодом ошибки {return_code}."
                 logging.error(error_msg)
                 if not self.last_error_message:
                     self.last_error_message = error_msg
-                self.status = f"завершен_с_ошибкой (код {return_code})"
-            # Если self.status == "ошибка_запуска", он уже установлен и не меняется здесь
+                self.transition(STATUS_FAILED, exit_code=return_code)
+            # Статус "ошибка_запуска" уже установлен и не меняется здесь
+            if self.recorder: # Последний сегмент FFmpeg заносит в список при завершении
+                self.recorder.poll(time.time())
+            for leg in self.output_legs:
+                if leg.status == LEG_RUNNING:
+                    leg.status = LEG_IDLE
+            self._first_packet_event.set() # Ожидающие первого пакета больше его не дождутся
+            self._supervisor.on_exit(self, return_code) # Планирует перезапуск согласно restart_policy (кроме остановки пользователем)
+            self._exited_event.set()
         else: # Процесс None или returncode is None (не должно быть здесь, если poll() не None)
-            if self.status not in ["ошибка_запуска", "ожидание"]: # Если не ошибка запуска и не начальное состояние
-                 self.status = "неизвестно" # Неожиданное состояние
-
+            self.transition(STATUS_UNKNOWN) # Неожиданное состояние (из "ожидание" и "ошибка_запуска" переход отклоняется)
 
-    def start(self):
-        if self.status in ["запущен", "запускается"]:
-            logging.warning(f"Конвертер для {self.stream_id} уже запущен или запускается.")
-            return
 
-        self.status = "запускается"
-        self.ffmpeg_logs.clear()
-        self.metrics_history.clear()
-        self.last_error_message = None
-        self.metrics = {
-            "bitrate_kbit": "N/A", "fps": "N/A", "cpu_percent": "N/A",
-            "memory_mb": "N/A", "dropped_frames": 0, "last_update_time": None
-        }
-        self._metrics_thread_stop_event.clear() # Сбрасываем событие остановки
-
-        # Используем -progress pipe:1 для структурированного вывода статистики в stdout.
-        # stderr по-прежнему будет использоваться для логов ошибок и общего вывода FFmpeg.
-        cmd_ffmpeg_push = [
-            FFMPEG_PATH,
-            # Опции для потенциального снижения задержки и улучшения стабильности:
-            '-analyzeduration', '1000000', # Анализировать вход не более 1 сек
-            '-probesize', '1000000',       # Читать не более 1МБ для определения формата
-            '-fflags', 'nobuffer',         # Уменьшить входную буферизацию (риск потерь при плохой сети)
-            '-fflags', '+discardcorrupt',  # Пытаться отбрасывать поврежденные пакеты (добавляем к существующим fflags)
-            
-            # Опции для автоматического переподключения к источнику RTMP
-            '-reconnect', '1',
-            '-reconnect_at_eof', '1',
-            '-reconnect_streamed', '1',
-            '-reconnect_delay_max', '4', # Максимальная задержка перед попыткой переподключения
-
-            '-loglevel', 'error',          # Оставляем только ошибки в stderr, основная инфа через -progress
-            '-progress', 'pipe:1',         # Направляем вывод прогресса в stdout (pipe:1)
-            '-nostdin',                    # Важно при использовании pipe:1
-
-            '-i', self.rtmp_url,           # Входной поток
-
-            # Копирование кодеков - наиболее оптимально по CPU/Memory и вносит мин. задержку
-            '-c:v', 'copy',
-            '-c:a', 'copy',
-            
-            '-f', 'rtsp',                  # Формат вывода
-            '-rtsp_transport', 'tcp',      # Транспорт для RTSP (TCP более надежен)
-            self.output_rtsp_url_for_ffmpeg_push # URL назначения
-        ]
-        # Примечание: опция -fflags может быть указана несколько раз, или значения могут быть объединены через '+'.
-        # Например, '-fflags', 'nobuffer+discardcorrupt'
-        # Для ясности здесь разделено, но FFmpeg может потребовать объединения.
-        # Проверим, как FFmpeg обработает несколько -fflags. Если будут проблемы, объединим.
-        # Корректный способ указать несколько fflags - это '+имяфлага', если он добавляется к предыдущим,
-        # или просто перечислить их через запятую для некоторых флагов, но не для fflags.
-        # Безопаснее всего: '-fflags', 'nobuffer discardcorrupt' (если так поддерживается) или использовать '+'
-        # Исправим на более надежный вариант с '+':
-        # Удалим предыдущие -fflags и добавим один объединенный:
-        cmd_ffmpeg_push = [
+    def _ffmpeg_command(self):
+        """Команда FFmpeg конвертера (группа упакованных потоков строит свою, см. packing.py)."""
+        if self._probe_cache.enabled:
+            # При известном составе потоков анализ входа минимальный; уровень info нужен для разбора "Stream #0:N"
+            self._probe = self._probe_cache.begin(self.rtmp_url)
+            input_options = self.profile.input_options(self.rtmp_url, self._probe.input_options(self.profile.probe_options()))
+            global_options = (*PROBE_LOG_OPTIONS, *PROGRESS_OPTIONS)
+        else:
+            self._probe = None
+            input_options, global_options = self.profile.input_options(self.rtmp_url), GLOBAL_OPTIONS
+        return [
             FFMPEG_PATH,
-            '-analyzeduration', '1000000',
-            '-probesize', '1000000',
-            '-fflags', 'nobuffer+discardcorrupt', # Объединенные флаги
+            *input_options,
             # Опции переподключения временно убраны из-за проблем совместимости
             # '-reconnect', '1',
             # '-reconnect_streamed', '1',
             # '-reconnect_delay_max', '4000',
-            '-loglevel', 'error',
-            '-progress', 'pipe:1',
-            '-nostdin',
+            *global_options,
             '-i', self.rtmp_url,
-            '-c:v', 'copy',
-            '-c:a', 'copy',
-            '-f', 'rtsp',
-            '-rtsp_transport', 'tcp',
-            self.output_rtsp_url_for_ffmpeg_push
+            # -c copy на один выход RTSP или на все выходы через tee (outputs.output_args)
+            *self.ffmpeg_output_args()
         ]
 
+    def ffmpeg_output_args(self):
+        """Аргументы выходов FFmpeg (по ним же узнается процесс прошлого запуска, см. registry.py)."""
+        leg_options = {self.recorder.url: self.recorder.leg_options()} if self.recorder else None
+        return output_args(self.output_urls(), leg_options=leg_options, rtsp_options=self.profile.rtsp_options())
+
+    def start(self, restart=False):
+        """Запускает FFmpeg; при restart=True (перезапуск супервизором) логи, последняя ошибка и история сохраняются."""
+        if self.state.status in RUNNING_STATUSES or not self.transition(STATUS_STARTING):
+            logging.warning(f"Конвертер для {self.stream_id} уже запущен или запускается (статус: {self.status}).")
+            return
+
+        if not restart:
+            self.ffmpeg_logs.clear()
+            self.metrics_store.clear()
+            self.last_error_message = None
+            for leg in self.output_legs:
+                leg.bytes = None
+        self._awaiting_recovery = restart
+        # Отложенные проверки завершения прошлого процесса сверяют его с self.process и не примут новый запуск за свой
+        self.process = None
+        self._exit_handled = False
+        self._adopted = False
+        self._stop_requested_at = None
+        self._metrics.set(self._empty_metrics())
+        self.first_packet_at = None
+        self._first_packet_event.clear()
+        self._progress_parser.reset()
+        self._stop_event.clear() # Сбрасываем событие остановки
+
+        cmd_ffmpeg_push = self._ffmpeg_command()
+
         logging.info(f"Запуск конвертера для {self.stream_id} ({self.rtmp_url} -> {self.output_rtsp_url_for_ffmpeg_push})")
         logging.info(f"Оптимизированная команда FFmpeg для {self.stream_id}: {' '.join(cmd_ffmpeg_push)}")
 
         try:
+            if self.recorder: # Каталог записи и новый список сегментов
+                self.recorder.prepare()
+            self._spawned_at = time.monotonic()
+            self._exited_event.clear()
+            spawn_started = time.perf_counter()
             self.process = subprocess.Popen(
                 cmd_ffmpeg_push,
                 stdout=subprocess.PIPE,
@@ -270,90 +427,173 @@ class RTMPToRTSPConverter:
                 close_fds=(os.name == 'posix') 
                 # startupinfo=startupinfo # Для Windows, если нужно скрыть окно
             )
-            self.status = "запущен"
+            self._instrumentation.observe("converter.spawn", time.perf_counter() - spawn_started)
+            self.transition(STATUS_RUNNING)
+            self.started_at = time.time()
+            self.start_count += 1
+            for leg in self.output_legs:
+                leg.mark_started()
+            self._metrics.update(probe_cache_hit=int(bool(self._probe and self._probe.hit)))
             logging.info(f"Процесс FFmpeg для {self.stream_id} запущен с PID: {self.process.pid}")
 
-            # Запускаем потоки для чтения stdout (для -progress) и stderr (для ошибок) FFmpeg
-            stdout_pipe = self.process.stdout
-            stderr_pipe = self.process.stderr
-
-            self.stdout_thread = threading.Thread(
-                target=self._log_stream_output, args=(stdout_pipe, "stdout_progress"), daemon=True, name=f"ffmpeg_stdout_{self.stream_id}"
+            # Регистрируем stdout (для -progress) и stderr (для ошибок) FFmpeg в общем цикле ввода-вывода
+            process = self.process
+            self._open_pipes = 2
+            # stdout (-progress) передается парсеру сырыми фрагментами, без разбиения на строки в цикле
+            instrumentation = self._instrumentation
+            self._reactor.add_pipe(
+                process.stdout, instrumentation.timed("ffmpeg.progress_chunk", self._progress_parser.feed, count_lines=True),
+                lambda: self._on_output_closed(process), raw=True
             )
-            self.stderr_thread = threading.Thread(
-                target=self._log_stream_output, args=(stderr_pipe, "stderr_errors"), daemon=True, name=f"ffmpeg_stderr_{self.stream_id}"
+            self._reactor.add_pipe(
+                process.stderr, instrumentation.timed("ffmpeg.stderr_line", lambda line: self._handle_output_line(line, "stderr_errors")),
+                lambda: self._on_output_closed(process)
             )
-            self.stdout_thread.start()
-            self.stderr_thread.start()
 
-            # Запускаем поток для мониторинга системных метрик
-            self._metrics_thread = threading.Thread(
-                target=self._monitor_system_metrics, daemon=True, name=f"system_metrics_{self.stream_id}"
-            )
-            self._metrics_thread.start()
+            self._exit_watched = self._reactor.add_process_exit(process.pid, lambda: self._on_process_exited(process))
+
+            # CPU/RSS процесса собирает общий сборщик метрик одним проходом по всем PID
+            self._health.register(self)
+            self._sampler.register(process.pid, self)
 
         except FileNotFoundError:
             error_msg = f"FFmpeg не найден по пути {FFMPEG_PATH}. Убедитесь, что FFmpeg установлен и добавлен в PATH (или доступен в Docker контейнере)."
             logging.error(error_msg)
             self.last_error_message = error_msg
-            self.status = "ошибка_запуска"
+            self.transition(STATUS_START_FAILED)
             if self.process: self.process = None # Убедимся, что процесс None
+            self._exited_event.set()
+            self._first_packet_event.set()
         except Exception as e:
             error_msg = f"Не удалось запустить FFmpeg для {self.stream_id}: {e}"
             logging.error(error_msg)
             self.last_error_message = error_msg
-            self.status = "ошибка_запуска"
+            self.transition(STATUS_START_FAILED)
             if self.process: self.process = None # Убедимся, что процесс None
-
-    def stop(self):
+            self._exited_event.set()
+            self._first_packet_event.set()
+
+    def adopt(self, process):
+        """Принимает уже работающий процесс FFmpeg прошлого запуска сервиса (registry.AdoptedProcess)."""
+        self.process = process
+        self._adopted = True
+        self._exit_handled = False
+        self._stop_event.clear()
+        self._stop_requested_at = None
+        self._open_pipes = 0
+        self._exited_event.clear()
+        self.transition(STATUS_RUNNING)
+        self.started_at = time.time()
+        self.start_count += 1
+        for leg in self.output_legs:
+            leg.mark_started()
+        if self.recorder: # Список сегментов принятого процесса дочитывается с начала
+            self.recorder.prepare(fresh=False)
+        log_entry = (f"[FFmpeg {self.stream_id}]: процесс {process.pid} принят после перезапуска сервиса; "
+                     f"-progress и stderr будут доступны после его перезапуска.")
+        logging.info(log_entry)
+        self.ffmpeg_logs.append(log_entry)
+        # pidfd можно открыть и для чужого процесса; если PID уже занят другим, завершение заметит сборщик метрик
+        self._exit_watched = self._reactor.add_process_exit(process.pid, lambda: self._on_process_exited(process))
+        self._health.register(self)
+        self._sampler.register(process.pid, self)
+
+    def stop(self, wait=True):
+        """Останавливает FFmpeg: SIGINT, затем SIGTERM и SIGKILL по таймаутам.
+
+        При wait=False возвращается сразу после SIGINT; дождаться завершения можно через wait_stopped().
+        """
         logging.info(f"Запрос на остановку конвертера для {self.stream_id} (текущий статус: {self.status})")
-        self._metrics_thread_stop_event.set() # Сигнализируем потоку метрик о необходимости завершения
-
-        if self.process and self.process.poll() is None: # Если процесс существует и еще запущен
-            if self.status not in ["останавливается", "остановлен", "завершен_с_ошибкой", "ошибка_запуска"]:
-                self.status = "останавливается"
-                logging.info(f"Отправка SIGINT процессу FFmpeg {self.process.pid} для {self.stream_id}...")
-                try:
-                    self.process.send_signal(signal.SIGINT)
-                    # Не ждем здесь долго, так как _log_stream_output и _update_status_after_process_exit обработают завершение
-                    # self.process.wait(timeout=10) # Это может заблокировать Streamlit UI
-                except Exception as e:
-                    logging.error(f"Ошибка при отправке SIGINT процессу {self.process.pid}: {e}")
-                    # Если отправка сигнала не удалась, возможно, стоит попробовать kill
-                    if self.process.poll() is None:
-                        logging.warning(f"SIGINT не удался, попытка SIGKILL для процесса {self.process.pid}")
-                        self.process.kill()
+        self._stop_event.set() # Сигнализируем о необходимости прекратить публикацию метрик
+        self._supervisor.cancel(self) # Остановленный пользователем поток не перезапускается
+        self._stop_system_metrics()
+
+        process = self.process
+        if process and process.poll() is None: # Если процесс существует и еще запущен
+            if self.transition(STATUS_STOPPING, allowed_from=(STATUS_STARTING, STATUS_RUNNING)):
+                self.last_stop = None
+                self._stop_requested_at = time.monotonic()
+                logging.info(f"Отправка SIGINT процессу FFmpeg {process.pid} для {self.stream_id}...")
+                self._send_stop_signal(process, signal.SIGINT)
+                self._escalation = self._reactor.call_later(STOP_TIMEOUT_SEC, lambda: self._escalate(process, signal.SIGTERM))
             else:
                  logging.info(f"Процесс FFmpeg для {self.stream_id} уже останавливается или остановлен.")
         else:
             logging.info(f"Процесс FFmpeg для {self.stream_id} не запущен или уже завершен.")
-            if self.status not in ["ошибка_запуска", "завершен_с_ошибкой"]:
-                 self.status = "остановлен" # Если не было ошибок, но процесс не найден
-
-        # Ожидание завершения потоков логов и метрик (с таймаутом)
-        if hasattr(self, 'stderr_thread') and self.stderr_thread.is_alive():
-            self.stderr_thread.join(timeout=2.0)
-        if self._metrics_thread and self._metrics_thread.is_alive():
-            self._metrics_thread.join(timeout=2.0)
-        
-        # Финальное обновление статуса, если процесс завершился
+            self.transition(STATUS_STOPPED) # Процесса нет; "ошибка_запуска" остается (переход отклоняется)
+
+        # Ожидание завершения (каналы дочитывает и процесс забирает цикл ввода-вывода)
+        if wait and self.process and not self._reactor.in_loop_thread():
+            self.wait_stopped(STOP_DEADLINE_SEC)
+
+        # Финальное обновление статуса, если процесс завершился и статус еще не финальный
         if self.process and self.process.poll() is not None:
+            if self.state.status not in FINAL_STATUSES:
+                self._update_status_after_process_exit()
+        elif not self.process and self.state.status != STATUS_IDLE:
+            self.transition(STATUS_STOPPED)
+
+
+    def _send_stop_signal(self, process, sig):
+        self._stop_signal = signal.Signals(sig).name
+        try:
+            process.send_signal(sig)
+        except Exception as e:
+            logging.error(f"Ошибка при отправке {self._stop_signal} процессу {process.pid}: {e}")
+            if sig != signal.SIGKILL and process.poll() is None:
+                logging.warning(f"{self._stop_signal} не удался, попытка SIGKILL для процесса {process.pid}")
+                self._send_stop_signal(process, signal.SIGKILL)
+
+    def _escalate(self, process, sig):
+        """Таймер цикла: процесс не завершился после предыдущего сигнала остановки."""
+        if process is not self.process or process.poll() is not None:
+            return
+        logging.warning(f"FFmpeg {process.pid} для {self.stream_id} не завершился после {self._stop_signal}, "
+                        f"отправка {signal.Signals(sig).name}.")
+        self._send_stop_signal(process, sig)
+        if sig == signal.SIGTERM:
+            self._escalation = self._reactor.call_later(KILL_TIMEOUT_SEC, lambda: self._escalate(process, signal.SIGKILL))
+
+    def wait_stopped(self, timeout=None):
+        """Ждет, пока завершение процесса будет обработано; True, если процесса больше нет."""
+        if self._exited_event.wait(timeout):
+            return True
+        if self.process and self.process.poll() is not None: # Например, без pidfd на медленном опросе
             self._update_status_after_process_exit()
-        elif not self.process and self.status not in ["ошибка_запуска", "ожидание"]:
-            self.status = "остановлен"
+        return self._exited_event.is_set()
 
+    def wait_first_packet(self, timeout=None):
+        """Ждет первого пакета текущего процесса; False, если процесс завершился раньше или истек timeout."""
+        self._first_packet_event.wait(timeout)
+        return self.first_packet_at is not None
 
     def get_status(self):
         """Возвращает текущий статус конвертера, обновляя его, если процесс завершился."""
-        if self.process and self.process.poll() is not None: # Процесс завершился
-            if self.status not in ["остановлен", "завершен_с_ошибкой", "ошибка_запуска"]: # Если статус еще не финальный
+        process = self.process
+        if process and process.poll() is not None: # Процесс завершился
+            if self.state.status not in FINAL_STATUSES: # Если статус еще не финальный
                 self._update_status_after_process_exit()
-        elif self.process and self.process.poll() is None: # Процесс еще жив
-             if self.status == "запускается": # Если все еще запускается, но процесс уже есть
-                 self.status = "запущен"
+        elif process and self.state.status == STATUS_STARTING: # Процесс уже есть, а статус еще "запускается"
+            self.transition(STATUS_RUNNING, allowed_from=(STATUS_STARTING,))
         # Если self.process is None, то статус должен быть "ожидание" или "ошибка_запуска"
         return self.status
     
+    def output_urls(self):
+        return [leg.url for leg in self.output_legs]
+
+    def get_output_legs(self):
+        """Возвращает состояние каждого выхода: URL, статус, ошибку и (приближенный для tee) объем в байтах."""
+        return [leg.as_dict() for leg in self.output_legs]
+
+    def get_recordings(self, since=None, until=None, at=None):
+        """Сегменты записи: содержащий момент at или пересекающие интервал [since, until)."""
+        if not self.recorder:
+            return None
+        if at is not None:
+            segment = self.recorder.find(at)
+            return [segment] if segment else []
+        return self.recorder.between(since if since is not None else 0.0, until if until is not None else float("inf"))
+
     def get_ffmpeg_logs(self):
         """Возвращает последние логи FFmpeg."""
         return list(self.ffmpeg_logs) # Возвращаем копию
@@ -363,7 +603,7 @@ class RTMPToRTSPConverter:
         return self.last_error_message
 
     def get_metrics(self):
-        """Возвращает текущие собранные метрики."""
+        """Возвращает текущие собранные метрики (вместе с метриками перезапусков)."""
         # Обновляем CPU/Memory если процесс еще жив, но _monitor_system_metrics не успел
         # Это не очень хорошо, лучше чтобы _monitor_system_metrics сам обновлял
         # if self.process and self.process.poll() is None and self.metrics["cpu_percent"] == "N/A":
@@ -373,28 +613,56 @@ class RTMPToRTSPConverter:
         #         self.metrics["memory_mb"] = round(p.memory_info().rss / (1024 * 1024), 2)
         #     except (psutil.NoSuchProcess, psutil.AccessDenied):
         #         pass # Ошибки здесь игнорируем, метрики останутся N/A
-        return self.metrics.copy()
-
-    def get_metrics_history(self):
-        return list(self.metrics_history)
+        metrics = self.metrics.as_dict()
+        metrics["auto_restarts"] = self.auto_restarts
+        metrics["time_to_recover_s"] = self.last_recovery_seconds
+        metrics["flapping"] = int(self._supervisor.is_flapping(self))
+        metrics["ffmpeg_errors"] = dict(self.stderr_pipeline.counts) # {категория: число строк}
+        metrics["log_lines_suppressed"] = self.stderr_pipeline.suppressed
+        metrics.update(self._health.health(self)) # health_score, health_state, health_reasons
+        metrics["unhealthy_restarts"] = self.unhealthy_restarts
+        if self.recorder:
+            metrics.update(self.recorder.metrics()) # dvr_*: сегменты, объем на диске, скорость записи, задержка
+        probe = self.latency_probe
+        if probe:
+            metrics.update(probe.metrics()) # latency_*: квантили задержки выхода RTSP по окну
+        return metrics
+
+    def get_metrics_history(self, count=60):
+        """Возвращает последние count секундных замеров в виде списка словарей."""
+        return self.metrics_store.latest(count)
+
+    def get_metrics_series(self, step=1):
+        """Возвращает (base_time, ndarray) истории метрик уровня step без копирования (колонки - metrics_store.COLUMNS)."""
+        return self.metrics_store.view(step)
 
 # Глобальный словарь для хранения экземпляров конвертеров (для нескольких потоков)
 # Этот словарь будет управляться Streamlit через st.session_state
 # converters_store = {} # Переименуем, чтобы не конфликтовать с возможным импортом
 
 # Функции для управления конвертерами (будут использоваться Streamlit)
-def create_and_start_conversion(stream_id, rtmp_url, rtsp_server_host, rtsp_port, rtsp_path="live"):
-    """Создает, запускает и возвращает экземпляр конвертера."""
+def create_and_start_conversion(stream_id, rtmp_url, rtsp_server_host, rtsp_port, rtsp_path="live", extra_outputs=None, record=False,
+                                admit=True, wait=True, profile=None):
+    """Создает, запускает и возвращает экземпляр конвертера.
+
+    admit=True - сначала проверить емкость узла (admission.py): при нехватке ждать до KAZSTREAMLINK_ADMIT_QUEUE_SEC
+    (wait=False - без ожидания) и выбросить AdmissionRejected.
+    """
     logging.info(f"Запрос на создание и запуск конверсии для ID: {stream_id}")
-    converter = RTMPToRTSPConverter(stream_id, rtmp_url, rtsp_server_host, rtsp_port, rtsp_path)
+    if admit:
+        get_capacity_model().admit(stream_id, rtmp_url, wait=wait)
+    converter = RTMPToRTSPConverter(stream_id, rtmp_url, rtsp_server_host, rtsp_port, rtsp_path, extra_outputs=extra_outputs,
+                                    record=record, profile=profile)
     converter.start()
+    if converter.state.status == STATUS_START_FAILED:
+        get_capacity_model().release(stream_id)
     return converter
 
-def stop_specific_conversion(converter_instance):
+def stop_specific_conversion(converter_instance, wait=True):
     """Останавливает конкретный экземпляр конвертера."""
     if converter_instance:
         logging.info(f"Запрос на остановку конверсии для ID: {converter_instance.stream_id}")
-        converter_instance.stop()
+        converter_instance.stop(wait=wait)
 
 # Функции handle_exit и main_cli больше не нужны, так как управление будет через Streamlit.
 # def handle_exit():
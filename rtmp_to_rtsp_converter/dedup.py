@@ -0,0 +1,205 @@
+import os
+import re
+import logging
+from urllib.parse import urlsplit, urlunsplit
+
+from rtmp_to_rtsp_converter.converter import RTMPToRTSPConverter
+from rtmp_to_rtsp_converter.packing import PackedConverterGroup, PackedStream
+from rtmp_to_rtsp_converter.outputs import parse_leg_failure
+from rtmp_to_rtsp_converter.state import STATUS_RUNNING, STATUS_STARTING
+from rtmp_to_rtsp_converter.profiles import get_profile
+
+# Дедупликация источников: один процесс FFmpeg на RTMP-источник.
+#
+# Ничто не мешает создать два потока с одним rtmp_url (например, из двух сессий Streamlit), и тогда
+# каждый тянет источник целиком и держит свой процесс FFmpeg. Менеджер (manager.py) сравнивает
+# источники по нормализованному URL (normalise_source) и подключает новый поток к уже работающему
+# процессу того же источника: выходы потока становятся ногами tee этого процесса (outputs.py).
+# Источник читается один раз, а потоки остаются отдельными для API, UI и реестра (PackedStream).
+#
+# Если источник тянет отдельный конвертер, он становится первым потоком общей группы
+# (SharedIngestGroup). Процесс перезапускается при каждом подключении и отключении потока:
+# набор ног tee задается при запуске FFmpeg. Остальные потоки источника прерываются на время запуска,
+# как в упаковке (packing.py). Процесс живет, пока в группе есть работающий поток (подсчет ссылок),
+# и останавливается вместе с последним.
+#
+# Не дедуплицируются потоки с записью, потоки по запросу и потоки внутри упакованных групп с несколькими
+# входами: у них свой жизненный цикл процесса. Потоки одного источника с разными профилями передачи
+# (profiles.py) тоже тянут его отдельно: буферизация входа и транспорт у процесса одни.
+#
+# Дедупликация включается явно (KAZSTREAMLINK_DEDUP=1): подключение потока перезапускает процесс
+# источника, и зрители уже работающих потоков этого источника теряют картинку на время запуска.
+
+DEDUP_ENABLED = os.environ.get("KAZSTREAMLINK_DEDUP", "0") == "1"
+_DEFAULT_PORTS = {"rtmp": 1935, "rtmps": 443, "rtmpt": 80, "rtsp": 554, "http": 80, "https": 443}
+_SLASHES_RE = re.compile(r"/{2,}")
+
+
+def normalise_source(url):
+    """Ключ источника: схема и хост в нижнем регистре, без порта по умолчанию, повторных и конечных "/".
+
+    Путь и параметры (ключ потока) сравниваются как есть. Имена хостов не разрешаются:
+    rtmp://localhost/... и rtmp://127.0.0.1/... - разные источники.
+    """
+    url = url.strip()
+    parts = urlsplit(url)
+    if not parts.scheme or not parts.netloc:
+        return url
+    scheme = parts.scheme.lower()
+    host = (parts.hostname or "").lower()
+    if ":" in host: # IPv6
+        host = f"[{host}]"
+    try:
+        port = parts.port
+    except ValueError:
+        return url
+    netloc = host if port is None or port == _DEFAULT_PORTS.get(scheme) else f"{host}:{port}"
+    if parts.username is not None:
+        userinfo = parts.username + (f":{parts.password}" if parts.password is not None else "")
+        netloc = f"{userinfo}@{netloc}"
+    path = _SLASHES_RE.sub("/", parts.path).rstrip("/")
+    return urlunsplit((scheme, netloc, path, parts.query, ""))
+
+
+class SharedIngestGroup(PackedConverterGroup):
+    """Один процесс FFmpeg на источник: выходы всех его потоков - ноги tee одного входа."""
+    member_label = "shared_ingest"
+
+    def __init__(self, group_id, specs, restart_policy=None):
+        super().__init__(group_id, specs, restart_policy=restart_policy)
+        self.source_key = normalise_source(specs[0]["rtmp_url"])
+        # Вход и ноги RTSP общие, поэтому профиль у всех потоков группы один (см. ConverterManager._find_ingest)
+        self.profile = get_profile(specs[0].get("profile"))
+        self.saved_ingest_bytes = 0.0 # Сколько байт источника не пришлось тянуть повторно
+        self._last_sample_time = None
+
+    def _ffmpeg_command(self):
+        members = self._running_members = self.active_members()
+        self.output_legs = [leg for member in members for leg in member.output_legs]
+        # Один вход: команда отдельного конвертера (с кэшем анализа входа) с ногами всех потоков
+        return RTMPToRTSPConverter._ffmpeg_command(self)
+
+    def _health_metrics(self, metrics):
+        return metrics # Вход общий: все метрики процесса относятся к каждому потоку группы
+
+    def start(self, restart=False):
+        self._last_sample_time = None
+        super().start(restart)
+
+    def attach(self, specs):
+        """Добавляет потоки того же источника; процесс перезапускается с их ногами tee."""
+        members = [PackedStream(self, spec) for spec in specs]
+        with self._members_lock:
+            self.members.extend(members)
+            logging.info(f"Потоки {', '.join(m.stream_id for m in members)} подключаются к процессу источника "
+                         f"{self.stream_id} ({len(self.active_members())} потоков).")
+            self.start_members(members)
+        return members
+
+    def _member_of_leg(self, leg):
+        return next((member for member in self._running_members if leg in member.output_legs), None)
+
+    def _handle_output_line(self, line_bytes, log_type):
+        if not line_bytes:
+            return
+        line = line_bytes.decode('utf-8', errors='replace').strip()
+        probe = self._probe
+        if probe and probe.feed(line): # Строка [info] с описанием потоков входа
+            if probe.layout is not None and probe.needs_full_probe():
+                self._restart_with_full_probe()
+            return
+        category, entries = self.stderr_pipeline.feed(line)
+        self.ffmpeg_logs.extend(entries)
+        if not category:
+            return
+        self.last_error_message = line
+        members = self._running_members # Ошибка входа касается всех потоков источника
+        leg_index = parse_leg_failure(line, self.output_urls()) if len(self.output_legs) > 1 else None
+        if leg_index is not None: # Отказала нога одного потока, остальные продолжают работу
+            leg = self.output_legs[leg_index]
+            leg.mark_failed(line)
+            logging.warning(f"Выход {leg.url} группы {self.stream_id} отключен: {line}")
+            owner = self._member_of_leg(leg)
+            members = [owner] if owner else []
+        for member in members:
+            member.ffmpeg_logs.extend(entries)
+            member.error_counts[category] += 1
+            member.last_error_message = line
+
+    def _publish_system_metrics(self, cpu_percent, memory_mb, sample_time):
+        RTMPToRTSPConverter._publish_system_metrics(self, cpu_percent, memory_mb, sample_time)
+        if self._stop_event.is_set():
+            return
+        members = self._running_members
+        if not members:
+            return
+        share = len(members)
+        group_metrics = self.metrics
+        # Вход общий: битрейт, FPS и счетчики кадров у всех потоков одни; CPU и RSS делятся поровну
+        changes = {
+            "cpu_percent": round(cpu_percent / share, 2) if isinstance(cpu_percent, (int, float)) else cpu_percent,
+            "memory_mb": round(memory_mb / share, 2) if isinstance(memory_mb, (int, float)) else memory_mb,
+            "last_update_time": sample_time,
+        }
+        for key in ("fps", "bitrate_kbit", "speed", "out_time_us", "total_size", "dropped_frames", "dup_frames",
+                    "time_to_first_packet_s"):
+            changes[key] = group_metrics[key]
+        for member in members:
+            member.metrics_store.append(sample_time, member._metrics.update(**changes))
+        bitrate = group_metrics.bitrate_kbit
+        if self._last_sample_time is not None and isinstance(bitrate, (int, float)):
+            self.saved_ingest_bytes += (share - 1) * bitrate * 125 * (sample_time - self._last_sample_time)
+        self._last_sample_time = sample_time
+
+
+def dedup_report(converters):
+    """Общие процессы источников и оценка экономии против отдельного процесса на каждый поток."""
+    groups = {}
+    for converter in converters:
+        if isinstance(converter, PackedStream) and isinstance(converter.group, SharedIngestGroup):
+            groups[converter.group.stream_id] = converter.group
+    totals = {"source_pulls": 0, "ingest_mbit": 0.0, "cpu_percent": 0.0, "memory_mb": 0.0, "ingest_gb": 0.0}
+    sources = []
+    for group in groups.values():
+        members = group.active_members()
+        running = group.state.status in (STATUS_RUNNING, STATUS_STARTING)
+        saved = len(members) - 1 if running and members else 0
+        metrics = group.metrics
+        bitrate = metrics.bitrate_kbit if isinstance(metrics.bitrate_kbit, (int, float)) else None
+        cpu_percent = metrics.cpu_percent if isinstance(metrics.cpu_percent, (int, float)) else None
+        memory_mb = metrics.memory_mb if isinstance(metrics.memory_mb, (int, float)) else None
+        # Отдельный процесс на поток стоил бы не меньше доли общего процесса на поток: оценка снизу
+        source = {
+            "source": group.source_key,
+            "ingest": group.stream_id,
+            "status": group.get_status(),
+            "streams": [member.stream_id for member in members],
+            "bitrate_kbit": bitrate,
+            "source_pulls_saved": saved,
+            "ingest_mbit_saved": round(saved * bitrate / 1000, 3) if bitrate is not None else 0.0,
+            "cpu_percent_saved": round(saved * cpu_percent / len(members), 2) if cpu_percent is not None and members else 0.0,
+            "memory_mb_saved": round(saved * memory_mb / len(members), 1) if memory_mb is not None and members else 0.0,
+            "ingest_gb_saved": round(group.saved_ingest_bytes / 1e9, 3),
+        }
+        sources.append(source)
+        totals["source_pulls"] += saved
+        totals["ingest_mbit"] += source["ingest_mbit_saved"]
+        totals["cpu_percent"] += source["cpu_percent_saved"]
+        totals["memory_mb"] += source["memory_mb_saved"]
+        totals["ingest_gb"] += group.saved_ingest_bytes / 1e9
+    return {
+        "enabled": DEDUP_ENABLED, # Менеджер подставляет свой флаг (ConverterManager.dedup)
+        "shared_sources": len(sources),
+        "streams": sum(len(source["streams"]) for source in sources),
+        # Сейчас (процессы и источники, которые не тянутся повторно) и с начала работы (трафик)
+        "saved": {
+            "source_pulls": totals["source_pulls"],
+            "processes": totals["source_pulls"],
+            "ingest_mbit": round(totals["ingest_mbit"], 3),
+            "cpu_percent": round(totals["cpu_percent"], 2),
+            "memory_mb": round(totals["memory_mb"], 1),
+            "ingest_gb": round(totals["ingest_gb"], 3),
+            "ingest_bytes": round(totals["ingest_gb"] * 1e9),
+        },
+        "sources": sources,
+    }
@@ -0,0 +1,281 @@
+import time
+import threading
+
+from rtmp_to_rtsp_converter.manager import get_manager
+from rtmp_to_rtsp_converter.sampler import METRICS_PERIOD_SEC
+from rtmp_to_rtsp_converter.supervisor import get_supervisor
+from rtmp_to_rtsp_converter.outputs import LEG_RUNNING
+from rtmp_to_rtsp_converter.probe_cache import get_probe_cache
+from rtmp_to_rtsp_converter.log_pipeline import CATEGORIES, dropped_log_records
+from rtmp_to_rtsp_converter.health import HEALTH_STATES, get_health_engine
+from rtmp_to_rtsp_converter.admission import get_capacity_model
+from rtmp_to_rtsp_converter.profiling import get_instrumentation
+from rtmp_to_rtsp_converter.latency import LATENCY_QUANTILES, MODE_TIMECODE, MODE_JITTER
+
+# Экспорт метрик в формате Prometheus / OpenMetrics (эндпоинт /metrics в api.py).
+# Текст ответа собирается из снимка метрик не чаще одного раза за период сбора
+# (KAZSTREAMLINK_METRICS_PERIOD) и отдается из кэша всем скрейпам в пределах периода.
+# Сборка только копирует словари метрик конвертеров и не трогает каналы FFmpeg.
+
+OPENMETRICS_CONTENT_TYPE = "application/openmetrics-text; version=1.0.0; charset=utf-8"
+PROMETHEUS_CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+_PROCESS_STARTED_AT = time.time()
+_BYTES_PER_MB = 1024 * 1024
+_RUNNING_STATUSES = ("запущен", "запускается")
+
+# (имя, тип, описание, ключ в converter.metrics, множитель)
+_STREAM_FAMILIES = (
+    ("kazstreamlink_stream_bitrate_kbit", "gauge", "Битрейт выхода FFmpeg, kbit/s.", "bitrate_kbit", 1),
+    ("kazstreamlink_stream_fps", "gauge", "Кадров в секунду по данным -progress.", "fps", 1),
+    ("kazstreamlink_stream_speed", "gauge", "Скорость обработки относительно реального времени.", "speed", 1),
+    ("kazstreamlink_stream_cpu_percent", "gauge", "Загрузка CPU процессом FFmpeg, %.", "cpu_percent", 1),
+    ("kazstreamlink_stream_memory_bytes", "gauge", "RSS процесса FFmpeg, байт.", "memory_mb", _BYTES_PER_MB),
+    ("kazstreamlink_stream_out_time_seconds", "gauge", "Позиция выхода FFmpeg (out_time), сек.", "out_time_us", 1e-6),
+    ("kazstreamlink_stream_dropped_frames", "counter", "Отброшенные FFmpeg кадры.", "dropped_frames", 1),
+    ("kazstreamlink_stream_dup_frames", "counter", "Продублированные FFmpeg кадры.", "dup_frames", 1),
+    ("kazstreamlink_stream_output_bytes", "counter", "Байт отправлено FFmpeg.", "total_size", 1),
+    ("kazstreamlink_stream_auto_restarts", "counter", "Автоматические перезапуски FFmpeg супервизором.", "auto_restarts", 1),
+    ("kazstreamlink_stream_time_to_recover_seconds", "gauge", "Время восстановления после последнего падения FFmpeg, сек.", "time_to_recover_s", 1),
+    ("kazstreamlink_stream_flapping", "gauge", "1, если поток слишком часто перезапускается (флаппинг).", "flapping", 1),
+    ("kazstreamlink_stream_time_to_first_packet_seconds", "gauge", "От запуска FFmpeg до первого отправленного пакета, сек.", "time_to_first_packet_s", 1),
+    ("kazstreamlink_stream_probe_cache_hit", "gauge", "1, если FFmpeg запущен с составом потоков из кэша анализа.", "probe_cache_hit", 1),
+    ("kazstreamlink_stream_log_lines_suppressed", "counter", "Строки stderr FFmpeg, не попавшие в лог из-за ограничения частоты.", "log_lines_suppressed", 1),
+    ("kazstreamlink_stream_health_score", "gauge", "Оценка здоровья потока, 0-100 (см. health.py).", "health_score", 1),
+    ("kazstreamlink_stream_unhealthy_restarts", "counter", "Перезапуски FFmpeg из-за зависания.", "unhealthy_restarts", 1),
+    ("kazstreamlink_dvr_segments", "gauge", "Сегментов записи на диске.", "dvr_segments", 1),
+    ("kazstreamlink_dvr_stored_bytes", "gauge", "Объем записи на диске, байт.", "dvr_bytes", 1),
+    ("kazstreamlink_dvr_written_bytes", "counter", "Байт записано в закрытые сегменты.", "dvr_written_bytes", 1),
+    ("kazstreamlink_dvr_write_bytes_per_second", "gauge", "Скорость записи сегментов на диск за последнюю минуту, байт/с.", "dvr_write_mbit", 1e6 / 8),
+    ("kazstreamlink_dvr_segment_latency_seconds", "gauge", "От конца последнего сегмента до его появления в индексе, сек.", "dvr_segment_latency_s", 1),
+    ("kazstreamlink_dvr_deleted_segments", "counter", "Сегменты, удаленные по сроку хранения.", "dvr_deleted_segments", 1),
+)
+
+
+def _escape_label(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_value(value):
+    return repr(value) if type(value) is float else str(int(value))
+
+
+def _format_bound(bound):
+    return "+Inf" if bound == float("inf") else repr(bound)
+
+
+class MetricsExporter:
+    def __init__(self, manager=None, max_age=None):
+        self.manager = manager or get_manager()
+        self.max_age = METRICS_PERIOD_SEC if max_age is None else max_age
+        self._lock = threading.Lock()
+        self._cache = {} # {openmetrics: (built_at, bytes)}
+        self._label_cache = {} # {stream_id: '{stream_id="..."}'} - экранирование меток один раз на поток
+        self.last_build_seconds = 0.0
+
+    def render(self, openmetrics=True):
+        """Возвращает (content_type, bytes) из кэша, пересобирая его, если снимок устарел."""
+        now = time.monotonic()
+        cached = self._cache.get(openmetrics)
+        if cached is None or now - cached[0] >= self.max_age:
+            with self._lock: # Параллельные скрейпы ждут одну сборку, а не собирают каждый свою
+                cached = self._cache.get(openmetrics)
+                if cached is None or time.monotonic() - cached[0] >= self.max_age:
+                    cached = (time.monotonic(), self._build(openmetrics))
+                    self._cache[openmetrics] = cached
+        return (OPENMETRICS_CONTENT_TYPE if openmetrics else PROMETHEUS_CONTENT_TYPE), cached[1]
+
+    def _snapshot(self):
+        """[(stream_id, status, metrics, started_at, restarts, output_legs)] из общего снимка менеджера (fleet.py)."""
+        return [
+            (row["stream_id"], row["status"], row["metrics"], row["started_at"], row["restarts"], row["outputs"])
+            for row in self.manager.snapshot(self.max_age).rows
+        ]
+
+    def _stream_labels(self, stream_ids):
+        cache = self._label_cache
+        if len(cache) > 2 * len(stream_ids) + 64: # Удаленные потоки не должны копиться бесконечно
+            cache.clear()
+        for stream_id in stream_ids:
+            if stream_id not in cache:
+                cache[stream_id] = f'{{stream_id="{_escape_label(stream_id)}"}}'
+        return cache
+
+    def _build(self, openmetrics):
+        started = time.perf_counter()
+        snapshot = self._snapshot()
+        now = time.time()
+        lines = []
+
+        labels = self._stream_labels([item[0] for item in snapshot])
+
+        def family(name, metric_type, help_text, samples):
+            """samples: [(текст меток вида '{k="v"}' или '', значение)]."""
+            # В OpenMetrics имя семейства счетчика указывается без суффикса _total, в формате 0.0.4 - с ним
+            suffix = "_total" if metric_type == "counter" else ""
+            family_name = name if openmetrics else name + suffix
+            lines.append(f"# HELP {family_name} {help_text}")
+            lines.append(f"# TYPE {family_name} {metric_type}")
+            sample_name = name + suffix
+            lines.extend(f"{sample_name}{label_text} {_format_value(value)}" for label_text, value in samples)
+
+        def histogram_family(name, help_text, samples):
+            """samples: [(метки вида 'k="v"' или '', profiling.Histogram)]."""
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} histogram")
+            for label_text, histogram in samples:
+                prefix = f"{label_text}," if label_text else ""
+                lines.extend(f'{name}_bucket{{{prefix}le="{_format_bound(bound)}"}} {count}' for bound, count in histogram.buckets())
+                suffix = f"{{{label_text}}}" if label_text else ""
+                lines.append(f"{name}_count{suffix} {histogram.count}")
+                lines.append(f"{name}_sum{suffix} {histogram.sum!r}")
+
+        for name, metric_type, help_text, key, scale in _STREAM_FAMILIES:
+            samples = []
+            for stream_id, _, metrics, _, _, _ in snapshot:
+                value = metrics.get(key)
+                if isinstance(value, (int, float)):
+                    samples.append((labels[stream_id], value * scale if scale != 1 else value))
+            family(name, metric_type, help_text, samples)
+
+        family("kazstreamlink_stream_up", "gauge", "1, если процесс FFmpeg потока работает.",
+               [(labels[sid], 1 if status in _RUNNING_STATUSES else 0) for sid, status, _, _, _, _ in snapshot])
+        family("kazstreamlink_stream_uptime_seconds", "gauge", "Время работы текущего процесса FFmpeg, сек.",
+               [(labels[sid], now - started_at) for sid, status, _, started_at, _, _ in snapshot
+                if started_at and status in _RUNNING_STATUSES])
+        family("kazstreamlink_stream_restarts", "counter", "Перезапуски процесса FFmpeg потока.",
+               [(labels[sid], restarts) for sid, _, _, _, restarts, _ in snapshot])
+
+        # Ошибки stderr по категориям классификатора (log_pipeline.py)
+        error_samples = []
+        for sid, _, metrics, _, _, _ in snapshot:
+            counts = metrics.get("ffmpeg_errors") or {}
+            error_samples.extend((f'{labels[sid][:-1]},category="{category}"}}', counts.get(category, 0)) for category in CATEGORIES)
+        family("kazstreamlink_stream_ffmpeg_errors", "counter", "Строки ошибок stderr FFmpeg по категориям.", error_samples)
+
+        # Выходы (ноги tee): метка output - порядковый номер выхода (0 - основной RTSP), без URL с ключами потоков
+        leg_samples = [(f'{labels[sid][:-1]},output="{i}"}}', leg) for sid, _, _, _, _, legs in snapshot for i, leg in enumerate(legs)]
+        family("kazstreamlink_output_up", "gauge", "1, если выход потока работает.",
+               [(label_text, 1 if leg["status"] == LEG_RUNNING else 0) for label_text, leg in leg_samples])
+        # Объем - только у выходов с точным счетчиком (outputs.py): остальные в семейство не попадают
+        family("kazstreamlink_output_bytes", "counter", "Байт отправлено на выход (выходы с точным счетчиком).",
+               [(label_text, leg["bytes"]) for label_text, leg in leg_samples if leg["bytes"] is not None])
+
+        # Зонды задержки (latency.py): квантили по окну; mode - timecode (от меток источника) или jitter (колебания)
+        latency_samples = []
+        for sid, _, metrics, _, _, _ in snapshot:
+            mode = metrics.get("latency_mode")
+            if mode in (MODE_TIMECODE, MODE_JITTER):
+                latency_samples.extend((f'{labels[sid][:-1]},mode="{mode}",quantile="{q}"}}', metrics[f"latency_p{round(q * 100)}_ms"] / 1000)
+                                       for q in LATENCY_QUANTILES)
+        if latency_samples:
+            family("kazstreamlink_stream_latency_seconds", "gauge",
+                   "Задержка выхода RTSP по данным зонда (квантили за окно KAZSTREAMLINK_LATENCY_WINDOW), сек.", latency_samples)
+
+        # Агрегаты по всему узлу
+        by_status = {}
+        for _, status, _, _, _, _ in snapshot:
+            by_status[status] = by_status.get(status, 0) + 1
+        family("kazstreamlink_streams", "gauge", "Количество потоков по статусам.",
+               [(f'{{status="{_escape_label(status)}"}}', count) for status, count in sorted(by_status.items())])
+        by_health = dict.fromkeys(HEALTH_STATES, 0)
+        for _, status, metrics, _, _, _ in snapshot:
+            if status in _RUNNING_STATUSES and metrics.get("health_state") in by_health:
+                by_health[metrics["health_state"]] += 1
+        family("kazstreamlink_streams_health", "gauge", "Работающие потоки по состоянию здоровья.",
+               [(f'{{state="{state}"}}', count) for state, count in by_health.items()])
+        for name, help_text, key, scale in (
+            ("kazstreamlink_fleet_bitrate_kbit", "Суммарный битрейт всех потоков, kbit/s.", "bitrate_kbit", 1),
+            ("kazstreamlink_fleet_cpu_percent", "Суммарная загрузка CPU процессами FFmpeg, %.", "cpu_percent", 1),
+            ("kazstreamlink_fleet_memory_bytes", "Суммарный RSS процессов FFmpeg, байт.", "memory_mb", _BYTES_PER_MB),
+        ):
+            total = sum(m[key] for _, _, m, _, _, _ in snapshot if isinstance(m.get(key), (int, float))) * scale
+            family(name, "gauge", help_text, [("", total)])
+        family("kazstreamlink_fleet_restarts", "counter", "Перезапуски FFmpeg по всем потокам.",
+               [("", sum(restarts for _, _, _, _, restarts, _ in snapshot))])
+        supervisor_stats = get_supervisor().stats()
+        family("kazstreamlink_restarts_in_flight", "gauge", "Перезапуски FFmpeg, ожидающие первого прогресса (ограничены на узел).",
+               [("", supervisor_stats["in_flight"])])
+        family("kazstreamlink_restarts_waiting", "gauge", "Перезапуски FFmpeg, ожидающие задержки или свободного слота.",
+               [("", supervisor_stats["scheduled"] + supervisor_stats["queued"])])
+        probe_stats = get_probe_cache().stats()
+        family("kazstreamlink_probe_cache_entries", "gauge", "Записей в кэше анализа входных потоков.", [("", probe_stats["entries"])])
+        for key, help_text in (("hits", "Запуски FFmpeg с составом потоков из кэша."),
+                               ("misses", "Запуски FFmpeg с полным анализом входа."),
+                               ("invalidations", "Сброшенные записи кэша анализа (несовпадение или сбой запуска).")):
+            family(f"kazstreamlink_probe_cache_{key}", "counter", help_text, [("", probe_stats[key])])
+        family("kazstreamlink_health_eval_seconds", "gauge", "Длительность последней оценки здоровья всего узла, сек.",
+               [("", get_health_engine().last_eval_seconds)])
+        capacity = get_capacity_model().report()
+        family("kazstreamlink_capacity_utilisation", "gauge",
+               "Загрузка узла по ресурсам: измеренная, прогноз модели емкости и предел допуска (доля емкости).",
+               [(f'{{resource="{resource}",kind="{kind}"}}', value)
+                for resource, values in capacity["utilisation"].items() for kind, value in values.items()])
+        family("kazstreamlink_admission_decisions", "counter", "Решения контроля допуска новых потоков.",
+               [(f'{{decision="{decision}"}}', count) for decision, count in capacity["decisions"].items()])
+        family("kazstreamlink_admission_waiting", "gauge", "Запросы, ожидающие емкости узла.", [("", capacity["waiting"])])
+        on_demand = self.manager.on_demand.report()
+        if on_demand["streams"]: # Потоки по запросу (ondemand.py)
+            histogram_family("kazstreamlink_ondemand_cold_start_seconds",
+                             "Холодный старт потока по запросу: от запроса зрителя до первого пакета, сек.",
+                             [("", self.manager.on_demand.cold_start_histogram)])
+            family("kazstreamlink_ondemand_readers", "gauge", "Зрители потоков по запросу (по сообщениям RTSP-сервера).",
+                   [(f'{{stream_id="{_escape_label(row["stream_id"])}"}}', row["readers"]) for row in on_demand["per_stream"]])
+            family("kazstreamlink_ondemand_idle_stops", "counter", "Остановки потоков по запросу после простоя без зрителей.",
+                   [("", sum(row["idle_stops"] for row in on_demand["per_stream"]))])
+            family("kazstreamlink_ondemand_saved_process_seconds", "counter",
+                   "Время, которое процессы FFmpeg потоков по запросу не работали (против круглосуточной работы), сек.",
+                   [("", on_demand["savings"]["process_seconds"])])
+        dedup = self.manager.dedup_report()
+        if dedup["sources"]: # Источники с общим процессом FFmpeg (dedup.py); URL источников в метки не попадают
+            family("kazstreamlink_dedup_streams", "gauge", "Потоки, подключенные к общему процессу источника.",
+                   [(f'{{ingest="{_escape_label(row["ingest"])}"}}', len(row["streams"])) for row in dedup["sources"]])
+            family("kazstreamlink_dedup_source_pulls_saved", "gauge",
+                   "Повторные подключения к источникам, которых удалось избежать (и процессы FFmpeg).",
+                   [("", dedup["saved"]["source_pulls"])])
+            family("kazstreamlink_dedup_saved_ingest_bytes", "counter",
+                   "Входящий трафик источников, который не пришлось тянуть повторно, байт.",
+                   [("", dedup["saved"]["ingest_bytes"])])
+        instrumentation = get_instrumentation()
+        if instrumentation.enabled: # KAZSTREAMLINK_INSTRUMENT=1 (profiling.py)
+            histogram_family("kazstreamlink_hotpath_seconds", "Длительность обработчиков горячего пути процесса, сек.",
+                             [(f'path="{_escape_label(path)}"', histogram) for path, histogram in sorted(instrumentation.histograms().items())])
+            family("kazstreamlink_hotpath_lines", "counter", "Строки, разобранные обработчиками сырых фрагментов каналов FFmpeg.",
+                   [(f'{{path="{_escape_label(key[:-len("_lines")])}"}}', count) for key, count in sorted(instrumentation.counters().items())])
+            lock_stats = sorted(instrumentation.lock_stats().items())
+            family("kazstreamlink_lock_acquisitions", "counter", "Захваты общих блокировок процесса.",
+                   [(f'{{lock="{name}"}}', acquisitions) for name, (acquisitions, _, _) in lock_stats])
+            family("kazstreamlink_lock_contended", "counter", "Захваты общих блокировок, которым пришлось ждать.",
+                   [(f'{{lock="{name}"}}', contended) for name, (_, contended, _) in lock_stats])
+            histogram_family("kazstreamlink_lock_wait_seconds", "Ожидание занятой блокировки, сек.",
+                             [(f'lock="{name}"', wait) for name, (_, _, wait) in lock_stats])
+            histogram_family("kazstreamlink_gil_wait_seconds", "Опоздание пробуждения потока-зонда (ожидание GIL), сек.",
+                             [("", instrumentation.gil_histogram())])
+            thread_cpu = {}
+            for row in instrumentation.thread_cpu(update_baseline=False):
+                thread_cpu[row["thread"]] = thread_cpu.get(row["thread"], 0.0) + row["cpu_seconds"]
+            family("kazstreamlink_thread_cpu_seconds", "counter", "Процессорное время потоков процесса KazStreamLink, сек.",
+                   [(f'{{thread="{_escape_label(name)}"}}', float(seconds)) for name, seconds in sorted(thread_cpu.items())])
+        family("kazstreamlink_log_records_dropped", "counter", "Записи логов, отброшенные из-за переполнения очереди логирования.",
+               [("", dropped_log_records())])
+        family("kazstreamlink_process_uptime_seconds", "gauge", "Время работы процесса KazStreamLink, сек.",
+               [("", now - _PROCESS_STARTED_AT)])
+        family("kazstreamlink_exporter_build_seconds", "gauge", "Длительность предыдущей сборки ответа /metrics, сек.",
+               [("", self.last_build_seconds)])
+
+        if openmetrics:
+            lines.append("# EOF")
+        self.last_build_seconds = time.perf_counter() - started
+        return ("\n".join(lines) + "\n").encode("utf-8")
+
+
+_default_exporter = None
+_default_exporter_lock = threading.Lock()
+
+def get_exporter():
+    """Возвращает общий для процесса экспортер метрик."""
+    global _default_exporter
+    with _default_exporter_lock:
+        if _default_exporter is None:
+            _default_exporter = MetricsExporter()
+        return _default_exporter
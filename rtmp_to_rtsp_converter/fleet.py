@@ -0,0 +1,85 @@
+import time
+
+# Снимок состояния всех потоков узла за один проход по реестру.
+# Его используют сводная таблица Streamlit и экспорт /metrics: вместо того чтобы каждый
+# читатель опрашивал каждый конвертер, менеджер собирает снимок не чаще раза за период
+# (ConverterManager.snapshot) и отдает один и тот же объект всем читателям.
+
+_RUNNING_STATUSES = ("запущен", "запускается")
+_NUMERIC = (int, float)
+
+# Колонки сводной таблицы: (заголовок, ключ строки или метрики)
+SUMMARY_COLUMNS = (
+    ("Поток", "stream_id"),
+    ("Статус", "status"),
+    ("Битрейт (kbit/s)", "bitrate_kbit"),
+    ("FPS", "fps"),
+    ("CPU (%)", "cpu_percent"),
+    ("Память (МБ)", "memory_mb"),
+    ("Скорость", "speed"),
+    ("Здоровье", "health_score"),
+    ("Автоперезапуски", "auto_restarts"),
+    ("До 1-го пакета (с)", "time_to_first_packet_s"),
+    ("Задержка p95 (мс)", "latency_p95_ms"),
+)
+
+
+class FleetSnapshot:
+    """Неизменяемый после сборки снимок: строки по потокам и агрегаты по узлу."""
+    __slots__ = ("built_at", "rows", "totals", "_table")
+
+    def __init__(self, rows):
+        self.built_at = time.time()
+        self.rows = rows # [{stream_id, status, metrics, started_at, restarts, outputs}]
+        self.totals = self._aggregate(rows)
+        self._table = None
+
+    @staticmethod
+    def _aggregate(rows):
+        by_status = {}
+        by_health = {}
+        totals = {"streams": len(rows), "running": 0, "bitrate_kbit": 0.0, "cpu_percent": 0.0, "memory_mb": 0.0}
+        for row in rows:
+            status = row["status"]
+            by_status[status] = by_status.get(status, 0) + 1
+            if status in _RUNNING_STATUSES:
+                totals["running"] += 1
+            metrics = row["metrics"]
+            health = metrics.get("health_state")
+            if health and status in _RUNNING_STATUSES:
+                by_health[health] = by_health.get(health, 0) + 1
+            for key in ("bitrate_kbit", "cpu_percent", "memory_mb"):
+                value = metrics.get(key)
+                if isinstance(value, _NUMERIC):
+                    totals[key] += value
+        totals["by_status"] = by_status
+        totals["by_health"] = by_health
+        return totals
+
+    def table(self):
+        """Сводная таблица по колонкам {заголовок: [значения]} (собирается один раз на снимок)."""
+        if self._table is None:
+            table = {title: [] for title, _ in SUMMARY_COLUMNS}
+            for row in self.rows:
+                metrics = row["metrics"]
+                for title, key in SUMMARY_COLUMNS:
+                    value = row[key] if key in row else metrics.get(key)
+                    # "N/A" и None - пустые ячейки, чтобы колонка оставалась числовой
+                    table[title].append(value if isinstance(value, (str, *_NUMERIC)) and value != "N/A" else None)
+            self._table = table
+        return self._table
+
+
+def build_fleet_snapshot(converters):
+    """Один проход по конвертерам."""
+    rows = []
+    for converter in converters:
+        rows.append({
+            "stream_id": converter.stream_id,
+            "status": converter.status,
+            "metrics": converter.get_metrics(),
+            "started_at": converter.started_at,
+            "restarts": max(converter.start_count - 1, 0),
+            "outputs": converter.get_output_legs(),
+        })
+    return FleetSnapshot(rows)
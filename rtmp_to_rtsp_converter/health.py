@@ -0,0 +1,298 @@
+import os
+import math
+import time
+import threading
+
+import numpy as np
+
+from rtmp_to_rtsp_converter.sampler import METRICS_PERIOD_SEC, get_sampler
+from rtmp_to_rtsp_converter.profiling import get_instrumentation
+
+# Оценка здоровья потоков по данным -progress.
+#
+# Статус конвертера берется из process.poll(), поэтому живой, но зависший FFmpeg (out_time не растет,
+# speed < 1.0x) оставался "запущен" бесконечно. Движок здоровья хранит короткую историю показателей
+# всех потоков узла в общих массивах NumPy (строка - поток, колонка - тик сборщика метрик, кольцевой
+# буфер) и после каждого прохода сборщика (SystemMetricsSampler) оценивает весь узел одним
+# векторным проходом, без цикла Python по потокам:
+#   * STALLED  - out_time не меняется stall_sec секунд (все замеры окна есть);
+#   * SLOW     - средняя скорость за slow_sec ниже slow_speed (медленнее реального времени);
+#   * DROPS    - FFmpeg отбрасывает больше max_drop_rate кадров в секунду;
+#   * COLLAPSE - отправка байт за collapse_sec упала ниже collapse_ratio от средней за baseline_sec до этого.
+#                Байты - total_size из -progress (или bitrate * out_time, если FFmpeg выдал только битрейт);
+#                без них правило к потоку не применяется.
+# Каждое правило снимает часть из 100 баллов (HEALTH_PENALTIES); состояние - ok, degraded, stalled
+# или unknown (прогресса еще нет, например у принятого процесса). Поток, зависший дольше
+# restart_after_sec, перезапускается (KAZSTREAMLINK_HEALTH_RESTART=1): процесс завершается,
+# а новый запуск выполняет супервизор с обычным backoff.
+
+HEALTH_ENABLED = os.environ.get("KAZSTREAMLINK_HEALTH", "1") != "0"
+HEALTH_RESTART = os.environ.get("KAZSTREAMLINK_HEALTH_RESTART", "1") != "0"
+STALL_SEC = float(os.environ.get("KAZSTREAMLINK_HEALTH_STALL", "5")) # Секунд без роста out_time до "stalled"
+RESTART_AFTER_SEC = float(os.environ.get("KAZSTREAMLINK_HEALTH_RESTART_AFTER", "20")) # Секунд в "stalled" до перезапуска
+
+STALLED, SLOW, DROPS, COLLAPSE = 1, 2, 4, 8
+HEALTH_REASONS = {
+    STALLED: "out_time не растет",
+    SLOW: "скорость ниже реального времени",
+    DROPS: "всплеск отброшенных кадров",
+    COLLAPSE: "битрейт упал",
+}
+HEALTH_PENALTIES = {STALLED: 100, SLOW: 30, DROPS: 25, COLLAPSE: 40}
+
+HEALTH_UNKNOWN, HEALTH_OK, HEALTH_DEGRADED, HEALTH_STALLED = "unknown", "ok", "degraded", "stalled"
+HEALTH_STATES = (HEALTH_UNKNOWN, HEALTH_OK, HEALTH_DEGRADED, HEALTH_STALLED) # Индекс - код состояния в массиве
+
+
+class HealthRules:
+    """Пороги правил здоровья (одни на узел)."""
+
+    def __init__(self, stall_sec=STALL_SEC, slow_speed=0.9, slow_sec=15.0, max_drop_rate=5.0, drop_sec=5.0,
+                 collapse_ratio=0.25, collapse_sec=5.0, baseline_sec=30.0, min_baseline_kbit=16.0,
+                 restart_after_sec=RESTART_AFTER_SEC, restart=HEALTH_RESTART):
+        self.stall_sec = stall_sec
+        self.slow_speed = slow_speed
+        self.slow_sec = slow_sec
+        self.max_drop_rate = max_drop_rate
+        self.drop_sec = drop_sec
+        self.collapse_ratio = collapse_ratio
+        self.collapse_sec = collapse_sec
+        self.baseline_sec = baseline_sec
+        self.min_baseline_kbit = min_baseline_kbit
+        self.restart_after_sec = restart_after_sec
+        self.restart = restart
+
+
+def _to_float(value):
+    return float(value) if isinstance(value, (int, float)) else math.nan
+
+
+def sent_bytes(metrics):
+    """Отправлено байт по -progress: total_size или средний битрейт на out_time; NaN, если данных нет."""
+    total_size = metrics.get("total_size")
+    if isinstance(total_size, (int, float)) and total_size >= 0:
+        return float(total_size)
+    bitrate, out_time = metrics.get("bitrate_kbit"), metrics.get("out_time_us")
+    if isinstance(bitrate, (int, float)) and bitrate >= 0 and isinstance(out_time, (int, float)):
+        return bitrate * 125 * out_time / 1e6 # bitrate в -progress - среднее с начала вывода
+    return math.nan
+
+
+class HealthEngine:
+    def __init__(self, rules=None, period=METRICS_PERIOD_SEC, capacity=64):
+        self.rules = rules or HealthRules()
+        self.period = period
+        r = self.rules
+        self._k_stall = self._samples(r.stall_sec)
+        self._k_slow = self._samples(r.slow_sec)
+        self._k_drop = self._samples(r.drop_sec)
+        self._k_collapse = self._samples(r.collapse_sec)
+        self._k_baseline = self._samples(r.baseline_sec)
+        # Окно истории: самому длинному правилу нужны k + 1 замеров (разности счетчиков)
+        self.window = max(self._k_stall, self._k_slow, self._k_drop, self._k_collapse + self._k_baseline) + 1
+        self._lock = get_instrumentation().lock("health")
+        self._rows = {} # {converter: строка}
+        self._converters = [] # строка -> converter или None
+        self._free = []
+        self._cursor = 0 # Колонка текущего тика
+        self._allocate(capacity)
+        self.last_eval_seconds = 0.0
+        self.unhealthy_restarts = 0
+
+    def _samples(self, seconds):
+        return max(1, int(round(seconds / self.period)))
+
+    def _allocate(self, capacity):
+        """Создает (или расширяет с копированием) массивы на capacity потоков."""
+        def grow(old, fill, dtype, shape):
+            new = np.full(shape, fill, dtype=dtype)
+            if old is not None:
+                new[:len(old)] = old
+            return new
+        old_capacity = len(self._converters)
+        w = self.window
+        get = lambda name: getattr(self, name, None) if old_capacity else None
+        self._out_time = grow(get("_out_time"), np.nan, np.float64, (capacity, w)) # мкс, float32 не хватает точности
+        self._speed = grow(get("_speed"), np.nan, np.float32, (capacity, w))
+        self._drops = grow(get("_drops"), np.nan, np.float64, (capacity, w))
+        self._bytes = grow(get("_bytes"), np.nan, np.float64, (capacity, w))
+        self._active = grow(get("_active"), False, np.bool_, (capacity,))
+        self._stalled_since = grow(get("_stalled_since"), np.nan, np.float64, (capacity,))
+        self.score = grow(get("score"), np.nan, np.float32, (capacity,))
+        self.flags = grow(get("flags"), 0, np.uint8, (capacity,))
+        self.state = grow(get("state"), 0, np.uint8, (capacity,))
+        self._free.extend(range(capacity - 1, old_capacity - 1, -1))
+        self._converters.extend([None] * (capacity - old_capacity))
+
+    # --- Регистрация и запись (запись - из цикла ввода-вывода, по строке на поток) ---
+
+    def register(self, converter):
+        with self._lock:
+            if converter in self._rows:
+                row = self._rows[converter]
+            else:
+                if not self._free:
+                    self._allocate(len(self._converters) * 2)
+                row = self._free.pop()
+                self._rows[converter] = row
+                self._converters[row] = converter
+            self._reset_row(row)
+            self._active[row] = True
+
+    def unregister(self, converter):
+        with self._lock:
+            row = self._rows.pop(converter, None)
+            if row is None:
+                return
+            self._reset_row(row)
+            self._active[row] = False
+            self._converters[row] = None
+            self._free.append(row)
+
+    def _reset_row(self, row):
+        for array in (self._out_time, self._speed, self._drops, self._bytes):
+            array[row] = np.nan
+        self._stalled_since[row] = np.nan
+        self.score[row] = np.nan
+        self.flags[row] = 0
+        self.state[row] = 0
+
+    def record(self, converter, metrics):
+        """Замер потока за текущий тик (вызывается из _publish_system_metrics конвертера)."""
+        out_time = _to_float(metrics.get("out_time_us"))
+        speed = _to_float(metrics.get("speed"))
+        drops = _to_float(metrics.get("dropped_frames"))
+        sent = sent_bytes(metrics)
+        # Под блокировкой: register() из других потоков может заменить массивы при расширении
+        with self._lock:
+            row = self._rows.get(converter)
+            if row is None:
+                return
+            column = self._cursor
+            self._out_time[row, column] = out_time
+            self._speed[row, column] = speed
+            self._drops[row, column] = drops
+            self._bytes[row, column] = sent
+
+    # --- Оценка всего узла ---
+
+    def _last(self, array, count, offset=0):
+        """Последние count колонок (от новых к старым), начиная offset тиков назад."""
+        columns = (self._cursor - offset - np.arange(count)) % self.window
+        return array[:, columns]
+
+    def evaluate(self, _sample_time=None):
+        """Один векторный проход по всем потокам; вызывается после каждого прохода сборщика метрик."""
+        started = time.perf_counter()
+        r = self.rules
+        p = self.period
+        now = time.monotonic()
+        to_restart = []
+        with self._lock:
+            active = self._active
+            with np.errstate(invalid="ignore", divide="ignore"):
+                # Зависание: все замеры окна есть, и out_time не изменился
+                out_time = self._last(self._out_time, self._k_stall + 1)
+                stalled = active & (out_time.max(axis=1) - out_time.min(axis=1) == 0)
+
+                speed = self._last(self._speed, self._k_slow)
+                speed_count = np.count_nonzero(~np.isnan(speed), axis=1)
+                mean_speed = np.nansum(speed, axis=1) / speed_count
+                slow = active & (speed_count * 2 >= self._k_slow) & (mean_speed < r.slow_speed)
+
+                drops = self._last(self._drops, self._k_drop + 1)
+                drop_rate = (drops[:, 0] - drops[:, -1]) / (self._k_drop * p)
+                drop_spike = active & (drop_rate > r.max_drop_rate)
+
+                sent = self._last(self._bytes, self._k_collapse + self._k_baseline + 1)
+                recent_kbit = (sent[:, 0] - sent[:, self._k_collapse]) * 8 / 1000 / (self._k_collapse * p)
+                baseline_kbit = (sent[:, self._k_collapse] - sent[:, -1]) * 8 / 1000 / (self._k_baseline * p)
+                collapse = active & (baseline_kbit >= r.min_baseline_kbit) & (recent_kbit < r.collapse_ratio * baseline_kbit)
+
+            flags = (stalled * STALLED) | (slow * SLOW) | (drop_spike * DROPS) | (collapse * COLLAPSE)
+            penalty = np.zeros(len(flags), dtype=np.float32)
+            for flag, value in HEALTH_PENALTIES.items():
+                penalty += ((flags & flag) != 0) * value
+            has_progress = ~np.isnan(self._out_time).all(axis=1)
+            self.flags = flags.astype(np.uint8)
+            self.score = np.where(active & has_progress, np.clip(100 - penalty, 0, 100), np.nan).astype(np.float32)
+            self.state = np.select(
+                [~active | ~has_progress, stalled, flags != 0], [0, 3, 2], default=1
+            ).astype(np.uint8)
+
+            # Время начала зависания; перезапуск - только для потоков, зависших дольше restart_after_sec
+            self._stalled_since = np.where(stalled, np.where(np.isnan(self._stalled_since), now, self._stalled_since), np.nan)
+            if r.restart:
+                for row in np.flatnonzero(stalled & (now - self._stalled_since >= r.restart_after_sec)):
+                    self._stalled_since[row] = np.nan
+                    to_restart.append(self._converters[row])
+
+            # Следующий тик пишет в следующую колонку; ее старые значения вытесняются
+            self._cursor = (self._cursor + 1) % self.window
+            for array in (self._out_time, self._speed, self._drops, self._bytes):
+                array[:, self._cursor] = np.nan
+        for converter in to_restart:
+            if converter is not None:
+                self.unhealthy_restarts += 1
+                converter._restart_unhealthy(self.describe(flags=STALLED))
+        self.last_eval_seconds = time.perf_counter() - started
+
+    # --- Чтение ---
+
+    def describe(self, flags):
+        return [reason for flag, reason in HEALTH_REASONS.items() if flags & flag]
+
+    def health(self, converter):
+        """{"health_score", "health_state", "health_reasons"} потока по последней оценке."""
+        row = self._rows.get(converter)
+        if row is None:
+            return {"health_score": "N/A", "health_state": HEALTH_UNKNOWN, "health_reasons": []}
+        score = float(self.score[row])
+        return {
+            "health_score": "N/A" if math.isnan(score) else round(score),
+            "health_state": HEALTH_STATES[self.state[row]],
+            "health_reasons": self.describe(int(self.flags[row])),
+        }
+
+    def counts_by_state(self):
+        with self._lock:
+            codes = self.state[self._active]
+        return {state: int(np.count_nonzero(codes == code)) for code, state in enumerate(HEALTH_STATES)}
+
+
+class _DisabledHealthEngine:
+    """Заглушка при KAZSTREAMLINK_HEALTH=0: интерфейс тот же, оценка не выполняется."""
+    last_eval_seconds = 0.0
+    unhealthy_restarts = 0
+
+    def register(self, converter):
+        pass
+
+    def unregister(self, converter):
+        pass
+
+    def record(self, converter, metrics):
+        pass
+
+    def health(self, converter):
+        return {"health_score": "N/A", "health_state": HEALTH_UNKNOWN, "health_reasons": []}
+
+    def counts_by_state(self):
+        return {}
+
+
+_default_engine = None
+_default_engine_lock = threading.Lock()
+
+def get_health_engine():
+    """Возвращает общий для процесса движок здоровья (оценка идет после каждого прохода сборщика метрик)."""
+    global _default_engine
+    with _default_engine_lock:
+        if _default_engine is None:
+            if HEALTH_ENABLED:
+                sampler = get_sampler()
+                _default_engine = HealthEngine(period=sampler.period)
+                sampler.add_pass_listener(_default_engine.evaluate)
+            else:
+                _default_engine = _DisabledHealthEngine()
+        return _default_engine
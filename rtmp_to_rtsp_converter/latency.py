@@ -0,0 +1,531 @@
+import os
+import time
+import socket
+import struct
+import logging
+import threading
+from collections import deque
+from urllib.parse import urljoin, urlsplit
+
+from rtmp_to_rtsp_converter.reactor import get_reactor
+from rtmp_to_rtsp_converter.profiling import get_instrumentation
+from rtmp_to_rtsp_converter.state import STATUS_RUNNING
+
+# Зонд задержки: легкий читатель RTSP, который тянет опубликованный путь потока, как зритель.
+#
+# -progress дает только out_time и speed - позицию мультиплексора FFmpeg, а не то, насколько выход RTSP
+# отстает от источника. Зонд подключается к final_rtsp_url_for_client (DESCRIBE/SETUP/PLAY, RTP через TCP
+# interleaved - без отдельных портов UDP), отдает сокет общему циклу ввода-вывода и для каждого кадра
+# видео считает задержку одним из двух способов:
+#   timecode - источник вставляет в поток метки времени (SEI user_data_unregistered с TIMECODE_UUID
+#              и временем кадра в мкс Unix time, см. timecode_sei). Задержка - время прихода кадра
+#              к зонду минус метка: полный путь "источник -> RTMP -> FFmpeg -> RTSP-сервер -> зритель".
+#              Часы источника и узла должны совпадать (один хост или NTP/PTP); FFmpeg с -c copy
+#              пропускает SEI без изменений;
+#   jitter   - меток нет (обычная камера): время прихода кадра минус его время RTP, за вычетом минимума
+#              по окну. Абсолютную задержку так не измерить, это колебания - очереди и повторы сверх
+#              лучшего кадра окна.
+# Квантили p50/p95/p99 считаются по окну KAZSTREAMLINK_LATENCY_WINDOW секунд и попадают в метрики потока
+# (get_metrics: latency_*), в /metrics и в GET /latency.
+#
+# Зонды включаются для всех потоков (KAZSTREAMLINK_LATENCY_PROBE=1) или для отдельных через
+# POST /streams/{id}/latency; выбор через API не сохраняется в реестре. Монитор на таймере цикла
+# подключает зонды к работающим потокам и отключает от остановленных; неудачное подключение
+# (путь еще не опубликован, сервер недоступен) повторяется через KAZSTREAMLINK_LATENCY_RETRY секунд.
+# Зонд - еще один зритель пути: RTSP-сервер отправляет ему поток целиком (битрейт потока на узел).
+
+LATENCY_PROBE_ALL = os.environ.get("KAZSTREAMLINK_LATENCY_PROBE", "0") == "1" # Зонды для всех потоков
+LATENCY_WINDOW_SEC = float(os.environ.get("KAZSTREAMLINK_LATENCY_WINDOW", "60")) # Окно квантилей
+LATENCY_RETRY_SEC = float(os.environ.get("KAZSTREAMLINK_LATENCY_RETRY", "5")) # Пауза перед повторным подключением
+LATENCY_CONNECT_TIMEOUT_SEC = 5.0
+LATENCY_KEEPALIVE_SEC = 20.0 # OPTIONS в сессии, чтобы сервер не закрыл ее по таймауту
+LATENCY_CHECK_PERIOD_SEC = 1.0
+LATENCY_QUANTILES = (0.5, 0.95, 0.99)
+RTP_JUMP_SEC = 10.0 # Скачок времени RTP между пакетами больше этого - смена публикации, а не задержка
+
+# Идентификатор меток времени KazStreamLink в SEI user_data_unregistered (16 байт)
+TIMECODE_UUID = b"KazStreamLink-TC"
+SEI_USER_DATA_UNREGISTERED = 5
+
+PROBE_IDLE = "idle" # Поток не работает
+PROBE_CONNECTING = "connecting"
+PROBE_PLAYING = "playing"
+PROBE_ERROR = "error" # Последнее подключение не удалось или оборвалось, ждет повтора
+
+MODE_TIMECODE = "timecode"
+MODE_JITTER = "jitter"
+
+
+def _escape_emulation(rbsp):
+    """RBSP -> байты NAL: 0x03 перед 0x00-0x03 после двух нулевых байт."""
+    escaped = bytearray()
+    zeros = 0
+    for byte in rbsp:
+        if zeros >= 2 and byte <= 3:
+            escaped.append(3)
+            zeros = 0
+        escaped.append(byte)
+        zeros = zeros + 1 if byte == 0 else 0
+    return bytes(escaped)
+
+
+def timecode_sei(wall_time=None, hevc=False):
+    """NAL SEI с меткой времени кадра (по умолчанию - текущее время) для тестового источника.
+
+    Вставляется перед кадром: в H.264 - NAL типа 6, в H.265 (hevc=True) - PREFIX_SEI (39).
+    """
+    micros = int((time.time() if wall_time is None else wall_time) * 1_000_000)
+    payload = TIMECODE_UUID + struct.pack("!Q", micros)
+    rbsp = _escape_emulation(bytes((SEI_USER_DATA_UNREGISTERED, len(payload))) + payload + b"\x80")
+    return (b"\x4e\x01" if hevc else b"\x06") + rbsp
+
+
+def parse_timecode(nal, header_size=1):
+    """Метка времени (секунды Unix time) из NAL SEI или None, если меток KazStreamLink в нем нет."""
+    rbsp = bytes(nal[header_size:]).replace(b"\x00\x00\x03", b"\x00\x00")
+    position = 0
+    while position < len(rbsp) and rbsp[position] != 0x80: # 0x80 - конец RBSP
+        values = []
+        for _ in range(2): # Тип и размер сообщения: 0xFF означает "+255 и следующий байт"
+            value = 0
+            while position < len(rbsp) and rbsp[position] == 0xFF:
+                value += 255
+                position += 1
+            if position >= len(rbsp):
+                return None
+            values.append(value + rbsp[position])
+            position += 1
+        payload_type, size = values
+        payload = rbsp[position:position + size]
+        if payload_type == SEI_USER_DATA_UNREGISTERED and len(payload) >= 24 and payload[:16] == TIMECODE_UUID:
+            return struct.unpack("!Q", payload[16:24])[0] / 1_000_000
+        position += size
+    return None
+
+
+def _sei_units(payload, hevc):
+    """NAL SEI в полезной нагрузке RTP: одиночный NAL или агрегирующий пакет (STAP-A / AP).
+
+    Фрагменты (FU-A / FU) не собираются: SEI с меткой занимает несколько десятков байт и не фрагментируется.
+    """
+    if hevc:
+        header, sei_types, aggregate = 2, (39, 40), 48
+        nal_type = (payload[0] >> 1) & 0x3F
+        type_of = lambda unit: (unit[0] >> 1) & 0x3F
+    else:
+        header, sei_types, aggregate = 1, (6,), 24
+        nal_type = payload[0] & 0x1F
+        type_of = lambda unit: unit[0] & 0x1F
+    if nal_type in sei_types:
+        return [payload]
+    if nal_type != aggregate:
+        return []
+    units = []
+    position = header
+    while position + 2 <= len(payload):
+        size = struct.unpack_from("!H", payload, position)[0]
+        unit = payload[position + 2:position + 2 + size]
+        if unit and type_of(unit) in sei_types:
+            units.append(unit)
+        position += 2 + size
+    return units
+
+
+def _percentile(ordered, q):
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+def _parse_sdp(sdp, base_url):
+    """(URL дорожки видео для SETUP, тип нагрузки RTP, частота часов RTP, кодек) из описания потока."""
+    media = payload_type = control = None
+    codec, clock_rate = "", 90000
+    for line in sdp.splitlines():
+        line = line.strip()
+        if line.startswith("m="):
+            if media == "video":
+                break
+            fields = line[2:].split()
+            media = fields[0]
+            payload_type = int(fields[3]) if len(fields) > 3 and fields[3].isdigit() else None
+            control = None
+        elif media == "video" and line.startswith("a=rtpmap:"):
+            number, _, encoding = line[len("a=rtpmap:"):].partition(" ")
+            if number.isdigit() and int(number) == payload_type:
+                codec, _, rate = encoding.partition("/")
+                clock_rate = int(rate.split("/")[0]) if rate.split("/")[0].isdigit() else clock_rate
+        elif media == "video" and line.startswith("a=control:"):
+            control = line[len("a=control:"):]
+    if media != "video":
+        raise ValueError("В описании потока (SDP) нет видео.")
+    if not control or control == "*":
+        track_url = base_url
+    elif control.lower().startswith("rtsp://"):
+        track_url = control
+    else:
+        track_url = urljoin(base_url.rstrip("/") + "/", control)
+    return track_url, payload_type, clock_rate, codec.upper()
+
+
+class LatencyProbe:
+    """Читатель RTSP одного потока: задержка кадров по меткам источника или ее колебания."""
+
+    def __init__(self, stream_id, url, window_sec=LATENCY_WINDOW_SEC, retry_sec=LATENCY_RETRY_SEC):
+        self.stream_id = stream_id
+        self.url = url
+        self.window_sec = window_sec
+        self.retry_sec = retry_sec
+        self.state = PROBE_IDLE
+        self.error = None
+        self.connects = 0
+        self.packets = 0
+        self.frames = 0
+        self.timecodes = 0 # Кадров с меткой источника за все время
+        self.codec = None
+        self._reactor = get_reactor()
+        # (time.monotonic() прихода, значение, с): задержки по меткам и "прибытие - время RTP" по кадрам.
+        # Пишет только цикл ввода-вывода; читатели копируют deque через list() (копирование идет под GIL целиком)
+        self._timecoded = deque()
+        self._transits = deque()
+        self._retry_at = 0.0
+        self._generation = 0 # Номер подключения: поток подключения, опоздавший к disconnect(), свой сокет закрывает
+        self._sock = None
+        self._keepalive = None
+        self._session = None
+        self._cseq = 0
+        self._buffer = bytearray()
+        self._payload_type = None
+        self._clock_rate = 90000
+        self._hevc = False
+        self._last_rtp = None
+        self._rtp_time = 0 # Время RTP с учетом переполнения 32 бит
+
+    # --- Подключение (вызывает LatencyMonitor в цикле ввода-вывода) ---
+
+    def ensure_connected(self, now):
+        if self.state in (PROBE_CONNECTING, PROBE_PLAYING) or now < self._retry_at:
+            return
+        self.state = PROBE_CONNECTING
+        self._generation += 1
+        threading.Thread(target=self._connect, args=(self._generation,), daemon=True,
+                         name=f"latency_probe_{self.stream_id}").start()
+
+    def disconnect(self):
+        """Отключает зонд (поток остановлен или зонд выключен); накопленное окно остается до нового подключения."""
+        self._generation += 1
+        self._retry_at = 0.0
+        self.state = PROBE_IDLE
+        sock, self._sock = self._sock, None
+        if self._keepalive:
+            self._keepalive.cancel()
+            self._keepalive = None
+        if sock is not None:
+            try: # EOF закроет сокет и снимет его с регистрации в цикле ввода-вывода
+                sock.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+
+    def _connect(self, generation):
+        try:
+            sock, leftover = self._handshake()
+        except (OSError, ValueError) as e:
+            self._reactor.call_soon(self._on_connect_failed, generation, str(e))
+            return
+        self._reactor.call_soon(self._on_connected, generation, sock, leftover)
+
+    def _on_connect_failed(self, generation, error):
+        if generation != self._generation:
+            return
+        if self.error != error:
+            logging.warning(f"Зонд задержки {self.stream_id} не подключился к {self.url}: {error}")
+        self.state = PROBE_ERROR
+        self.error = error
+        self._retry_at = time.monotonic() + self.retry_sec
+
+    def _on_connected(self, generation, sock, leftover):
+        if generation != self._generation: # Поток остановили, пока шло подключение
+            sock.close()
+            return
+        logging.info(f"Зонд задержки {self.stream_id} читает {self.url} ({self.codec}).")
+        self.state = PROBE_PLAYING
+        self.error = None
+        self.connects += 1
+        self._sock = sock
+        self._buffer.clear()
+        self._reset_rtp_clock()
+        self._on_chunk(leftover)
+        self._reactor.add_pipe(sock, self._on_chunk, lambda: self._on_closed(generation), raw=True)
+        self._keepalive = self._reactor.call_every(LATENCY_KEEPALIVE_SEC, lambda: self._send_keepalive(sock))
+
+    def _on_closed(self, generation):
+        if generation != self._generation:
+            return
+        self._sock = None
+        if self._keepalive:
+            self._keepalive.cancel()
+            self._keepalive = None
+        self.state = PROBE_ERROR
+        self.error = "RTSP-сервер закрыл соединение."
+        self._retry_at = time.monotonic() + self.retry_sec
+
+    def _send_keepalive(self, sock):
+        if sock is not self._sock:
+            return
+        try:
+            sock.send(self._request_bytes("OPTIONS", self.url))
+        except OSError: # Буфер отправки занят или соединение рвется - EOF обработает _on_closed
+            pass
+
+    # --- RTSP ---
+
+    def _request_bytes(self, method, url, headers=()):
+        self._cseq += 1
+        lines = [f"{method} {url} RTSP/1.0", f"CSeq: {self._cseq}", "User-Agent: KazStreamLink latency probe", *headers]
+        if self._session:
+            lines.append(f"Session: {self._session}")
+        return ("\r\n".join(lines) + "\r\n\r\n").encode()
+
+    def _request(self, sock, buffer, method, url, headers=()):
+        """Отправляет запрос и читает ответ; возвращает (заголовки, тело), остаток данных остается в buffer."""
+        sock.sendall(self._request_bytes(method, url, headers))
+        while b"\r\n\r\n" not in buffer:
+            chunk = sock.recv(65536)
+            if not chunk:
+                raise ConnectionResetError("RTSP-сервер закрыл соединение.")
+            buffer += chunk
+        end = buffer.index(b"\r\n\r\n") + 4
+        head = buffer[:end].decode(errors="replace").split("\r\n")
+        headers = {name.strip().lower(): value.strip() for name, _, value in (line.partition(":") for line in head[1:] if line)}
+        length = int(headers.get("content-length", "0") or 0)
+        while len(buffer) < end + length:
+            chunk = sock.recv(65536)
+            if not chunk:
+                raise ConnectionResetError("RTSP-сервер закрыл соединение.")
+            buffer += chunk
+        body = bytes(buffer[end:end + length])
+        del buffer[:end + length]
+        status = head[0].split(" ", 2)
+        if len(status) < 2 or status[1] != "200":
+            raise ConnectionRefusedError(f"{method}: {head[0]}")
+        return headers, body
+
+    def _handshake(self):
+        parts = urlsplit(self.url)
+        sock = socket.create_connection((parts.hostname, parts.port or 554), timeout=LATENCY_CONNECT_TIMEOUT_SEC)
+        try:
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            buffer = bytearray()
+            self._session = None
+            headers, body = self._request(sock, buffer, "DESCRIBE", self.url, ["Accept: application/sdp"])
+            base_url = headers.get("content-base") or headers.get("content-location") or self.url
+            track_url, self._payload_type, self._clock_rate, self.codec = _parse_sdp(body.decode(errors="replace"), base_url)
+            self._hevc = self.codec in ("H265", "HEVC")
+            headers, _ = self._request(sock, buffer, "SETUP", track_url, ["Transport: RTP/AVP/TCP;unicast;interleaved=0-1"])
+            self._session = headers.get("session", "").split(";")[0] or None
+            self._request(sock, buffer, "PLAY", base_url, ["Range: npt=0.000-"])
+        except BaseException:
+            sock.close()
+            raise
+        return sock, bytes(buffer)
+
+    # --- Разбор потока (цикл ввода-вывода) ---
+
+    def _on_chunk(self, chunk):
+        if not chunk:
+            return
+        arrival = time.time()
+        now = time.monotonic()
+        buffer = self._buffer
+        buffer += chunk
+        position = 0
+        while position < len(buffer):
+            if buffer[position] == 0x24: # '$', канал, длина - пакет RTP/RTCP interleaved
+                if position + 4 > len(buffer):
+                    break
+                channel, length = buffer[position + 1], struct.unpack_from("!H", buffer, position + 2)[0]
+                if position + 4 + length > len(buffer):
+                    break
+                if channel == 0:
+                    self._on_rtp(memoryview(buffer)[position + 4:position + 4 + length], arrival, now)
+                position += 4 + length
+                continue
+            end = buffer.find(b"\r\n\r\n", position) # Ответ на OPTIONS (keepalive) или запрос сервера
+            if end < 0:
+                break
+            head = buffer[position:end].decode(errors="replace").lower()
+            length = 0
+            for line in head.split("\r\n"):
+                name, _, value = line.partition(":")
+                if name.strip() == "content-length" and value.strip().isdigit():
+                    length = int(value)
+            if end + 4 + length > len(buffer):
+                break
+            position = end + 4 + length
+        del buffer[:position]
+
+    def _on_rtp(self, packet, arrival, now):
+        if len(packet) < 12 or packet[0] >> 6 != 2:
+            return
+        if self._payload_type is not None and packet[1] & 0x7F != self._payload_type:
+            return
+        self.packets += 1
+        offset = 12 + 4 * (packet[0] & 0x0F) # CSRC
+        if packet[0] & 0x10 and len(packet) >= offset + 4: # Расширение заголовка
+            offset += 4 + 4 * struct.unpack_from("!H", packet, offset + 2)[0]
+        end = len(packet) - (packet[-1] if packet[0] & 0x20 else 0) # Выравнивание
+        payload = packet[offset:end]
+        if len(payload) < 2:
+            return
+        for unit in _sei_units(payload, self._hevc):
+            timecode = parse_timecode(unit, 2 if self._hevc else 1)
+            if timecode is not None:
+                self.timecodes += 1
+                self._append(self._timecoded, now, arrival - timecode)
+        timestamp = struct.unpack_from("!I", packet, 4)[0]
+        if self._last_rtp is not None:
+            step = (timestamp - self._last_rtp + 0x80000000) % 0x100000000 - 0x80000000
+            if abs(step) > RTP_JUMP_SEC * self._clock_rate: # Новая публикация пути: другая база времени RTP
+                self._reset_rtp_clock()
+            else:
+                self._rtp_time += step
+        self._last_rtp = timestamp
+        if packet[1] & 0x80: # Маркер - последний пакет кадра
+            self.frames += 1
+            self._append(self._transits, now, now - self._rtp_time / self._clock_rate)
+
+    def _reset_rtp_clock(self):
+        """Новая база времени RTP: колебания считаются заново (задержки по меткам от нее не зависят)."""
+        self._last_rtp = None
+        self._rtp_time = 0
+        self._transits.clear()
+
+    def _append(self, samples, now, value):
+        samples.append((now, value))
+        horizon = now - self.window_sec
+        while samples[0][0] < horizon:
+            samples.popleft()
+
+    # --- Чтение из других потоков ---
+
+    def _window(self, samples, now):
+        horizon = now - self.window_sec
+        return [value for at, value in list(samples) if at >= horizon]
+
+    def latency(self):
+        """(режим, задержки окна в секундах) или (None, []), если кадров еще не было."""
+        now = time.monotonic()
+        timecoded = self._window(self._timecoded, now)
+        if timecoded:
+            return MODE_TIMECODE, timecoded
+        transits = self._window(self._transits, now)
+        if len(transits) < 2:
+            return None, []
+        base = min(transits)
+        return MODE_JITTER, [transit - base for transit in transits]
+
+    def metrics(self):
+        """Поля latency_* для метрик потока (RTMPToRTSPConverter.get_metrics)."""
+        mode, values = self.latency()
+        metrics = {"latency_probe": self.state, "latency_mode": mode or "N/A", "latency_samples": len(values)}
+        ordered = sorted(values)
+        for q in LATENCY_QUANTILES:
+            metrics[f"latency_p{round(q * 100)}_ms"] = round(_percentile(ordered, q) * 1000, 1) if ordered else "N/A"
+        return metrics
+
+    def as_dict(self):
+        return {
+            "stream_id": self.stream_id,
+            "url": self.url,
+            "codec": self.codec,
+            "state": self.state,
+            "error": self.error,
+            "connects": self.connects,
+            "packets": self.packets,
+            "frames": self.frames,
+            "timecodes": self.timecodes,
+            **self.metrics(),
+        }
+
+
+class LatencyMonitor:
+    """Зонды задержки потоков менеджера: подключение к работающим потокам и отключение от остановленных."""
+
+    def __init__(self, manager, probe_all=LATENCY_PROBE_ALL, window_sec=LATENCY_WINDOW_SEC):
+        self._manager = manager
+        self.probe_all = probe_all
+        self.window_sec = window_sec
+        self._selected = {} # {stream_id: True/False} - выбор через API поверх probe_all
+        self._probes = {} # {stream_id: LatencyProbe}
+        self._lock = get_instrumentation().lock("latency")
+        self._timer = None
+        if probe_all:
+            self._ensure_timer()
+
+    def _wanted(self, stream_id):
+        return self._selected.get(stream_id, self.probe_all)
+
+    def _ensure_timer(self):
+        with self._lock:
+            if self._timer is None:
+                self._timer = get_reactor().call_every(LATENCY_CHECK_PERIOD_SEC, self._check)
+
+    def set_enabled(self, stream_ids, enabled):
+        """Включает или выключает зонды потоков; применяется на ближайшем проходе монитора."""
+        with self._lock:
+            for stream_id in stream_ids:
+                self._selected[stream_id] = enabled
+        self._ensure_timer()
+        get_reactor().call_soon(self._check)
+
+    def forget(self, stream_id):
+        with self._lock:
+            self._selected.pop(stream_id, None)
+        get_reactor().call_soon(self._check)
+
+    def is_enabled(self, stream_id):
+        return self._wanted(stream_id)
+
+    @staticmethod
+    def _published(converter):
+        """FFmpeg уже отправляет поток: до первого пакета путь на RTSP-сервере еще не опубликован."""
+        if converter.first_packet_at is not None:
+            return True
+        # Принятый после перезапуска сервиса процесс (registry.py) прогресса не выдает - подключаемся после паузы
+        return bool(converter.started_at) and time.time() - converter.started_at >= LATENCY_RETRY_SEC
+
+    def _check(self):
+        """Таймер цикла: зонд у каждого потока, для которого он включен, подключен, пока поток работает."""
+        now = time.monotonic()
+        converters = {converter.stream_id: converter for converter in self._manager.converters()}
+        with self._lock:
+            for stream_id in list(self._probes):
+                converter = converters.get(stream_id)
+                if converter is None or not self._wanted(stream_id) or converter.latency_probe is not self._probes[stream_id]:
+                    probe = self._probes.pop(stream_id)
+                    probe.disconnect()
+                    if converter is not None and converter.latency_probe is probe:
+                        converter.latency_probe = None
+            for stream_id, converter in converters.items():
+                if not self._wanted(stream_id):
+                    continue
+                probe = self._probes.get(stream_id)
+                if probe is None:
+                    probe = LatencyProbe(stream_id, converter.final_rtsp_url_for_client, self.window_sec)
+                    self._probes[stream_id] = converter.latency_probe = probe
+                if converter.status == STATUS_RUNNING and self._published(converter):
+                    probe.ensure_connected(now)
+                elif probe.state != PROBE_IDLE:
+                    probe.disconnect()
+            if not self._probes and not self.probe_all and self._timer is not None: # Зондов нет - таймер не нужен
+                self._timer.cancel()
+                self._timer = None
+
+    def report(self):
+        """Все зонды: состояние подключения, режим и квантили задержки по окну."""
+        with self._lock:
+            probes = list(self._probes.values())
+        return {
+            "probe_all": self.probe_all,
+            "window_sec": self.window_sec,
+            "quantiles": list(LATENCY_QUANTILES),
+            "probes": [probe.as_dict() for probe in probes],
+        }
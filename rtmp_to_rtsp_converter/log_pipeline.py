@@ -0,0 +1,185 @@
+import os
+import re
+import time
+import queue
+import atexit
+import logging
+import threading
+from logging.handlers import QueueHandler, QueueListener
+
+# Конвейер stderr FFmpeg и неблокирующее логирование.
+#
+# Раньше каждая строка stderr уходила в logging.error и в ffmpeg_logs, а ее тип определялся
+# четырьмя поисками по line.lower(). Источник с битыми кадрами выдает тысячи строк в секунду,
+# и все они доходили до сборщика логов. Теперь строки потока проходят StderrPipeline:
+#   * классификатор - одно заранее скомпилированное выражение с именованными группами
+#     (ERROR_CATEGORIES): категория строки и счетчик по категориям за один проход;
+#   * подряд идущие одинаковые строки сворачиваются в "повторено N раз" (не реже раза в
+#     REPEAT_FLUSH_SEC, чтобы бесконечный повтор не пропадал совсем);
+#   * токен-бакет на поток: не больше LOG_RATE строк в секунду (с запасом LOG_BURST),
+#     остальные считаются и сводятся в одну запись "пропущено N строк".
+# Сами записи логов передаются через ограниченную очередь (install_queue_logging) потоку
+# QueueListener: цикл ввода-вывода никогда не ждет вывод логов, а при переполнении очереди
+# записи отбрасываются и считаются (dropped_records). Очередь ставят точки входа (api.main,
+# cluster.main, streamlit_app.py): импорт пакета корневой логгер приложения не меняет.
+
+LOG_RATE = float(os.environ.get("KAZSTREAMLINK_LOG_RATE", "5")) # Строк stderr в секунду на поток
+LOG_BURST = int(os.environ.get("KAZSTREAMLINK_LOG_BURST", "20"))
+LOG_QUEUE_SIZE = int(os.environ.get("KAZSTREAMLINK_LOG_QUEUE", "10000")) # 0 - писать логи в вызывающем потоке
+REPEAT_FLUSH_SEC = 10.0
+
+FFMPEG_LOGGER = logging.getLogger("kazstreamlink.ffmpeg")
+
+# Категории ошибок FFmpeg в порядке проверки; "other" - прежняя эвристика (error/failed/corrupt/unable)
+ERROR_CATEGORIES = (
+    ("rtsp_refused", r"Server returned [45]\d\d|method (?:ANNOUNCE|SETUP|RECORD) failed|\b(?:401 Unauthorized|403 Forbidden|"
+                     r"404 Not Found|461 Unsupported transport)|Could not write header"),
+    ("timestamps", r"Non-monoton(?:ous|ically increasing) dts|Timestamps are unset|pts has no value|Invalid (?:timestamp|DTS|PTS)"
+                   r"|Application provided invalid|DTS \d+ [<>]|out of order"),
+    ("corrupt_packet", r"corrupt|Invalid data found|error while decoding|decode_slice_header|concealing \d+|missing picture"
+                       r"|Invalid NAL unit|non-existing PPS|no frame!"),
+    ("network", r"Connection (?:refused|reset|timed out)|Network is unreachable|No route to host|Input/output error"
+                r"|Broken pipe|End of file|Operation timed out|Failed to resolve hostname|Error during demuxing"),
+    ("other", r"error|failed|unable"),
+)
+CATEGORIES = tuple(name for name, _ in ERROR_CATEGORIES)
+_CLASSIFIER_RE = re.compile("|".join(f"(?P<{name}>{pattern})" for name, pattern in ERROR_CATEGORIES), re.IGNORECASE)
+
+
+def classify(line):
+    """Категория строки stderr FFmpeg или None, если это не ошибка."""
+    match = _CLASSIFIER_RE.search(line)
+    return match.lastgroup if match else None
+
+
+class TokenBucket:
+    __slots__ = ("rate", "burst", "tokens", "updated_at")
+
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = max(burst, 1)
+        self.tokens = float(self.burst)
+        self.updated_at = time.monotonic()
+
+    def take(self, now):
+        self.tokens = min(self.burst, self.tokens + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+        if self.tokens >= 1.0:
+            self.tokens -= 1.0
+            return True
+        return False
+
+
+class StderrPipeline:
+    """Классификация, свертка повторов и ограничение частоты строк stderr одного потока.
+
+    Вызывается только из потока цикла ввода-вывода, поэтому без блокировок.
+    """
+
+    def __init__(self, stream_id, rate=LOG_RATE, burst=LOG_BURST, logger=FFMPEG_LOGGER):
+        self.stream_id = stream_id
+        self.logger = logger
+        self._bucket = TokenBucket(rate, burst)
+        self.counts = dict.fromkeys(CATEGORIES, 0) # Счетчики по категориям за все время потока
+        self.suppressed = 0 # Строк отброшено ограничением частоты
+        self.collapsed = 0 # Строк свернуто как повторы
+        self._pending_suppressed = 0
+        self._last_line = None
+        self._repeats = 0
+        self._repeats_since = 0.0
+
+    def feed(self, line):
+        """Принимает строку stderr; возвращает (категория или None, [записи для ffmpeg_logs])."""
+        category = classify(line)
+        if category:
+            self.counts[category] += 1
+        now = time.monotonic()
+        entries = []
+        if line == self._last_line:
+            self._repeats += 1
+            self.collapsed += 1
+            if now - self._repeats_since >= REPEAT_FLUSH_SEC:
+                self._flush_repeats(entries, now)
+            return category, entries
+        self._flush_repeats(entries, now)
+        self._last_line = line
+        self._emit(f"[FFmpeg {self.stream_id} STDERR]: {line}", category, entries, now)
+        return category, entries
+
+    def flush(self):
+        """Выводит накопленные повторы и пропуски (процесс FFmpeg завершился)."""
+        entries = []
+        self._flush_repeats(entries, time.monotonic())
+        self._flush_suppressed(entries)
+        self._last_line = None
+        return entries
+
+    def _flush_repeats(self, entries, now):
+        if self._repeats:
+            self._emit(f"[FFmpeg {self.stream_id} STDERR]: последнее сообщение повторено {self._repeats} раз",
+                       classify(self._last_line), entries, now)
+            self._repeats = 0
+        self._repeats_since = now
+
+    def _flush_suppressed(self, entries):
+        if self._pending_suppressed:
+            self._write(f"[FFmpeg {self.stream_id}]: пропущено {self._pending_suppressed} строк stderr "
+                        f"(ограничение {self._bucket.rate:g} строк/с)", "suppressed", entries)
+            self._pending_suppressed = 0
+
+    def _emit(self, entry, category, entries, now):
+        if not self._bucket.take(now):
+            self._pending_suppressed += 1
+            self.suppressed += 1
+            return
+        self._flush_suppressed(entries)
+        self._write(entry, category, entries)
+
+    def _write(self, entry, category, entries):
+        # Ошибки известных категорий - ERROR, остальной вывод stderr - WARNING
+        level = logging.ERROR if category in self.counts else logging.WARNING
+        self.logger.log(level, entry, extra={"stream_id": self.stream_id, "ffmpeg_category": category})
+        entries.append(entry)
+
+
+class DroppingQueueHandler(QueueHandler):
+    """QueueHandler для ограниченной очереди: при переполнении запись отбрасывается, а не ждет."""
+
+    def __init__(self, log_queue):
+        super().__init__(log_queue)
+        self.dropped_records = 0
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped_records += 1
+
+
+_listener = None
+_queue_handler = None
+_listener_lock = threading.Lock()
+
+def install_queue_logging(logger=None, size=LOG_QUEUE_SIZE):
+    """Переносит обработчики логгера (по умолчанию корневого) за очередь с фоновым QueueListener."""
+    global _listener, _queue_handler
+    logger = logger or logging.getLogger()
+    with _listener_lock:
+        if _listener is not None or size <= 0:
+            return _queue_handler
+        handlers = [handler for handler in logger.handlers if not isinstance(handler, QueueHandler)]
+        if not handlers:
+            return None
+        _queue_handler = DroppingQueueHandler(queue.Queue(size))
+        _listener = QueueListener(_queue_handler.queue, *handlers, respect_handler_level=True)
+        for handler in handlers:
+            logger.removeHandler(handler)
+        logger.addHandler(_queue_handler)
+        _listener.start()
+        atexit.register(_listener.stop) # Дописывает очередь при завершении процесса
+        return _queue_handler
+
+
+def dropped_log_records():
+    """Сколько записей логов отброшено из-за переполнения очереди."""
+    return _queue_handler.dropped_records if _queue_handler is not None else 0
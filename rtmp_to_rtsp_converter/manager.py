@@ -0,0 +1,708 @@
+import re
+import time
+import atexit
+import logging
+import threading
+import itertools
+from concurrent.futures import ThreadPoolExecutor
+
+from rtmp_to_rtsp_converter.converter import (
+    RTMPToRTSPConverter, create_and_start_conversion, stop_specific_conversion, STOP_DEADLINE_SEC
+)
+from rtmp_to_rtsp_converter.supervisor import get_supervisor, RESTARTING_STATUS, FLAPPING_STATUS
+from rtmp_to_rtsp_converter.packing import PackedConverterGroup, PackedStream, PACK_SIZE
+from rtmp_to_rtsp_converter.fleet import build_fleet_snapshot
+from rtmp_to_rtsp_converter.sampler import METRICS_PERIOD_SEC
+from rtmp_to_rtsp_converter.admission import AdmissionRejected, get_capacity_model
+from rtmp_to_rtsp_converter.profiling import get_instrumentation
+from rtmp_to_rtsp_converter.ondemand import OnDemandController
+from rtmp_to_rtsp_converter.dedup import SharedIngestGroup, normalise_source, dedup_report, DEDUP_ENABLED
+from rtmp_to_rtsp_converter.node import spec_of
+from rtmp_to_rtsp_converter.profiles import get_profile
+from rtmp_to_rtsp_converter.latency import LatencyMonitor
+from rtmp_to_rtsp_converter.outputs import check_input_url, output_path
+from rtmp_to_rtsp_converter.state import (
+    STATUS_RUNNING, STATUS_STARTING, STATUS_STOPPING, STATUS_STOPPED, STATUS_START_FAILED
+)
+from rtmp_to_rtsp_converter.registry import (
+    get_registry, find_orphan_ffmpeg, matches_command, terminate_orphans, AdoptedProcess, DESIRED_RUNNING, DESIRED_STOPPED
+)
+
+# Общий для процесса реестр конвертеров.
+# Раньше конвертеры жили в st.session_state и пропадали вместе с сессией браузера;
+# теперь ими владеет менеджер, а Streamlit и HTTP API (api.py) - лишь его клиенты.
+# При pack_size > 1 массовое создание упаковывает потоки в общие процессы FFmpeg (packing.py);
+# в реестре такие потоки представлены объектами PackedStream с тем же интерфейсом.
+# С постоянным реестром (registry.py) описания и желаемое состояние потоков переживают
+# перезапуск сервиса: get_manager() восстанавливает их при старте (restore).
+# Массовая остановка не ждет потоки по одному: SIGINT получают все процессы сразу, эскалация
+# SIGTERM/SIGKILL идет на таймерах цикла ввода-вывода, а менеджер ждет завершения всех с одним общим
+# сроком - остановка узла занимает время самого медленного потока, а не сумму.
+# Потоки по запросу (spec "on_demand": true) создаются без процесса FFmpeg: его запускает и
+# останавливает по простою OnDemandController (ondemand.py) по сообщениям о зрителях.
+# Поток с тем же источником, что у работающего, подключается к его процессу FFmpeg (dedup.py):
+# создание потоков одного источника сериализуется блокировкой этого источника, чтобы два
+# параллельных запроса не запустили два процесса.
+# Зонды задержки (latency.py) читают выход RTSP работающих потоков как зрители; их подключением
+# управляет LatencyMonitor менеджера.
+
+BULK_MAX_WORKERS = 32 # Сколько конвертеров запускать/останавливать параллельно в массовых операциях
+ACTIVE_STATUSES = (STATUS_RUNNING, STATUS_STARTING, STATUS_STOPPING)
+_STREAM_ID_RE = re.compile(r"stream_(\d+)$")
+
+
+def validate_spec(spec):
+    """Проверяет описание потока и возвращает нормализованную копию (ValueError при ошибке)."""
+    if not isinstance(spec, dict):
+        raise ValueError("Описание потока должно быть объектом.")
+    if not spec.get("rtmp_url"):
+        raise ValueError("RTMP URL не может быть пустым.")
+    if not isinstance(spec["rtmp_url"], str):
+        raise ValueError("RTMP URL должен быть строкой.")
+    check_input_url(spec["rtmp_url"].strip())
+    if not spec.get("rtsp_server_host"):
+        raise ValueError("Хост RTSP-сервера не может быть пустым.")
+    if not spec.get("rtsp_path"):
+        raise ValueError("Путь RTSP-потока не может быть пустым.")
+    try:
+        rtsp_port = int(spec.get("rtsp_port", 8554))
+    except (TypeError, ValueError):
+        raise ValueError("Порт RTSP-сервера должен быть числом.")
+    if not 1 <= rtsp_port <= 65535:
+        raise ValueError("Порт RTSP-сервера должен быть в диапазоне 1-65535.")
+    extra_outputs = spec.get("extra_outputs") or []
+    if not isinstance(extra_outputs, list) or not all(isinstance(url, str) and url.strip() for url in extra_outputs):
+        raise ValueError("Поле extra_outputs должно быть списком непустых URL.")
+    for url in extra_outputs: # Схема или каталог выхода не разрешены - ValueError (outputs.py)
+        output_path(url.strip())
+    normalized = dict(spec)
+    normalized["rtsp_port"] = rtsp_port
+    normalized["extra_outputs"] = [url.strip() for url in extra_outputs]
+    if not isinstance(spec.get("record", False), bool):
+        raise ValueError("Поле record должно быть true или false.")
+    normalized["record"] = spec.get("record", False)
+    if not isinstance(spec.get("on_demand", False), bool):
+        raise ValueError("Поле on_demand должно быть true или false.")
+    normalized["on_demand"] = spec.get("on_demand", False)
+    normalized["profile"] = get_profile(spec.get("profile")).name # ValueError для неизвестного профиля
+    return normalized
+
+
+class ConverterManager:
+    def __init__(self, pack_size=PACK_SIZE, registry=None, dedup=DEDUP_ENABLED):
+        self._converters = {} # {stream_id: RTMPToRTSPConverter | PackedStream}
+        self._lock = get_instrumentation().lock("manager", reentrant=True)
+        self._id_counter = itertools.count()
+        self._group_counter = itertools.count()
+        self.pack_size = max(1, pack_size)
+        self._snapshot = None # Последний снимок состояния (fleet.py)
+        self._snapshot_lock = get_instrumentation().lock("manager_snapshot")
+        self._registry = registry # StreamRegistry или None (без сохранения)
+        self.last_restore = None # Итог последнего restore()
+        self.on_demand = OnDemandController(self)
+        self.dedup = dedup
+        self.latency = LatencyMonitor(self)
+        self._source_locks = {} # {ключ источника: блокировка} - создание потоков одного источника (dedup.py)
+
+    def next_stream_id(self):
+        with self._lock:
+            while True:
+                stream_id = f"stream_{next(self._id_counter)}"
+                if stream_id not in self._converters:
+                    return stream_id
+
+    def get(self, stream_id):
+        with self._lock:
+            return self._converters.get(stream_id)
+
+    def converters(self):
+        """Возвращает список запущенных через менеджер конвертеров в порядке создания."""
+        with self._lock:
+            return [conv for conv in self._converters.values() if conv is not None]
+
+    def snapshot(self, max_age=METRICS_PERIOD_SEC):
+        """Снимок состояния всех потоков; пересобирается не чаще раза в max_age секунд."""
+        snapshot = self._snapshot
+        if snapshot is None or time.time() - snapshot.built_at >= max_age:
+            with self._snapshot_lock: # Параллельные читатели ждут одну сборку
+                snapshot = self._snapshot
+                if snapshot is None or time.time() - snapshot.built_at >= max_age:
+                    snapshot = self._snapshot = build_fleet_snapshot(self.converters())
+        return snapshot
+
+    def _invalidate_snapshot(self):
+        self._snapshot = None
+
+    def _reserve(self, spec):
+        """Проверяет спецификацию и резервирует stream_id (конвертер добавляется после запуска)."""
+        spec = validate_spec(spec)
+        with self._lock:
+            stream_id = spec.get("stream_id") or self.next_stream_id()
+            if stream_id in self._converters:
+                raise ValueError(f"Поток {stream_id} уже существует.")
+            self._converters[stream_id] = None # Резерв, чтобы параллельный запрос не занял тот же ID
+        spec["stream_id"] = stream_id
+        return spec
+
+    def create(self, spec):
+        """Создает и запускает конвертер по описанию потока, возвращает его."""
+        spec = self._reserve(spec)
+        if self._dedup_eligible(spec):
+            converter = self._start_shared([spec])[0][1]
+        else:
+            converter = self._start_reserved(spec)
+        self._persist(spec)
+        return converter
+
+    def _persist(self, *specs):
+        if self._registry is not None and specs:
+            self._registry.put_many(specs, DESIRED_RUNNING)
+
+    def _persist_desired(self, stream_ids, desired):
+        if self._registry is not None and stream_ids:
+            self._registry.set_desired_many(stream_ids, desired)
+
+    def _start_reserved(self, spec, admit=True, wait=True):
+        stream_id = spec["stream_id"]
+        if spec["on_demand"]: # Процесс запустит первый зритель (емкость проверяется тогда же)
+            converter = converter_from_spec(spec)
+            self.on_demand.register(converter)
+            with self._lock:
+                self._converters[stream_id] = converter
+            self._invalidate_snapshot()
+            return converter
+        try:
+            converter = create_and_start_conversion(
+                stream_id, spec["rtmp_url"], spec["rtsp_server_host"], spec["rtsp_port"], spec["rtsp_path"],
+                extra_outputs=spec["extra_outputs"], record=spec["record"], admit=admit, wait=wait, profile=spec["profile"]
+            )
+        except Exception:
+            with self._lock:
+                self._converters.pop(stream_id, None)
+            raise
+        with self._lock:
+            self._converters[stream_id] = converter
+        self._invalidate_snapshot()
+        return converter
+
+    def create_many(self, specs, admit=True):
+        """Массово создает конвертеры; возвращает результат по каждому описанию в исходном порядке.
+
+        admit=False - без проверки емкости узла (восстановление потоков, которые узел уже обслуживал).
+        """
+        results = [None] * len(specs)
+        reserved = []
+        for i, spec in enumerate(specs):
+            try:
+                reserved.append((i, self._reserve(spec)))
+            except ValueError as e:
+                results[i] = {"stream_id": spec.get("stream_id") if isinstance(spec, dict) else None, "ok": False, "error": str(e)}
+
+        # После первого отказа по емкости остальные потоки пакета не ждут ее освобождения, а сразу получают отказ
+        exhausted = threading.Event()
+
+        def rejected(i, spec, error):
+            exhausted.set()
+            results[i] = {"stream_id": spec["stream_id"], "ok": False, "error": str(error), "rejected": True}
+
+        def start_one(item):
+            i, spec = item
+            try:
+                converter = self._start_reserved(spec, admit=admit, wait=not exhausted.is_set())
+                results[i] = {"stream_id": converter.stream_id, "ok": True, "status": converter.get_status()}
+            except AdmissionRejected as e:
+                rejected(i, spec, e)
+            except Exception as e:
+                logging.error(f"Ошибка при массовом запуске потока {spec['stream_id']}: {e}")
+                results[i] = {"stream_id": spec["stream_id"], "ok": False, "error": str(e)}
+
+        def start_group(items):
+            admitted = []
+            for i, spec in items:
+                try:
+                    if admit:
+                        get_capacity_model().admit(spec["stream_id"], spec["rtmp_url"], wait=not exhausted.is_set())
+                    admitted.append((i, spec))
+                except AdmissionRejected as e:
+                    with self._lock:
+                        self._converters.pop(spec["stream_id"], None)
+                    rejected(i, spec, e)
+            if not admitted:
+                return
+            try:
+                for i, member in self._start_group([spec for _, spec in admitted]):
+                    results[admitted[i][0]] = {"stream_id": member.stream_id, "ok": True, "status": member.get_status()}
+            except Exception as e:
+                logging.error(f"Ошибка при запуске группы потоков: {e}")
+                for i, spec in admitted:
+                    get_capacity_model().release(spec["stream_id"])
+                    results[i] = {"stream_id": spec["stream_id"], "ok": False, "error": str(e)}
+
+        def start_shared(items):
+            try:
+                for i, member in self._start_shared([spec for _, spec in items], admit=admit, wait=not exhausted.is_set()):
+                    results[items[i][0]] = {"stream_id": member.stream_id, "ok": True, "status": member.get_status()}
+            except AdmissionRejected as e:
+                for i, spec in items:
+                    rejected(i, spec, e)
+            except Exception as e:
+                logging.error(f"Ошибка при запуске потоков источника {items[0][1]['rtmp_url']}: {e}")
+                for i, spec in items:
+                    results[i] = {"stream_id": spec["stream_id"], "ok": False, "error": str(e)}
+
+        # Потоки одного источника запускаются одним заданием (без упаковки - все подходящие: так
+        # параллельные запросы с тем же источником дождутся друг друга, см. _start_shared)
+        shared = []
+        if self.dedup:
+            by_source = {}
+            for item in reserved:
+                if self._dedup_eligible(item[1]):
+                    by_source.setdefault(self._ingest_key(item[1]), []).append(item)
+            shared = [items for key, items in by_source.items()
+                      if self.pack_size == 1 or len(items) > 1 or self._find_ingest(key) is not None]
+        in_shared = {i for items in shared for i, _ in items}
+        reserved_rest = [item for item in reserved if item[0] not in in_shared]
+        # Потоки с записью не упаковываются: нога записи есть только у отдельного конвертера (см. recording.py);
+        # потоки по запросу тоже - каждый запускается и останавливается своими зрителями
+        packable = [item for item in reserved_rest if not item[1]["record"] and not item[1]["on_demand"]]
+        if self.pack_size > 1 and len(packable) > 1:
+            jobs = [(start_group, packable[i:i + self.pack_size]) for i in range(0, len(packable), self.pack_size)]
+            jobs += [(start_one, item) for item in reserved_rest if item[1]["record"] or item[1]["on_demand"]]
+        else:
+            jobs = [(start_one, item) for item in reserved_rest]
+        jobs += [(start_shared, items) for items in shared]
+        if jobs:
+            with ThreadPoolExecutor(max_workers=min(BULK_MAX_WORKERS, len(jobs)), thread_name_prefix="bulk_start") as pool:
+                list(pool.map(lambda job: job[0](job[1]), jobs))
+        # Одна транзакция реестра на всю операцию
+        self._persist(*(spec for i, spec in reserved if results[i]["ok"]))
+        return results
+
+    def _start_group(self, specs):
+        """Запускает зарезервированные потоки одним процессом FFmpeg, возвращает [(индекс, PackedStream)]."""
+        group = PackedConverterGroup(f"group_{next(self._group_counter)}", specs)
+        try:
+            group.start()
+            if group.status == "ошибка_запуска":
+                raise RuntimeError(group.get_last_error())
+        except Exception:
+            with self._lock:
+                for spec in specs:
+                    self._converters.pop(spec["stream_id"], None)
+            raise
+        with self._lock:
+            for member in group.members:
+                self._converters[member.stream_id] = member
+        self._invalidate_snapshot()
+        return list(enumerate(group.members))
+
+    # --- Зонды задержки (latency.py) ---
+
+    def set_latency_probe(self, stream_ids, enabled):
+        """Включает или выключает зонды задержки потоков; KeyError - поток не найден."""
+        missing = [stream_id for stream_id in stream_ids if self.get(stream_id) is None]
+        if missing:
+            raise KeyError(missing[0])
+        self.latency.set_enabled(stream_ids, enabled)
+
+    def latency_report(self):
+        """Зонды задержки и квантили по окну (см. latency.LatencyMonitor.report)."""
+        return self.latency.report()
+
+    # --- Дедупликация источников (dedup.py) ---
+
+    def dedup_report(self):
+        """Общие процессы источников и экономия (см. dedup.dedup_report)."""
+        report = dedup_report(self.converters())
+        report["enabled"] = self.dedup
+        return report
+
+    def _dedup_eligible(self, spec):
+        # У потоков с записью и по запросу свой жизненный цикл процесса
+        return self.dedup and not spec["record"] and not spec["on_demand"]
+
+    def _source_lock(self, key):
+        with self._lock:
+            lock = self._source_locks.get(key)
+            if lock is None:
+                lock = self._source_locks[key] = threading.Lock()
+            return lock
+
+    @staticmethod
+    def _ingest_key(spec):
+        # Потоки с разными профилями передачи источник не делят: буферизация входа у процесса одна
+        return normalise_source(spec["rtmp_url"]), spec["profile"]
+
+    def _find_ingest(self, key):
+        """Работающий процесс, который уже тянет источник key: SharedIngestGroup или отдельный конвертер."""
+        source, profile = key
+        with self._lock:
+            converters = [conv for conv in self._converters.values() if conv is not None]
+        for converter in converters:
+            if converter.profile.name != profile:
+                continue
+            if isinstance(converter, PackedStream):
+                group = converter.group
+                if isinstance(group, SharedIngestGroup) and group.source_key == source and group.active_members():
+                    return group
+            elif (not converter.on_demand and converter.recorder is None
+                  and converter.state.status in (STATUS_RUNNING, STATUS_STARTING)
+                  and normalise_source(converter.rtmp_url) == source):
+                return converter
+        return None
+
+    def _start_shared(self, specs, admit=True, wait=True):
+        """Запускает зарезервированные потоки одного источника, подключая их к его процессу, если он уже есть.
+
+        Возвращает [(индекс, конвертер или PackedStream)]. Подключение к работающему процессу не проверяет
+        емкость: источник уже тянется, процесс уже учтен.
+        """
+        key = self._ingest_key(specs[0])
+        with self._source_lock(key):
+            ingest = self._find_ingest(key)
+            if ingest is None and len(specs) == 1:
+                return [(0, self._start_reserved(specs[0], admit=admit, wait=wait))]
+            try:
+                if ingest is None:
+                    if admit:
+                        get_capacity_model().admit(specs[0]["stream_id"], specs[0]["rtmp_url"], wait=wait)
+                    members = self._start_shared_group(specs, admit)
+                else:
+                    members = self._attach(ingest, specs)
+            except Exception:
+                with self._lock:
+                    for spec in specs:
+                        self._converters.pop(spec["stream_id"], None)
+                raise
+        with self._lock:
+            for member in members:
+                self._converters[member.stream_id] = member
+        self._invalidate_snapshot()
+        new_ids = {spec["stream_id"] for spec in specs}
+        return list(enumerate(member for member in members if member.stream_id in new_ids))
+
+    def _start_shared_group(self, specs, admitted):
+        group = SharedIngestGroup(f"ingest_{next(self._group_counter)}", specs)
+        group.start()
+        if group.state.status == STATUS_START_FAILED:
+            if admitted:
+                get_capacity_model().release(specs[0]["stream_id"])
+            raise RuntimeError(group.get_last_error())
+        logging.info(f"Потоки {', '.join(spec['stream_id'] for spec in specs)} используют один процесс источника "
+                     f"{group.source_key} ({group.stream_id}).")
+        return group.members
+
+    def _attach(self, ingest, specs):
+        """Подключает потоки к процессу источника; возвращает все потоки этого процесса."""
+        if isinstance(ingest, SharedIngestGroup):
+            attached = ingest.attach(specs)
+            if ingest.state.status == STATUS_START_FAILED:
+                for member in attached: # Супервизор перезапустит группу без неподключенных потоков
+                    member.stopped = True
+                    ingest.discard_member(member)
+                raise RuntimeError(ingest.get_last_error())
+            return ingest.active_members()
+        # Отдельный конвертер становится первым потоком общей группы: его процесс заменяется процессом группы
+        logging.info(f"Источник потока {ingest.stream_id} уже тянется: потоки "
+                     f"{', '.join(spec['stream_id'] for spec in specs)} подключаются к нему, процесс перезапускается.")
+        get_supervisor().cancel(ingest)
+        ingest.stop()
+        group = SharedIngestGroup(f"ingest_{next(self._group_counter)}", [spec_of(ingest), *specs])
+        group.start()
+        if group.state.status == STATUS_START_FAILED:
+            ingest.start() # Исходный поток продолжает работу своим процессом
+            raise RuntimeError(group.get_last_error())
+        get_supervisor().forget(ingest)
+        get_capacity_model().forget(ingest)
+        return group.members
+
+    def stop(self, stream_id, wait=True):
+        self.on_demand.set_enabled([stream_id], False) # Остановленный вручную поток зрители не запускают
+        converter = self._stop(stream_id, wait)
+        self._persist_desired([stream_id], DESIRED_STOPPED)
+        return converter
+
+    def _stop(self, stream_id, wait=True):
+        converter = self.get(stream_id)
+        if converter is None:
+            raise KeyError(stream_id)
+        stop_specific_conversion(converter, wait=wait)
+        self._invalidate_snapshot()
+        return converter
+
+    def stop_many(self, stream_ids=None, persist=True):
+        """Массово останавливает конвертеры (все, если stream_ids не указан); результат по каждому потоку.
+
+        Все процессы получают SIGINT сразу, затем менеджер ждет их завершения с общим сроком STOP_DEADLINE_SEC.
+        persist=False - желаемое состояние в реестре не меняется (остановка сервиса, см. shutdown).
+        """
+        with self._lock:
+            if stream_ids is None:
+                stream_ids = [sid for sid, conv in self._converters.items() if conv is not None]
+        if persist:
+            self.on_demand.set_enabled(stream_ids, False)
+        deadline = time.monotonic() + STOP_DEADLINE_SEC
+        results = {}
+        waiting = [] # [(конвертер или группа, [потоки])] - сигнал отправлен, ждем завершения
+
+        def stop_group(item):
+            group, members = item
+            try:
+                group.stop_members(members) # Оставшиеся потоки группы перезапускаются без остановленных
+                for member in members:
+                    results[member.stream_id] = {"ok": True, "status": member.get_status()}
+            except Exception as e:
+                for member in members:
+                    results[member.stream_id] = {"ok": False, "error": str(e)}
+
+        # Потоки одной группы останавливаются вместе, чтобы процесс группы перезапускался не больше одного раза
+        by_group = {}
+        for stream_id in stream_ids:
+            converter = self.get(stream_id)
+            if converter is None:
+                results[stream_id] = {"ok": False, "error": f"Поток {stream_id} не найден."}
+            elif isinstance(converter, PackedStream):
+                by_group.setdefault(converter.group, []).append(converter)
+            else:
+                try:
+                    converter.stop(wait=False)
+                    waiting.append((converter, [converter]))
+                except Exception as e:
+                    results[stream_id] = {"ok": False, "error": str(e)}
+        restarting = []
+        for group, members in by_group.items():
+            if len(members) == len(group.active_members()): # Группа останавливается целиком - ждать перезапуска не нужно
+                try:
+                    group.stop_members(members, wait=False)
+                    waiting.append((group, members))
+                except Exception as e:
+                    for member in members:
+                        results[member.stream_id] = {"ok": False, "error": str(e)}
+            else:
+                restarting.append((group, members))
+        if restarting:
+            with ThreadPoolExecutor(max_workers=min(BULK_MAX_WORKERS, len(restarting)), thread_name_prefix="bulk_stop") as pool:
+                list(pool.map(stop_group, restarting))
+
+        # Процессы завершаются параллельно, поэтому общий срок отсчитывается один раз
+        for converter, members in waiting:
+            exited = converter.wait_stopped(max(0.0, deadline - time.monotonic()))
+            outcome = dict(converter.last_stop or {})
+            if not exited:
+                outcome["error"] = f"Процесс FFmpeg не завершился за {STOP_DEADLINE_SEC:.0f} с."
+            for member in members:
+                results[member.stream_id] = dict(outcome, ok=exited, status=member.get_status())
+        self._invalidate_snapshot()
+        if persist:
+            self._persist_desired([sid for sid in stream_ids if results[sid]["ok"]], DESIRED_STOPPED)
+        return [dict(stream_id=sid, **results[sid]) for sid in stream_ids]
+
+    def shutdown(self):
+        """Останавливает все потоки при завершении сервиса; реестр не меняется, restore() запустит их снова."""
+        results = self.stop_many(persist=False)
+        if results:
+            logging.info(f"Остановка сервиса: завершено {sum(1 for r in results if r['ok'])} из {len(results)} потоков.")
+        return results
+
+    def start(self, stream_id):
+        """Запускает остановленный поток заново."""
+        converter = self.get(stream_id)
+        if converter is None:
+            raise KeyError(stream_id)
+        self.start_many([stream_id])
+        return converter
+
+    def start_many(self, stream_ids=None, persist=True):
+        """Массово запускает остановленные потоки (все неработающие, если stream_ids не указан); результат по каждому.
+
+        persist=False - желаемое состояние в реестре не меняется (запуск потока по запросу зрителя, см. ondemand.py).
+        Ручной запуск потока по запросу снова разрешает запуски зрителями; без зрителей он остановится по простою.
+        """
+        with self._lock:
+            if stream_ids is None:
+                stream_ids = [sid for sid, conv in self._converters.items()
+                              if conv is not None and conv.get_status() not in ACTIVE_STATUSES]
+        if persist:
+            self.on_demand.set_enabled(stream_ids, True)
+        deadline = time.monotonic() + STOP_DEADLINE_SEC
+        results = {}
+        capacity = get_capacity_model()
+        exhausted = threading.Event()
+
+        def admit(converter):
+            """Проверка емкости перед запуском остановленного потока; False - отказ записан в results."""
+            if converter.get_status() in (*ACTIVE_STATUSES, RESTARTING_STATUS, FLAPPING_STATUS):
+                return True # Поток уже занимает емкость узла
+            try:
+                capacity.admit(converter.stream_id, converter.rtmp_url, wait=not exhausted.is_set())
+                return True
+            except AdmissionRejected as e:
+                exhausted.set()
+                results[converter.stream_id] = {"ok": False, "error": str(e), "rejected": True}
+                return False
+
+        def start_one(converter):
+            try:
+                if converter.get_status() == "останавливается": # Новый процесс займет те же выходы
+                    converter.wait_stopped(max(0.0, deadline - time.monotonic()))
+                if not admit(converter):
+                    return
+                get_supervisor().cancel(converter) # Запуск вручную заменяет запланированный перезапуск
+                converter.start()
+                status = converter.get_status()
+                if status == "ошибка_запуска":
+                    capacity.release(converter.stream_id)
+                results[converter.stream_id] = ({"ok": True, "status": status} if status != "ошибка_запуска"
+                                                else {"ok": False, "status": status, "error": converter.get_last_error()})
+            except Exception as e:
+                results[converter.stream_id] = {"ok": False, "error": str(e)}
+
+        def start_group(item):
+            group, members = item
+            members = [member for member in members if admit(member)]
+            if not members:
+                return
+            try:
+                group.start_members(members) # Один перезапуск процесса группы на все ее потоки
+                status = group.get_status()
+                for member in members:
+                    results[member.stream_id] = ({"ok": True, "status": member.get_status()} if status != "ошибка_запуска"
+                                                 else {"ok": False, "status": status, "error": group.get_last_error()})
+            except Exception as e:
+                for member in members:
+                    results[member.stream_id] = {"ok": False, "error": str(e)}
+
+        jobs = []
+        by_group = {}
+        for stream_id in stream_ids:
+            converter = self.get(stream_id)
+            if converter is None:
+                results[stream_id] = {"ok": False, "error": f"Поток {stream_id} не найден."}
+            elif isinstance(converter, PackedStream):
+                by_group.setdefault(converter.group, []).append(converter)
+            else:
+                jobs.append((start_one, converter))
+        jobs.extend((start_group, item) for item in by_group.items())
+        if jobs:
+            with ThreadPoolExecutor(max_workers=min(BULK_MAX_WORKERS, len(jobs)), thread_name_prefix="bulk_start") as pool:
+                list(pool.map(lambda job: job[0](job[1]), jobs))
+        self._invalidate_snapshot()
+        if persist:
+            self._persist_desired([sid for sid in stream_ids if results[sid]["ok"]], DESIRED_RUNNING)
+        return [dict(stream_id=sid, **results[sid]) for sid in stream_ids]
+
+    def remove(self, stream_id):
+        """Удаляет остановленный конвертер из реестра."""
+        with self._lock:
+            converter = self._converters.get(stream_id)
+            if converter is None:
+                raise KeyError(stream_id)
+            if converter.get_status() in [*ACTIVE_STATUSES, RESTARTING_STATUS, FLAPPING_STATUS]:
+                raise ValueError(f"Поток {stream_id} еще работает, сначала остановите его.")
+            del self._converters[stream_id]
+        self._invalidate_snapshot()
+        if self._registry is not None:
+            self._registry.delete(stream_id)
+        self.latency.forget(stream_id)
+        if isinstance(converter, PackedStream):
+            if converter.group.discard_member(converter): # Последний поток группы удален
+                get_supervisor().forget(converter.group)
+            return
+        self.on_demand.forget(stream_id)
+        get_supervisor().forget(converter)
+        get_capacity_model().forget(converter)
+        if converter.recorder: # Сегменты и индекс остаются на диске
+            converter.recorder.close()
+
+    def restore(self):
+        """Восстанавливает потоки из реестра при старте сервиса (см. registry.py), возвращает итог."""
+        if self._registry is None:
+            return None
+        started = time.monotonic()
+        entries = []
+        for spec, desired in self._registry.load():
+            try:
+                entries.append((validate_spec(spec), desired))
+            except ValueError as e:
+                logging.error(f"Запись реестра {spec.get('stream_id')} пропущена: {e}")
+        if not entries:
+            return None
+
+        orphans = find_orphan_ffmpeg()
+        adopted, to_start, stopped, lazy = [], [], [], []
+        known_outputs = set()
+        for spec, desired in entries:
+            converter = converter_from_spec(spec)
+            known_outputs.update(converter.output_urls())
+            if spec["on_demand"]: # Без зрителей процесс не нужен: работающий остановится по простою
+                self.on_demand.register(converter, enabled=desired == DESIRED_RUNNING)
+            if desired != DESIRED_RUNNING:
+                stopped.append(converter)
+                continue
+            tail = converter.ffmpeg_output_args()
+            match = next((o for o in orphans if matches_command(o[2], spec["rtmp_url"], tail)), None)
+            if match is not None:
+                orphans.remove(match)
+                adopted.append((converter, match))
+            elif spec["on_demand"]:
+                lazy.append(converter)
+            else:
+                to_start.append(spec)
+
+        # Остальные процессы прошлого запуска (в том числе упакованные группы) держат пути RTSP потоков реестра
+        stale = [o for o in orphans if any(url in " ".join(o[2]) for url in known_outputs)]
+        if stale:
+            logging.warning(f"Завершение {len(stale)} осиротевших процессов FFmpeg прошлого запуска.")
+            terminate_orphans(stale)
+
+        with self._lock:
+            for converter, (pid, starttime, _) in adopted:
+                converter.adopt(AdoptedProcess(pid, starttime))
+                self._converters[converter.stream_id] = converter
+            for converter in stopped:
+                converter.transition(STATUS_STOPPED)
+                self._converters[converter.stream_id] = converter
+            for converter in lazy:
+                self._converters[converter.stream_id] = converter
+            # Новые ID не должны совпадать с восстановленными
+            indices = [int(m.group(1)) for m in map(_STREAM_ID_RE.match, self._converters) if m]
+            if indices:
+                self._id_counter = itertools.count(max(indices) + 1)
+        results = self.create_many(to_start, admit=False) if to_start else []
+
+        self.last_restore = {
+            "streams": len(entries),
+            "adopted": len(adopted),
+            "started": sum(1 for r in results if r["ok"]),
+            "failed": sum(1 for r in results if not r["ok"]),
+            "stopped": len(stopped),
+            "on_demand": len(lazy),
+            "orphans_terminated": len(stale),
+            "seconds": round(time.monotonic() - started, 3),
+        }
+        logging.info(f"Потоки восстановлены из реестра: {self.last_restore}")
+        self._invalidate_snapshot()
+        return self.last_restore
+
+
+def converter_from_spec(spec):
+    """Конвертер без запуска по проверенному описанию потока (validate_spec)."""
+    return RTMPToRTSPConverter(
+        spec["stream_id"], spec["rtmp_url"], spec["rtsp_server_host"], spec["rtsp_port"], spec["rtsp_path"],
+        extra_outputs=spec["extra_outputs"], record=spec["record"], on_demand=spec["on_demand"], profile=spec["profile"]
+    )
+
+
+_default_manager = None
+_default_manager_lock = threading.Lock()
+
+def get_manager():
+    """Возвращает общий для процесса менеджер конвертеров."""
+    global _default_manager
+    with _default_manager_lock:
+        if _default_manager is None:
+            _default_manager = ConverterManager(registry=get_registry())
+            _default_manager.restore()
+            # При штатном завершении процесса потоки останавливаются параллельно, а не остаются сиротами
+            atexit.register(_default_manager.shutdown)
+        return _default_manager
@@ -0,0 +1,157 @@
+import math
+
+import numpy as np
+
+from rtmp_to_rtsp_converter.profiling import get_instrumentation
+
+# Компактное хранилище истории метрик потока на массивах NumPy.
+#
+# Колонки фиксированы (см. COLUMNS), значения - float32, отсутствующие ("N/A") - NaN.
+# Три уровня детализации (DEFAULT_TIERS): 1 с за час, 10 с за 6 часов и 1 мин за сутки.
+# Каждый более грубый уровень заполняется свертками предыдущего (среднее по корзине,
+# для счетчика дропов - максимум), поэтому запись стоит O(1) независимо от длины истории.
+#
+# Каждый уровень - кольцевой буфер двойной длины: строка пишется в позиции i и i + capacity,
+# благодаря чему последние N строк всегда лежат в памяти непрерывно и view() отдает срез
+# без копирования (numpy view), который можно сразу передать в pandas/Streamlit.
+#
+# Память на поток ограничена и не зависит от времени работы:
+#     строк = 3600 + 2160 + 1440 = 7200, строка = 7 колонок * 4 байта = 28 байт,
+#     x2 (двойной буфер) = 7200 * 28 * 2 = 403 200 байт (~394 КиБ) на поток.
+
+COLUMNS = ("time", "bitrate_kbit", "fps", "cpu_percent", "memory_mb", "dropped_frames", "speed")
+VALUE_COLUMNS = COLUMNS[1:]
+_DROPS_INDEX = COLUMNS.index("dropped_frames")
+
+# (шаг в секундах, количество строк)
+DEFAULT_TIERS = (
+    (1, 3600),  # 1 с за 1 час
+    (10, 2160), # 10 с за 6 часов
+    (60, 1440), # 1 мин за 24 часа
+)
+
+
+def _to_float(value):
+    if isinstance(value, (int, float)):
+        return float(value)
+    return math.nan # "N/A", "N/A (parse)", None
+
+
+class _Tier:
+    __slots__ = ("step", "capacity", "data", "head", "count", "bucket_sum", "bucket_n", "bucket_max_drops", "bucket_start")
+
+    def __init__(self, step, capacity):
+        self.step = step
+        self.capacity = capacity
+        self.data = np.full((capacity * 2, len(COLUMNS)), np.nan, dtype=np.float32)
+        self.head = 0 # Индекс самой старой строки
+        self.count = 0
+        # Аккумуляторы текущей корзины для свертки в следующий уровень
+        self.bucket_sum = np.zeros(len(COLUMNS), dtype=np.float64)
+        self.bucket_n = np.zeros(len(COLUMNS), dtype=np.int32)
+        self.bucket_max_drops = math.nan
+        self.bucket_start = None
+
+    def append(self, row):
+        if self.count < self.capacity:
+            pos = self.head + self.count
+            self.count += 1
+        else:
+            pos = self.head
+            self.head = (self.head + 1) % self.capacity
+        pos %= self.capacity
+        self.data[pos] = row
+        self.data[pos + self.capacity] = row
+
+    def view(self):
+        return self.data[self.head:self.head + self.count]
+
+
+class MetricsStore:
+    """Типизированная история метрик одного потока с несколькими уровнями детализации."""
+
+    def __init__(self, tiers=DEFAULT_TIERS):
+        self._tiers = [_Tier(step, capacity) for step, capacity in tiers]
+        self._lock = get_instrumentation().lock("metrics_store") # Только для записи; чтение view() блокировок не требует
+        self.base_time = None # Время хранится как float32-смещение от base_time (сек)
+
+    @staticmethod
+    def memory_bytes_per_stream(tiers=DEFAULT_TIERS):
+        return sum(capacity * 2 * len(COLUMNS) * 4 for _, capacity in tiers)
+
+    def tiers(self):
+        return [tier.step for tier in self._tiers]
+
+    def clear(self):
+        with self._lock:
+            for tier in self._tiers:
+                tier.data.fill(np.nan)
+                tier.head = tier.count = 0
+                tier.bucket_sum.fill(0)
+                tier.bucket_n.fill(0)
+                tier.bucket_max_drops = math.nan
+                tier.bucket_start = None
+            self.base_time = None
+
+    def append(self, timestamp, metrics):
+        """Добавляет секундный замер (словарь метрик конвертера) и обновляет свертки."""
+        with self._lock:
+            if self.base_time is None:
+                self.base_time = timestamp
+            row = np.empty(len(COLUMNS), dtype=np.float64)
+            row[0] = timestamp - self.base_time
+            for i, name in enumerate(VALUE_COLUMNS, start=1):
+                row[i] = _to_float(metrics.get(name))
+            self._append_to_tier(0, row)
+
+    def _append_to_tier(self, level, row):
+        tier = self._tiers[level]
+        tier.append(row)
+        if level + 1 >= len(self._tiers):
+            return
+        next_tier = self._tiers[level + 1]
+        bucket_index = math.floor(row[0] / next_tier.step)
+        if tier.bucket_start is not None and bucket_index != tier.bucket_start:
+            self._append_to_tier(level + 1, self._close_bucket(tier, next_tier))
+        tier.bucket_start = bucket_index
+        finite = ~np.isnan(row)
+        tier.bucket_sum[finite] += row[finite]
+        tier.bucket_n[finite] += 1
+        drops = row[_DROPS_INDEX]
+        if not math.isnan(drops) and not (drops <= tier.bucket_max_drops):
+            tier.bucket_max_drops = drops
+
+    @staticmethod
+    def _close_bucket(tier, next_tier):
+        with np.errstate(invalid="ignore", divide="ignore"):
+            rolled = tier.bucket_sum / tier.bucket_n # Среднее по корзине (NaN, если значений не было)
+        rolled[0] = tier.bucket_start * next_tier.step # Метка времени - начало корзины
+        rolled[_DROPS_INDEX] = tier.bucket_max_drops # Счетчик дропов: берем максимум
+        tier.bucket_sum.fill(0)
+        tier.bucket_n.fill(0)
+        tier.bucket_max_drops = math.nan
+        return rolled
+
+    def view(self, step=1, last=None):
+        """Возвращает (base_time, ndarray[N, len(COLUMNS)]) - срез без копирования для уровня step.
+
+        Срез действителен до следующей записи: при заполненном буфере самая старая строка
+        может быть перезаписана новой, что для отображения графиков несущественно.
+        """
+        for tier in self._tiers:
+            if tier.step == step:
+                data = tier.view()
+                if last is not None:
+                    data = data[-last:]
+                return self.base_time, data
+        raise ValueError(f"Нет уровня детализации с шагом {step} с. Доступны: {self.tiers()}")
+
+    def latest(self, count):
+        """Последние count секундных замеров в виде словарей (для обратной совместимости)."""
+        base_time, data = self.view(1, last=count)
+        result = []
+        for row in data:
+            item = {name: (None if math.isnan(value) else float(value)) for name, value in zip(VALUE_COLUMNS, row[1:])}
+            item["last_update_time"] = base_time + float(row[0])
+            result.append(item)
+        return result
@@ -0,0 +1,152 @@
+import os
+import json
+import time
+import socket
+import logging
+import threading
+import urllib.error
+import urllib.request
+
+from rtmp_to_rtsp_converter.registry import NODE_ID
+from rtmp_to_rtsp_converter.admission import NODE_MAX_STREAMS, NODE_NIC_MBIT
+
+# Узел-исполнитель кластера (см. cluster.py): отчет о емкости и heartbeat координатору.
+#
+# Узел - обычный процесс HTTP API (api.py) со своим менеджером конвертеров. С --coordinator он раз в
+# HEARTBEAT_SEC отправляет координатору отчет (node_report): загрузку CPU и RSS процессами FFmpeg,
+# байты сетевых интерфейсов, отправленные байты потоков с точным объемом выходов, число потоков и их описания. Описания
+# нужны, чтобы перезапущенный координатор восстановил размещение без собственной базы.
+
+HEARTBEAT_SEC = float(os.environ.get("KAZSTREAMLINK_HEARTBEAT", "2"))
+HTTP_TIMEOUT_SEC = 10.0
+# Токен HTTP API (api.py): один на кластер, узлы и координатор передают его друг другу
+API_TOKEN = os.environ.get("KAZSTREAMLINK_API_TOKEN", "")
+
+
+def read_nic_bytes():
+    """Сумма принятых и отправленных байт всех интерфейсов, кроме lo (/proc/net/dev), или None."""
+    try:
+        with open("/proc/net/dev", "rb") as f:
+            lines = f.read().splitlines()[2:]
+    except OSError:
+        return None
+    total = 0
+    for line in lines:
+        name, _, counters = line.partition(b":")
+        if name.strip() == b"lo":
+            continue
+        fields = counters.split()
+        total += int(fields[0]) + int(fields[8]) # rx_bytes, tx_bytes
+    return total
+
+
+def spec_of(converter):
+    """Описание потока (как в POST /streams) по конвертеру или PackedStream."""
+    return {
+        "stream_id": converter.stream_id,
+        "rtmp_url": converter.rtmp_url,
+        "rtsp_server_host": converter.rtsp_server_host,
+        "rtsp_port": converter.rtsp_port,
+        "rtsp_path": converter.rtsp_path,
+        "extra_outputs": list(converter.extra_outputs),
+        "record": converter.recorder is not None,
+        "on_demand": converter.on_demand,
+        "profile": converter.profile.name,
+    }
+
+
+def default_node_id(port):
+    return NODE_ID or f"{socket.gethostname()}:{port}"
+
+
+def node_report(manager, node_id, url=None):
+    """Емкость и потоки узла по снимку менеджера (fleet.py)."""
+    snapshot = manager.snapshot()
+    cpu_percent = memory_mb = output_bytes = 0.0
+    counted = 0 # Потоки, у которых известен объем всех выходов
+    streams = []
+    for row in snapshot.rows:
+        metrics = row["metrics"]
+        if isinstance(metrics.get("cpu_percent"), (int, float)):
+            cpu_percent += metrics["cpu_percent"]
+        if isinstance(metrics.get("memory_mb"), (int, float)):
+            memory_mb += metrics["memory_mb"]
+        if row["outputs"] and all(leg["bytes"] is not None for leg in row["outputs"]):
+            output_bytes += sum(leg["bytes"] for leg in row["outputs"])
+            counted += 1
+        converter = manager.get(row["stream_id"])
+        if converter is None:
+            continue
+        streams.append({"stream_id": row["stream_id"], "status": row["status"],
+                        "health_state": metrics.get("health_state"), "spec": spec_of(converter)})
+    return {
+        "node_id": node_id,
+        "url": url,
+        "time": time.time(),
+        "cpu_count": os.cpu_count() or 1,
+        "load1": os.getloadavg()[0] if hasattr(os, "getloadavg") else None,
+        "cpu_percent": round(cpu_percent, 1), # Сумма по процессам FFmpeg, 100 = одно ядро
+        "memory_mb": round(memory_mb, 1),
+        "nic_bytes": read_nic_bytes(),
+        "nic_mbit": NODE_NIC_MBIT,
+        "output_bytes": output_bytes,
+        "output_streams": counted,
+        "max_streams": NODE_MAX_STREAMS,
+        "streams": streams,
+    }
+
+
+def http_json(url, method="GET", body=None, timeout=HTTP_TIMEOUT_SEC):
+    """Запрос JSON к узлу или координатору: (status, payload). OSError - узел недоступен."""
+    data = json.dumps(body).encode("utf-8") if body is not None else None
+    headers = {"Content-Type": "application/json"}
+    if API_TOKEN:
+        headers["Authorization"] = f"Bearer {API_TOKEN}"
+    request = urllib.request.Request(url, data=data, method=method, headers=headers)
+    try:
+        with urllib.request.urlopen(request, timeout=timeout) as response:
+            raw = response.read()
+            return response.status, (json.loads(raw) if raw else None)
+    except urllib.error.HTTPError as e: # Ответ с кодом ошибки - узел доступен
+        raw = e.read()
+        try:
+            return e.code, json.loads(raw) if raw else None
+        except ValueError:
+            return e.code, {"error": raw.decode("utf-8", errors="replace")}
+
+
+class WorkerAgent:
+    """Фоновый поток heartbeat: отправляет координатору node_report раз в HEARTBEAT_SEC."""
+
+    def __init__(self, manager, coordinator_url, node_id, advertise_url, period=HEARTBEAT_SEC):
+        self.manager = manager
+        self.coordinator_url = coordinator_url.rstrip("/")
+        self.node_id = node_id
+        self.advertise_url = advertise_url.rstrip("/")
+        self.period = period
+        self._stop_event = threading.Event()
+        self._thread = None
+        self.connected = False
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, daemon=True, name="cluster_heartbeat")
+        self._thread.start()
+
+    def stop(self):
+        self._stop_event.set()
+
+    def _run(self):
+        while not self._stop_event.is_set():
+            try:
+                status, _ = http_json(f"{self.coordinator_url}/nodes/heartbeat", "POST",
+                                      node_report(self.manager, self.node_id, self.advertise_url))
+                if not self.connected:
+                    logging.info(f"Узел {self.node_id} подключен к координатору {self.coordinator_url} (ответ {status}).")
+                self.connected = status == 200
+            except OSError as e:
+                if self.connected:
+                    logging.warning(f"Координатор {self.coordinator_url} недоступен: {e}")
+                self.connected = False
+            except Exception as e:
+                logging.error(f"Ошибка heartbeat узла {self.node_id}: {e}")
+            self._stop_event.wait(self.period)
@@ -0,0 +1,277 @@
+import os
+import time
+import logging
+
+from rtmp_to_rtsp_converter.reactor import get_reactor
+from rtmp_to_rtsp_converter.admission import AdmissionRejected
+from rtmp_to_rtsp_converter.profiling import Histogram, get_instrumentation
+from rtmp_to_rtsp_converter.state import STATUS_RUNNING, STATUS_STARTING, STATUS_STOPPING, FINAL_STATUSES
+
+# Потоки по запросу (spec "on_demand": true).
+#
+# Обычный поток тянет RTMP-источник и отправляет его в mediamtx круглосуточно, даже когда его никто
+# не смотрит. Поток по запросу только зарегистрирован (статус "ожидание"), а FFmpeg запускается,
+# когда к пути RTSP подключается первый зритель, и останавливается через ONDEMAND_IDLE_SEC после
+# ухода последнего. О зрителях сообщает mediamtx хуками путей (mediamtx.yml):
+#   runOnDemand   -> POST /demand/read?path=$MTX_PATH    (первый зритель пути без источника)
+#   runOnUnDemand -> POST /demand/unread?path=$MTX_PATH  (зрителей не осталось)
+# Те же вызовы может делать любой другой RTSP-сервер или скрипт (см. benchmarks/bench_ondemand.py).
+#
+# read() запускает процесс через менеджер (с проверкой емкости узла, admission.py) и по умолчанию
+# ждет первого отправленного пакета. Холодный старт - время от запроса зрителя до первого пакета -
+# копится в гистограмме: вместе с долей времени, когда процессы работали, это цена экономии CPU и сети.
+# Остановка по простою идет на таймере цикла ввода-вывода и не меняет желаемое состояние в реестре;
+# поток, остановленный пользователем, на запросы зрителей не запускается до ручного запуска.
+
+ONDEMAND_IDLE_SEC = float(os.environ.get("KAZSTREAMLINK_ONDEMAND_IDLE_SEC", "30")) # Простой без зрителей до остановки
+ONDEMAND_START_TIMEOUT_SEC = float(os.environ.get("KAZSTREAMLINK_ONDEMAND_START_TIMEOUT", "10")) # Ожидание первого пакета в read()
+ONDEMAND_CHECK_PERIOD_SEC = 1.0
+COLD_START_BOUNDS = (0.1, 0.25, 0.5, 0.75, 1.0, 1.5, 2.0, 3.0, 5.0, 7.5, 10.0, 15.0, 30.0)
+COLD_START_QUANTILES = (0.5, 0.95, 0.99)
+_ACTIVE_STATUSES = (STATUS_RUNNING, STATUS_STARTING, STATUS_STOPPING) # Процесс FFmpeg существует
+
+
+class DemandEntry:
+    """Зрители и учет одного потока по запросу."""
+    __slots__ = ("converter", "enabled", "readers", "starting", "demand_at", "idle_since", "registered_at",
+                 "active_seconds", "demands", "cold_starts", "last_cold_start_s", "start_failures", "idle_stops",
+                 "bitrate_kbit", "cpu_percent")
+
+    def __init__(self, converter, enabled=True):
+        self.converter = converter
+        self.enabled = enabled # False - поток остановлен пользователем
+        self.readers = 0
+        self.starting = False # Запуск по запросу зрителя идет в другом потоке
+        self.demand_at = None # time.monotonic() запроса, запустившего процесс (до первого пакета)
+        self.idle_since = None
+        self.registered_at = time.monotonic()
+        self.active_seconds = 0.0 # Сколько работал процесс FFmpeg
+        self.demands = 0
+        self.cold_starts = 0
+        self.last_cold_start_s = None
+        self.start_failures = 0
+        self.idle_stops = 0
+        self.bitrate_kbit = None # Последние замеры работающего процесса - для оценки экономии
+        self.cpu_percent = None
+
+
+class OnDemandController:
+    """Запуск потоков по запросу зрителей и остановка по простою."""
+
+    def __init__(self, manager, idle_sec=ONDEMAND_IDLE_SEC, start_timeout=ONDEMAND_START_TIMEOUT_SEC):
+        self._manager = manager
+        self.idle_sec = idle_sec
+        self.start_timeout = start_timeout
+        self._entries = {} # {stream_id: DemandEntry}
+        self._paths = {} # {путь RTSP без "/": stream_id}
+        self._lock = get_instrumentation().lock("ondemand")
+        self.cold_start_histogram = Histogram(COLD_START_BOUNDS)
+        self.start_timeouts = 0 # read() не дождался первого пакета за start_timeout
+        self._timer = None
+        self._last_tick = None
+
+    def register(self, converter, enabled=True):
+        with self._lock:
+            self._entries[converter.stream_id] = DemandEntry(converter, enabled)
+            self._paths[converter.rtsp_path.strip("/")] = converter.stream_id
+            if self._timer is None: # Таймер нужен, только пока есть потоки по запросу
+                self._last_tick = time.monotonic()
+                self._timer = get_reactor().call_every(ONDEMAND_CHECK_PERIOD_SEC, self._check)
+
+    def forget(self, stream_id):
+        with self._lock:
+            entry = self._entries.pop(stream_id, None)
+            if entry and self._paths.get(entry.converter.rtsp_path.strip("/")) == stream_id:
+                del self._paths[entry.converter.rtsp_path.strip("/")]
+
+    def set_enabled(self, stream_ids, enabled):
+        """Ручной запуск (enabled=True) или остановка потоков; остальные stream_ids пропускаются."""
+        with self._lock:
+            for stream_id in stream_ids:
+                entry = self._entries.get(stream_id)
+                if entry:
+                    entry.enabled = enabled
+                    if not enabled:
+                        entry.readers = 0
+                        entry.demand_at = None
+
+    def is_on_demand(self, stream_id):
+        return stream_id in self._entries
+
+    def _entry(self, path=None, stream_id=None):
+        with self._lock:
+            if stream_id is None:
+                stream_id = self._paths.get((path or "").strip("/"))
+            entry = self._entries.get(stream_id)
+        if entry is None:
+            raise KeyError(stream_id or path)
+        return entry
+
+    def read(self, path=None, stream_id=None, wait=True):
+        """Зритель подключился: запускает FFmpeg, если он не работает; при wait - ждет первого пакета.
+
+        KeyError - поток по запросу не найден, ValueError - поток остановлен пользователем,
+        AdmissionRejected - не хватает емкости узла, RuntimeError - FFmpeg не запустился.
+        """
+        entry = self._entry(path, stream_id)
+        converter = entry.converter
+        with self._lock:
+            if not entry.enabled:
+                raise ValueError(f"Поток {converter.stream_id} остановлен пользователем.")
+            entry.readers += 1
+            entry.demands += 1
+            entry.idle_since = None
+            launch = not entry.starting and converter.state.status not in (STATUS_RUNNING, STATUS_STARTING)
+            if launch:
+                entry.starting = True
+                entry.demand_at = time.monotonic()
+        cold_start = entry.demand_at is not None
+        if launch:
+            logging.info(f"Зритель запросил поток {converter.stream_id}: запуск FFmpeg по запросу.")
+            try:
+                result = self._manager.start_many([converter.stream_id], persist=False)[0]
+            finally:
+                with self._lock:
+                    entry.starting = False
+            if not result["ok"]:
+                with self._lock:
+                    entry.readers = max(0, entry.readers - 1)
+                    entry.demand_at = None
+                    entry.start_failures += 1
+                    if not entry.readers:
+                        entry.idle_since = time.monotonic()
+                if result.get("rejected"):
+                    raise AdmissionRejected(converter.stream_id, None, result["error"])
+                raise RuntimeError(result.get("error") or f"Не удалось запустить поток {converter.stream_id}.")
+        if cold_start and wait:
+            if converter.wait_first_packet(self.start_timeout):
+                self._record_cold_start(entry)
+            elif converter.state.status in _ACTIVE_STATUSES:
+                self.start_timeouts += 1 # Задержку учтет таймер, когда пакет все-таки придет
+        return self._describe(entry, cold_start)
+
+    def unread(self, path=None, stream_id=None):
+        """Зритель отключился; без зрителей поток остановится через idle_sec."""
+        entry = self._entry(path, stream_id)
+        with self._lock:
+            if entry.readers:
+                entry.readers -= 1
+            if not entry.readers and entry.idle_since is None:
+                entry.idle_since = time.monotonic()
+        return self._describe(entry)
+
+    def _record_cold_start(self, entry):
+        with self._lock:
+            demand_at = entry.demand_at
+            first_packet_at = entry.converter.first_packet_at
+            if demand_at is None or first_packet_at is None or first_packet_at < demand_at:
+                return # Уже учтен (read() и таймер) или пакет относится к прошлому процессу
+            entry.demand_at = None
+            seconds = first_packet_at - demand_at
+            entry.cold_starts += 1
+            entry.last_cold_start_s = round(seconds, 3)
+            self.cold_start_histogram.observe(seconds)
+        logging.info(f"Холодный старт потока {entry.converter.stream_id}: {seconds:.2f} с до первого пакета.")
+
+    def _check(self):
+        """Таймер цикла: учет времени работы, отложенные замеры холодного старта и остановка по простою."""
+        now = time.monotonic()
+        elapsed = now - self._last_tick
+        self._last_tick = now
+        with self._lock:
+            entries = list(self._entries.values())
+        idle = []
+        for entry in entries:
+            converter = entry.converter
+            status = converter.state.status
+            if status not in _ACTIVE_STATUSES:
+                entry.idle_since = None
+                if entry.demand_at is not None and status in FINAL_STATUSES and not entry.starting:
+                    entry.demand_at = None # Процесс завершился, не отправив ни одного пакета
+                continue
+            entry.active_seconds += elapsed
+            metrics = converter.metrics
+            if isinstance(metrics.bitrate_kbit, (int, float)):
+                entry.bitrate_kbit = metrics.bitrate_kbit
+            if isinstance(metrics.cpu_percent, (int, float)):
+                entry.cpu_percent = metrics.cpu_percent
+            if entry.demand_at is not None and converter.first_packet_at is not None:
+                self._record_cold_start(entry)
+            if entry.readers or entry.starting or status == STATUS_STOPPING:
+                continue
+            if entry.idle_since is None: # Например, поток запущен вручную без зрителей
+                entry.idle_since = now
+            elif now - entry.idle_since >= self.idle_sec:
+                idle.append(entry)
+        for entry in idle:
+            with self._lock:
+                if entry.readers or entry.starting: # Зритель пришел, пока шла проверка
+                    continue
+                entry.idle_stops += 1
+                entry.idle_since = None
+            logging.info(f"Поток по запросу {entry.converter.stream_id}: зрителей нет {self.idle_sec:.0f} с, остановка FFmpeg.")
+            entry.converter.stop(wait=False) # Эскалация сигналов - на таймерах цикла, поток цикла не блокируется
+
+    def _describe(self, entry, cold_start=None):
+        info = {
+            "stream_id": entry.converter.stream_id,
+            "path": entry.converter.rtsp_path,
+            "status": entry.converter.get_status(),
+            "readers": entry.readers,
+        }
+        if cold_start is not None:
+            info["cold_start"] = cold_start
+            info["cold_start_s"] = entry.last_cold_start_s if cold_start else None
+        return info
+
+    def report(self):
+        """Зрители и холодные старты потоков по запросу и оценка экономии против круглосуточной работы."""
+        now = time.monotonic()
+        with self._lock:
+            entries = list(self._entries.values())
+        histogram = self.cold_start_histogram
+        cold_start = {
+            "count": histogram.count,
+            "timeouts": self.start_timeouts,
+            "mean_s": round(histogram.sum / histogram.count, 3) if histogram.count else None,
+            "max_s": round(histogram.max, 3) if histogram.count else None,
+        }
+        for q in COLD_START_QUANTILES:
+            value = histogram.quantile(q)
+            cold_start[f"p{int(q * 100)}_s"] = round(value, 3) if value is not None else None
+        streams = []
+        total_seconds = active_seconds = cpu_core_seconds = ingest_bytes = 0.0
+        for entry in entries:
+            lifetime = max(now - entry.registered_at, 1e-9)
+            off_seconds = max(0.0, lifetime - entry.active_seconds)
+            total_seconds += lifetime
+            active_seconds += entry.active_seconds
+            if entry.cpu_percent is not None:
+                cpu_core_seconds += off_seconds * entry.cpu_percent / 100
+            if entry.bitrate_kbit is not None:
+                ingest_bytes += off_seconds * entry.bitrate_kbit * 1000 / 8
+            streams.append(dict(
+                self._describe(entry),
+                enabled=entry.enabled,
+                demands=entry.demands,
+                cold_starts=entry.cold_starts,
+                last_cold_start_s=entry.last_cold_start_s,
+                start_failures=entry.start_failures,
+                idle_stops=entry.idle_stops,
+                duty_cycle=round(entry.active_seconds / lifetime, 4),
+            ))
+        return {
+            "streams": len(entries),
+            "active": sum(1 for entry in entries if entry.converter.state.status in _ACTIVE_STATUSES),
+            "readers": sum(entry.readers for entry in entries),
+            "idle_sec": self.idle_sec,
+            "cold_start": cold_start,
+            # Экономия против круглосуточной работы тех же потоков: процессы, ядра CPU и трафик от источников
+            "savings": {
+                "duty_cycle": round(active_seconds / total_seconds, 4) if total_seconds else None,
+                "process_seconds": round(total_seconds - active_seconds, 1),
+                "cpu_core_seconds": round(cpu_core_seconds, 1),
+                "ingest_gb": round(ingest_bytes / 1e9, 3),
+            },
+            "per_stream": streams,
+        }
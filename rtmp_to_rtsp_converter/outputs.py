@@ -0,0 +1,179 @@
+import os
+import re
+import time
+
+# Раздача одного входа на несколько выходов одним процессом FFmpeg (tee muxer).
+#
+# Без tee на каждый дополнительный выход (второй RTSP-сервер, запись) нужен отдельный
+# процесс FFmpeg, который заново тянет и демультиплексирует тот же RTMP-источник.
+# С tee вход читается один раз, а пакеты (-c copy) раздаются всем "ногам":
+#     -map 0:v:0? -map 0:a:0? -c copy -f tee "[f=rtsp:rtsp_transport=tcp:onfail=ignore]rtsp://a|[f=flv:onfail=ignore]rtmp://b"
+# onfail=ignore: отказ одной ноги не останавливает остальные. FFmpeg сообщает об этом в stderr
+# ("Slave muxer #1 failed: ..."), откуда берется статус ноги (parse_leg_failure).
+#
+# Побайтовых счетчиков по ногам FFmpeg не выдает (total_size у tee и RTSP всегда N/A), а байты,
+# отправленные в сокеты (send/sendto), не попадают в /proc/<pid>/io. Поэтому объем ноги известен
+# только там, где он точный: единственный выход с total_size в -progress и запись сегментами
+# (размеры файлов, см. recording.py). У остальных ног bytes = None - объем неизвестен.
+
+# Допустимые выходы. API не требует входа по паролю на loopback (api.py), поэтому описание потока не
+# должно позволять FFmpeg писать куда угодно: сетевые выходы - только по схемам из NETWORK_OUTPUT_SCHEMES,
+# файлы - только внутри OUTPUT_DIR (относительный путь считается от него). Вход - только сетевой
+# источник (INPUT_SCHEMES): file:, pipe: и подобные протоколы FFmpeg открыли бы локальные файлы.
+OUTPUT_DIR = os.environ.get("KAZSTREAMLINK_OUTPUT_DIR", "outputs") # Пустая строка - выходы в файлы запрещены
+NETWORK_OUTPUT_SCHEMES = ("rtsp", "rtsps", "rtmp", "rtmps", "srt", "udp", "rtp")
+INPUT_SCHEMES = ("rtmp", "rtmps", "rtmpt", "rtmpe", "rtmpte", "rtmpts", "rtsp", "rtsps", "srt", "udp")
+
+LEG_RUNNING = "работает"
+LEG_FAILED = "ошибка"
+LEG_IDLE = "ожидание"
+
+# Формат ноги по схеме URL или расширению файла (для остальных FFmpeg определит формат сам)
+_SCHEME_FORMATS = {
+    "rtsp": "rtsp", "rtsps": "rtsp", "rtmp": "flv", "rtmps": "flv",
+    "srt": "mpegts", "udp": "mpegts", "rtp": "rtp_mpegts",
+}
+_EXTENSION_FORMATS = {".flv": "flv", ".ts": "mpegts", ".mkv": "matroska", ".mp4": "mp4", ".mov": "mov"}
+# Опции ног RTSP по умолчанию; профиль потока задает свои (см. profiles.py)
+DEFAULT_RTSP_OPTIONS = (("rtsp_transport", "tcp"),)
+
+_PROTOCOL_RE = re.compile(r"^[A-Za-z][A-Za-z0-9+.-]+:") # Протокол FFmpeg без "//": file:, pipe:, concat:...
+_SLAVE_FAILED_RE = re.compile(r"Slave muxer #(\d+) failed")
+_SLAVE_OPEN_RE = re.compile(r"Slave '(.*?)': error")
+
+
+def guess_format(url):
+    scheme, sep, _ = url.partition("://")
+    if sep:
+        return _SCHEME_FORMATS.get(scheme.lower())
+    return _EXTENSION_FORMATS.get(os.path.splitext(url)[1].lower())
+
+
+def check_input_url(url):
+    """ValueError, если вход не сетевой источник с допустимой схемой."""
+    scheme, sep, _ = url.partition("://")
+    if not sep or scheme.lower() not in INPUT_SCHEMES:
+        raise ValueError(f"Источник должен быть URL со схемой {', '.join(INPUT_SCHEMES)}: {url}")
+
+
+def output_path(url, output_dir=OUTPUT_DIR):
+    """URL, который получит FFmpeg: сетевой выход как есть, файл - абсолютный путь внутри output_dir.
+
+    ValueError, если схема не разрешена или файл оказывается вне output_dir (в том числе через .. и ссылки).
+    """
+    scheme, sep, _ = url.partition("://")
+    if sep:
+        if scheme.lower() not in NETWORK_OUTPUT_SCHEMES:
+            raise ValueError(f"Схема выхода {scheme} не разрешена (допустимы {', '.join(NETWORK_OUTPUT_SCHEMES)} и файлы).")
+        return url
+    if url.startswith("file:"):
+        url = url[5:]
+    elif _PROTOCOL_RE.match(url):
+        raise ValueError(f"Протокол выхода {url.split(':', 1)[0]} не разрешен.")
+    if not output_dir:
+        raise ValueError("Выходы в файлы запрещены (KAZSTREAMLINK_OUTPUT_DIR не задан).")
+    base = os.path.realpath(output_dir)
+    path = os.path.realpath(os.path.join(base, url))
+    if os.path.commonpath([base, path]) != base or path == base:
+        raise ValueError(f"Файл выхода должен быть внутри {base}: {url}")
+    os.makedirs(os.path.dirname(path), exist_ok=True) # FFmpeg сам каталоги не создает
+    return path
+
+
+def _escape_tee(value):
+    # Спецсимволы синтаксиса tee: разделитель ног '|', скобки опций и обратная косая черта
+    for char in "\\|[]":
+        value = value.replace(char, "\\" + char)
+    return value
+
+
+def tee_option(key, value):
+    """Опция ноги tee со значением, экранированным для обоих уровней разбора (опции ноги и список ног)."""
+    for char in "\\:]":
+        value = value.replace(char, "\\" + char)
+    return f"{key}={_escape_tee(value)}"
+
+
+def tee_spec(urls, leg_options=None, rtsp_options=DEFAULT_RTSP_OPTIONS):
+    """Строка выходов для -f tee: по ноге на URL, каждая с onfail=ignore.
+
+    leg_options ({url: [опции]}) задает опции ноги вместо определенных по URL (запись сегментами, см. recording.py);
+    rtsp_options ((ключ, значение), ...) - опции ног RTSP.
+    """
+    legs = []
+    for url in urls:
+        if leg_options and url in leg_options:
+            options = list(leg_options[url]) + ["onfail=ignore"]
+            legs.append(f"[{':'.join(options)}]{_escape_tee(url)}")
+            continue
+        fmt = guess_format(url)
+        options = ([f"f={fmt}"] if fmt else []) + ["onfail=ignore"]
+        if fmt == "rtsp":
+            options[1:1] = [tee_option(key, value) for key, value in rtsp_options]
+        legs.append(f"[{':'.join(options)}]{_escape_tee(url)}")
+    return "|".join(legs)
+
+
+def map_args(input_index):
+    """Явный выбор потоков входа: первое видео и первое аудио, как выбор FFmpeg по умолчанию."""
+    return ["-map", f"{input_index}:v:0?", "-map", f"{input_index}:a:0?"]
+
+
+def output_args(urls, input_index=None, leg_options=None, rtsp_options=DEFAULT_RTSP_OPTIONS):
+    """Аргументы FFmpeg после -i: прямой выход для одного URL или tee для нескольких.
+
+    input_index задает вход явно (несколько входов в одном процессе, см. packing.py).
+    Ноги с leg_options всегда идут через tee. rtsp_options - транспорт и буферы выходов RTSP (profiles.py).
+    """
+    if len(urls) == 1 and not leg_options:
+        fmt = guess_format(urls[0]) or "rtsp"
+        args = map_args(input_index) if input_index is not None else []
+        args += ["-c:v", "copy", "-c:a", "copy", "-f", fmt]
+        if fmt == "rtsp": # Транспорт для RTSP (по умолчанию TCP - он надежнее) и буферы
+            for key, value in rtsp_options:
+                args += [f"-{key}", value]
+        return args + [urls[0]]
+    # tee требует явного выбора потоков
+    return map_args(input_index or 0) + ["-c:v", "copy", "-c:a", "copy", "-f", "tee", tee_spec(urls, leg_options, rtsp_options)]
+
+
+def parse_leg_failure(line, urls):
+    """Возвращает индекс ноги tee, об отказе которой сообщает строка stderr, или None."""
+    if "Slave" not in line:
+        return None
+    match = _SLAVE_FAILED_RE.search(line)
+    if match:
+        index = int(match.group(1))
+        return index if index < len(urls) else None
+    match = _SLAVE_OPEN_RE.search(line)
+    if match and match.group(1) in urls:
+        return urls.index(match.group(1))
+    return None
+
+
+class OutputLeg:
+    """Один выход конвертера и его состояние."""
+    __slots__ = ("url", "status", "error", "bytes", "started_at", "failed_at")
+
+    def __init__(self, url):
+        self.url = url
+        self.status = LEG_IDLE
+        self.error = None
+        self.bytes = None # Только точный объем, иначе None (см. описание модуля)
+        self.started_at = None
+        self.failed_at = None
+
+    def mark_started(self):
+        self.status = LEG_RUNNING
+        self.error = None
+        self.started_at = time.time()
+        self.failed_at = None
+
+    def mark_failed(self, error):
+        self.status = LEG_FAILED
+        self.error = error
+        self.failed_at = time.time()
+
+    def as_dict(self):
+        return {"url": self.url, "status": self.status, "error": self.error,
+                "bytes": int(self.bytes) if self.bytes is not None else None, "started_at": self.started_at, "failed_at": self.failed_at}
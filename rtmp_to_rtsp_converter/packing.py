@@ -0,0 +1,300 @@
+import os
+import re
+import logging
+import threading
+from collections import deque
+
+from rtmp_to_rtsp_converter.converter import RTMPToRTSPConverter, FFMPEG_PATH, GLOBAL_OPTIONS
+from rtmp_to_rtsp_converter.profiles import get_profile
+from rtmp_to_rtsp_converter.outputs import OutputLeg, output_args, output_path
+from rtmp_to_rtsp_converter.metrics_store import MetricsStore
+from rtmp_to_rtsp_converter.log_pipeline import CATEGORIES
+from rtmp_to_rtsp_converter.state import AtomicRef, STATUS_STOPPED
+
+# Упаковка нескольких потоков в один процесс FFmpeg.
+#
+# Каждый процесс FFmpeg стоит десятки МБ RSS, и при -c copy почти вся эта память - накладные
+# расходы самого процесса. В режиме упаковки (KAZSTREAMLINK_PACK_SIZE > 1) массовое создание
+# потоков объединяет до PACK_SIZE потоков в одну группу - один процесс с парами -i/-map:
+#     ffmpeg ... -i rtmp://a -i rtmp://b  -map 0:v:0? -map 0:a:0? ... rtsp://.../a  -map 1:v:0? ... rtsp://.../b
+# Вход i всегда соответствует выходному файлу i, поэтому строки stderr с префиксом
+# [in#i/...] или [out#i/...] относятся к потоку i группы.
+#
+# Группа (PackedConverterGroup) - обычный конвертер для супервизора: фатальная ошибка любого
+# входа или выхода завершает процесс группы, и перезапускается только эта группа
+# (с backoff и общим лимитом перезапусков, см. supervisor.py).
+#
+# Разделение -progress по потокам ограничено тем, что выдает FFmpeg: fps, битрейт, total_size
+# и счетчики кадров относятся к первому выходу процесса (поток 0 группы), speed и out_time -
+# ко всему процессу. Поэтому поток 0 получает эти значения точно, у остальных они "N/A"
+# (FIRST_OUTPUT_METRICS), а CPU и RSS процесса делятся между потоками группы поровну.
+# Здоровье группы с несколькими потоками оценивается только по speed и out_time: правила
+# отброшенных кадров и падения битрейта по потоку 0 приписали бы его состояние всей группе.
+#
+# Остановка или повторный запуск одного потока перезапускает процесс группы без него
+# (FFmpeg не умеет отключать вход на ходу) - остальные потоки группы прерываются на время запуска.
+
+PACK_SIZE = int(os.environ.get("KAZSTREAMLINK_PACK_SIZE", "1")) # 1 - упаковка выключена
+FIRST_OUTPUT_METRICS = ("fps", "bitrate_kbit", "total_size", "dropped_frames", "dup_frames")
+
+_CONTEXT_RE = re.compile(r"\[(?:in|out)#(\d+)")
+# Ошибки, после которых вход или выход потока не восстановится без перезапуска процесса
+_FATAL_RE = re.compile(
+    r"Error during demuxing|Error opening (?:input|output)|Input/output error|Connection (?:refused|reset|timed out)"
+    r"|Broken pipe|Error muxing|Error writing|Server returned",
+    re.IGNORECASE
+)
+
+
+class PackedStream:
+    """Поток внутри группы: тот же интерфейс, что у RTMPToRTSPConverter, для менеджера, API и UI."""
+
+    def __init__(self, group, spec):
+        self.group = group
+        self.stream_id = spec["stream_id"]
+        self.rtmp_url = spec["rtmp_url"]
+        self.rtsp_server_host = spec["rtsp_server_host"]
+        self.rtsp_port = spec["rtsp_port"]
+        self.rtsp_path = spec["rtsp_path"]
+        self.output_rtsp_url_for_ffmpeg_push = f"rtsp://{self.rtsp_server_host}:{self.rtsp_port}/{self.rtsp_path}"
+        self.final_rtsp_url_for_client = self.output_rtsp_url_for_ffmpeg_push
+        self.extra_outputs = list(spec.get("extra_outputs") or [])
+        self.output_legs = [OutputLeg(url) for url in [self.output_rtsp_url_for_ffmpeg_push] + [output_path(url) for url in self.extra_outputs]]
+        self.recorder = None # Потоки с записью не упаковываются
+        self.on_demand = False # Потоки по запросу тоже (см. ondemand.py)
+        self.profile = get_profile(spec.get("profile")) # Опции своего входа и своих ног RTSP (см. profiles.py)
+        self.latency_probe = None # У каждого потока группы свой путь RTSP и свой зонд (см. latency.py)
+        self._metrics = AtomicRef(RTMPToRTSPConverter._empty_metrics()) # Снимки публикует процесс группы
+        self.metrics_store = MetricsStore()
+        self.ffmpeg_logs = deque(maxlen=100)
+        self.error_counts = dict.fromkeys(CATEGORIES, 0) # Ошибки stderr группы, отнесенные к этому потоку
+        self.last_error_message = None
+        self.stopped = False
+
+    @property
+    def metrics(self):
+        return self._metrics.get()
+
+    # Состояние процесса берется у группы
+    @property
+    def status(self):
+        return STATUS_STOPPED if self.stopped else self.group.status
+
+    @property
+    def process(self):
+        return self.group.process
+
+    @property
+    def started_at(self):
+        return self.group.started_at
+
+    @property
+    def start_count(self):
+        return self.group.start_count
+
+    @property
+    def first_packet_at(self):
+        return self.group.first_packet_at
+
+    @property
+    def auto_restarts(self):
+        return self.group.auto_restarts
+
+    @property
+    def restart_policy(self):
+        return self.group.restart_policy
+
+    def output_urls(self):
+        return [leg.url for leg in self.output_legs]
+
+    def get_status(self):
+        return STATUS_STOPPED if self.stopped else self.group.get_status()
+
+    def get_metrics(self):
+        metrics = self.metrics.as_dict()
+        group_metrics = self.group.get_metrics()
+        for key in ("auto_restarts", "time_to_recover_s", "flapping", "log_lines_suppressed",
+                    "health_score", "health_state", "health_reasons", "unhealthy_restarts"):
+            metrics[key] = group_metrics[key]
+        metrics["ffmpeg_errors"] = dict(self.error_counts)
+        metrics[self.group.member_label] = self.group.stream_id
+        probe = self.latency_probe
+        if probe:
+            metrics.update(probe.metrics())
+        return metrics
+
+    def get_metrics_history(self, count=60):
+        return self.metrics_store.latest(count)
+
+    def get_metrics_series(self, step=1):
+        return self.metrics_store.view(step)
+
+    def get_output_legs(self):
+        return [leg.as_dict() for leg in self.output_legs]
+
+    def get_recordings(self, since=None, until=None, at=None):
+        return None
+
+    def get_ffmpeg_logs(self):
+        return list(self.ffmpeg_logs)
+
+    def get_last_error(self):
+        return self.last_error_message or self.group.get_last_error()
+
+    def start(self):
+        self.group.start_members([self])
+
+    def stop(self, wait=True):
+        self.group.stop_members([self], wait=wait)
+
+    def wait_stopped(self, timeout=None):
+        return self.group.wait_stopped(timeout)
+
+    @property
+    def last_stop(self):
+        return self.group.last_stop
+
+
+class PackedConverterGroup(RTMPToRTSPConverter):
+    """Один процесс FFmpeg для нескольких потоков."""
+    member_label = "packed_group" # Ключ ID группы в метриках потока (get_metrics)
+
+    def __init__(self, group_id, specs, restart_policy=None):
+        first = specs[0]
+        super().__init__(group_id, first["rtmp_url"], first["rtsp_server_host"], first["rtsp_port"], first["rtsp_path"],
+                         restart_policy=restart_policy)
+        self.members = [PackedStream(self, spec) for spec in specs]
+        self._running_members = [] # Потоки в порядке входов текущего процесса
+        self._members_lock = threading.RLock()
+
+    def active_members(self):
+        return [member for member in self.members if not member.stopped]
+
+    def _ffmpeg_command(self):
+        members = self._running_members = self.active_members()
+        # Ноги всех потоков группы: запуск/остановка процесса обновляют их статусы в базовом классе
+        self.output_legs = [leg for member in members for leg in member.output_legs]
+        cmd = [FFMPEG_PATH, *GLOBAL_OPTIONS]
+        for member in members:
+            cmd += [*member.profile.input_options(member.rtmp_url), '-i', member.rtmp_url]
+        for index, member in enumerate(members):
+            cmd += output_args(member.output_urls(), input_index=index, rtsp_options=member.profile.rtsp_options())
+        return cmd
+
+    def _capacity_inputs(self):
+        return [(member.stream_id, member.rtmp_url) for member in self._running_members]
+
+    def start(self, restart=False):
+        if not self.active_members():
+            logging.warning(f"В группе {self.stream_id} нет потоков для запуска.")
+            return
+        for member in self.active_members():
+            member._metrics.set(self._empty_metrics())
+            if not restart:
+                member.metrics_store.clear()
+                member.ffmpeg_logs.clear()
+                member.last_error_message = None
+        super().start(restart)
+
+    def start_members(self, members):
+        """(Пере)запускает процесс группы, включив в него members."""
+        with self._members_lock:
+            for member in members:
+                member.stopped = False
+            if self.process and self.process.poll() is None:
+                self.stop()
+            self.start(restart=True)
+
+    def stop_members(self, members, wait=True):
+        """Останавливает потоки группы; процесс перезапускается без них, если в группе остались другие.
+
+        wait=False действует, только если остановлена вся группа: перед перезапуском старый процесс нужно дождаться.
+        """
+        with self._members_lock:
+            for member in members:
+                member.stopped = True
+            self.stop(wait=wait or bool(self.active_members()))
+            if self.active_members():
+                logging.info(f"Перезапуск группы {self.stream_id} без остановленных потоков "
+                             f"({len(self.active_members())} из {len(self.members)} остаются).")
+                self.start(restart=True)
+
+    def discard_member(self, member):
+        """Убирает остановленный поток из группы (удаление из реестра)."""
+        with self._members_lock:
+            if member in self.members:
+                self.members.remove(member)
+            return not self.members
+
+    # --- Разбор вывода FFmpeg по потокам ---
+
+    def _member_for_line(self, line):
+        members = self._running_members
+        match = _CONTEXT_RE.search(line)
+        if match:
+            index = int(match.group(1))
+            return members[index] if index < len(members) else None
+        for member in members: # Старые версии FFmpeg печатают URL вместо префикса [in#N]
+            if member.rtmp_url in line or any(url in line for url in member.output_urls()):
+                return member
+        return None
+
+    def _handle_output_line(self, line_bytes, log_type):
+        if not line_bytes:
+            return
+        line = line_bytes.decode('utf-8', errors='replace').strip()
+        category, entries = self.stderr_pipeline.feed(line) # Лимит частоты общий на процесс группы
+        self.ffmpeg_logs.extend(entries)
+        member = self._member_for_line(line)
+        if member is None:
+            self.last_error_message = line
+            return
+        member.ffmpeg_logs.extend(entries)
+        if category:
+            member.error_counts[category] += 1
+        member.last_error_message = line
+        if _FATAL_RE.search(line):
+            self._on_member_failed(member, line)
+
+    def _on_member_failed(self, member, line):
+        """Фатальная ошибка входа или выхода одного потока: перезапускаем только эту группу."""
+        process = self.process
+        if self._stop_event.is_set() or process is None or process.poll() is not None:
+            return
+        logging.warning(f"Поток {member.stream_id} в группе {self.stream_id} отказал ({line}), перезапуск группы.")
+        self.last_error_message = f"{member.stream_id}: {line}"
+        try:
+            process.terminate() # Завершение процесса обработает супервизор, как любое падение FFmpeg
+        except OSError:
+            pass
+
+    def _publish_system_metrics(self, cpu_percent, memory_mb, sample_time):
+        super()._publish_system_metrics(cpu_percent, memory_mb, sample_time)
+        if self._stop_event.is_set():
+            return
+        members = self._running_members
+        if not members:
+            return
+        share = len(members)
+        group_metrics = self.metrics
+        for index, member in enumerate(members):
+            changes = {
+                "cpu_percent": round(cpu_percent / share, 2) if isinstance(cpu_percent, (int, float)) else cpu_percent,
+                "memory_mb": round(memory_mb / share, 2) if isinstance(memory_mb, (int, float)) else memory_mb,
+                "speed": group_metrics.speed,
+                "out_time_us": group_metrics.out_time_us,
+                "last_update_time": sample_time,
+            }
+            for key in FIRST_OUTPUT_METRICS: # FFmpeg выдает их только для первого выхода процесса
+                changes[key] = group_metrics[key] if index == 0 else "N/A"
+            member.metrics_store.append(sample_time, member._metrics.update(**changes))
+
+    def _health_metrics(self, metrics):
+        if len(self._running_members) <= 1:
+            return metrics
+        return metrics.replace(**dict.fromkeys(FIRST_OUTPUT_METRICS, "N/A")) # Остаются speed и out_time всего процесса
+
+    def _reset_system_metrics(self):
+        super()._reset_system_metrics()
+        for member in self._running_members:
+            member._metrics.update(cpu_percent="N/A", memory_mb="N/A")
@@ -0,0 +1,180 @@
+import os
+import re
+import time
+import logging
+import threading
+
+# Кэш результатов анализа входного потока (probe) по RTMP URL.
+#
+# Без кэша каждый запуск и перезапуск FFmpeg тратит до секунды на анализ входа
+# (-analyzeduration 1000000 -probesize 1000000), хотя у одной и той же камеры кодеки
+# и состав потоков не меняются. Запуск с кэшем:
+#   * FFmpeg запускается с -loglevel level+info: строки уровня [info] ("Input #0", "Stream #0:0: Video: ...",
+#     "Output #0") разбирает StreamLayoutParser, остальные строки обрабатываются как раньше;
+#   * после первого успешного запуска (дошел первый пакет) состав потоков сохраняется в кэш;
+#   * следующие запуски того же URL в пределах TTL идут с минимальным анализом (CACHED_PROBE_OPTIONS);
+#   * если разобранный при таком запуске состав не совпал с кэшем, запись удаляется; если при этом
+#     потоков меньше или не определены параметры (например, размер кадра), процесс перезапускается
+#     с полным анализом (через супервизор), как и при падении FFmpeg до первого пакета.
+#
+# Уровень info вместо error увеличивает объем stderr каждого потока: FFmpeg пишет строки [info] и
+# [warning] (состав потоков при каждом запуске, предупреждения нестабильного источника), а отбрасывает
+# их ProbeSession.feed() в Python, а не сам FFmpeg. При KAZSTREAMLINK_PROBE_CACHE=0 кэш выключен и
+# FFmpeg снова запускается с -loglevel error (LOG_OPTIONS в converter.py).
+
+PROBE_CACHE_ENABLED = os.environ.get("KAZSTREAMLINK_PROBE_CACHE", "1") != "0"
+PROBE_TTL_SEC = float(os.environ.get("KAZSTREAMLINK_PROBE_TTL", "3600"))
+
+FULL_PROBE_OPTIONS = ('-analyzeduration', '1000000', '-probesize', '1000000')
+# analyzeduration=0 у FFmpeg означает значение по умолчанию (5 с), поэтому минимум задается явно
+CACHED_PROBE_OPTIONS = ('-analyzeduration', '200000', '-probesize', '65536')
+# Строки [info] нужны только для разбора состава потоков: баннер и статистику отключаем
+PROBE_LOG_OPTIONS = ('-hide_banner', '-nostats', '-loglevel', 'level+info')
+
+_STREAM_RE = re.compile(r"Stream #\d+:(\d+)[^:]*: (Video|Audio|Data|Subtitle): (\w+)(.*)")
+_RESOLUTION_RE = re.compile(r", (\d{2,5})x(\d{2,5})")
+_SAMPLE_RATE_RE = re.compile(r", (\d+) Hz")
+
+
+class StreamLayoutParser:
+    """Разбирает состав входных потоков из вывода FFmpeg уровня info."""
+
+    def __init__(self):
+        self.section = None # "input" | "output"
+        self.streams = []
+        self.complete = False # Выход открыт ("Output #0") - состав входа окончательный
+
+    def feed(self, line):
+        if "Input #" in line:
+            self.section = "input"
+        elif "Output #" in line:
+            self.section = "output"
+            self.complete = True
+        elif self.section == "input":
+            match = _STREAM_RE.search(line)
+            if match:
+                index, kind, codec, details = match.groups()
+                if kind == "Video":
+                    resolution = _RESOLUTION_RE.search(details)
+                    params = f"{resolution.group(1)}x{resolution.group(2)}" if resolution else None
+                elif kind == "Audio":
+                    sample_rate = _SAMPLE_RATE_RE.search(details)
+                    params = f"{sample_rate.group(1)}Hz" if sample_rate else None
+                else:
+                    params = ""
+                self.streams.append((int(index), kind.lower(), codec, params))
+
+    def layout(self):
+        return tuple(sorted(self.streams))
+
+
+def layout_is_complete(layout):
+    """Все ли параметры потоков определены (для copy в RTSP нужны размер кадра и частота)."""
+    return bool(layout) and all(params is not None for _, _, _, params in layout)
+
+
+class _ProbeEntry:
+    __slots__ = ("layout", "stored_at", "hits")
+
+    def __init__(self, layout):
+        self.layout = layout
+        self.stored_at = time.time()
+        self.hits = 0
+
+
+class ProbeSession:
+    """Состояние анализа одного запуска FFmpeg."""
+
+    def __init__(self, cache, url, cached_layout):
+        self.cache = cache
+        self.url = url
+        self.cached_layout = cached_layout
+        self.hit = cached_layout is not None
+        self.parser = StreamLayoutParser()
+        self.layout = None
+
+    def input_options(self, full_options=FULL_PROBE_OPTIONS):
+        """Опции анализа входа: минимальные при известном составе потоков, иначе full_options (профиль потока)."""
+        return CACHED_PROBE_OPTIONS if self.hit else full_options
+
+    def feed(self, line):
+        """Принимает строку stderr; возвращает True, если это строка уровня info/warning (в логи не идет, как при -loglevel error)."""
+        if "[info]" not in line:
+            return "[warning]" in line
+        if not self.parser.complete:
+            self.parser.feed(line)
+            if self.parser.complete:
+                self.layout = self.parser.layout()
+        return True
+
+    def needs_full_probe(self):
+        """Состав потоков при минимальном анализе хуже кэшированного - нужен перезапуск с полным анализом."""
+        if not self.hit or self.layout is None or self.layout == self.cached_layout:
+            return False
+        self.cache.invalidate(self.url, f"состав потоков изменился: {self.cached_layout} -> {self.layout}")
+        self.hit = False
+        return len(self.layout) < len(self.cached_layout) or not layout_is_complete(self.layout)
+
+    def on_first_packet(self):
+        """Первый пакет отправлен: состав потоков подтвержден и сохраняется в кэш."""
+        if self.layout is not None and layout_is_complete(self.layout) and self.layout != self.cached_layout:
+            self.cache.store(self.url, self.layout)
+
+    def on_failed_before_first_packet(self):
+        if self.hit:
+            self.cache.invalidate(self.url, "FFmpeg завершился до первого пакета")
+
+
+class ProbeCache:
+    def __init__(self, ttl=PROBE_TTL_SEC, enabled=PROBE_CACHE_ENABLED):
+        self.ttl = ttl
+        self.enabled = enabled
+        self._entries = {} # {url: _ProbeEntry}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+
+    def begin(self, url):
+        """Начинает анализ для запуска FFmpeg: с кэшированным составом потоков или без него."""
+        cached_layout = None
+        with self._lock:
+            entry = self._entries.get(url)
+            if entry is not None and time.time() - entry.stored_at > self.ttl:
+                del self._entries[url] # Устарела по TTL
+                entry = None
+            if entry is not None:
+                entry.hits += 1
+                self.hits += 1
+                cached_layout = entry.layout
+            else:
+                self.misses += 1
+        return ProbeSession(self, url, cached_layout)
+
+    def store(self, url, layout):
+        with self._lock:
+            self._entries[url] = _ProbeEntry(layout)
+        logging.info(f"Состав потоков {url} сохранен в кэш анализа: {layout}")
+
+    def invalidate(self, url, reason=""):
+        with self._lock:
+            if self._entries.pop(url, None) is None:
+                return
+            self.invalidations += 1
+        logging.warning(f"Запись кэша анализа для {url} сброшена ({reason}).")
+
+    def stats(self):
+        with self._lock:
+            return {"entries": len(self._entries), "hits": self.hits, "misses": self.misses, "invalidations": self.invalidations}
+
+
+_default_probe_cache = None
+_default_probe_cache_lock = threading.Lock()
+
+def get_probe_cache():
+    """Возвращает общий для процесса кэш анализа входных потоков."""
+    global _default_probe_cache
+    with _default_probe_cache_lock:
+        if _default_probe_cache is None:
+            _default_probe_cache = ProbeCache()
+        return _default_probe_cache
@@ -0,0 +1,104 @@
+import os
+
+# Профили передачи: буферизация входа и транспорт ноги RTSP под сеть и битрейт потока.
+#
+# Раньше у всех потоков были одни опции: -fflags nobuffer+discardcorrupt, анализ входа 1 с / 1 МБ
+# и -rtsp_transport tcp. Профиль (поле "profile" в описании потока) задает:
+#   вход    - -analyzeduration/-probesize при полном анализе (кэш анализа по-прежнему сокращает его,
+#             см. probe_cache.py), -fflags, -rtmp_buffer (буфер клиента RTMP, мс; только для rtmp://)
+#             и -thread_queue_size (очередь пакетов между чтением входа и мультиплексором);
+#   выход   - rtsp_transport (tcp или udp), buffer_size (буфер сокета отправки, байт), pkt_size
+#             (размер пакета RTP, байт) и max_delay (задержка мультиплексора, мкс) для каждой ноги RTSP:
+#             опциями FFmpeg перед URL или опциями ноги tee (outputs.py).
+# Не заданные профилем опции FFmpeg берет по умолчанию. Профиль "balanced" дает ровно прежнюю команду,
+# поэтому процессы прошлых версий по-прежнему узнаются при восстановлении (registry.py).
+#
+# UDP multicast для ноги публикации выбрать нельзя: RTSP-мультиплексор FFmpeg отправляет только
+# по tcp и udp (udp_multicast есть лишь у демультиплексора). Раздачу зрителям по multicast
+# настраивает RTSP-сервер (у mediamtx - параметр multicast*), она от профиля не зависит.
+
+DEFAULT_PROFILE = os.environ.get("KAZSTREAMLINK_PROFILE", "balanced")
+RTSP_TRANSPORTS = ("tcp", "udp")
+
+
+class TransportProfile:
+    """Именованный набор опций буферизации входа и транспорта RTSP."""
+    __slots__ = ("name", "title", "description", "analyzeduration", "probesize", "fflags", "rtmp_buffer_ms",
+                 "thread_queue_size", "rtsp_transport", "buffer_size", "pkt_size", "max_delay_us")
+
+    def __init__(self, name, title, description, analyzeduration=1000000, probesize=1000000, fflags="nobuffer+discardcorrupt",
+                 rtmp_buffer_ms=None, thread_queue_size=None, rtsp_transport="tcp", buffer_size=None, pkt_size=None,
+                 max_delay_us=None):
+        if rtsp_transport not in RTSP_TRANSPORTS:
+            raise ValueError(f"Транспорт RTSP {rtsp_transport} не поддерживается (допустимо: {', '.join(RTSP_TRANSPORTS)}).")
+        self.name = name
+        self.title = title
+        self.description = description
+        self.analyzeduration = analyzeduration
+        self.probesize = probesize
+        self.fflags = fflags
+        self.rtmp_buffer_ms = rtmp_buffer_ms
+        self.thread_queue_size = thread_queue_size
+        self.rtsp_transport = rtsp_transport
+        self.buffer_size = buffer_size
+        self.pkt_size = pkt_size
+        self.max_delay_us = max_delay_us
+
+    def probe_options(self):
+        """Опции полного анализа входа (без записи в кэше анализа)."""
+        return ('-analyzeduration', str(self.analyzeduration), '-probesize', str(self.probesize))
+
+    def input_options(self, url, probe_options=None):
+        """Опции перед -i url; probe_options - анализ входа из кэша (по умолчанию полный анализ профиля)."""
+        options = [*(probe_options or self.probe_options()), '-fflags', self.fflags]
+        if self.rtmp_buffer_ms is not None and url.lower().startswith("rtmp"):
+            options += ['-rtmp_buffer', str(self.rtmp_buffer_ms)]
+        if self.thread_queue_size is not None:
+            options += ['-thread_queue_size', str(self.thread_queue_size)]
+        return tuple(options)
+
+    def rtsp_options(self):
+        """Опции ноги RTSP: ((ключ, значение), ...) в порядке следования в команде FFmpeg."""
+        options = [("rtsp_transport", self.rtsp_transport)]
+        for key, value in (("buffer_size", self.buffer_size), ("pkt_size", self.pkt_size), ("max_delay", self.max_delay_us)):
+            if value is not None:
+                options.append((key, str(value)))
+        return tuple(options)
+
+    def as_dict(self):
+        return {name: getattr(self, name) for name in self.__slots__}
+
+
+PROFILES = {profile.name: profile for profile in (
+    TransportProfile(
+        "balanced", "Сбалансированный",
+        "Прежние опции: вход без буферизации, RTSP по TCP. Подходит для большинства камер в локальной сети."
+    ),
+    TransportProfile(
+        "low_latency", "Минимальная задержка",
+        "RTSP по UDP без повторной передачи и малые пакеты, короткий анализ и буфер входа. "
+        "Для надежной сети: потерянный пакет не ждет повтора, а пропадает.",
+        analyzeduration=500000, probesize=500000, rtmp_buffer_ms=100, rtsp_transport="udp", pkt_size=1200, max_delay_us=0,
+    ),
+    TransportProfile(
+        "high_throughput", "Высокий битрейт",
+        "RTSP по TCP с большим буфером сокета и очередью пакетов входа: выдерживает всплески битрейта "
+        "ценой большей задержки.",
+        fflags="discardcorrupt", rtmp_buffer_ms=3000, thread_queue_size=1024, buffer_size=4194304, max_delay_us=700000,
+    ),
+    TransportProfile(
+        "lossy_network", "Сеть с потерями",
+        "RTSP по TCP (потери восстанавливает повторная передача), буферизация входа и умеренные пакеты: "
+        "для каналов с потерями и колебаниями задержки.",
+        analyzeduration=2000000, probesize=2000000, fflags="discardcorrupt", rtmp_buffer_ms=2000, thread_queue_size=512,
+        buffer_size=1048576, pkt_size=1200, max_delay_us=500000,
+    ),
+)}
+
+
+def get_profile(name=None):
+    """Профиль по имени (None - профиль по умолчанию); ValueError для неизвестного имени."""
+    profile = PROFILES.get(name or DEFAULT_PROFILE)
+    if profile is None:
+        raise ValueError(f"Неизвестный профиль передачи {name or DEFAULT_PROFILE} (допустимо: {', '.join(PROFILES)}).")
+    return profile
@@ -0,0 +1,424 @@
+import os
+import sys
+import time
+import bisect
+import logging
+import weakref
+import threading
+from collections import Counter
+
+# Встроенная инструментация процесса KazStreamLink и выборочный профилировщик.
+#
+# Инструментация (KAZSTREAMLINK_INSTRUMENT=1) включается при старте процесса:
+#   - timed(name, fn) оборачивает обработчики горячего пути (строки stderr, фрагменты -progress,
+#     периодические задачи цикла ввода-вывода) и копит гистограммы их длительности;
+#   - lock(name) выдает блокировку, считающую захваты общих блокировок и время ожидания занятой;
+#   - поток-зонд засыпает на GIL_PROBE_INTERVAL_SEC и меряет опоздание пробуждения: когда GIL
+#     держат другие потоки, проснувшийся поток ждет его, и опоздание растет.
+# При выключенной инструментации timed() возвращает обработчик без обертки, а lock() -
+# обычный threading.Lock/RLock, так что горячий путь не выполняет ни одной лишней инструкции.
+#
+# Загрузка CPU по потокам процесса (/proc/self/task) и профилировщик доступны всегда: они
+# ничего не стоят, пока их не вызывают. Профилировщик раз в 1/hz секунды снимает стеки всех
+# потоков через sys._current_frames() и копит их в формате "folded stacks"
+# (поток;модуль:функция;... число), который принимают flamegraph.pl, speedscope и inferno.
+
+INSTRUMENT_ENABLED = os.environ.get("KAZSTREAMLINK_INSTRUMENT", "0") == "1"
+PROFILE_HZ = float(os.environ.get("KAZSTREAMLINK_PROFILE_HZ", "100"))
+PROFILE_MAX_SEC = float(os.environ.get("KAZSTREAMLINK_PROFILE_MAX_SEC", "300")) # Забытый профилировщик остановится сам
+PROFILE_MAX_HZ = 1000.0
+GIL_PROBE_INTERVAL_SEC = 0.005
+
+# Верхние границы корзин гистограмм, сек (от 10 мкс до 1 с)
+HISTOGRAM_BOUNDS = (1e-5, 2.5e-5, 5e-5, 1e-4, 2.5e-4, 5e-4, 1e-3, 2.5e-3, 5e-3, 1e-2, 2.5e-2, 5e-2, 0.1, 0.25, 1.0)
+QUANTILES = (0.5, 0.95, 0.99)
+
+_TASK_DIR = "/proc/self/task"
+_CLK_TCK = os.sysconf("SC_CLK_TCK") if hasattr(os, "sysconf") else 100
+
+
+class Histogram:
+    """Гистограмма длительностей с фиксированными корзинами (по умолчанию HISTOGRAM_BOUNDS).
+
+    Без блокировки: пишет в основном цикл ввода-вывода, а редкая потеря отсчета при гонке
+    двух потоков для статистики несущественна.
+    """
+    __slots__ = ("bounds", "counts", "count", "sum", "max")
+
+    def __init__(self, bounds=HISTOGRAM_BOUNDS):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1) # Последняя корзина - больше последней границы
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def observe(self, seconds):
+        self.counts[bisect.bisect_left(self.bounds, seconds)] += 1
+        self.count += 1
+        self.sum += seconds
+        if seconds > self.max:
+            self.max = seconds
+
+    def quantile(self, q):
+        """Верхняя граница корзины, в которую попадает квантиль q (для последней корзины - максимум)."""
+        if not self.count:
+            return None
+        rank = q * self.count
+        seen = 0
+        for i, n in enumerate(self.counts):
+            seen += n
+            if seen >= rank and n:
+                return self.bounds[i] if i < len(self.bounds) else self.max
+        return self.max
+
+    def buckets(self):
+        """[(верхняя граница, накопленное число)] для экспорта в Prometheus; последняя граница - +Inf."""
+        result = []
+        seen = 0
+        for bound, n in zip(self.bounds + (float("inf"),), self.counts):
+            seen += n
+            result.append((bound, seen))
+        return result
+
+    def summary(self, elapsed=None):
+        info = {
+            "count": self.count,
+            "mean_us": round(1e6 * self.sum / self.count, 1) if self.count else None,
+            "max_us": round(1e6 * self.max, 1),
+        }
+        for q in QUANTILES:
+            value = self.quantile(q)
+            info[f"p{int(q * 100)}_us"] = round(1e6 * value, 1) if value is not None else None
+        if elapsed:
+            info["per_sec"] = round(self.count / elapsed, 1)
+        return info
+
+
+class ContendedLock:
+    """Обертка над Lock/RLock, считающая захваты, ожидания и время ожидания занятой блокировки."""
+    __slots__ = ("_inner", "acquisitions", "contended", "wait", "__weakref__")
+
+    def __init__(self, reentrant=False):
+        self._inner = threading.RLock() if reentrant else threading.Lock()
+        self.acquisitions = 0
+        self.contended = 0
+        self.wait = Histogram()
+
+    def acquire(self, blocking=True, timeout=-1):
+        if self._inner.acquire(False): # Свободна (или уже наша для RLock) - без замера времени
+            self.acquisitions += 1
+            return True
+        if not blocking:
+            return False
+        started = time.perf_counter()
+        acquired = self._inner.acquire(True, timeout)
+        self.wait.observe(time.perf_counter() - started)
+        self.contended += 1
+        if acquired:
+            self.acquisitions += 1
+        return acquired
+
+    def release(self):
+        self._inner.release()
+
+    def locked(self):
+        locked = getattr(self._inner, "locked", None)
+        return locked() if locked else None
+
+    __enter__ = acquire
+
+    def __exit__(self, *exc_info):
+        self._inner.release()
+
+
+class Instrumentation:
+    def __init__(self, enabled=INSTRUMENT_ENABLED):
+        self.enabled = enabled
+        self.started_at = time.monotonic()
+        self._histograms = {} # {имя: Histogram}
+        self._counters = Counter() # {имя: число}, например строки -progress
+        self._locks = {} # {имя: WeakSet(ContendedLock)} - у одноименных блокировок (по одной на поток) общий итог
+        self._registry_lock = threading.Lock()
+        self._gil = Histogram()
+        self._gil_thread = None
+        self._thread_cpu = {} # {native_id: (cpu_seconds, monotonic)} - точка отсчета для thread_cpu()
+        if enabled:
+            self._start_gil_probe()
+
+    def histogram(self, name):
+        histogram = self._histograms.get(name)
+        if histogram is None:
+            with self._registry_lock:
+                histogram = self._histograms.setdefault(name, Histogram())
+        return histogram
+
+    def timed(self, name, fn, count_lines=False):
+        """Возвращает fn, замеряющую свою длительность в гистограмму name; без инструментации - fn как есть.
+
+        count_lines=True - для обработчиков сырых фрагментов канала: строки фрагмента добавляются
+        к счетчику "<name>_lines".
+        """
+        if not self.enabled:
+            return fn
+        histogram = self.histogram(name)
+        perf_counter = time.perf_counter
+        if count_lines:
+            counters = self._counters
+            lines_key = f"{name}_lines"
+
+            def wrapper(chunk):
+                started = perf_counter()
+                try:
+                    return fn(chunk)
+                finally:
+                    histogram.observe(perf_counter() - started)
+                    counters[lines_key] += chunk.count(b"\n")
+        else:
+            def wrapper(*args, **kwargs):
+                started = perf_counter()
+                try:
+                    return fn(*args, **kwargs)
+                finally:
+                    histogram.observe(perf_counter() - started)
+        wrapper.__qualname__ = getattr(fn, "__qualname__", name)
+        return wrapper
+
+    def observe(self, name, seconds):
+        """Однократный замер (например, длительность Popen) - только при включенной инструментации."""
+        if self.enabled:
+            self.histogram(name).observe(seconds)
+
+    def lock(self, name, reentrant=False):
+        """Блокировка для общего состояния: с учетом ожиданий при инструментации, иначе обычная."""
+        if not self.enabled:
+            return threading.RLock() if reentrant else threading.Lock()
+        lock = ContendedLock(reentrant)
+        with self._registry_lock:
+            self._locks.setdefault(name, weakref.WeakSet()).add(lock)
+        return lock
+
+    # --- Зонд GIL ---
+
+    def _start_gil_probe(self):
+        self._gil_thread = threading.Thread(target=self._gil_probe, daemon=True, name="gil_probe")
+        self._gil_thread.start()
+
+    def _gil_probe(self):
+        interval = GIL_PROBE_INTERVAL_SEC
+        while True:
+            started = time.perf_counter()
+            time.sleep(interval)
+            self._gil.observe(max(time.perf_counter() - started - interval, 0.0))
+
+    # --- Отчеты ---
+
+    def thread_cpu(self, update_baseline=True):
+        """[{thread, native_id, cpu_seconds, cpu_percent}] по потокам процесса; CPU% - с прошлого вызова.
+
+        update_baseline=False - для экспортера: его частые вызовы не сдвигают точку отсчета отчета API.
+        """
+        names = {thread.native_id: thread.name for thread in threading.enumerate() if getattr(thread, "native_id", None)}
+        try:
+            task_ids = [int(tid) for tid in os.listdir(_TASK_DIR)]
+        except OSError: # Не Linux: доступно только время текущего потока
+            return [{"thread": threading.current_thread().name, "native_id": threading.get_native_id(),
+                     "cpu_seconds": round(time.thread_time(), 3), "cpu_percent": None}]
+        now = time.monotonic()
+        previous = self._thread_cpu
+        current = {}
+        rows = []
+        for tid in task_ids:
+            try:
+                with open(f"{_TASK_DIR}/{tid}/stat", "rb") as f:
+                    stat = f.read()
+            except OSError:
+                continue # Поток завершился между listdir и чтением
+            fields = stat[stat.rindex(b")") + 2:].split()
+            cpu_seconds = (int(fields[11]) + int(fields[12])) / _CLK_TCK
+            current[tid] = (cpu_seconds, now)
+            cpu_percent = None
+            if tid in previous and now > previous[tid][1]:
+                cpu_percent = round(100.0 * (cpu_seconds - previous[tid][0]) / (now - previous[tid][1]), 1)
+            rows.append({"thread": names.get(tid, f"native_{tid}"), "native_id": tid,
+                         "cpu_seconds": round(cpu_seconds, 2), "cpu_percent": cpu_percent})
+        if update_baseline:
+            self._thread_cpu = current
+        rows.sort(key=lambda row: row["cpu_seconds"], reverse=True)
+        return rows
+
+    def lock_stats(self):
+        """{имя: (захваты, ожидания, Histogram ожиданий)} с суммой по одноименным блокировкам."""
+        with self._registry_lock:
+            groups = {name: list(locks) for name, locks in self._locks.items()}
+        stats = {}
+        for name, locks in groups.items():
+            wait = Histogram()
+            for lock in locks:
+                for i, n in enumerate(lock.wait.counts):
+                    wait.counts[i] += n
+                wait.count += lock.wait.count
+                wait.sum += lock.wait.sum
+                wait.max = max(wait.max, lock.wait.max)
+            stats[name] = (sum(lock.acquisitions for lock in locks), sum(lock.contended for lock in locks), wait)
+        return stats
+
+    def histograms(self):
+        with self._registry_lock:
+            return dict(self._histograms)
+
+    def counters(self):
+        return dict(self._counters)
+
+    def gil_histogram(self):
+        return self._gil
+
+    def report(self):
+        elapsed = time.monotonic() - self.started_at
+        report = {"enabled": self.enabled, "uptime_s": round(elapsed, 1), "threads": self.thread_cpu()}
+        if not self.enabled:
+            return report
+        report["paths"] = {name: histogram.summary(elapsed) for name, histogram in sorted(self.histograms().items())}
+        report["counters"] = {name: {"count": count, "per_sec": round(count / elapsed, 1)}
+                              for name, count in sorted(self.counters().items())}
+        report["locks"] = {
+            name: {"acquisitions": acquisitions, "contended": contended,
+                   "contention_ratio": round(contended / acquisitions, 4) if acquisitions else 0.0,
+                   "wait": wait.summary()}
+            for name, (acquisitions, contended, wait) in sorted(self.lock_stats().items())
+        }
+        report["gil_wait"] = self._gil.summary()
+        return report
+
+
+class SamplingProfiler:
+    """Выборочный профилировщик всех потоков процесса по запросу (start/stop)."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._thread = None
+        self._stop_event = threading.Event()
+        self._stacks = Counter() # {"поток;кадр;кадр": число выборок}
+        self._labels = {} # {code object: "модуль:функция"}
+        self.hz = PROFILE_HZ
+        self.samples = 0
+        self.started_at = None
+        self.stopped_at = None
+        self.sampling_seconds = 0.0 # Время, потраченное на сами выборки (накладные расходы)
+
+    @property
+    def running(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self, hz=None, duration=None):
+        """Запускает сбор стеков; прошлый результат сбрасывается. RuntimeError, если уже идет."""
+        try:
+            hz = PROFILE_HZ if hz is None else float(hz)
+            duration = PROFILE_MAX_SEC if duration is None else float(duration)
+        except (TypeError, ValueError):
+            raise ValueError("Частота выборок и длительность профилирования задаются числами.") from None
+        if not 0 < hz <= PROFILE_MAX_HZ:
+            raise ValueError(f"Частота выборок должна быть в пределах (0, {PROFILE_MAX_HZ:g}] Гц.")
+        if not 0 < duration <= PROFILE_MAX_SEC:
+            raise ValueError(f"Длительность профилирования должна быть в пределах (0, {PROFILE_MAX_SEC:g}] сек.")
+        with self._lock:
+            if self.running:
+                raise RuntimeError("Профилировщик уже запущен.")
+            self.hz = hz
+            self._stacks = Counter()
+            self.samples = 0
+            self.sampling_seconds = 0.0
+            self.started_at = time.time()
+            self.stopped_at = None
+            self._stop_event.clear()
+            self._thread = threading.Thread(target=self._run, args=(1.0 / hz, duration), daemon=True, name="sampling_profiler")
+            self._thread.start()
+        logging.info(f"Профилировщик запущен: {hz:g} Гц, не дольше {duration:g} сек.")
+        return self.status()
+
+    def stop(self):
+        """Останавливает сбор и возвращает стеки в формате folded."""
+        with self._lock:
+            thread = self._thread
+            self._stop_event.set()
+        if thread is not None and thread is not threading.current_thread():
+            thread.join(timeout=2.0)
+        return self.folded()
+
+    def status(self):
+        end = self.stopped_at or time.time()
+        return {
+            "running": self.running,
+            "hz": self.hz,
+            "samples": self.samples,
+            "stacks": len(self._stacks),
+            "started_at": self.started_at,
+            "duration_s": round(end - self.started_at, 2) if self.started_at else 0.0,
+            "overhead_percent": round(100.0 * self.sampling_seconds / (end - self.started_at), 2)
+                if self.started_at and end > self.started_at else 0.0,
+        }
+
+    def folded(self):
+        """Стеки в формате folded (строка на стек: "поток;внешний кадр;...;внутренний кадр число")."""
+        stacks = self._stacks.copy()
+        return "".join(f"{stack} {count}\n" for stack, count in sorted(stacks.items()))
+
+    def _label(self, code):
+        label = self._labels.get(code)
+        if label is None:
+            module = os.path.splitext(os.path.basename(code.co_filename))[0]
+            name = getattr(code, "co_qualname", code.co_name)
+            label = self._labels[code] = f"{module}:{name}".replace(";", ":").replace(" ", "_")
+        return label
+
+    def _run(self, interval, duration):
+        own_id = threading.get_ident()
+        deadline = time.monotonic() + duration
+        names = {}
+        names_refreshed = 0.0
+        next_at = time.monotonic()
+        while not self._stop_event.is_set():
+            now = time.monotonic()
+            if now >= deadline:
+                logging.info("Профилировщик остановлен по истечении заданной длительности.")
+                break
+            started = time.perf_counter()
+            if now - names_refreshed >= 1.0: # Имена потоков обновляем раз в секунду, а не на каждой выборке
+                names = {thread.ident: thread.name.replace(";", ":").replace(" ", "_") for thread in threading.enumerate()}
+                names_refreshed = now
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == own_id:
+                    continue
+                labels = []
+                while frame is not None:
+                    labels.append(self._label(frame.f_code))
+                    frame = frame.f_back
+                labels.append(names.get(thread_id, f"thread_{thread_id}"))
+                labels.reverse()
+                self._stacks[";".join(labels)] += 1
+            self.samples += 1
+            self.sampling_seconds += time.perf_counter() - started
+            next_at = max(next_at + interval, time.monotonic()) # Не догоняем пропущенные выборки
+            self._stop_event.wait(next_at - time.monotonic())
+        self.stopped_at = time.time()
+
+
+_default_instrumentation = None
+_default_profiler = None
+_default_lock = threading.Lock()
+
+def get_instrumentation():
+    """Возвращает общую для процесса инструментацию (включается KAZSTREAMLINK_INSTRUMENT=1)."""
+    global _default_instrumentation
+    with _default_lock:
+        if _default_instrumentation is None:
+            _default_instrumentation = Instrumentation()
+        return _default_instrumentation
+
+
+def get_profiler():
+    """Возвращает общий для процесса выборочный профилировщик."""
+    global _default_profiler
+    with _default_lock:
+        if _default_profiler is None:
+            _default_profiler = SamplingProfiler()
+        return _default_profiler
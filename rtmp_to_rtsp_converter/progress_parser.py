@@ -0,0 +1,140 @@
+# Инкрементальный парсер блоков -progress FFmpeg.
+# FFmpeg выдает блок из ~12 строк key=value, завершающийся строкой progress=continue|end.
+# Парсер работает с сырыми байтами и не режет фрагмент на строки: конец блока (строка progress=)
+# и строки известных ключей ищутся через find по всему блоку, поэтому цикл Python идет по известным
+# ключам, а не по строкам. Байты значения копируются только если оно изменилось с прошлого блока
+# (сравнение на месте, startswith со смещением), и тогда же переводятся в числа. Ненужные ключи
+# не копируются и не декодируются вовсе.
+# Метрики публикуются одним снимком на блок (только изменившиеся значения), поэтому
+# читатели никогда не видят наполовину обновленный блок.
+
+# Порядок ключей определяет индексы последних значений (ProgressParser._last_raw)
+_FIELDS = (
+    (b"fps", "fps"),
+    (b"bitrate", "bitrate_kbit"),
+    (b"drop_frames", "dropped_frames"),
+    (b"dup_frames", "dup_frames"),
+    (b"out_time_us", "out_time_us"),
+    (b"speed", "speed"),
+    (b"total_size", "total_size"),
+)
+_FIELD_COUNT = len(_FIELDS)
+_METRIC_NAMES = tuple(name for _, name in _FIELDS)
+# Поиск ключа в блоке: "\nkey=" (строка внутри фрагмента) и "key=" (строка в начале фрагмента)
+_FIELD_NEEDLES = tuple((i, b"\n" + key + b"=", len(key) + 2, key + b"=", len(key) + 1, _METRIC_NAMES[i])
+                       for i, (key, _) in enumerate(_FIELDS))
+_PROGRESS_NEEDLE = b"\nprogress="
+_PROGRESS_PREFIX = b"progress="
+_UNSET = object()
+
+
+def _parse_bitrate(value):
+    # "  -1.0kbits/s", "1234.5kbits/s", "N/A" или число в bits/s
+    value = value.strip()
+    if value.endswith(b"kbits/s"):
+        try:
+            return round(float(value[:-7]), 2)
+        except ValueError:
+            return "N/A (parse)"
+    try:
+        return round(float(value) / 1000, 2) # Переводим в kbit/s
+    except ValueError:
+        return _UNSET # Игнорируем, если не число (например, N/A)
+
+
+def _parse_float(value):
+    try:
+        return round(float(value), 2)
+    except ValueError:
+        return "N/A (parse)"
+
+
+def _parse_speed(value):
+    # "2.63x" или "N/A"
+    value = value.strip()
+    if value.endswith(b"x"):
+        value = value[:-1]
+    try:
+        return round(float(value), 3)
+    except ValueError:
+        return "N/A"
+
+
+def _parse_int(value):
+    try:
+        return int(value) # int() принимает bytes с пробелами по краям
+    except ValueError:
+        return _UNSET
+
+
+_PARSERS = (_parse_float, _parse_bitrate, _parse_int, _parse_int, _parse_int, _parse_speed, _parse_int)
+
+
+class ProgressParser:
+    """Собирает строки -progress в блоки и публикует по одному снимку метрик на блок."""
+    __slots__ = ("_last_raw", "_on_block", "_tail", "blocks")
+
+    def __init__(self, on_block):
+        # Большинство значений (fps, speed, drop/dup_frames) от блока к блоку не меняются:
+        # разбираем и публикуем только те, чьи байты изменились
+        self._last_raw = [None] * _FIELD_COUNT
+        self._on_block = on_block # on_block(dict) вызывается один раз на завершенный блок
+        self._tail = b"" # Незавершенный блок из предыдущего фрагмента
+        self.blocks = 0
+
+    def reset(self):
+        for i in range(_FIELD_COUNT):
+            self._last_raw[i] = None
+        self._tail = b""
+
+    def feed(self, data):
+        """Принимает сырой фрагмент stdout FFmpeg (любой длины, строки и блоки могут быть разрезаны)."""
+        if self._tail:
+            data = self._tail + data
+            self._tail = b""
+        find = data.find
+        startswith = data.startswith
+        pos = 0 # Начало текущего блока (всегда начало строки)
+        while True:
+            # Конец блока: строка progress=..., завершенная переводом строки
+            if startswith(_PROGRESS_PREFIX, pos):
+                progress = pos
+            else:
+                progress = find(_PROGRESS_NEEDLE, pos - 1 if pos else 0)
+                if progress < 0:
+                    break
+                progress += 1
+            block_end = find(b"\n", progress)
+            if block_end < 0:
+                break
+            self._commit(data, pos, progress)
+            pos = block_end + 1
+        if pos < len(data): # Незавершенный блок ждет следующего фрагмента
+            self._tail = data[pos:]
+
+    def _commit(self, data, pos, progress):
+        """Разбирает известные ключи блока data[pos:progress] и публикует изменившиеся значения."""
+        last_raw = self._last_raw
+        find = data.find
+        startswith = data.startswith
+        base = pos - 1 if pos else 0 # data[pos - 1] - перевод строки перед блоком
+        snapshot = {}
+        for index, needle, needle_len, prefix, prefix_len, name in _FIELD_NEEDLES:
+            start = find(needle, base, progress)
+            if start >= 0:
+                start += needle_len
+            elif not pos and startswith(prefix): # Первая строка фрагмента
+                start = prefix_len
+            else:
+                continue
+            end = find(b"\n", start)
+            raw = last_raw[index]
+            if raw is not None and end - start == len(raw) and startswith(raw, start):
+                continue # Значение уже опубликовано предыдущим блоком - байты не копируются
+            raw = last_raw[index] = data[start:end]
+            value = _PARSERS[index](raw)
+            if value is not _UNSET:
+                snapshot[name] = value
+        self.blocks += 1
+        if snapshot:
+            self._on_block(snapshot)
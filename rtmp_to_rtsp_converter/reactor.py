@@ -0,0 +1,273 @@
+import os
+import time
+import heapq
+import logging
+import selectors
+import threading
+import itertools
+from collections import deque
+
+from rtmp_to_rtsp_converter.profiling import get_instrumentation
+
+# Общий цикл ввода-вывода для всех конвертеров.
+# Вместо трех потоков на каждый процесс FFmpeg (stdout, stderr, метрики) все каналы
+# обслуживаются одним потоком на selectors, а периодические задачи (сбор метрик)
+# выполняются на таймерах этого же цикла. Завершение процессов FFmpeg цикл узнает по pidfd
+# (add_process_exit), без опроса waitpid и без блокирующих wait() в вызывающих потоках.
+
+READ_CHUNK_SIZE = 65536 # Сколько байт читать из канала за один вызов os.read
+MAX_LINE_BYTES = 65536 # Недописанная строка длиннее этого отдается обработчику частью, чтобы буфер не рос
+
+
+class TimerHandle:
+    """Дескриптор отложенной или периодической задачи цикла."""
+    __slots__ = ("when", "interval", "callback", "cancelled")
+
+    def __init__(self, when, interval, callback):
+        self.when = when
+        self.interval = interval
+        self.callback = callback
+        self.cancelled = False
+
+    def cancel(self):
+        self.cancelled = True
+
+
+class FFmpegIOReactor:
+    def __init__(self, name="ffmpeg_io_reactor"):
+        self.name = name
+        self._selector = selectors.DefaultSelector()
+        self._instrumentation = get_instrumentation()
+        self._lock = self._instrumentation.lock("reactor")
+        self._pending = deque() # Задачи, переданные из других потоков
+        self._timers = [] # Куча (when, seq, TimerHandle)
+        self._seq = itertools.count()
+        self._wakeup_r, self._wakeup_w = os.pipe()
+        os.set_blocking(self._wakeup_r, False)
+        os.set_blocking(self._wakeup_w, False)
+        self._selector.register(self._wakeup_r, selectors.EVENT_READ, None)
+        self._thread = None
+        self._stopping = False
+
+    # --- Публичный API (потокобезопасный) ---
+
+    def start(self):
+        """Запускает поток цикла, если он еще не запущен."""
+        with self._lock:
+            if self._thread and self._thread.is_alive():
+                return
+            self._stopping = False
+            self._thread = threading.Thread(target=self._run, daemon=True, name=self.name)
+            self._thread.start()
+
+    def stop(self):
+        """Останавливает цикл (используется в бенчмарках и при завершении процесса)."""
+        self._stopping = True
+        self._wakeup()
+        if self._thread and self._thread is not threading.current_thread():
+            self._thread.join(timeout=2.0)
+
+    def in_loop_thread(self):
+        return self._thread is threading.current_thread()
+
+    def call_soon(self, callback, *args):
+        """Выполняет callback в потоке цикла."""
+        with self._lock:
+            self._pending.append((callback, args))
+        self._wakeup()
+
+    def call_later(self, delay, callback):
+        """Однократно выполняет callback через delay секунд."""
+        return self._add_timer(TimerHandle(time.monotonic() + delay, None, callback))
+
+    def call_every(self, interval, callback, first_delay=None):
+        """Периодически выполняет callback с заданным интервалом."""
+        delay = interval if first_delay is None else first_delay
+        # Периодические задачи (проход сборщика метрик, оценка здоровья) - в гистограммы инструментации
+        callback = self._instrumentation.timed(f"timer:{getattr(callback, '__qualname__', 'callback')}", callback)
+        return self._add_timer(TimerHandle(time.monotonic() + delay, interval, callback))
+
+    def add_pipe(self, pipe, on_line, on_close=None, raw=False):
+        """Регистрирует канал процесса: on_line(bytes) на каждую строку, on_close() при EOF.
+
+        При raw=True on_line получает прочитанные фрагменты целиком, а разбиение на строки
+        выполняет сам обработчик (так парсер -progress избегает вызова на каждую строку).
+        """
+        if os.name != "posix":
+            # selectors на Windows не работает с каналами, поэтому читаем их отдельным потоком
+            threading.Thread(
+                target=self._read_pipe_blocking, args=(pipe, on_line, on_close, raw), daemon=True,
+                name=f"{self.name}_pipe_{pipe.fileno()}"
+            ).start()
+            return
+        os.set_blocking(pipe.fileno(), False)
+        self.start()
+        self.call_soon(self._register_pipe, pipe, on_line, on_close, raw)
+
+    def add_process_exit(self, pid, on_exit):
+        """Вызывает on_exit() в потоке цикла, когда процесс pid завершится (pidfd, Linux 5.3+).
+
+        Возвращает False, если pidfd недоступен: тогда завершение отслеживается по закрытию каналов и опросом poll().
+        """
+        if os.name != "posix" or not hasattr(os, "pidfd_open"):
+            return False
+        try:
+            fd = os.pidfd_open(pid)
+        except OSError:
+            return False # Старое ядро или процесс уже не существует
+        self.start()
+        self.call_soon(self._register_process_exit, fd, on_exit)
+        return True
+
+    def watched_pipes_count(self):
+        return sum(1 for key in self._selector.get_map().values() if isinstance(key.data, list))
+
+    # --- Внутренняя часть ---
+
+    def _add_timer(self, handle):
+        self.start()
+        with self._lock:
+            heapq.heappush(self._timers, (handle.when, next(self._seq), handle))
+        self._wakeup()
+        return handle
+
+    def _wakeup(self):
+        try:
+            os.write(self._wakeup_w, b"\0")
+        except (BlockingIOError, OSError):
+            pass # Канал пробуждения уже заполнен, цикл и так проснется
+
+    def _register_pipe(self, pipe, on_line, on_close, raw):
+        # Для raw-каналов буфер строк не нужен (None)
+        self._selector.register(pipe.fileno(), selectors.EVENT_READ, [pipe, on_line, on_close, None if raw else bytearray()])
+
+    def _register_process_exit(self, fd, on_exit):
+        # Данные-функция отличают pidfd от каналов (список) и канала пробуждения (None)
+        self._selector.register(fd, selectors.EVENT_READ, on_exit)
+
+    def _handle_process_exit(self, fd, on_exit):
+        try:
+            self._selector.unregister(fd)
+        except (KeyError, ValueError):
+            pass
+        os.close(fd)
+        self._safe_call(on_exit)
+
+    def _close_pipe(self, fd, data):
+        pipe, on_line, on_close, buffer = data
+        try:
+            self._selector.unregister(fd)
+        except (KeyError, ValueError):
+            pass
+        if buffer:
+            self._safe_call(on_line, bytes(buffer))
+            buffer.clear()
+        try:
+            pipe.close()
+        except OSError:
+            pass
+        if on_close:
+            self._safe_call(on_close)
+
+    def _handle_readable(self, fd, data):
+        try:
+            chunk = os.read(fd, READ_CHUNK_SIZE)
+        except BlockingIOError:
+            return
+        except OSError as e:
+            logging.error(f"Ошибка чтения канала {fd} в цикле ввода-вывода: {e}")
+            chunk = b""
+        if not chunk:
+            self._close_pipe(fd, data)
+            return
+        on_line, buffer = data[1], data[3]
+        if buffer is None:
+            self._safe_call(on_line, chunk)
+            return
+        buffer += chunk
+        start = 0
+        while True:
+            end = buffer.find(b"\n", start)
+            if end < 0:
+                break
+            self._safe_call(on_line, bytes(buffer[start:end]))
+            start = end + 1
+        if start:
+            del buffer[:start]
+        if len(buffer) > MAX_LINE_BYTES: # Процесс пишет без переводов строки - отдаем накопленное как строку
+            self._safe_call(on_line, bytes(buffer))
+            buffer.clear()
+
+    def _run_timers(self):
+        now = time.monotonic()
+        while True:
+            with self._lock:
+                if not self._timers or self._timers[0][0] > now:
+                    return
+                _, _, handle = heapq.heappop(self._timers)
+            if handle.cancelled:
+                continue
+            self._safe_call(handle.callback)
+            if handle.interval is not None and not handle.cancelled:
+                # Не накапливаем пропущенные тики, если цикл был занят
+                handle.when = max(handle.when + handle.interval, now)
+                with self._lock:
+                    heapq.heappush(self._timers, (handle.when, next(self._seq), handle))
+
+    def _next_timeout(self):
+        with self._lock:
+            if self._pending:
+                return 0
+            if not self._timers:
+                return None
+            return max(self._timers[0][0] - time.monotonic(), 0)
+
+    def _run(self):
+        while not self._stopping:
+            for key, _ in self._selector.select(self._next_timeout()):
+                if key.data is None:
+                    try:
+                        while os.read(self._wakeup_r, 4096):
+                            pass
+                    except BlockingIOError:
+                        pass
+                    continue
+                if callable(key.data):
+                    self._handle_process_exit(key.fd, key.data)
+                    continue
+                self._handle_readable(key.fd, key.data)
+            self._run_timers()
+            while True:
+                with self._lock:
+                    if not self._pending:
+                        break
+                    callback, args = self._pending.popleft()
+                self._safe_call(callback, *args)
+
+    @staticmethod
+    def _safe_call(callback, *args):
+        try:
+            callback(*args)
+        except Exception as e:
+            logging.error(f"Ошибка в обработчике цикла ввода-вывода ({getattr(callback, '__qualname__', callback)}): {e}", exc_info=True)
+
+    def _read_pipe_blocking(self, pipe, on_line, on_close, raw):
+        try:
+            for line_bytes in iter(pipe.readline, b''):
+                self._safe_call(on_line, line_bytes if raw else line_bytes.rstrip(b"\n"))
+        finally:
+            pipe.close()
+            if on_close:
+                self._safe_call(on_close)
+
+
+_default_reactor = None
+_default_reactor_lock = threading.Lock()
+
+def get_reactor():
+    """Возвращает общий для процесса цикл ввода-вывода (создается при первом обращении)."""
+    global _default_reactor
+    with _default_reactor_lock:
+        if _default_reactor is None:
+            _default_reactor = FFmpegIOReactor()
+        return _default_reactor
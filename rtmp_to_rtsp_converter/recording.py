@@ -0,0 +1,322 @@
+import os
+import time
+import queue
+import bisect
+import logging
+import threading
+from collections import deque
+
+from rtmp_to_rtsp_converter.outputs import tee_option
+
+# Запись потока (DVR) сегментами тем же процессом FFmpeg, что отдает RTSP.
+#
+# Отдельный процесс записи заново тянул бы RTMP-источник. Вместо этого запись - еще одна нога tee
+# (см. outputs.py) с segment muxer и -c copy: пакеты, уже прочитанные для RTSP, режутся на файлы
+# по SEGMENT_SEC секунд (по ключевым кадрам):
+#     [f=segment:segment_time=6:segment_format=mpegts:strftime=1:reset_timestamps=1:
+#      segment_list=recordings/stream_1/.segments.csv:segment_list_type=csv:onfail=ignore]recordings/stream_1/%s.ts
+# Имя файла - время начала сегмента (strftime %s, секунды Unix), поэтому после перезапуска FFmpeg
+# файлы не перезаписываются. Закрыв сегмент, FFmpeg дописывает строку "файл,начало,конец" в список
+# .segments.csv; сервис дочитывает список на каждом проходе сборщика метрик (sampler.py) и заносит
+# сегмент в индекс потока (SegmentIndex): в памяти - отсортированные времена начала для поиска
+# bisect за O(log n), на диске - index.tsv, который только дописывается.
+#
+# Ввод-вывод: сегменты пишет сам FFmpeg через свой буфер, файлы только дописываются и не
+# переписываются. Сервис не читает сегменты - только stat закрытого файла ради размера.
+# Удаление по сроку хранения выполняется пачкой в отдельном потоке, а index.tsv переписывается
+# целиком, только когда устаревших строк в нем больше, чем живых.
+
+RECORDINGS_DIR = os.environ.get("KAZSTREAMLINK_RECORDINGS_DIR", "recordings")
+SEGMENT_SEC = float(os.environ.get("KAZSTREAMLINK_SEGMENT_SEC", "6"))
+SEGMENT_FORMAT = os.environ.get("KAZSTREAMLINK_SEGMENT_FORMAT", "mpegts") # mpegts или fmp4
+RETENTION_SEC = float(os.environ.get("KAZSTREAMLINK_RETENTION", "3600")) # 0 - без ограничения по времени
+RETENTION_MB = float(os.environ.get("KAZSTREAMLINK_RETENTION_MB", "0")) # 0 - без ограничения по объему
+THROUGHPUT_WINDOW_SEC = 60.0 # Окно расчета скорости записи на диск
+
+INDEX_FILE = "index.tsv"
+LIST_FILE = ".segments.csv" # Список закрытых сегментов, который дописывает FFmpeg
+
+# Расширение и опции segment muxer по формату сегментов
+_FORMATS = {
+    "mpegts": (".ts", ("segment_format=mpegts",)),
+    # Фрагментированный MP4: moov в начале файла, сегмент можно отдавать, не дожидаясь конца записи
+    "fmp4": (".mp4", ("segment_format=mp4",
+                      tee_option("segment_format_options", "movflags=+frag_keyframe+empty_moov+default_base_moof"))),
+}
+
+
+class SegmentIndex:
+    """Индекс сегментов потока: время начала -> файл, длительность и размер; поиск за O(log n)."""
+
+    def __init__(self, directory):
+        self.directory = directory
+        self.path = os.path.join(directory, INDEX_FILE)
+        self._starts = [] # Времена начала по возрастанию (ключи bisect)
+        self._entries = [] # (start, duration, size, name) в том же порядке
+        self._names = set()
+        self.total_bytes = 0
+        self._stale_rows = 0 # Строки index.tsv, удаленные из памяти, но еще лежащие в файле
+        self._file = None
+        self._lock = threading.Lock() # Индекс дополняет цикл ввода-вывода, а читает API
+
+    def load(self):
+        """Читает index.tsv (строки "начало\\tдлительность\\tразмер\\tфайл")."""
+        with self._lock:
+            self._starts, self._entries, self._names, self.total_bytes = [], [], set(), 0
+            try:
+                with open(self.path, encoding="utf-8") as f:
+                    rows = f.read().splitlines()
+            except FileNotFoundError:
+                rows = []
+            for row in rows:
+                try:
+                    start, duration, size, name = row.split("\t")
+                    self._insert(float(start), float(duration), int(size), name)
+                except ValueError:
+                    continue # Строка, недописанная при аварийном завершении
+            self._stale_rows = len(rows) - len(self._entries)
+
+    def _insert(self, start, duration, size, name):
+        if name in self._names:
+            return False
+        i = bisect.bisect_right(self._starts, start) # Почти всегда в конец
+        self._starts.insert(i, start)
+        self._entries.insert(i, (start, duration, size, name))
+        self._names.add(name)
+        self.total_bytes += size
+        return True
+
+    def add(self, start, duration, size, name):
+        """Добавляет закрытый сегмент в память и в конец index.tsv; False, если он уже есть."""
+        with self._lock:
+            if not self._insert(start, duration, size, name):
+                return False
+            if self._file is None:
+                self._file = open(self.path, "a", encoding="utf-8", buffering=64 * 1024)
+            self._file.write(f"{start:.3f}\t{duration:.3f}\t{size}\t{name}\n")
+            return True
+
+    def flush(self):
+        with self._lock:
+            if self._file is not None:
+                self._file.flush()
+
+    def find(self, at):
+        """Сегмент, содержащий момент at (секунды Unix), или None."""
+        with self._lock:
+            i = bisect.bisect_right(self._starts, at) - 1
+            if i < 0:
+                return None
+            start, duration, size, name = self._entries[i]
+            if at >= start + duration:
+                return None # Момент попал в разрыв записи
+            return _segment_dict(self.directory, self._entries[i])
+
+    def between(self, since, until):
+        """Сегменты, пересекающие интервал [since, until)."""
+        with self._lock:
+            i = max(bisect.bisect_right(self._starts, since) - 1, 0)
+            j = bisect.bisect_left(self._starts, until)
+            return [_segment_dict(self.directory, entry) for entry in self._entries[i:j] if entry[0] + entry[1] > since]
+
+    def expire(self, now, retention_sec, retention_bytes):
+        """Убирает из индекса сегменты старше срока хранения или сверх объема, возвращает их пути."""
+        with self._lock:
+            count = 0
+            while count < len(self._entries):
+                start, duration, size, _ = self._entries[count]
+                too_old = retention_sec > 0 and start + duration < now - retention_sec
+                too_big = retention_bytes > 0 and self.total_bytes > retention_bytes and count < len(self._entries) - 1
+                if not (too_old or too_big):
+                    break
+                self.total_bytes -= size
+                count += 1
+            if not count:
+                return []
+            expired = self._entries[:count]
+            del self._entries[:count], self._starts[:count]
+            for entry in expired:
+                self._names.discard(entry[3])
+            self._stale_rows += count
+            if self._stale_rows > len(self._entries):
+                self._compact()
+            return [os.path.join(self.directory, entry[3]) for entry in expired]
+
+    def _compact(self):
+        """Переписывает index.tsv только живыми строками (временный файл и атомарная замена)."""
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8", buffering=64 * 1024) as f:
+            f.writelines(f"{start:.3f}\t{duration:.3f}\t{size}\t{name}\n" for start, duration, size, name in self._entries)
+        os.replace(tmp_path, self.path)
+        self._stale_rows = 0
+
+    def close(self):
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+    def __len__(self):
+        return len(self._entries)
+
+    def oldest(self):
+        return self._starts[0] if self._starts else None
+
+
+def _segment_dict(directory, entry):
+    start, duration, size, name = entry
+    return {"start": start, "end": round(start + duration, 3), "duration": round(duration, 3), "bytes": size,
+            "path": os.path.join(directory, name)}
+
+
+class SegmentRecorder:
+    """Нога записи конвертера: опции segment muxer, разбор списка сегментов FFmpeg, срок хранения и метрики."""
+
+    def __init__(self, stream_id, base_dir=RECORDINGS_DIR, segment_sec=SEGMENT_SEC, segment_format=SEGMENT_FORMAT,
+                 retention_sec=RETENTION_SEC, retention_mb=RETENTION_MB):
+        if segment_format not in _FORMATS:
+            raise ValueError(f"Неизвестный формат сегментов {segment_format} (допустимо: {', '.join(_FORMATS)}).")
+        self.stream_id = stream_id
+        self.directory = os.path.join(base_dir, stream_id)
+        self.segment_sec = segment_sec
+        self.retention_sec = retention_sec
+        self.retention_bytes = int(retention_mb * 1024 * 1024)
+        extension, self._format_options = _FORMATS[segment_format]
+        self.url = os.path.join(self.directory, "%s" + extension) # URL ноги tee: шаблон имени сегмента
+        self.list_path = os.path.join(self.directory, LIST_FILE)
+        self.index = SegmentIndex(self.directory)
+        self._loaded = False
+        self._list_offset = 0
+        self._list_tail = b"" # Недописанная строка списка
+        self._written = deque() # (время индексации, байт) за THROUGHPUT_WINDOW_SEC
+        self.bytes_written = 0
+        self.segments_written = 0
+        self.segments_deleted = 0
+        self.last_latency = None
+
+    def leg_options(self):
+        """Опции ноги tee для FFmpeg."""
+        return [
+            "f=segment",
+            f"segment_time={self.segment_sec:g}",
+            *self._format_options,
+            "strftime=1",
+            "reset_timestamps=1",
+            tee_option("segment_list", self.list_path),
+            "segment_list_type=csv",
+        ]
+
+    def prepare(self, fresh=True):
+        """Готовит каталог перед запуском FFmpeg. fresh=False - процесс принят уже работающим, его список дочитывается."""
+        os.makedirs(self.directory, exist_ok=True)
+        if not self._loaded:
+            self.index.load()
+            self._loaded = True
+        if fresh:
+            # Новый процесс начинает список заново; прошлые сегменты уже в индексе
+            self.poll(time.time())
+            try:
+                os.unlink(self.list_path)
+            except FileNotFoundError:
+                pass
+        self._list_offset = 0
+        self._list_tail = b""
+
+    def poll(self, now):
+        """Заносит в индекс сегменты, закрытые FFmpeg с прошлого вызова, и применяет срок хранения."""
+        try:
+            with open(self.list_path, "rb") as f:
+                f.seek(self._list_offset)
+                data = f.read()
+        except FileNotFoundError:
+            data = b""
+        if data:
+            self._list_offset += len(data)
+            lines = (self._list_tail + data).split(b"\n")
+            self._list_tail = lines.pop()
+            for line in lines:
+                self._on_segment_closed(line, now)
+            self.index.flush()
+        expired = self.index.expire(now, self.retention_sec, self.retention_bytes)
+        if expired:
+            self.segments_deleted += len(expired)
+            get_segment_deleter().delete(expired)
+        while self._written and self._written[0][0] < now - THROUGHPUT_WINDOW_SEC:
+            self._written.popleft()
+
+    def _on_segment_closed(self, line, now):
+        try:
+            name, start_pts, end_pts = line.decode("utf-8").strip().rsplit(",", 2)
+            duration = max(float(end_pts) - float(start_pts), 0.0)
+            start = float(os.path.splitext(name.strip('"'))[0])
+        except ValueError:
+            return
+        name = os.path.basename(name.strip('"'))
+        try:
+            size = os.stat(os.path.join(self.directory, name)).st_size
+        except OSError:
+            return # Сегмент уже удален
+        if not self.index.add(start, duration, size, name):
+            return
+        # Задержка сегмента: от его конца до появления в индексе (закрытие по ключевому кадру + период опроса)
+        self.last_latency = round(max(now - (start + duration), 0.0), 3)
+        self.bytes_written += size
+        self.segments_written += 1
+        self._written.append((now, size))
+
+    def find(self, at):
+        return self.index.find(at)
+
+    def between(self, since, until):
+        return self.index.between(since, until)
+
+    def metrics(self):
+        return {
+            "dvr_segments": len(self.index),
+            "dvr_bytes": self.index.total_bytes, # Хранится на диске
+            "dvr_oldest": self.index.oldest(),
+            "dvr_written_bytes": self.bytes_written,
+            "dvr_write_mbit": round(sum(size for _, size in self._written) * 8 / THROUGHPUT_WINDOW_SEC / 1e6, 3),
+            "dvr_segment_latency_s": self.last_latency if self.last_latency is not None else "N/A",
+            "dvr_deleted_segments": self.segments_deleted,
+        }
+
+    def close(self):
+        self.index.close()
+
+
+class SegmentDeleter:
+    """Фоновое удаление сегментов по сроку хранения: unlink больших файлов не задерживает цикл ввода-вывода."""
+
+    def __init__(self):
+        self._queue = queue.Queue()
+        self._thread = threading.Thread(target=self._run, daemon=True, name="dvr_deleter")
+        self._thread.start()
+
+    def delete(self, paths):
+        self._queue.put(paths)
+
+    def _run(self):
+        while True:
+            for path in self._queue.get():
+                try:
+                    os.unlink(path)
+                except FileNotFoundError:
+                    pass
+                except OSError as e:
+                    logging.warning(f"Не удалось удалить сегмент записи {path}: {e}")
+
+
+_default_deleter = None
+_default_deleter_lock = threading.Lock()
+
+def get_segment_deleter():
+    """Возвращает общий для процесса поток удаления сегментов."""
+    global _default_deleter
+    with _default_deleter_lock:
+        if _default_deleter is None:
+            _default_deleter = SegmentDeleter()
+        return _default_deleter
@@ -0,0 +1,216 @@
+import os
+import json
+import time
+import signal
+import logging
+import sqlite3
+import threading
+
+from rtmp_to_rtsp_converter.converter import FFMPEG_PATH
+from rtmp_to_rtsp_converter.sampler import read_proc_sample
+
+# Постоянный реестр потоков: описание (spec) и желаемое состояние каждого потока.
+#
+# Раньше набор потоков жил только в памяти процесса: перезапуск контейнера или сервиса
+# терял все описания, а процессы FFmpeg, пережившие свой хост-процесс, продолжали работать
+# без учета. Теперь менеджер записывает каждое создание, остановку и удаление в SQLite (режим WAL),
+# а при старте (ConverterManager.restore):
+#   * находит "осиротевшие" процессы FFmpeg прошлого запуска по /proc (find_orphan_ffmpeg);
+#   * процесс, чья команда совпадает с описанием потока, принимается без перезапуска (AdoptedProcess):
+#     CPU/RSS и завершение отслеживаются по /proc, но -progress и stderr прошлого хоста недоступны,
+#     поэтому до первого перезапуска у такого потока нет битрейта, FPS и логов;
+#   * остальные осиротевшие процессы с выходами из реестра завершаются (они держат пути RTSP);
+#   * недостающие потоки с желаемым состоянием "running" запускаются массово (create_many,
+#     не более BULK_MAX_WORKERS параллельно), остановленные возвращаются в список остановленными.
+#
+# Записи идут одной транзакцией на массовую операцию; перезапуски супервизором реестр не меняют
+# (желаемое состояние то же).
+
+REGISTRY_PATH = os.environ.get("KAZSTREAMLINK_REGISTRY", os.path.join("data", "registry.sqlite3")) # "" - без реестра
+# Имя узла кластера (см. cluster.py). Процессы FFmpeg наследуют его через окружение, поэтому несколько
+# узлов на одной машине не принимают и не завершают процессы друг друга как "осиротевшие"
+NODE_ID = os.environ.get("KAZSTREAMLINK_NODE_ID", "")
+
+DESIRED_RUNNING = "running"
+DESIRED_STOPPED = "stopped"
+
+ADOPTED_EXIT_CODE = -1 # Код завершения принятого процесса неизвестен (он не наш дочерний)
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS streams (
+    stream_id TEXT PRIMARY KEY,
+    spec TEXT NOT NULL,
+    desired TEXT NOT NULL,
+    updated_at REAL NOT NULL
+)
+"""
+
+
+class StreamRegistry:
+    def __init__(self, path=REGISTRY_PATH):
+        self.path = path
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        # Одно соединение на процесс под замком; isolation_level=None - транзакции задаются явно
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._lock = threading.Lock()
+        with self._lock:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("PRAGMA synchronous=NORMAL") # В WAL-режиме устойчиво к падению процесса
+            self._conn.execute(_SCHEMA)
+
+    def _write(self, sql, rows):
+        with self._lock:
+            self._conn.execute("BEGIN")
+            try:
+                self._conn.executemany(sql, rows)
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+
+    def put_many(self, specs, desired=DESIRED_RUNNING):
+        """Сохраняет описания потоков (порядок создания сохраняется при обновлении)."""
+        now = time.time()
+        self._write(
+            "INSERT INTO streams (stream_id, spec, desired, updated_at) VALUES (?, ?, ?, ?) "
+            "ON CONFLICT(stream_id) DO UPDATE SET spec=excluded.spec, desired=excluded.desired, updated_at=excluded.updated_at",
+            [(spec["stream_id"], json.dumps(spec, ensure_ascii=False), desired, now) for spec in specs]
+        )
+
+    def set_desired_many(self, stream_ids, desired):
+        now = time.time()
+        self._write("UPDATE streams SET desired=?, updated_at=? WHERE stream_id=?",
+                    [(desired, now, stream_id) for stream_id in stream_ids])
+
+    def delete(self, stream_id):
+        self._write("DELETE FROM streams WHERE stream_id=?", [(stream_id,)])
+
+    def load(self):
+        """[(spec, desired)] в порядке создания."""
+        with self._lock:
+            rows = self._conn.execute("SELECT spec, desired FROM streams ORDER BY rowid").fetchall()
+        return [(json.loads(spec), desired) for spec, desired in rows]
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+class AdoptedProcess:
+    """Процесс FFmpeg прошлого запуска сервиса с интерфейсом subprocess.Popen (без каналов и кода возврата)."""
+
+    def __init__(self, pid, starttime):
+        self.pid = pid
+        self.starttime = starttime
+        self.returncode = None
+        self.stdout = self.stderr = None
+
+    def poll(self):
+        if self.returncode is None:
+            sample = read_proc_sample(self.pid)
+            if sample is None or sample[1] != self.starttime: # Завершился (или PID уже занят другим процессом)
+                self.returncode = ADOPTED_EXIT_CODE
+        return self.returncode
+
+    def wait(self, timeout=None):
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while self.poll() is None:
+            if deadline is not None and time.monotonic() >= deadline:
+                raise TimeoutError(f"Процесс {self.pid} не завершился за {timeout} с")
+            time.sleep(0.05)
+        return self.returncode
+
+    def send_signal(self, sig):
+        if self.poll() is None:
+            try:
+                os.kill(self.pid, sig)
+            except ProcessLookupError:
+                pass
+
+    def terminate(self):
+        self.send_signal(signal.SIGTERM)
+
+    def kill(self):
+        self.send_signal(signal.SIGKILL)
+
+
+def _read_proc(pid, name):
+    with open(f"/proc/{pid}/{name}", "rb") as f: # cmdline упакованной группы может быть длиннее страницы
+        return f.read()
+
+
+def _proc_node_id(pid):
+    """KAZSTREAMLINK_NODE_ID из окружения процесса ("" - не задан)."""
+    for item in _read_proc(pid, "environ").split(b"\0"):
+        if item.startswith(b"KAZSTREAMLINK_NODE_ID="):
+            return item.split(b"=", 1)[1].decode("utf-8", errors="replace")
+    return ""
+
+
+def _proc_stat_fields(pid):
+    stat = _read_proc(pid, "stat")
+    return stat[stat.rindex(b")") + 2:].split()
+
+
+def find_orphan_ffmpeg(ffmpeg_path=FFMPEG_PATH):
+    """Процессы FFmpeg с -progress (так запускает KazStreamLink) этого узла, не являющиеся дочерними этого процесса.
+
+    Возвращает [(pid, starttime, argv)]; без /proc (не Linux) - пустой список.
+    """
+    if not os.path.isdir("/proc/self"):
+        return []
+    name = os.path.basename(ffmpeg_path)
+    own_pid = os.getpid()
+    orphans = []
+    for entry in os.listdir("/proc"):
+        if not entry.isdigit():
+            continue
+        pid = int(entry)
+        try:
+            argv = [arg.decode("utf-8", errors="replace") for arg in _read_proc(pid, "cmdline").split(b"\0")[:-1]]
+            # Заменитель FFmpeg-скрипт виден как "python3 путь/скрипт ...", поэтому проверяем и второй аргумент
+            if "-progress" not in argv or not any(os.path.basename(arg) == name for arg in argv[:2]):
+                continue
+            if _proc_node_id(pid) != NODE_ID: # Процесс другого узла на этой же машине
+                continue
+            fields = _proc_stat_fields(pid)
+        except (OSError, ValueError):
+            continue # Процесс завершился во время обхода
+        if fields[0] == b"Z" or int(fields[1]) == own_pid:
+            continue
+        orphans.append((pid, int(fields[19]), argv))
+    return orphans
+
+
+def matches_command(argv, rtmp_url, output_tail):
+    """Команда процесса запускает именно этот поток: один вход rtmp_url и те же аргументы выхода."""
+    inputs = [argv[i + 1] for i, arg in enumerate(argv[:-1]) if arg == "-i"]
+    return inputs == [rtmp_url] and argv[-len(output_tail):] == output_tail
+
+
+def terminate_orphans(orphans, timeout=2.0):
+    """Завершает осиротевшие процессы: SIGTERM, затем SIGKILL тем, кто не успел за timeout."""
+    processes = [AdoptedProcess(pid, starttime) for pid, starttime, _ in orphans]
+    for process in processes:
+        process.terminate()
+    deadline = time.monotonic() + timeout
+    for process in processes:
+        try:
+            process.wait(max(0.0, deadline - time.monotonic()))
+        except TimeoutError:
+            logging.warning(f"Осиротевший процесс FFmpeg {process.pid} не завершился по SIGTERM, отправка SIGKILL.")
+            process.kill()
+
+
+_default_registry = None
+_default_registry_lock = threading.Lock()
+
+def get_registry():
+    """Возвращает общий для процесса реестр потоков или None, если он отключен (KAZSTREAMLINK_REGISTRY="")."""
+    global _default_registry
+    with _default_registry_lock:
+        if _default_registry is None and REGISTRY_PATH:
+            _default_registry = StreamRegistry(REGISTRY_PATH)
+        return _default_registry
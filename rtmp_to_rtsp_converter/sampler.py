@@ -0,0 +1,191 @@
+import os
+import time
+import logging
+import threading
+
+try:
+    import psutil # Запасной вариант для систем без /proc
+except ImportError: # pragma: no cover - psutil есть в образе Docker
+    psutil = None
+
+from rtmp_to_rtsp_converter.reactor import get_reactor
+from rtmp_to_rtsp_converter.profiling import get_instrumentation
+
+# Централизованный сбор CPU/RSS для всех процессов FFmpeg.
+# Один проход по всем живым PID за тик цикла ввода-вывода: на Linux читаются
+# /proc/<pid>/stat и /proc/<pid>/statm, CPU считается по приращению тиков между
+# проходами (без блокирующего interval), на прочих ОС используется psutil.
+
+# Период сбора задается для всего развертывания через переменную окружения
+METRICS_PERIOD_SEC = float(os.environ.get("KAZSTREAMLINK_METRICS_PERIOD", "1.0"))
+
+_PROC_AVAILABLE = os.path.isdir("/proc/self") and hasattr(os, "sysconf")
+_CLK_TCK = os.sysconf("SC_CLK_TCK") if _PROC_AVAILABLE else 100
+_PAGE_SIZE = os.sysconf("SC_PAGE_SIZE") if _PROC_AVAILABLE else 4096
+_BYTES_PER_MB = 1024 * 1024
+_denied_pids = set() # PID, чей /proc недоступен (hidepid, процесс другого пользователя) - сообщаем один раз
+
+
+def _read_file(path):
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        return os.read(fd, 4096)
+    finally:
+        os.close(fd)
+
+
+def read_proc_sample(pid):
+    """Возвращает (cpu_ticks, starttime, rss_bytes) для PID из /proc или None, если процесса нет."""
+    try:
+        stat = _read_file(f"/proc/{pid}/stat")
+        statm = _read_file(f"/proc/{pid}/statm")
+    except (FileNotFoundError, ProcessLookupError):
+        return None
+    except PermissionError as e: # Замеров не будет, как и для завершившегося процесса
+        if pid not in _denied_pids:
+            _denied_pids.add(pid)
+            logging.warning(f"Нет доступа к /proc для PID {pid}, CPU и память не собираются: {e}")
+        return None
+    # Имя процесса в скобках может содержать пробелы, поэтому разбираем поля после последней ')'
+    fields = stat[stat.rindex(b")") + 2:].split()
+    if fields[0] == b"Z": # Зомби: процесс уже завершился, ждет reap
+        return None
+    cpu_ticks = int(fields[11]) + int(fields[12]) # utime + stime
+    starttime = int(fields[19])
+    rss_bytes = int(statm.split()[1]) * _PAGE_SIZE
+    return cpu_ticks, starttime, rss_bytes
+
+
+class _Target:
+    __slots__ = ("pid", "converter", "prev_cpu", "prev_time", "starttime", "ps_process")
+
+    def __init__(self, pid, converter):
+        self.pid = pid
+        self.converter = converter
+        self.prev_cpu = None
+        self.prev_time = None
+        self.starttime = None
+        self.ps_process = None
+
+
+class SystemMetricsSampler:
+    def __init__(self, reactor=None, period=None, use_proc=None):
+        self._reactor = reactor or get_reactor()
+        self.period = METRICS_PERIOD_SEC if period is None else period
+        self.use_proc = _PROC_AVAILABLE if use_proc is None else use_proc
+        self._targets = {} # {pid: _Target}
+        self._lock = get_instrumentation().lock("sampler")
+        self._timer = None
+        self._pass_listeners = [] # Вызываются после каждого прохода (оценка здоровья по всему узлу)
+        self.last_pass_duration = 0.0 # Длительность последнего прохода, сек (для самоконтроля)
+
+    def register(self, pid, converter):
+        """Добавляет процесс FFmpeg в сбор метрик; converter получает _publish_system_metrics()."""
+        target = _Target(pid, converter)
+        self._prime(target)
+        with self._lock:
+            self._targets[pid] = target
+            if self._timer is None:
+                self._timer = self._reactor.call_every(self.period, self._sample_all)
+
+    def unregister(self, pid):
+        with self._lock:
+            self._targets.pop(pid, None)
+        _denied_pids.discard(pid) # PID может достаться новому процессу
+
+    def add_pass_listener(self, callback):
+        """callback(wall_time) вызывается в цикле ввода-вывода после публикации замеров всех процессов."""
+        with self._lock:
+            self._pass_listeners.append(callback)
+
+    def tracked_pids(self):
+        with self._lock:
+            return list(self._targets)
+
+    def _prime(self, target):
+        """Первый замер задает точку отсчета для расчета CPU."""
+        target.prev_time = time.monotonic()
+        if self.use_proc:
+            sample = read_proc_sample(target.pid)
+            if sample:
+                target.prev_cpu = sample[0] / _CLK_TCK
+                target.starttime = sample[1]
+        elif psutil is not None:
+            try:
+                target.ps_process = psutil.Process(target.pid)
+                cpu_times = target.ps_process.cpu_times()
+                target.prev_cpu = cpu_times.user + cpu_times.system
+            except (psutil.NoSuchProcess, psutil.AccessDenied):
+                pass
+
+    def _measure(self, target, now):
+        """Возвращает (cpu_percent, memory_mb) или None, если процесс пропал."""
+        if self.use_proc:
+            sample = read_proc_sample(target.pid)
+            if sample is None:
+                return None
+            cpu_ticks, starttime, rss_bytes = sample
+            if target.starttime is not None and starttime != target.starttime:
+                return None # PID переиспользован другим процессом
+            cpu_seconds = cpu_ticks / _CLK_TCK
+        else:
+            if target.ps_process is None:
+                return None
+            try:
+                with target.ps_process.oneshot():
+                    cpu_times = target.ps_process.cpu_times()
+                    rss_bytes = target.ps_process.memory_info().rss
+            except (psutil.NoSuchProcess, psutil.AccessDenied):
+                return None
+            cpu_seconds = cpu_times.user + cpu_times.system
+
+        wall = now - target.prev_time
+        cpu_percent = "N/A"
+        if target.prev_cpu is not None and wall > 0:
+            cpu_percent = round(100.0 * (cpu_seconds - target.prev_cpu) / wall, 1)
+        target.prev_cpu = cpu_seconds
+        target.prev_time = now
+        return cpu_percent, round(rss_bytes / _BYTES_PER_MB, 2)
+
+    def _sample_all(self):
+        """Один проход по всем отслеживаемым процессам (выполняется в цикле ввода-вывода)."""
+        started = time.perf_counter()
+        with self._lock:
+            targets = list(self._targets.values())
+            if not targets and self._timer is not None:
+                self._timer.cancel()
+                self._timer = None
+                return
+        now = time.monotonic()
+        wall_now = time.time()
+        for target in targets:
+            try:
+                result = self._measure(target, now)
+            except Exception as e:
+                logging.error(f"Ошибка при сборе системных метрик для PID {target.pid}: {e}")
+                continue
+            if result is None:
+                with self._lock:
+                    if self._targets.get(target.pid) is target:
+                        del self._targets[target.pid]
+                target.converter._on_system_metrics_lost(target.pid)
+                continue
+            target.converter._publish_system_metrics(result[0], result[1], wall_now)
+        for callback in self._pass_listeners:
+            try:
+                callback(wall_now)
+            except Exception as e:
+                logging.error(f"Ошибка обработчика прохода сборщика метрик: {e}")
+        self.last_pass_duration = time.perf_counter() - started
+
+
+_default_sampler = None
+_default_sampler_lock = threading.Lock()
+
+def get_sampler():
+    """Возвращает общий для процесса сборщик системных метрик."""
+    global _default_sampler
+    with _default_sampler_lock:
+        if _default_sampler is None:
+            _default_sampler = SystemMetricsSampler()
+        return _default_sampler
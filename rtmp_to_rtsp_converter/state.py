@@ -0,0 +1,168 @@
+import time
+import logging
+
+from rtmp_to_rtsp_converter.profiling import get_instrumentation
+
+# Состояние конвертера как неизменяемые снимки.
+#
+# Метрики (MetricsSnapshot) и статус (ConverterState) - объекты со __slots__, которые после создания
+# не меняются. Писатель (цикл ввода-вывода: блок -progress, проход сборщика метрик; stop()/start()
+# из потоков API и UI) собирает новый снимок через replace() и публикует его заменой одной ссылки
+# в AtomicRef. Читатель берет ссылку один раз и без блокировок видит согласованный снимок: все поля
+# одного блока -progress или одного замера CPU/RSS вместе, без копирования словаря.
+#
+# Писатели сериализуются короткой блокировкой AtomicRef (в отчете инструментации - "converter_state"),
+# чтобы два обновления разных полей не затерли друг друга.
+#
+# Статус меняется только по таблице TRANSITIONS: недопустимый переход (например, "остановлен" ->
+# "запущен" в обход запуска) отклоняется, а не перезаписывает состояние, установленное другим потоком.
+
+STATUS_IDLE = "ожидание"
+STATUS_STARTING = "запускается"
+STATUS_RUNNING = "запущен"
+STATUS_STOPPING = "останавливается"
+STATUS_STOPPED = "остановлен"
+STATUS_FAILED = "завершен_с_ошибкой" # Отображается с кодом: "завершен_с_ошибкой (код 1)"
+STATUS_START_FAILED = "ошибка_запуска"
+STATUS_RESTARTING = "перезапуск" # Ждет перезапуска супервизором (supervisor.py)
+STATUS_FLAPPING = "флаппинг"
+STATUS_UNKNOWN = "неизвестно"
+
+RUNNING_STATUSES = (STATUS_RUNNING, STATUS_STARTING)
+FINAL_STATUSES = (STATUS_STOPPED, STATUS_FAILED, STATUS_START_FAILED)
+
+# {статус: статусы, в которые из него можно перейти}; переход в тот же статус допустим всегда
+TRANSITIONS = {
+    STATUS_IDLE: {STATUS_STARTING, STATUS_RUNNING, STATUS_STOPPED}, # RUNNING - процесс принят из реестра
+    STATUS_STARTING: {STATUS_RUNNING, STATUS_START_FAILED, STATUS_STOPPING, STATUS_STOPPED, STATUS_FAILED, STATUS_UNKNOWN},
+    STATUS_RUNNING: {STATUS_STOPPING, STATUS_STOPPED, STATUS_FAILED, STATUS_UNKNOWN},
+    STATUS_STOPPING: {STATUS_STOPPED, STATUS_UNKNOWN},
+    STATUS_STOPPED: {STATUS_STARTING, STATUS_RESTARTING},
+    STATUS_FAILED: {STATUS_STARTING, STATUS_RESTARTING, STATUS_FLAPPING, STATUS_STOPPED},
+    STATUS_START_FAILED: {STATUS_STARTING, STATUS_RESTARTING, STATUS_FLAPPING},
+    STATUS_RESTARTING: {STATUS_STARTING, STATUS_FLAPPING, STATUS_STOPPED},
+    STATUS_FLAPPING: {STATUS_STARTING, STATUS_RESTARTING, STATUS_STOPPED},
+    STATUS_UNKNOWN: {STATUS_STARTING, STATUS_STOPPED},
+}
+
+# (поле, значение по умолчанию) снимка метрик
+METRIC_DEFAULTS = (
+    ("bitrate_kbit", "N/A"),
+    ("fps", "N/A"),
+    ("cpu_percent", "N/A"),
+    ("memory_mb", "N/A"),
+    ("dropped_frames", 0), # Счетчик дропнутых кадров (по данным FFmpeg)
+    ("dup_frames", 0),
+    ("speed", "N/A"), # Скорость обработки относительно реального времени (1.0 = realtime)
+    ("out_time_us", "N/A"),
+    ("total_size", "N/A"), # Байт отправлено FFmpeg
+    ("time_to_first_packet_s", "N/A"), # От запуска процесса до первого отправленного пакета
+    ("probe_cache_hit", 0), # 1, если запуск шел с составом потоков из кэша анализа
+    ("last_update_time", None),
+)
+METRIC_FIELDS = tuple(name for name, _ in METRIC_DEFAULTS)
+
+_set = object.__setattr__
+
+
+class MetricsSnapshot:
+    """Неизменяемый снимок метрик FFmpeg одного процесса; читается как словарь (get, [ключ])."""
+    __slots__ = METRIC_FIELDS
+
+    def __init__(self, **values):
+        for name, default in METRIC_DEFAULTS:
+            _set(self, name, values.pop(name, default))
+        if values:
+            raise TypeError(f"Неизвестные метрики: {', '.join(values)}")
+
+    def __setattr__(self, name, value):
+        raise AttributeError("Снимок метрик неизменяем, новый снимок создает replace().")
+
+    def replace(self, **changes):
+        """Новый снимок с измененными полями (исходный не меняется)."""
+        clone = object.__new__(MetricsSnapshot)
+        for name in METRIC_FIELDS:
+            _set(clone, name, changes.pop(name) if name in changes else getattr(self, name))
+        if changes:
+            raise TypeError(f"Неизвестные метрики: {', '.join(changes)}")
+        return clone
+
+    def get(self, name, default=None):
+        return getattr(self, name, default) if name in METRIC_FIELDS else default
+
+    def __getitem__(self, name):
+        if name not in METRIC_FIELDS:
+            raise KeyError(name)
+        return getattr(self, name)
+
+    def as_dict(self):
+        return {name: getattr(self, name) for name in METRIC_FIELDS}
+
+    def __repr__(self):
+        return f"MetricsSnapshot({self.as_dict()!r})"
+
+
+class ConverterState:
+    """Неизменяемый статус конвертера: статус из TRANSITIONS, код завершения и время перехода."""
+    __slots__ = ("status", "exit_code", "since")
+
+    def __init__(self, status, exit_code=None, since=None):
+        _set(self, "status", status)
+        _set(self, "exit_code", exit_code)
+        _set(self, "since", time.time() if since is None else since)
+
+    def __setattr__(self, name, value):
+        raise AttributeError("Статус неизменяем, новый создает AtomicRef.transition().")
+
+    @property
+    def label(self):
+        """Строка статуса для UI, API и реестра (как до перехода на снимки)."""
+        if self.status == STATUS_FAILED:
+            return f"{STATUS_FAILED} (код {self.exit_code})"
+        return self.status
+
+    def __repr__(self):
+        return f"ConverterState({self.label!r})"
+
+
+class AtomicRef:
+    """Ссылка на неизменяемый снимок: чтение без блокировки, запись - заменой ссылки под блокировкой писателей."""
+    __slots__ = ("_value", "lock", "version")
+
+    def __init__(self, value, lock_name="converter_state"):
+        self._value = value
+        self.lock = get_instrumentation().lock(lock_name) # Только для писателей
+        self.version = 0 # Номер опубликованного снимка (для проверки согласованности в стресс-тесте)
+
+    def get(self):
+        return self._value
+
+    def set(self, value):
+        with self.lock:
+            self._value = value
+            self.version += 1
+
+    def update(self, **changes):
+        """Публикует копию текущего снимка с changes и возвращает ее."""
+        with self.lock:
+            value = self._value = self._value.replace(**changes)
+            self.version += 1
+        return value
+
+    def transition(self, status, exit_code=None, allowed_from=None):
+        """Переводит ConverterState в status, если переход есть в TRANSITIONS (и текущий статус в allowed_from).
+
+        Возвращает True, если новый статус опубликован или уже установлен.
+        """
+        with self.lock:
+            current = self._value
+            if allowed_from is not None and current.status not in allowed_from:
+                return False
+            if current.status == status and current.exit_code == exit_code:
+                return True
+            if status != current.status and status not in TRANSITIONS[current.status]:
+                logging.debug(f"Недопустимый переход статуса {current.label} -> {status} отклонен.")
+                return False
+            self._value = ConverterState(status, exit_code)
+            self.version += 1
+            return True
@@ -0,0 +1,245 @@
+import os
+import time
+import random
+import logging
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+from rtmp_to_rtsp_converter.reactor import get_reactor
+from rtmp_to_rtsp_converter.profiling import get_instrumentation
+from rtmp_to_rtsp_converter.state import STATUS_RESTARTING, STATUS_FLAPPING, STATUS_START_FAILED
+
+# Автоматический перезапуск FFmpeg после неожиданного завершения процесса.
+#
+# Опции -reconnect в команде FFmpeg отключены, поэтому обрыв источника RTMP завершает процесс.
+# Супервизор перезапускает его сам:
+#   * задержка растет экспоненциально (base_delay * multiplier^attempt, не больше max_delay)
+#     и случайно уменьшается на долю jitter, чтобы потоки одного источника не стартовали разом;
+#   * одновременно перезапускается не больше KAZSTREAMLINK_MAX_CONCURRENT_RESTARTS процессов на узел,
+#     остальные ждут в очереди - падение общего источника не превращается в лавину fork();
+#     слот занят, пока перезапущенный FFmpeg не выдаст первый блок -progress (или settle_timeout);
+#   * поток, перезапущенный flap_threshold раз за flap_window секунд, считается "флаппингом"
+#     и следующая попытка откладывается на flap_cooldown;
+#   * после stable_after секунд успешной работы счетчик попыток сбрасывается.
+# Таймеры работают на общем цикле ввода-вывода, сам запуск (Popen) - в небольшом пуле потоков.
+
+AUTO_RESTART_ENABLED = os.environ.get("KAZSTREAMLINK_AUTO_RESTART", "1") != "0"
+MAX_CONCURRENT_RESTARTS = int(os.environ.get("KAZSTREAMLINK_MAX_CONCURRENT_RESTARTS", "4"))
+
+RESTARTING_STATUS = STATUS_RESTARTING
+FLAPPING_STATUS = STATUS_FLAPPING
+
+
+class RestartPolicy:
+    """Параметры перезапуска одного конвертера."""
+
+    def __init__(self, enabled=AUTO_RESTART_ENABLED, base_delay=0.5, max_delay=30.0, multiplier=2.0, jitter=0.5,
+                 stable_after=30.0, flap_window=120.0, flap_threshold=5, flap_cooldown=300.0,
+                 settle_timeout=10.0, restart_on_clean_exit=True):
+        self.enabled = enabled
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.multiplier = multiplier
+        self.jitter = jitter
+        self.stable_after = stable_after
+        self.flap_window = flap_window
+        self.flap_threshold = flap_threshold
+        self.flap_cooldown = flap_cooldown
+        self.settle_timeout = settle_timeout
+        self.restart_on_clean_exit = restart_on_clean_exit # Код 0 обычно означает, что источник закончил публикацию
+
+    def delay(self, attempt):
+        """Задержка перед попыткой attempt (с нуля) с учетом джиттера."""
+        delay = min(self.max_delay, self.base_delay * self.multiplier ** attempt)
+        return delay * (1.0 - self.jitter * random.random())
+
+
+DEFAULT_POLICY = RestartPolicy()
+
+
+class _RestartState:
+    __slots__ = ("attempt", "history", "failed_at", "timer", "queued", "in_flight", "settle_timer")
+
+    def __init__(self):
+        self.attempt = 0
+        self.history = deque() # time.monotonic() перезапусков в пределах flap_window
+        self.failed_at = None # Начало текущего простоя (для time-to-recover)
+        self.timer = None # Отложенный перезапуск (TimerHandle)
+        self.queued = False
+        self.in_flight = False
+        self.settle_timer = None
+
+
+class RestartSupervisor:
+    def __init__(self, reactor=None, max_concurrent=MAX_CONCURRENT_RESTARTS):
+        self._reactor = reactor or get_reactor()
+        self.max_concurrent = max(1, max_concurrent)
+        self._executor = ThreadPoolExecutor(max_workers=self.max_concurrent, thread_name_prefix="supervisor_restart")
+        self._lock = get_instrumentation().lock("supervisor")
+        self._states = {} # {converter: _RestartState}
+        self._queue = deque() # Конвертеры, ожидающие свободного слота
+        self._in_flight = 0
+        self.total_restarts = 0
+
+    def _state(self, converter):
+        state = self._states.get(converter)
+        if state is None:
+            state = self._states[converter] = _RestartState()
+        return state
+
+    def on_exit(self, converter, return_code):
+        """Процесс FFmpeg конвертера завершился не по запросу пользователя; планирует перезапуск."""
+        policy = converter.restart_policy
+        if policy is None or not policy.enabled or converter._stop_event.is_set():
+            return
+        if return_code == 0 and not policy.restart_on_clean_exit:
+            return
+        now = time.monotonic()
+        with self._lock:
+            state = self._state(converter)
+            self._release(state)
+            ran_for = time.time() - converter.started_at if converter.started_at else 0.0
+            if ran_for >= policy.stable_after or state.failed_at is None:
+                if ran_for >= policy.stable_after:
+                    state.attempt = 0 # Процесс долго работал стабильно - начинаем отсчет заново
+                state.failed_at = now
+            while state.history and now - state.history[0] > policy.flap_window:
+                state.history.popleft()
+            flapping = len(state.history) >= policy.flap_threshold
+            delay = policy.flap_cooldown if flapping else policy.delay(state.attempt)
+            state.attempt += 1
+            if state.timer:
+                state.timer.cancel()
+            state.timer = self._reactor.call_later(delay, lambda: self._enqueue(converter))
+            converter.transition(FLAPPING_STATUS if flapping else RESTARTING_STATUS)
+        if flapping:
+            logging.warning(f"Поток {converter.stream_id} перезапускался {len(state.history)} раз за {policy.flap_window:.0f} с "
+                            f"(флаппинг), следующая попытка через {delay:.0f} с.")
+        else:
+            logging.info(f"Перезапуск FFmpeg для {converter.stream_id} через {delay:.2f} с (попытка {state.attempt}, код {return_code}).")
+
+    def _enqueue(self, converter):
+        with self._lock:
+            state = self._states.get(converter)
+            if state is None or state.timer is None:
+                return # Перезапуск отменен
+            state.timer = None
+            state.queued = True
+            self._queue.append(converter)
+        self._drain()
+
+    def _drain(self):
+        """Запускает ожидающие перезапуски, пока есть свободные слоты."""
+        with self._lock:
+            while self._queue and self._in_flight < self.max_concurrent:
+                converter = self._queue.popleft()
+                state = self._states.get(converter)
+                if state is None or not state.queued:
+                    continue
+                state.queued = False
+                state.in_flight = True
+                self._in_flight += 1
+                state.history.append(time.monotonic())
+                self.total_restarts += 1
+                self._executor.submit(self._restart, converter)
+
+    def _restart(self, converter):
+        """Выполняется в пуле: запускает FFmpeg заново с сохранением истории и логов."""
+        with self._lock:
+            state = self._states.get(converter)
+            if state is None or not state.in_flight:
+                return
+        converter.auto_restarts += 1
+        converter.start(restart=True)
+        if converter.state.status == STATUS_START_FAILED:
+            self.on_exit(converter, None) # Popen не удался - пробуем снова по той же политике
+            return
+        with self._lock:
+            state = self._states.get(converter)
+            cancelled = state is None or not state.in_flight
+            if not cancelled:
+                timeout = converter.restart_policy.settle_timeout
+                state.settle_timer = self._reactor.call_later(timeout, lambda: self._settle(converter))
+        if cancelled: # Пока процесс запускался, поток остановили
+            converter.stop()
+
+    def _settle(self, converter):
+        """FFmpeg не выдал прогресс за settle_timeout: освобождаем слот для других перезапусков."""
+        with self._lock:
+            state = self._states.get(converter)
+            if state is not None:
+                state.settle_timer = None
+                self._release(state)
+        self._drain()
+
+    def on_recovered(self, converter):
+        """Первый блок -progress после перезапуска: поток восстановлен."""
+        with self._lock:
+            state = self._states.get(converter)
+            if state is None:
+                return
+            if state.failed_at is not None:
+                converter.last_recovery_seconds = round(time.monotonic() - state.failed_at, 3)
+                state.failed_at = None
+            self._release(state)
+        logging.info(f"Поток {converter.stream_id} восстановлен за {converter.last_recovery_seconds} с.")
+        self._drain()
+
+    def _release(self, state):
+        # Вызывается под self._lock
+        if state.settle_timer:
+            state.settle_timer.cancel()
+            state.settle_timer = None
+        if state.in_flight:
+            state.in_flight = False
+            self._in_flight -= 1
+
+    def cancel(self, converter):
+        """Отменяет запланированный перезапуск (остановка или удаление потока)."""
+        with self._lock:
+            state = self._states.get(converter)
+            if state is None:
+                return
+            if state.timer:
+                state.timer.cancel()
+                state.timer = None
+            state.queued = False
+            state.failed_at = None
+            self._release(state)
+        self._drain()
+
+    def forget(self, converter):
+        self.cancel(converter)
+        with self._lock:
+            self._states.pop(converter, None)
+
+    def is_flapping(self, converter):
+        policy = converter.restart_policy
+        with self._lock:
+            state = self._states.get(converter)
+            if state is None or policy is None:
+                return False
+            now = time.monotonic()
+            return sum(1 for t in state.history if now - t <= policy.flap_window) >= policy.flap_threshold
+
+    def stats(self):
+        with self._lock:
+            return {
+                "in_flight": self._in_flight,
+                "queued": sum(1 for state in self._states.values() if state.queued),
+                "scheduled": sum(1 for state in self._states.values() if state.timer is not None),
+                "total_restarts": self.total_restarts,
+            }
+
+
+_default_supervisor = None
+_default_supervisor_lock = threading.Lock()
+
+def get_supervisor():
+    """Возвращает общий для процесса супервизор перезапусков."""
+    global _default_supervisor
+    with _default_supervisor_lock:
+        if _default_supervisor is None:
+            _default_supervisor = RestartSupervisor()
+        return _default_supervisor
@@ -1,8 +1,15 @@
 import streamlit as st
+import os
 import uuid
 import time
+import threading
 import pandas as pd # Добавлено для графиков
-from rtmp_to_rtsp_converter.converter import create_and_start_conversion, stop_specific_conversion, RTMPToRTSPConverter
+from rtmp_to_rtsp_converter.manager import get_manager
+from rtmp_to_rtsp_converter.api import start_api_in_background, API_HOST, API_PORT
+from rtmp_to_rtsp_converter.metrics_store import VALUE_COLUMNS
+from rtmp_to_rtsp_converter.admission import get_capacity_model, RESOURCE_TITLES
+from rtmp_to_rtsp_converter.profiles import PROFILES, DEFAULT_PROFILE
+from rtmp_to_rtsp_converter.log_pipeline import install_queue_logging
 import logging
 import sys # Добавлено для logging.StreamHandler
 
@@ -11,13 +18,20 @@ if not logging.getLogger().hasHandlers():
     logging.basicConfig(level=logging.INFO,
                         format='%(asctime)s - %(levelname)s - %(message)s',
                         handlers=[logging.StreamHandler(sys.stdout)])
+# Вывод логов - в фоновом потоке (см. log_pipeline.py); повторные запуски скрипта Streamlit очередь не меняют
+install_queue_logging()
 
-# Инициализация session_state для хранения конвертеров
-if 'converters' not in st.session_state:
-    st.session_state.converters = {} # Словарь {stream_id: converter_instance}
+# Конвертеры хранятся в общем для процесса менеджере, а не в st.session_state,
+# поэтому они не пропадают вместе с сессией браузера и видны HTTP API
+manager = get_manager()
 
-if 'next_stream_id_counter' not in st.session_state:
-    st.session_state.next_stream_id_counter = 0
+@st.cache_resource
+def _embedded_api():
+    """Запускает HTTP API в процессе Streamlit один раз (если задан KAZSTREAMLINK_EMBED_API=1)."""
+    return start_api_in_background(API_HOST, API_PORT, manager)
+
+if os.environ.get("KAZSTREAMLINK_EMBED_API") == "1":
+    _embedded_api()
 
 st.set_page_config(page_title="KazStreamLink: RTMP-RTSP Конвертер", layout="wide")
 
@@ -43,6 +57,18 @@ with st.form("new_stream_form", clear_on_submit=True):
         rtsp_port_input = st.number_input("Порт RTSP-сервера (для FFmpeg):", value=8554, min_value=1, max_value=65535, help="Порт, на котором слушает ваш RTSP-сервер (mediamtx).")
     with col3:
         rtsp_path_input = st.text_input("Путь RTSP-потока (на сервере):", placeholder="mystream", help="Например, 'mystream1'. Итоговый URL будет rtsp://<хост_docker>:<порт_mediamtx>/mystream1")
+    extra_outputs_input = st.text_area(
+        "Дополнительные выходы (по одному URL в строке, необязательно):",
+        placeholder="rtsp://backup-server:8554/mystream\n/recordings/mystream.ts",
+        help="Один процесс FFmpeg раздаст поток на все выходы (tee muxer); отказ одного выхода не останавливает остальные."
+    )
+    record_input = st.checkbox("Запись сегментами (DVR)", help="Тот же процесс FFmpeg пишет поток в каталог записи сегментами с индексом и сроком хранения.")
+    on_demand_input = st.checkbox("По запросу", help="FFmpeg запускается, когда к пути RTSP подключается первый зритель, и останавливается после простоя без зрителей (нужны хуки mediamtx, см. README).")
+    profile_input = st.selectbox(
+        "Профиль передачи:", list(PROFILES), index=list(PROFILES).index(DEFAULT_PROFILE),
+        format_func=lambda name: PROFILES[name].title,
+        help="Буферизация входа и транспорт RTSP (TCP/UDP): " + " ".join(f"{p.title} - {p.description}" for p in PROFILES.values())
+    )
 
     submitted = st.form_submit_button("Начать конвертацию")
 
@@ -54,128 +80,246 @@ with st.form("new_stream_form", clear_on_submit=True):
         elif not rtsp_path_input:
             st.error("Путь RTSP-потока не может быть пустым.")
         else:
-            stream_id = f"stream_{st.session_state.next_stream_id_counter}"
-            st.session_state.next_stream_id_counter += 1
-            
+            stream_id = manager.next_stream_id()
+
             st.info(f"Запуск конвертации для {stream_id} ({rtmp_url_input})...")
             try:
-                converter_instance = create_and_start_conversion(
-                    stream_id,
-                    rtmp_url_input,
-                    rtsp_server_host_input,
-                    int(rtsp_port_input),
-                    rtsp_path_input
-                )
-                st.session_state.converters[stream_id] = converter_instance
-                st.success(f"Конвертация {stream_id} запущена!")
-                # Небольшая задержка, чтобы дать FFmpeg время запуститься перед обновлением UI
-                time.sleep(1) 
-                st.rerun()
+                manager.create({
+                    "stream_id": stream_id,
+                    "rtmp_url": rtmp_url_input,
+                    "rtsp_server_host": rtsp_server_host_input,
+                    "rtsp_port": int(rtsp_port_input),
+                    "rtsp_path": rtsp_path_input,
+                    "extra_outputs": [url.strip() for url in extra_outputs_input.splitlines() if url.strip()],
+                    "record": record_input,
+                    "on_demand": on_demand_input,
+                    "profile": profile_input,
+                })
+                st.success(f"Поток {stream_id} зарегистрирован: FFmpeg запустится при подключении первого зрителя." if on_demand_input
+                           else f"Конвертация {stream_id} запущена!")
+                st.rerun() # Статус и метрики нового потока подхватит его панель при следующем обновлении
             except Exception as e:
                 st.error(f"Ошибка при запуске конвертации {stream_id}: {e}")
                 logging.error(f"Ошибка UI при запуске {stream_id}: {e}", exc_info=True)
 
 
-# --- Контейнер для отображения потоков (для real-time обновления) ---
-streams_placeholder = st.empty()
+# --- Отображение потоков ---
+# Раньше весь список перерисовывался полным перезапуском скрипта и только по кнопке.
+# Теперь сводка и панели потоков - фрагменты (st.fragment) со своим таймером: каждый
+# перерисовывает только себя раз в UI_REFRESH_SEC. Сводная таблица строится из одного
+# снимка менеджера (manager.snapshot), общего для всех сессий и экспорта /metrics,
+# а панели рисуются только для текущей страницы списка.
+UI_REFRESH_SEC = float(os.environ.get("KAZSTREAMLINK_UI_REFRESH", "2"))
+PAGE_SIZES = [10, 25, 50, 100]
+HISTORY_STEPS = {1: "1 с (час)", 10: "10 с (6 ч)", 60: "1 мин (сутки)"}
+HISTORY_CHARTS = {"bitrate_kbit": "Битрейт (kbit/s)", "cpu_percent": "CPU FFmpeg (%)", "fps": "FPS"}
+ACTIVE_STATUSES = ["запущен", "запускается", "перезапуск", "флаппинг"]
+ERROR_CATEGORY_TITLES = {"rtsp_refused": "отказ RTSP-сервера", "timestamps": "метки времени", "corrupt_packet": "битые пакеты",
+                         "network": "сеть", "other": "прочие"}
+HEALTH_TITLES = {"ok": "в норме", "degraded": "деградация", "stalled": "завис", "unknown": "нет данных"}
+LATENCY_TITLES = {"timecode": "от меток источника", "jitter": "колебания сверх лучшего кадра"}
+PROBE_TITLES = {"idle": "поток не работает", "connecting": "подключается", "playing": "нет кадров", "error": "нет подключения"}
+
+
+def _format_total(value, digits=1):
+    return f"{value:.{digits}f}"
+
+
+@st.fragment(run_every=UI_REFRESH_SEC)
+def fleet_summary():
+    snapshot = manager.snapshot()
+    stream_ids = tuple(row["stream_id"] for row in snapshot.rows)
+    # Потоки добавлены или удалены (в том числе через HTTP API) - список страниц нужно перестроить
+    if st.session_state.setdefault("known_streams", stream_ids) != stream_ids:
+        st.session_state["known_streams"] = stream_ids
+        st.rerun()
+
+    totals = snapshot.totals
+    t_col1, t_col2, t_col3, t_col4, t_col5 = st.columns(5)
+    t_col1.metric("Потоков", totals["streams"])
+    t_col2.metric("Работают", totals["running"])
+    t_col3.metric("Суммарный битрейт (kbit/s)", _format_total(totals["bitrate_kbit"]))
+    t_col4.metric("CPU FFmpeg (%)", _format_total(totals["cpu_percent"]))
+    t_col5.metric("Память FFmpeg (MB)", _format_total(totals["memory_mb"]))
+    unhealthy = {state: count for state, count in totals["by_health"].items() if state in ("degraded", "stalled")}
+    if unhealthy:
+        st.warning("Здоровье потоков: " + ", ".join(f"{HEALTH_TITLES[state]}: {count}" for state, count in unhealthy.items()))
+    capacity = get_capacity_model().report()
+    if capacity["enabled"]:
+        st.caption("Емкость узла (факт / прогноз / предел): " + ", ".join(
+            f"{RESOURCE_TITLES[resource]} {values['actual']:.0%} / {values['predicted']:.0%} / {values['limit']:.0%}"
+            for resource, values in capacity["utilisation"].items()
+        ) + (f"; ждут емкости: {capacity['waiting']}" if capacity["waiting"] else ""))
+    on_demand = manager.on_demand.report()
+    if on_demand["streams"]:
+        cold_start = on_demand["cold_start"]
+        st.caption(
+            f"По запросу: {on_demand['streams']} потоков, работают {on_demand['active']}, зрителей {on_demand['readers']}; "
+            f"холодный старт p50/p95: {cold_start['p50_s'] or '-'} / {cold_start['p95_s'] or '-'} с; "
+            f"доля времени работы: {on_demand['savings']['duty_cycle']:.0%}"
+        )
+    dedup = manager.dedup_report()
+    if dedup["sources"]:
+        st.caption(
+            f"Общие источники: {dedup['shared_sources']} процессов FFmpeg на {dedup['streams']} потоков; "
+            f"не тянутся повторно: {dedup['saved']['source_pulls']} подключений, {dedup['saved']['ingest_mbit']} Мбит/с"
+        )
+    if snapshot.rows:
+        with st.expander("Сводная таблица", expanded=False):
+            st.dataframe(pd.DataFrame(snapshot.table()), hide_index=True)
+    st.caption(f"Снимок: {time.strftime('%H:%M:%S', time.localtime(snapshot.built_at))}")
+
+
+def render_details(converter, metrics, status):
+    stream_id = converter.stream_id
+    st.markdown(f"**RTMP Источник:** `{converter.rtmp_url}`")
+    st.markdown(f"**FFmpeg отправляет на:** `{converter.output_rtsp_url_for_ffmpeg_push}`")
+    if converter.rtsp_server_host == "mediamtx":
+        client_rtsp_url_display = f"rtsp://<IP_хоста_Docker>:{converter.rtsp_port}/{converter.rtsp_path}"
+        st.markdown(f"**Примерный RTSP URL для клиента:** `{client_rtsp_url_display}` (замените `<IP_хоста_Docker>`)")
+    else:
+        st.markdown(f"**RTSP URL для клиента:** `{converter.final_rtsp_url_for_client}`")
+
+    r_col1, r_col2, r_col3 = st.columns(3)
+    with r_col1:
+        st.metric(label="Ошибки/Дропы (счетчик)", value=str(metrics.get("dropped_frames", 0)))
+    with r_col2:
+        st.metric(label="Автоперезапуски", value=str(metrics.get("auto_restarts", 0)))
+    with r_col3:
+        recovery = metrics.get("time_to_recover_s")
+        st.metric(label="Восстановление (с)", value="N/A" if recovery is None else str(recovery))
+    error_counts = metrics.get("ffmpeg_errors") or {}
+    if any(error_counts.values()):
+        summary = ", ".join(f"{ERROR_CATEGORY_TITLES.get(category, category)}: {count}"
+                            for category, count in error_counts.items() if count)
+        suppressed = metrics.get("log_lines_suppressed")
+        st.caption(f"Ошибки FFmpeg по категориям: {summary}" + (f" (в лог не попало строк: {suppressed})" if suppressed else ""))
+    output_legs = converter.get_output_legs()
+    if len(output_legs) > 1:
+        st.markdown("**Выходы (tee):**")
+        st.dataframe(pd.DataFrame(output_legs)[["url", "status", "bytes", "error"]], hide_index=True)
+
+    ffmpeg_logs = converter.get_ffmpeg_logs()
+    if ffmpeg_logs:
+        st.markdown("**Логи FFmpeg (последние):**")
+        st.code("\n".join(ffmpeg_logs), language="log", line_numbers=False)
+
+    # История метрик: срез массива без копирования, NaN вместо "N/A"
+    history_step = st.radio(
+        "Детализация истории:", options=list(HISTORY_STEPS), format_func=HISTORY_STEPS.get,
+        horizontal=True, key=f"history_step_{stream_id}"
+    )
+    base_time, series = converter.get_metrics_series(history_step)
+    if len(series):
+        df_series = pd.DataFrame(series[:, 1:], columns=VALUE_COLUMNS, copy=False)
+        df_series.index = pd.to_datetime(base_time + series[:, 0].astype("float64"), unit="s")
+        charts_to_display = {
+            title: df_series[column] for column, title in HISTORY_CHARTS.items()
+            if df_series[column].notna().any()
+        }
+        if charts_to_display:
+            st.line_chart(pd.DataFrame(charts_to_display))
+        else:
+            st.caption("Нет данных для графика истории метрик.")
+    else:
+        st.caption("Недостаточно данных для построения графика истории.")
+
+
+@st.fragment(run_every=UI_REFRESH_SEC)
+def stream_panel(stream_id):
+    converter = manager.get(stream_id)
+    if converter is None:
+        st.caption(f"Поток {stream_id} удален.")
+        return
+    status = converter.get_status()
+    metrics = converter.get_metrics()
+
+    with st.container(border=True):
+        col_info, col_action = st.columns([5, 1])
+        with col_info:
+            st.markdown(f"**{stream_id}** | Статус: **{status.upper()}** | `{converter.rtmp_url}` | {converter.profile.title}")
+            m_col1, m_col2, m_col3, m_col4 = st.columns(4)
+            m_col1.metric(label="Битрейт (kbit/s)", value=str(metrics.get("bitrate_kbit", "N/A")))
+            m_col2.metric(label="FPS", value=str(metrics.get("fps", "N/A")))
+            m_col3.metric(label="CPU FFmpeg (%)", value=str(metrics.get("cpu_percent", "N/A")))
+            m_col4.metric(label="Память FFmpeg (MB)", value=str(metrics.get("memory_mb", "N/A")))
+            health_state = metrics.get("health_state", "unknown")
+            if health_state in ("degraded", "stalled") and status in ACTIVE_STATUSES:
+                reasons = ", ".join(metrics.get("health_reasons") or [])
+                st.warning(f"Здоровье: {HEALTH_TITLES[health_state]} ({metrics.get('health_score')}/100): {reasons}")
+            if metrics.get("flapping"):
+                st.warning("Поток слишком часто перезапускается (флаппинг): следующая попытка отложена.")
+            if status.startswith("завершен_с_ошибкой") or status in ["ошибка_запуска", "перезапуск", "флаппинг"]:
+                last_error = converter.get_last_error()
+                if last_error:
+                    st.error(f"Последняя ошибка FFmpeg: {last_error}")
+            if metrics.get("shared_ingest"):
+                st.caption(f"Источник общий с другими потоками: процесс FFmpeg {metrics['shared_ingest']}.")
+            if "dvr_segments" in metrics:
+                st.caption(f"Запись: {metrics['dvr_segments']} сегм., {metrics['dvr_bytes'] / (1024 * 1024):.1f} МБ на диске, "
+                           f"{metrics['dvr_write_mbit']} Мбит/с, задержка сегмента {metrics['dvr_segment_latency_s']} с")
+            if "latency_probe" in metrics:
+                mode = metrics["latency_mode"]
+                if mode in LATENCY_TITLES:
+                    st.caption(f"Задержка выхода RTSP ({LATENCY_TITLES[mode]}): p50 {metrics['latency_p50_ms']} / "
+                               f"p95 {metrics['latency_p95_ms']} / p99 {metrics['latency_p99_ms']} мс, "
+                               f"кадров в окне: {metrics['latency_samples']}")
+                else:
+                    st.caption(f"Зонд задержки: {PROBE_TITLES.get(metrics['latency_probe'], metrics['latency_probe'])}.")
+            if metrics.get("last_update_time"):
+                st.caption(f"Метрики обновлены: {time.strftime('%H:%M:%S', time.localtime(metrics['last_update_time']))}")
+
+        with col_action:
+            # Ключи виджетов построены на stream_id, чтобы быть стабильными между перерисовками
+            if status in ACTIVE_STATUSES:
+                if st.button("Остановить", key=f"stop_{stream_id}"):
+                    # Без ожидания: SIGINT -> SIGTERM -> SIGKILL доводит цикл ввода-вывода, панель покажет итог
+                    manager.stop(stream_id, wait=False)
+                    st.rerun() # Перерисовка всего приложения: меняются сводка и список
+            elif status not in ["останавливается"]:
+                if st.button("Запустить", key=f"start_{stream_id}"):
+                    manager.start(stream_id)
+                    st.rerun()
+                if st.button("Удалить из списка", key=f"remove_{stream_id}"):
+                    manager.remove(stream_id)
+                    st.rerun()
+            probe_enabled = manager.latency.is_enabled(stream_id)
+            if st.toggle("Зонд задержки", value=probe_enabled, key=f"latency_{stream_id}") != probe_enabled:
+                manager.set_latency_probe([stream_id], not probe_enabled)
+            show_details = st.toggle("Подробности", key=f"details_{stream_id}")
+
+        # Подробности (логи, выходы, графики истории) строятся только для раскрытых панелей
+        if show_details:
+            render_details(converter, metrics, status)
+
 
 def display_streams():
-    with streams_placeholder.container():
-        st.header("Активные и завершенные конвертации")
-
-        if not st.session_state.converters:
-            st.info("Нет активных конвертаций.")
-            return # Выходим, если нет конвертеров
-
-        active_converters_ids = list(st.session_state.converters.keys())
-
-        for stream_id in active_converters_ids:
-            if stream_id not in st.session_state.converters:
-                continue
-                
-            converter = st.session_state.converters[stream_id]
-            status = converter.get_status()
-            metrics = converter.get_metrics()
-
-            with st.expander(f"Поток: {stream_id} | Статус: {status.upper()}", expanded=True):
-                col_info, col_action = st.columns([3,1])
-                
-                with col_info:
-                    st.markdown(f"**RTMP Источник:** `{converter.rtmp_url}`")
-                    st.markdown(f"**FFmpeg отправляет на:** `{converter.output_rtsp_url_for_ffmpeg_push}`")
-                    
-                    client_rtsp_url_display = converter.final_rtsp_url_for_client
-                    if converter.rtsp_server_host == "mediamtx":
-                        client_rtsp_url_display = f"rtsp://<IP_хоста_Docker>:{converter.rtsp_port}/{converter.rtsp_path}"
-                        st.markdown(f"**Примерный RTSP URL для клиента:** `{client_rtsp_url_display}` (замените `<IP_хоста_Docker>`)")
-                    else:
-                         st.markdown(f"**RTSP URL для клиента:** `{client_rtsp_url_display}`")
-
-                    st.markdown("---")
-                    st.subheader("Метрики потока:")
-                    m_col1, m_col2, m_col3, m_col4 = st.columns(4)
-                    with m_col1:
-                        st.metric(label="Битрейт (kbit/s)", value=str(metrics.get("bitrate_kbit", "N/A")))
-                    with m_col2:
-                        st.metric(label="FPS", value=str(metrics.get("fps", "N/A")))
-                    with m_col3:
-                        st.metric(label="CPU FFmpeg (%)", value=str(metrics.get("cpu_percent", "N/A")))
-                    with m_col4:
-                        st.metric(label="Память FFmpeg (MB)", value=str(metrics.get("memory_mb", "N/A")))
-                    
-                    st.metric(label="Ошибки/Дропы (счетчик)", value=str(metrics.get("dropped_frames", 0)))
-                    
-                    if metrics.get("last_update_time"):
-                        st.caption(f"Метрики обновлены: {time.strftime('%H:%M:%S', time.localtime(metrics['last_update_time']))}")
-
-                    if status == "завершен_с_ошибкой" or status == "ошибка_запуска":
-                        last_error = converter.get_last_error()
-                        if last_error:
-                            st.error(f"Последняя ошибка FFmpeg: {last_error}")
-                
-                with col_action:
-                    # Кнопки должны быть уникальными, даже если форма перерисовывается
-                    # Используем stream_id в key кнопки
-                    if status in ["запущен", "запускается"]:
-                        if st.button("Остановить", key=f"stop_{stream_id}_{time.time()}"): # Добавляем time для уникальности при быстром обновлении
-                            st.info(f"Остановка потока {stream_id}...")
-                            stop_specific_conversion(converter)
-                            time.sleep(0.5) # Короткая пауза перед rerun
-                            st.rerun()
-                    elif status not in ["останавливается"]:
-                        if st.button("Удалить из списка", key=f"remove_{stream_id}_{time.time()}"):
-                            del st.session_state.converters[stream_id]
-                            st.rerun()
-                
-                ffmpeg_logs = converter.get_ffmpeg_logs()
-                if ffmpeg_logs:
-                    with st.container():
-                        st.markdown("**Логи FFmpeg (последние):**")
-                        log_text = "\n".join(ffmpeg_logs)
-                        st.code(log_text, language="log", line_numbers=False)
-                
-                st.markdown("---")
-                metrics_history = converter.get_metrics_history()
-                if metrics_history:
-                    df_metrics = pd.DataFrame(metrics_history)
-                    charts_to_display = {}
-                    if 'bitrate_kbit' in df_metrics.columns and pd.to_numeric(df_metrics['bitrate_kbit'], errors='coerce').notnull().any():
-                        charts_to_display['Битрейт (kbit/s)'] = pd.to_numeric(df_metrics['bitrate_kbit'], errors='coerce')
-                    if 'cpu_percent' in df_metrics.columns and pd.to_numeric(df_metrics['cpu_percent'], errors='coerce').notnull().any():
-                        charts_to_display['CPU FFmpeg (%)'] = pd.to_numeric(df_metrics['cpu_percent'], errors='coerce')
-                    if 'fps' in df_metrics.columns and pd.to_numeric(df_metrics['fps'], errors='coerce').notnull().any():
-                         charts_to_display['FPS'] = pd.to_numeric(df_metrics['fps'], errors='coerce')
-
-                    if charts_to_display:
-                        st.subheader("История метрик:")
-                        df_chart = pd.DataFrame(charts_to_display)
-                        df_chart.dropna(inplace=True)
-                        if not df_chart.empty:
-                            st.line_chart(df_chart)
-                        else:
-                            st.caption("Недостаточно данных для построения графика истории.")
-                    else:
-                        st.caption("Нет данных для графика истории метрик.")
+    st.header("Активные и завершенные конвертации")
+    fleet_summary()
+
+    converters = manager.converters()
+    if not converters:
+        st.info("Нет активных конвертаций.")
+        return
+
+    f_col1, f_col2, f_col3 = st.columns([3, 1, 1])
+    with f_col1:
+        query = st.text_input("Фильтр (ID потока или статус):", key="stream_filter").strip().lower()
+    if query:
+        converters = [c for c in converters if query in c.stream_id.lower() or query in c.get_status().lower()]
+    with f_col2:
+        page_size = st.selectbox("Потоков на странице:", PAGE_SIZES, key="page_size")
+    pages = max(1, -(-len(converters) // page_size))
+    if st.session_state.get("page", 1) > pages: # Потоков стало меньше - остаемся на последней странице
+        st.session_state["page"] = pages
+    with f_col3:
+        page = st.number_input("Страница:", min_value=1, max_value=pages, step=1, key="page")
+    page_converters = converters[(page - 1) * page_size:page * page_size]
+    st.caption(f"Показано {len(page_converters)} из {len(converters)} (страница {page} из {pages}).")
+
+    for converter in page_converters:
+        stream_panel(converter.stream_id)
+
 
 # --- Боковая панель ---
 st.sidebar.header("О проекте")
@@ -185,47 +329,17 @@ st.sidebar.info(
     "Для раздачи RTSP потоков рекомендуется использовать mediamtx."
 )
 st.sidebar.markdown("---")
-# Убираем кнопку "Обновить статусы", так как будет автообновление
-# if st.sidebar.button("Обновить статусы всех потоков"):
-#    st.rerun()
-
-# --- Логика автообновления ---
-# Этот цикл будет выполняться постоянно, обновляя содержимое streams_placeholder
-# Важно: st.rerun() внутри этого цикла не нужен, так как мы напрямую обновляем placeholder.
-# Однако, чтобы кнопки работали корректно и Streamlit обрабатывал их состояние,
-# st.rerun() все еще нужен ПОСЛЕ нажатия кнопки.
-# Для простого периодического обновления данных без взаимодействия, можно было бы обойтись без rerun,
-# но кнопки усложняют ситуацию.
-#
-# Простой способ заставить Streamlit обновляться - это использовать st.rerun() в конце скрипта
-# после небольшой задержки. Это будет вызывать полный пересчет скрипта.
-
-# Первоначальное отображение
-display_streams()
+st.sidebar.subheader("Все потоки")
+# Массовые операции выполняются в фоне: остановка ждет завершения FFmpeg (до KAZSTREAMLINK_STOP_TIMEOUT
+# + KAZSTREAMLINK_KILL_TIMEOUT), а прогон скрипта не должен блокироваться
+bulk_col1, bulk_col2 = st.sidebar.columns(2)
+if bulk_col1.button("Остановить все", key="stop_all"):
+    threading.Thread(target=manager.stop_many, daemon=True, name="ui_stop_all").start()
+    st.toast("Остановка всех потоков запущена.")
+if bulk_col2.button("Запустить все", key="start_all"):
+    threading.Thread(target=manager.start_many, daemon=True, name="ui_start_all").start()
+    st.toast("Запуск остановленных потоков запущен.")
+st.sidebar.markdown("---")
+st.sidebar.caption(f"Сводка и панели потоков обновляются каждые {UI_REFRESH_SEC:g} с (KAZSTREAMLINK_UI_REFRESH).")
 
-# Цикл для периодического обновления (если не было взаимодействия, которое вызвало rerun)
-# Этот подход может быть не идеальным, так как st.rerun() перезапускает весь скрипт.
-# Более продвинутые техники могут использовать st.experimental_fragment или кастомные компоненты.
-# Для простоты, оставим st.rerun() после действий пользователя и кнопку ручного обновления.
-# Если нужно "живое" обновление без действий, то это сложнее.
-
-# Для имитации "живого" обновления, можно добавить кнопку "Обновить сейчас" в основной части
-# или положиться на то, что пользователь будет взаимодействовать с UI (нажимать кнопки),
-# что и так вызывает st.rerun().
-
-# Если мы хотим принудительное автообновление каждые N секунд:
-# Это должно быть в самом конце скрипта.
-# time.sleep(2) # Интервал обновления в секундах
-# st.rerun()
-# ВНИМАНИЕ: Бесконечный st.rerun() с time.sleep() может привести к проблемам с производительностью
-# и поведением виджетов, особенно если интервал слишком мал.
-# Streamlit не предназначен для такого типа постоянного фонового обновления без взаимодействия.
-# Лучше всего, если обновления происходят в ответ на действия пользователя или через
-# более контролируемые механизмы, если они появятся в Streamlit.
-
-# Пока оставим обновление по кнопкам. Если нужно более "живое", можно исследовать
-# st.experimental_fragment или другие подходы.
-# Для текущей задачи, обновление при взаимодействии (нажатие "Остановить", "Удалить", "Начать")
-# и кнопка "Обновить статусы всех потоков" должны быть достаточны.
-if st.sidebar.button("Обновить отображение потоков"):
-    st.rerun()
+display_streams()
@@ -0,0 +1,77 @@
+import threading
+
+import pytest
+
+from rtmp_to_rtsp_converter import admission
+from rtmp_to_rtsp_converter.admission import PRIOR_COST, AdmissionRejected, CapacityModel
+
+HEADROOM = {"cpu": 1.0, "memory": 1.0, "nic": 1.0, "streams": 1.0}
+
+
+def _model(streams=float("inf"), queue_sec=0.0):
+    capacity = {"cpu": 100.0, "memory": 1000.0, "nic": 100.0, "streams": streams}
+    return CapacityModel(capacity, HEADROOM, queue_sec=queue_sec, queue_max=4, enabled=True)
+
+
+class _Converter:
+    def __init__(self, stream_id, url):
+        self.inputs = [(stream_id, url)]
+
+    def _capacity_inputs(self):
+        return self.inputs
+
+
+def test_reservations_count_until_first_sample():
+    model = _model(streams=2)
+    model.admit("a", "rtmp://h/live/a", wait=False)
+    model.admit("b", "rtmp://h/live/b", wait=False)
+    with pytest.raises(AdmissionRejected) as error:
+        model.admit("c", "rtmp://h/live/c", wait=False)
+    assert error.value.resource == "streams"
+    model.release("b")
+    model.admit("c", "rtmp://h/live/c", wait=False)
+    assert model.decisions == {"admitted": 3, "queued": 0, "rejected": 1}
+
+
+def test_empty_node_admits_any_stream():
+    model = _model()
+    model._fleet_cost = [500.0, 10.0, 1.0] # Дороже всего узла
+    model.admit("a", "rtmp://h/live/a", wait=False)
+    with pytest.raises(AdmissionRejected) as error:
+        model.admit("b", "rtmp://h/live/b", wait=False)
+    assert error.value.resource == "cpu"
+
+
+def test_cost_is_learned_per_source(monkeypatch):
+    monkeypatch.setattr(admission, "WARMUP_SEC", 0.0)
+    model = _model()
+    assert model.cost("rtmp://h/live/a") == PRIOR_COST
+    converter = _Converter("a", "rtmp://h/live/a")
+    model.admit("a", "rtmp://h/live/a", wait=False)
+    for _ in range(3):
+        model.record(converter, 20.0, 100.0, 8.0)
+    assert model.cost("rtmp://h/live/a") == pytest.approx((20.0, 100.0, 8.0))
+    assert model.report()["reserved"] == 0 and model.report()["actual"]["cpu"] == 20.0
+    # Незнакомый источник получает стоимость узла, которая тоже учится на замерах
+    assert model.cost("rtmp://h/live/new")[0] == pytest.approx(20.0)
+    model.record(converter, "N/A", 100.0, 8.0) # Неполный замер не учитывается
+    assert model.report()["actual"]["cpu"] == 20.0
+    model.forget(converter)
+    assert model.report()["actual"]["cpu"] == 0.0
+
+
+def test_queued_request_is_admitted_when_capacity_frees():
+    model = _model(streams=1, queue_sec=5.0)
+    model.admit("a", "rtmp://h/live/a", wait=False)
+    timer = threading.Timer(0.2, model.release, args=("a",))
+    timer.start()
+    model.admit("b", "rtmp://h/live/b")
+    timer.join()
+    assert model.decisions["queued"] == 1 and model.decisions["admitted"] == 2 and model.waiting == 0
+
+
+def test_disabled_model_admits_everything():
+    model = CapacityModel({"cpu": 1.0, "memory": 1.0, "nic": 1.0, "streams": 1}, HEADROOM, enabled=False)
+    for i in range(5):
+        model.admit(f"s{i}", "rtmp://h/live/x", wait=False)
+    assert model.decisions["admitted"] == 0
@@ -0,0 +1,151 @@
+import json
+import asyncio
+
+import pytest
+
+from rtmp_to_rtsp_converter.api import (
+    MAX_HEADERS, ControlPlaneAPI, HTTPError, authorized, check_bind, content_length, is_loopback
+)
+
+
+class _Manager:
+    last_restore = None
+
+    def converters(self):
+        return []
+
+    def stop_many(self, stream_ids=None):
+        return []
+
+
+class _Writer:
+    def __init__(self):
+        self.data = b""
+        self.closed = False
+
+    def write(self, data):
+        self.data += data
+
+    async def drain(self):
+        pass
+
+    def close(self):
+        self.closed = True
+
+
+def _exchange(raw, token=""):
+    """Прогоняет сырые байты запросов через handle_connection; возвращает [(статус, тело JSON)]."""
+    async def run():
+        reader = asyncio.StreamReader()
+        reader.feed_data(raw)
+        reader.feed_eof()
+        writer = _Writer()
+        await ControlPlaneAPI(_Manager(), node_id="test", token=token).handle_connection(reader, writer)
+        return writer
+    writer = asyncio.run(run())
+    assert writer.closed
+    responses = []
+    data = writer.data
+    while data:
+        head, _, rest = data.partition(b"\r\n\r\n")
+        lines = head.decode("latin-1").split("\r\n")
+        length = next(int(line.split(":", 1)[1]) for line in lines if line.lower().startswith("content-length:"))
+        responses.append((int(lines[0].split()[1]), json.loads(rest[:length]) if length else None))
+        data = rest[length:]
+    return responses
+
+
+@pytest.mark.parametrize("value, expected", [(None, 0), ("", 0), ("0", 0), ("12", 12)])
+def test_content_length_valid(value, expected):
+    headers = {} if value is None else {"content-length": value}
+    assert content_length(headers) == expected
+
+
+@pytest.mark.parametrize("value", ["abc", "-1", "+1", "1_000", "1.5", "²"])
+def test_content_length_invalid(value):
+    with pytest.raises(HTTPError) as error:
+        content_length({"content-length": value})
+    assert error.value.status == 400
+
+
+def test_keep_alive_requests():
+    request = b"GET /health HTTP/1.1\r\nHost: x\r\n\r\n"
+    assert [status for status, _ in _exchange(request * 2)] == [200, 200]
+
+
+@pytest.mark.parametrize("value", [b"abc", b"-5"])
+def test_bad_content_length_answers_400(value):
+    responses = _exchange(b"POST /streams HTTP/1.1\r\nContent-Length: " + value + b"\r\n\r\n{}")
+    assert len(responses) == 1 and responses[0][0] == 400
+
+
+def test_bad_request_line_answers_400():
+    assert _exchange(b"garbage\r\n\r\n")[0][0] == 400
+
+
+def test_oversized_request_line_answers_400():
+    responses = _exchange(b"GET /" + b"a" * 70000 + b" HTTP/1.1\r\n\r\n")
+    assert [status for status, _ in responses] == [400]
+
+
+@pytest.mark.parametrize("headers", [b"X-Long: " + b"a" * 70000 + b"\r\n", b"X-Many: 1\r\n" * (MAX_HEADERS + 1)])
+def test_oversized_headers_answer_431(headers):
+    responses = _exchange(b"GET /health HTTP/1.1\r\n" + headers + b"\r\nGET /health HTTP/1.1\r\n\r\n")
+    assert [status for status, _ in responses] == [431] # Соединение закрыто, второй запрос не читается
+
+
+def test_header_count_limit():
+    responses = _exchange(b"GET /health HTTP/1.1\r\n" + b"X-Many: 1\r\n" * MAX_HEADERS + b"Connection: close\r\n\r\n")
+    assert responses[0][0] == 431 # Connection - сто первый заголовок
+    responses = _exchange(b"GET /health HTTP/1.1\r\n" + b"X-Many: 1\r\n" * (MAX_HEADERS - 1) + b"Connection: close\r\n\r\n")
+    assert responses[0][0] == 200
+
+
+def test_body_must_be_json():
+    body = b"not json"
+    responses = _exchange(b"POST /streams HTTP/1.1\r\nContent-Length: %d\r\nConnection: close\r\n\r\n%s" % (len(body), body))
+    assert responses[0][0] == 400
+
+
+def test_stream_ids_body_must_be_object():
+    body = b'["s1"]'
+    responses = _exchange(b"POST /streams/stop HTTP/1.1\r\nContent-Length: %d\r\nConnection: close\r\n\r\n%s" % (len(body), body))
+    assert responses[0][0] == 400
+
+
+def test_unknown_route_404():
+    assert _exchange(b"GET /nope HTTP/1.1\r\nConnection: close\r\n\r\n")[0][0] == 404
+
+
+@pytest.mark.parametrize("host, expected", [("127.0.0.1", True), ("127.1.2.3", True), ("::1", True), ("[::1]", True),
+                                            ("localhost", True), ("0.0.0.0", False), ("", False), ("10.0.0.5", False)])
+def test_is_loopback(host, expected):
+    assert is_loopback(host) is expected
+
+
+def test_check_bind_requires_token_off_loopback():
+    check_bind("127.0.0.1", token="")
+    check_bind("0.0.0.0", token="secret")
+    with pytest.raises(RuntimeError):
+        check_bind("0.0.0.0", token="")
+
+
+@pytest.mark.parametrize("headers, path, expected", [
+    ({}, "/streams", False),
+    ({"authorization": "Bearer secret"}, "/streams", True),
+    ({"authorization": "bearer secret"}, "/streams", True),
+    ({"authorization": "Bearer wrong"}, "/streams", False),
+    ({"authorization": "Basic secret"}, "/streams", False),
+    ({}, "/health", True),
+])
+def test_authorized(headers, path, expected):
+    assert authorized(headers, path, token="secret") is expected
+    assert authorized(headers, path, token="") is True
+
+
+def test_missing_token_answers_401():
+    request = b"GET /streams HTTP/1.1\r\n\r\n"
+    assert _exchange(request, token="secret")[0][0] == 401
+    with_token = b"GET /streams HTTP/1.1\r\nAuthorization: Bearer secret\r\n\r\n"
+    assert _exchange(with_token, token="secret")[0][0] == 200
+    assert _exchange(b"GET /health HTTP/1.1\r\n\r\n", token="secret")[0][0] == 200
@@ -0,0 +1,103 @@
+import time
+
+import pytest
+
+from rtmp_to_rtsp_converter import cluster
+from rtmp_to_rtsp_converter.cluster import (
+    DEFAULT_STREAM_CPU, DEFAULT_STREAM_MBIT, NODE_DRAINING, Coordinator, NodeState, PlacementScheduler
+)
+
+
+def _node(node_id, streams=0, max_streams=10, **report):
+    node = NodeState(node_id, f"http://{node_id}:8080")
+    node.update({"cpu_count": 8, "nic_mbit": 10000.0, "max_streams": max_streams, **report})
+    node.streams = {f"{node_id}_{i}" for i in range(streams)}
+    return node
+
+
+def test_per_stream_defaults_until_measured():
+    assert _node("a").per_stream() == (DEFAULT_STREAM_CPU, DEFAULT_STREAM_MBIT)
+
+
+def test_per_stream_egress_counts_only_exact_streams():
+    node = NodeState("a", "http://a:8080")
+    node.update({"streams": [{}] * 4, "cpu_percent": 40.0, "output_bytes": 0, "output_streams": 2, "time": 100.0})
+    node.update({"streams": [{}] * 4, "cpu_percent": 40.0, "output_bytes": 2_500_000, "output_streams": 2, "time": 102.0})
+    assert node.egress_mbit == pytest.approx(10.0)
+    assert node.per_stream() == (10.0, pytest.approx(5.0))
+    node.update({"streams": [{}] * 4, "cpu_percent": 40.0, "output_bytes": 2_500_000, "output_streams": 0, "time": 104.0})
+    assert node.per_stream()[1] == DEFAULT_STREAM_MBIT # Точных счетчиков нет - трафик по умолчанию
+
+
+def test_load_is_the_largest_fraction():
+    node = _node("a", streams=4, max_streams=5)
+    assert node.load() == pytest.approx(0.8)
+    assert node.load(extra=1) == pytest.approx(1.0)
+
+
+@pytest.mark.parametrize("policy, expected", [("least_loaded", ["b", "b", "b"]), ("binpack", ["a", "b", "b"])])
+def test_placement_policies(policy, expected):
+    nodes = [_node("a", streams=3, max_streams=4), _node("b", streams=0, max_streams=4)]
+    choice = PlacementScheduler(policy).place(nodes, 3)
+    assert [node.node_id for node in choice] == expected
+
+
+def test_placement_skips_draining_and_full_nodes():
+    nodes = [_node("a", streams=3, max_streams=4), _node("b", streams=0, max_streams=4)]
+    nodes[1].draining = True
+    assert nodes[1].state == NODE_DRAINING
+    choice = PlacementScheduler("least_loaded").place(nodes, 2)
+    assert [node.node_id if node else None for node in choice] == ["a", None] # Второму потоку места нет
+
+
+def test_unknown_policy():
+    with pytest.raises(ValueError):
+        PlacementScheduler("random")
+
+
+def _wait(condition, timeout=2.0):
+    deadline = time.monotonic() + timeout
+    while not condition() and time.monotonic() < deadline:
+        time.sleep(0.01)
+    return condition()
+
+
+def test_rebalance_skips_unreachable_target(monkeypatch):
+    def http_json(url, method="GET", body=None):
+        if url.startswith("http://b") and url.endswith("/stop"):
+            raise OSError("connection refused")
+        if url.endswith("/streams"):
+            return 200, {"results": [{"stream_id": spec["stream_id"], "ok": True} for spec in body["streams"]]}
+        return 200, {}
+
+    monkeypatch.setattr(cluster, "http_json", http_json)
+    coordinator = Coordinator(period=60)
+    try:
+        coordinator.nodes = {"a": _node("a"), "b": _node("b")}
+        coordinator.nodes["a"].streams = {"s1", "s2"}
+        for stream_id in ("s1", "s2"):
+            spec = {"stream_id": stream_id, "rtmp_url": "rtmp://src/live", "rtsp_path": stream_id}
+            coordinator.placements[stream_id] = {"node_id": "a", "spec": spec, "desired": "stopped"}
+        coordinator.nodes["a"].failed = True
+        result = coordinator.rebalance()
+        assert (result["moved"], result["failed"]) == (2, 0) # Отказ остановки s1 не прерывает перенос s2
+        assert coordinator.nodes["b"].streams == {"s1", "s2"}
+    finally:
+        coordinator.close()
+
+
+def test_monitor_survives_failed_pass(monkeypatch):
+    coordinator = Coordinator(node_timeout=0.05, period=0.02)
+    try:
+        def rebalance(node_ids=None):
+            raise RuntimeError("сбой прохода")
+
+        monkeypatch.setattr(coordinator, "rebalance", rebalance)
+        coordinator.heartbeat({"node_id": "a", "url": "http://a:8080"})
+        coordinator.nodes["a"].streams = {"s1"}
+        assert _wait(lambda: coordinator.nodes["a"].failed)
+        time.sleep(0.1) # Несколько проходов с ошибкой
+        coordinator.heartbeat({"node_id": "b", "url": "http://b:8080"})
+        assert _wait(lambda: coordinator.nodes["b"].failed) # Обнаружение отказов продолжается
+    finally:
+        coordinator.close()
@@ -0,0 +1,38 @@
+import pytest
+
+from rtmp_to_rtsp_converter.dedup import normalise_source
+
+
+@pytest.mark.parametrize("url", [
+    "rtmp://127.0.0.1/live/src1",
+    "RTMP://127.0.0.1/live/src1",
+    "rtmp://127.0.0.1:1935/live/src1",
+    "rtmp://127.0.0.1//live/src1/",
+    "  rtmp://127.0.0.1/live//src1  ",
+])
+def test_equivalent_urls_share_a_key(url):
+    assert normalise_source(url) == "rtmp://127.0.0.1/live/src1"
+
+
+@pytest.mark.parametrize("a, b", [
+    ("rtmp://127.0.0.1/live/src1", "rtmp://localhost/live/src1"), # Имена хостов не разрешаются
+    ("rtmp://127.0.0.1/live/src1", "rtmp://127.0.0.1:1936/live/src1"),
+    ("rtmp://127.0.0.1/live/Src1", "rtmp://127.0.0.1/live/src1"), # Ключ потока - с учетом регистра
+    ("rtmp://127.0.0.1/live/src1?token=a", "rtmp://127.0.0.1/live/src1?token=b"),
+    ("rtmp://127.0.0.1/live/src1", "rtmps://127.0.0.1/live/src1"),
+    ("rtmp://user:a@host/live/x", "rtmp://user:b@host/live/x"),
+])
+def test_different_sources_keep_different_keys(a, b):
+    assert normalise_source(a) != normalise_source(b)
+
+
+def test_host_case_ipv6_and_default_ports():
+    assert normalise_source("rtmp://CAM.Example.com/live/x") == "rtmp://cam.example.com/live/x"
+    assert normalise_source("rtmp://[::1]:1935/live/x") == "rtmp://[::1]/live/x"
+    assert normalise_source("rtsp://cam:554/stream") == "rtsp://cam/stream"
+    assert normalise_source("rtmps://host:443/app") == "rtmps://host/app"
+
+
+@pytest.mark.parametrize("url", ["not a url", "rtmp://host:port/live/x"])
+def test_unparseable_urls_are_returned_as_is(url):
+    assert normalise_source(url) == url.strip()
@@ -0,0 +1,62 @@
+import re
+import time
+
+from rtmp_to_rtsp_converter.exporter import MetricsExporter
+from rtmp_to_rtsp_converter.fleet import FleetSnapshot
+from rtmp_to_rtsp_converter.manager import ConverterManager
+
+
+class _Manager(ConverterManager):
+    def __init__(self, rows):
+        super().__init__(registry=None)
+        self.rows = rows
+
+    def snapshot(self, max_age=None):
+        return FleetSnapshot(self.rows)
+
+
+def _row(stream_id, status="запущен", outputs=(), **metrics):
+    return {"stream_id": stream_id, "status": status, "metrics": metrics, "started_at": time.time() - 10,
+            "restarts": 1, "outputs": list(outputs)}
+
+
+def _render(rows, openmetrics=True):
+    content_type, body = MetricsExporter(_Manager(rows), max_age=0).render(openmetrics)
+    return content_type, body.decode("utf-8")
+
+
+def test_stream_samples_and_escaping():
+    _, text = _render([_row('cam "1"\\', bitrate_kbit=2500.5, fps=25, memory_mb=2.0, cpu_percent="N/A")])
+    labels = '{stream_id="cam \\"1\\"\\\\"}'
+    assert f"kazstreamlink_stream_bitrate_kbit{labels} 2500.5" in text
+    assert f"kazstreamlink_stream_fps{labels} 25" in text
+    assert f"kazstreamlink_stream_memory_bytes{labels} 2097152.0" in text
+    assert "kazstreamlink_stream_cpu_percent{" not in text # "N/A" не экспортируется
+
+
+def test_counter_names_by_format():
+    rows = [_row("a", dropped_frames=3)]
+    content_type, text = _render(rows, openmetrics=True)
+    assert content_type.startswith("application/openmetrics-text")
+    assert "# TYPE kazstreamlink_stream_dropped_frames counter" in text
+    assert 'kazstreamlink_stream_dropped_frames_total{stream_id="a"} 3' in text
+    assert text.endswith("# EOF\n")
+    content_type, text = _render(rows, openmetrics=False)
+    assert content_type.startswith("text/plain; version=0.0.4")
+    assert "# TYPE kazstreamlink_stream_dropped_frames_total counter" in text and "# EOF" not in text
+
+
+def test_output_bytes_only_for_exact_legs():
+    legs = [{"url": "rtsp://h/a", "status": "работает", "bytes": 1000}, {"url": "rtmp://h/a", "status": "работает", "bytes": None}]
+    _, text = _render([_row("a", outputs=legs)])
+    samples = re.findall(r'^kazstreamlink_output_bytes_total\{(.*)\} (\d+)$', text, re.MULTILINE)
+    assert samples == [('stream_id="a",output="0"', "1000")]
+
+
+def test_every_sample_has_a_family():
+    _, text = _render([_row("a", bitrate_kbit=1.0), _row("b", status="остановлен")])
+    families = set(re.findall(r"^# TYPE (\S+) ", text, re.MULTILINE))
+    for line in text.splitlines():
+        if line and not line.startswith("#"):
+            name = re.match(r"[a-zA-Z_:][a-zA-Z0-9_:]*", line).group(0)
+            assert any(name == f or name.startswith(f + "_") for f in families), line
@@ -0,0 +1,45 @@
+import os
+import sys
+import time
+import signal
+import subprocess
+
+from rtmp_to_rtsp_converter.progress_parser import ProgressParser
+
+FAKE_FFMPEG = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "benchmarks", "fake_ffmpeg.py")
+ARGS = ["-analyzeduration", "0", "-i", "rtmp://source/live/a", "-progress", "pipe:1", "-f", "rtsp", "rtsp://127.0.0.1:8554/a"]
+
+
+def _run(**env):
+    environment = dict(os.environ, FAKE_FFMPEG_PROGRESS_PERIOD="0.05", **env)
+    return subprocess.Popen([sys.executable, FAKE_FFMPEG, *ARGS], stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                            env=environment)
+
+
+def test_progress_blocks_are_parsed_and_source_loss_exits_with_1():
+    process = _run(FAKE_FFMPEG_EXIT_AFTER="0.3", FAKE_FFMPEG_DROP_RATE="100")
+    stdout, stderr = process.communicate(timeout=10)
+    blocks = []
+    parser = ProgressParser(blocks.append)
+    parser.feed(stdout)
+    assert process.returncode == 1 and b"Connection reset by peer" in stderr
+    assert parser.blocks >= 3
+    assert 24.8 <= blocks[0]["fps"] <= 25.2 and blocks[-1]["dropped_frames"] > 0
+
+
+def test_same_seed_gives_same_output():
+    first, second = (_run(FAKE_FFMPEG_EXIT_AFTER="0.01", FAKE_FFMPEG_SEED="7") for _ in range(2))
+    outputs = [process.communicate(timeout=10)[0].split(b"progress=continue\n")[0] for process in (first, second)]
+    fields = [[line for line in out.splitlines() if line.startswith((b"fps=", b"total_size="))] for out in outputs]
+    assert fields[0] == fields[1] and fields[0]
+
+
+def test_sigint_stops_after_stop_delay():
+    process = _run(FAKE_FFMPEG_STOP_DELAY="0.2")
+    process.stdout.readline() # Первый блок -progress: процесс работает
+    started = time.monotonic()
+    process.send_signal(signal.SIGINT)
+    assert process.wait(timeout=5) == 255
+    assert time.monotonic() - started >= 0.15
+    process.stdout.close()
+    process.stderr.close()
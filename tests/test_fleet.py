@@ -0,0 +1,56 @@
+import time
+
+from rtmp_to_rtsp_converter.fleet import FleetSnapshot, build_fleet_snapshot
+from rtmp_to_rtsp_converter.manager import ConverterManager
+
+
+class _Converter:
+    def __init__(self, stream_id, status="запущен", **metrics):
+        self.stream_id = stream_id
+        self.status = status
+        self.metrics = metrics
+        self.started_at = time.time()
+        self.start_count = 3
+        self.reads = 0
+
+    def get_status(self):
+        return self.status
+
+    def get_metrics(self):
+        self.reads += 1
+        return dict(self.metrics)
+
+    def get_output_legs(self):
+        return []
+
+
+def test_totals_count_running_streams_and_numeric_metrics():
+    rows = [
+        {"stream_id": "a", "status": "запущен", "metrics": {"bitrate_kbit": 1000.0, "cpu_percent": 12.5, "health_state": "ok"}},
+        {"stream_id": "b", "status": "запускается", "metrics": {"bitrate_kbit": "N/A", "health_state": "stalled"}},
+        {"stream_id": "c", "status": "остановлен", "metrics": {"memory_mb": 30.0, "health_state": "stalled"}},
+    ]
+    totals = FleetSnapshot(rows).totals
+    assert (totals["streams"], totals["running"]) == (3, 2)
+    assert (totals["bitrate_kbit"], totals["cpu_percent"], totals["memory_mb"]) == (1000.0, 12.5, 30.0)
+    assert totals["by_health"] == {"ok": 1, "stalled": 1} # Здоровье остановленных потоков не считается
+    assert totals["by_status"] == {"запущен": 1, "запускается": 1, "остановлен": 1}
+
+
+def test_table_blanks_missing_values():
+    snapshot = build_fleet_snapshot([_Converter("a", fps=25, speed="N/A")])
+    table = snapshot.table()
+    assert table["Поток"] == ["a"] and table["FPS"] == [25]
+    assert table["Скорость"] == [None] and table["Здоровье"] == [None]
+    assert table["Автоперезапуски"] == [None] and snapshot.rows[0]["restarts"] == 2
+    assert snapshot.table() is table # Таблица собирается один раз на снимок
+
+
+def test_manager_snapshot_is_shared_within_period():
+    converter = _Converter("a", fps=25)
+    converter_manager = ConverterManager(pack_size=1, registry=None, dedup=False)
+    converter_manager._converters["a"] = converter
+    first = converter_manager.snapshot(max_age=60)
+    assert converter_manager.snapshot(max_age=60) is first and converter.reads == 1
+    converter_manager._invalidate_snapshot()
+    assert converter_manager.snapshot(max_age=60) is not first and converter.reads == 2
@@ -0,0 +1,118 @@
+import math
+
+import pytest
+
+from rtmp_to_rtsp_converter.health import HealthEngine, HealthRules, COLLAPSE, DROPS, SLOW, STALLED, sent_bytes
+
+KBIT = 4000 # Битрейт потока до обвала
+
+
+class _Stream:
+    def __init__(self):
+        self.restarts = []
+
+    def _restart_unhealthy(self, reasons):
+        self.restarts.append(reasons)
+
+
+def _engine():
+    # Пороги по умолчанию: правило обязано срабатывать на них, а не на подобранных для теста
+    return HealthEngine(HealthRules(restart=False), period=1.0, capacity=4)
+
+
+def _run(engine, stream, seconds, metrics_at):
+    for t in range(seconds):
+        engine.record(stream, metrics_at(t))
+        engine.evaluate()
+
+
+def _progress(t, collapse_at, key):
+    """Блок -progress: KBIT до collapse_at, потом почти ничего; out_time растет (поток не завис)."""
+    sent = KBIT * 125 * min(t, collapse_at) + 100 * max(t - collapse_at, 0)
+    out_time_us = t * 1_000_000
+    if key == "total_size":
+        return {"out_time_us": out_time_us, "speed": 1.0, "total_size": sent}
+    return {"out_time_us": out_time_us, "speed": 1.0, "bitrate_kbit": sent * 8 / 1000 / max(t, 1)}
+
+
+@pytest.mark.parametrize("key", ["total_size", "bitrate_kbit"])
+def test_collapse_fires_on_progress_counters(key):
+    engine, stream = _engine(), _Stream()
+    engine.register(stream)
+    collapse_at = engine.window - engine._k_collapse
+    _run(engine, stream, collapse_at, lambda t: _progress(t, collapse_at, key))
+    assert not engine.flags[engine._rows[stream]] & COLLAPSE
+    _run(engine, stream, engine._k_collapse + 1, lambda t: _progress(collapse_at + t, collapse_at, key))
+    assert engine.flags[engine._rows[stream]] & COLLAPSE
+    assert "битрейт упал" in engine.health(stream)["health_reasons"]
+
+
+def test_collapse_not_fired_on_steady_stream():
+    engine, stream = _engine(), _Stream()
+    engine.register(stream)
+    _run(engine, stream, engine.window * 2, lambda t: _progress(t, engine.window * 10, "total_size"))
+    assert engine.health(stream) == {"health_score": 100, "health_state": "ok", "health_reasons": []}
+
+
+def test_sent_bytes_without_counters():
+    assert math.isnan(sent_bytes({"total_size": "N/A", "bitrate_kbit": "N/A"}))
+    assert sent_bytes({"total_size": 1000}) == 1000.0
+    assert sent_bytes({"bitrate_kbit": 8.0, "out_time_us": 2_000_000}) == 2000.0
+
+
+def _steady(t, **changes):
+    metrics = {"out_time_us": t * 1_000_000, "speed": 1.0, "total_size": KBIT * 125 * t, "dropped_frames": 0}
+    metrics.update(changes)
+    return metrics
+
+
+def test_unknown_without_progress():
+    engine, stream = _engine(), _Stream()
+    engine.register(stream)
+    _run(engine, stream, 3, lambda t: {"out_time_us": "N/A", "speed": "N/A"})
+    assert engine.health(stream) == {"health_score": "N/A", "health_state": "unknown", "health_reasons": []}
+
+
+def test_stall_marks_stalled_and_restarts():
+    engine = HealthEngine(HealthRules(restart_after_sec=0.0, restart=True), period=1.0, capacity=4)
+    stream = _Stream()
+    engine.register(stream)
+    _run(engine, stream, engine._k_stall, _steady)
+    assert not stream.restarts
+    _run(engine, stream, engine._k_stall + 1, lambda t: _steady(engine._k_stall)) # out_time стоит на месте
+    assert stream.restarts == [["out_time не растет"]]
+    assert engine.unhealthy_restarts == 1
+
+
+def test_stall_without_restart_reports_state():
+    engine, stream = _engine(), _Stream()
+    engine.register(stream)
+    _run(engine, stream, engine._k_stall + 1, lambda t: _steady(0))
+    health = engine.health(stream)
+    assert health["health_state"] == "stalled" and health["health_score"] == 0
+    assert engine.flags[engine._rows[stream]] & STALLED and not stream.restarts
+
+
+def test_slow_speed():
+    engine, stream = _engine(), _Stream()
+    engine.register(stream)
+    _run(engine, stream, engine._k_slow, lambda t: _steady(t, speed=0.5))
+    assert engine.flags[engine._rows[stream]] == SLOW
+    assert engine.health(stream)["health_state"] == "degraded"
+
+
+def test_drop_spike():
+    engine, stream = _engine(), _Stream()
+    engine.register(stream)
+    _run(engine, stream, engine._k_drop + 1, lambda t: _steady(t, dropped_frames=t * 50))
+    assert engine.flags[engine._rows[stream]] == DROPS
+    assert engine.counts_by_state()["degraded"] == 1
+
+
+def test_missing_counters_disable_drop_and_collapse_rules():
+    # Так оценивается группа упакованных потоков: счетчики выхода - "N/A" (packing.py)
+    engine, stream = _engine(), _Stream()
+    engine.register(stream)
+    _run(engine, stream, engine.window * 2,
+         lambda t: _steady(t, total_size="N/A", bitrate_kbit="N/A", dropped_frames="N/A"))
+    assert engine.health(stream)["health_state"] == "ok"
@@ -0,0 +1,79 @@
+import struct
+
+import pytest
+
+from rtmp_to_rtsp_converter.latency import (
+    TIMECODE_UUID, _escape_emulation, _parse_sdp, _percentile, _sei_units, parse_timecode, timecode_sei
+)
+
+
+@pytest.mark.parametrize("rbsp, nal", [
+    (b"\x00\x00\x00", b"\x00\x00\x03\x00"),
+    (b"\x00\x00\x01\x00\x00\x02", b"\x00\x00\x03\x01\x00\x00\x03\x02"),
+    (b"\x00\x00\x04", b"\x00\x00\x04"),
+    (b"\x00\x00\x03", b"\x00\x00\x03\x03"),
+    (b"\x01\x00\x02\x00\x00", b"\x01\x00\x02\x00\x00"),
+])
+def test_escape_emulation(rbsp, nal):
+    assert _escape_emulation(rbsp) == nal
+
+
+@pytest.mark.parametrize("hevc, header_size", [(False, 1), (True, 2)])
+@pytest.mark.parametrize("micros", [1_760_000_000_123_456, 0x0000000100000001]) # Второе - с нулями в метке
+def test_timecode_round_trip(hevc, header_size, micros):
+    nal = timecode_sei(micros / 1_000_000, hevc=hevc)
+    assert b"\x00\x00\x00" not in nal and b"\x00\x00\x01" not in nal
+    assert parse_timecode(nal, header_size) == pytest.approx(micros / 1_000_000, abs=1e-6)
+
+
+def test_parse_timecode_skips_other_messages():
+    other = bytes((1, 2)) + b"\xaa\xbb" # pic_timing
+    big = bytes((0xFF, 0x2D)) + b"y" * 300 # Размер 300: 0xFF + 45
+    nal = b"\x06" + _escape_emulation(other + bytes((5,)) + big + bytes((5, len(TIMECODE_UUID) + 8))
+                                       + TIMECODE_UUID + struct.pack("!Q", 5_000_000) + b"\x80")
+    assert parse_timecode(nal) == 5.0
+
+
+@pytest.mark.parametrize("nal", [b"\x06\x05\x02ab\x80", b"\x06", b"\x06\x05", b"\x06\xff\xff"])
+def test_parse_timecode_without_marks(nal):
+    assert parse_timecode(nal) is None
+
+
+def test_sei_units_in_stap_a():
+    sei = timecode_sei(1.0)
+    slice_nal = b"\x65" + b"\x00" * 4
+    stap = b"\x18" + struct.pack("!H", len(slice_nal)) + slice_nal + struct.pack("!H", len(sei)) + sei
+    assert _sei_units(stap, hevc=False) == [sei]
+    assert _sei_units(sei, hevc=False) == [sei]
+    assert _sei_units(slice_nal, hevc=False) == []
+
+
+SDP = """v=0
+o=- 0 0 IN IP4 127.0.0.1
+s=Stream
+m=audio 0 RTP/AVP 97
+a=rtpmap:97 MPEG4-GENERIC/48000/2
+a=control:trackID=1
+m=video 0 RTP/AVP 96
+a=rtpmap:96 H265/90000
+a=control:trackID=0
+"""
+
+
+def test_parse_sdp_picks_video_track():
+    assert _parse_sdp(SDP, "rtsp://host:8554/cam") == ("rtsp://host:8554/cam/trackID=0", 96, 90000, "H265")
+    absolute = SDP.replace("a=control:trackID=0", "a=control:rtsp://other/cam/v")
+    assert _parse_sdp(absolute, "rtsp://host/cam")[0] == "rtsp://other/cam/v"
+    aggregate = SDP.replace("a=control:trackID=0", "a=control:*")
+    assert _parse_sdp(aggregate, "rtsp://host/cam")[0] == "rtsp://host/cam"
+
+
+def test_parse_sdp_without_video():
+    with pytest.raises(ValueError):
+        _parse_sdp("v=0\nm=audio 0 RTP/AVP 97\n", "rtsp://host/cam")
+
+
+def test_percentile():
+    ordered = list(range(100))
+    assert [_percentile(ordered, q) for q in (0.5, 0.95, 0.99)] == [50, 95, 99]
+    assert _percentile([7], 0.99) == 7
@@ -0,0 +1,90 @@
+import sys
+import logging
+import subprocess
+
+import pytest
+
+from rtmp_to_rtsp_converter.log_pipeline import DroppingQueueHandler, StderrPipeline, TokenBucket, classify
+
+
+def test_import_keeps_root_handlers():
+    # Отдельный процесс: очередь логов ставится один раз на процесс
+    code = ("import logging, sys\n"
+            "handler = logging.StreamHandler(sys.stderr)\n"
+            "logging.getLogger().addHandler(handler)\n"
+            "import rtmp_to_rtsp_converter.api, rtmp_to_rtsp_converter.converter\n"
+            "assert logging.getLogger().handlers == [handler], logging.getLogger().handlers\n")
+    subprocess.run([sys.executable, "-c", code], check=True)
+
+
+def test_install_queue_logging_moves_handlers_behind_queue():
+    code = ("import logging, sys\n"
+            "from logging.handlers import QueueHandler\n"
+            "from rtmp_to_rtsp_converter.log_pipeline import install_queue_logging\n"
+            "logger = logging.getLogger('app')\n"
+            "logger.addHandler(logging.StreamHandler(sys.stdout))\n"
+            "handler = install_queue_logging(logger)\n"
+            "assert logger.handlers == [handler] and isinstance(handler, QueueHandler)\n"
+            "assert install_queue_logging(logger) is handler\n"
+            "logger.warning('через очередь')\n")
+    result = subprocess.run([sys.executable, "-c", code], check=True, capture_output=True, text=True)
+    assert "через очередь" in result.stdout
+
+
+def test_dropping_queue_handler_counts_overflow():
+    import queue
+    handler = DroppingQueueHandler(queue.Queue(2))
+    record = logging.LogRecord("t", logging.INFO, __file__, 1, "x", None, None)
+    for _ in range(5):
+        handler.enqueue(record)
+    assert handler.dropped_records == 3
+
+
+@pytest.mark.parametrize("line, category", [
+    ("[rtsp @ 0x55] method ANNOUNCE failed: 404 Not Found", "rtsp_refused"),
+    ("[mp4 @ 0x55] Non-monotonous DTS in output stream 0:0", "timestamps"),
+    ("[h264 @ 0x55] error while decoding MB 12 40", "corrupt_packet"),
+    ("[in#0/flv @ 0x55] Error during demuxing: Connection reset by peer", "network"),
+    ("Unable to find a suitable output format", "other"),
+    ("Stream #0:0: Video: h264 (High), yuv420p, 1920x1080", None),
+])
+def test_classify(line, category):
+    assert classify(line) == category
+
+
+def test_token_bucket_refills_at_rate():
+    bucket = TokenBucket(rate=2, burst=3)
+    now = bucket.updated_at
+    assert [bucket.take(now) for _ in range(4)] == [True, True, True, False]
+    assert bucket.take(now + 0.5) and not bucket.take(now + 0.5)
+
+
+class _Logger:
+    def __init__(self):
+        self.records = []
+
+    def log(self, level, message, extra=None):
+        self.records.append((level, message))
+
+
+def test_repeats_are_collapsed():
+    logger = _Logger()
+    pipeline = StderrPipeline("s", rate=100, burst=100, logger=logger)
+    line = "[h264 @ 0x55] concealing 30 DC errors"
+    for _ in range(5):
+        pipeline.feed(line)
+    category, entries = pipeline.feed("next line")
+    assert category is None
+    assert entries == ["[FFmpeg s STDERR]: последнее сообщение повторено 4 раз", "[FFmpeg s STDERR]: next line"]
+    assert pipeline.collapsed == 4 and pipeline.counts["corrupt_packet"] == 5
+    assert [level for level, _ in logger.records] == [logging.ERROR, logging.ERROR, logging.WARNING]
+
+
+def test_rate_limit_summarises_suppressed_lines():
+    logger = _Logger()
+    pipeline = StderrPipeline("s", rate=0.001, burst=2, logger=logger)
+    for i in range(10):
+        pipeline.feed(f"Connection refused {i}")
+    assert len(logger.records) == 2 and pipeline.suppressed == 8
+    assert pipeline.counts["network"] == 10 # Счетчики категорий учитывают и пропущенные строки
+    assert pipeline.flush() == ["[FFmpeg s]: пропущено 8 строк stderr (ограничение 0.001 строк/с)"]
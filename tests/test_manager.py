@@ -0,0 +1,63 @@
+import time
+import threading
+
+from rtmp_to_rtsp_converter import manager
+from rtmp_to_rtsp_converter.manager import ConverterManager
+
+
+class _Converter:
+    """Процесс, который завершается через exit_after секунд после SIGINT (None - не завершается)."""
+
+    def __init__(self, stream_id, exit_after=0.2):
+        self.stream_id = stream_id
+        self.exit_after = exit_after
+        self.status = "запущен"
+        self.last_stop = None
+        self.signalled_at = None
+        self._stopped = threading.Event()
+
+    def get_status(self):
+        return self.status
+
+    def stop(self, wait=True):
+        self.signalled_at = time.monotonic()
+        self.status = "останавливается"
+        if self.exit_after is not None:
+            threading.Timer(self.exit_after, self._exit).start()
+
+    def _exit(self):
+        self.status = "остановлен"
+        self.last_stop = {"signal": "SIGINT", "exit_code": 0}
+        self._stopped.set()
+
+    def wait_stopped(self, timeout):
+        return self._stopped.wait(timeout)
+
+
+def _manager(converters):
+    converter_manager = ConverterManager(pack_size=1, registry=None, dedup=False)
+    for converter in converters:
+        converter_manager._converters[converter.stream_id] = converter
+    return converter_manager
+
+
+def test_stop_many_signals_all_and_waits_once():
+    converters = [_Converter(f"stream_{i}") for i in range(8)]
+    started = time.monotonic()
+    results = _manager(converters).stop_many(persist=False)
+    elapsed = time.monotonic() - started
+    assert elapsed < 1.0 # Время самого медленного потока, а не сумма 8 x 0.2 с
+    assert max(c.signalled_at for c in converters) - started < 0.1 # SIGINT получили все сразу
+    assert [r["stream_id"] for r in results] == [c.stream_id for c in converters]
+    assert all(r["ok"] and r["status"] == "остановлен" and r["signal"] == "SIGINT" for r in results)
+
+
+def test_stop_many_shared_deadline_and_unknown_stream(monkeypatch):
+    monkeypatch.setattr(manager, "STOP_DEADLINE_SEC", 0.3)
+    stuck, quick = _Converter("stream_0", exit_after=None), _Converter("stream_1", exit_after=0.05)
+    started = time.monotonic()
+    results = {r["stream_id"]: r for r in _manager([stuck, quick]).stop_many(["stream_0", "stream_1", "stream_9"], persist=False)}
+    assert time.monotonic() - started < 0.6
+    assert not results["stream_0"]["ok"] and "не завершился" in results["stream_0"]["error"]
+    assert results["stream_1"]["ok"]
+    assert results["stream_9"] == {"stream_id": "stream_9", "ok": False, "error": "Поток stream_9 не найден."}
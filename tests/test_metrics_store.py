@@ -0,0 +1,55 @@
+import numpy as np
+import pytest
+
+from rtmp_to_rtsp_converter.metrics_store import COLUMNS, MetricsStore
+
+
+def _sample(i):
+    return {"bitrate_kbit": float(i), "fps": 25.0, "cpu_percent": "N/A", "memory_mb": 50.0,
+            "dropped_frames": i, "speed": 1.0}
+
+
+def test_ring_buffer_keeps_last_rows_contiguous():
+    store = MetricsStore(tiers=((1, 4),))
+    for i in range(10):
+        store.append(1000.0 + i, _sample(i))
+    base_time, data = store.view(1)
+    assert base_time == 1000.0
+    assert data.shape == (4, len(COLUMNS))
+    assert data[:, 0].tolist() == [6.0, 7.0, 8.0, 9.0]
+    assert data.base is not None # Срез буфера, а не копия
+    assert np.isnan(data[:, COLUMNS.index("cpu_percent")]).all()
+    assert store.view(1, last=2)[1][:, 0].tolist() == [8.0, 9.0]
+
+
+def test_rollup_averages_and_keeps_max_drops():
+    store = MetricsStore(tiers=((1, 100), (10, 10)))
+    for i in range(25):
+        store.append(float(i), _sample(i))
+    _, data = store.view(10)
+    assert data[:, 0].tolist() == [0.0, 10.0] # Третья корзина еще не закрыта
+    assert data[:, COLUMNS.index("bitrate_kbit")].tolist() == [4.5, 14.5]
+    assert data[:, COLUMNS.index("dropped_frames")].tolist() == [9.0, 19.0]
+
+
+def test_latest_returns_dicts_with_none_for_missing():
+    store = MetricsStore(tiers=((1, 8),))
+    store.append(50.0, _sample(1))
+    store.append(51.0, _sample(2))
+    latest = store.latest(1)
+    assert len(latest) == 1
+    assert latest[0]["last_update_time"] == 51.0
+    assert latest[0]["bitrate_kbit"] == 2.0 and latest[0]["cpu_percent"] is None
+
+
+def test_clear_and_unknown_step():
+    store = MetricsStore(tiers=((1, 8),))
+    store.append(1.0, _sample(1))
+    store.clear()
+    assert store.base_time is None and len(store.view(1)[1]) == 0
+    with pytest.raises(ValueError):
+        store.view(10)
+
+
+def test_memory_bound_matches_header():
+    assert MetricsStore.memory_bytes_per_stream() == 7200 * len(COLUMNS) * 4 * 2
@@ -0,0 +1,117 @@
+import time
+
+import pytest
+
+from rtmp_to_rtsp_converter import ondemand
+from rtmp_to_rtsp_converter.admission import AdmissionRejected
+from rtmp_to_rtsp_converter.ondemand import OnDemandController
+from rtmp_to_rtsp_converter.state import (ConverterState, MetricsSnapshot, STATUS_IDLE, STATUS_RUNNING,
+                                          STATUS_STOPPED)
+
+
+class _Reactor:
+    def __init__(self):
+        self.periodic = []
+
+    def call_every(self, period, callback):
+        self.periodic.append(callback)
+        return object()
+
+
+class _Converter:
+    def __init__(self, name):
+        self.stream_id = name
+        self.rtsp_path = f"/{name}"
+        self.state = ConverterState(STATUS_IDLE)
+        self.metrics = MetricsSnapshot()
+        self.first_packet_at = None
+        self.stops = 0
+
+    def wait_first_packet(self, timeout):
+        return self.first_packet_at is not None
+
+    def get_status(self):
+        return self.state.label
+
+    def stop(self, wait=True):
+        self.stops += 1
+        self.state = ConverterState(STATUS_STOPPED)
+
+
+class _Manager:
+    """start_many менеджера: процесс "запускается" и сразу отправляет первый пакет."""
+
+    def __init__(self, converters, result=None):
+        self.converters = {c.stream_id: c for c in converters}
+        self.result = result
+        self.started = []
+
+    def start_many(self, stream_ids, persist=True):
+        self.started.extend(stream_ids)
+        if self.result:
+            return [self.result]
+        for stream_id in stream_ids:
+            converter = self.converters[stream_id]
+            converter.state = ConverterState(STATUS_RUNNING)
+            converter.first_packet_at = time.monotonic()
+        return [{"ok": True}]
+
+
+@pytest.fixture
+def reactor(monkeypatch):
+    reactor = _Reactor()
+    monkeypatch.setattr(ondemand, "get_reactor", lambda: reactor)
+    return reactor
+
+
+def _controller(converter, result=None, idle_sec=30.0):
+    manager = _Manager([converter], result)
+    controller = OnDemandController(manager, idle_sec=idle_sec, start_timeout=0.1)
+    controller.register(converter)
+    return controller, manager
+
+
+def test_first_reader_starts_once_and_records_cold_start(reactor):
+    converter = _Converter("cam")
+    controller, manager = _controller(converter)
+    first = controller.read(path="cam")
+    second = controller.read(stream_id="cam")
+    assert manager.started == ["cam"]
+    assert first["cold_start"] and first["cold_start_s"] is not None and not second["cold_start"]
+    assert second["readers"] == 2 and controller.cold_start_histogram.count == 1
+    assert len(reactor.periodic) == 1 # Один таймер на все потоки по запросу
+
+
+def test_idle_stream_stopped_after_last_reader(reactor):
+    converter = _Converter("cam")
+    controller, _ = _controller(converter, idle_sec=0.0)
+    controller.read(path="cam")
+    controller._check()
+    assert converter.stops == 0 # Зритель еще смотрит
+    assert controller.unread(path="cam")["readers"] == 0
+    controller._check()
+    report = controller.report()
+    assert converter.stops == 1 and report["per_stream"][0]["idle_stops"] == 1
+    assert report["cold_start"]["count"] == 1 and 0 < report["savings"]["duty_cycle"] <= 1
+
+
+def test_disabled_and_unknown_streams_rejected(reactor):
+    converter = _Converter("cam")
+    controller, manager = _controller(converter)
+    controller.set_enabled(["cam", "other"], False)
+    with pytest.raises(ValueError):
+        controller.read(path="cam")
+    with pytest.raises(KeyError):
+        controller.read(path="missing")
+    controller.forget("cam")
+    assert not controller.is_on_demand("cam") and manager.started == []
+
+
+def test_rejected_start_releases_reader(reactor):
+    converter = _Converter("cam")
+    controller, _ = _controller(converter, result={"ok": False, "rejected": True, "error": "нет емкости"})
+    with pytest.raises(AdmissionRejected):
+        controller.read(path="cam")
+    entry = controller._entry(stream_id="cam")
+    assert (entry.readers, entry.start_failures, entry.demand_at) == (0, 1, None)
+    assert entry.idle_since is not None
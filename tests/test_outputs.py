@@ -0,0 +1,104 @@
+import os
+
+import pytest
+
+from rtmp_to_rtsp_converter.manager import validate_spec
+from rtmp_to_rtsp_converter.outputs import (
+    OutputLeg, check_input_url, output_args, output_path, parse_leg_failure, tee_option, tee_spec
+)
+
+
+@pytest.mark.parametrize("url", ["rtmp://host/live/key", "RTMPS://host/app", "srt://host:9000", "rtsp://cam/stream"])
+def test_check_input_url_accepts_network_sources(url):
+    check_input_url(url)
+
+
+@pytest.mark.parametrize("url", ["/etc/passwd", "file:/etc/passwd", "file:///etc/passwd", "pipe:0",
+                                 "concat:a.flv|b.flv", "http://host/x.flv"])
+def test_check_input_url_rejects_local_sources(url):
+    with pytest.raises(ValueError):
+        check_input_url(url)
+
+
+@pytest.mark.parametrize("url", ["rtsp://host:8554/a", "rtmp://host/live/a", "srt://host:9000", "udp://239.0.0.1:1234"])
+def test_output_path_keeps_network_outputs(url, tmp_path):
+    assert output_path(url, str(tmp_path)) == url
+
+
+def test_output_path_resolves_files_inside_output_dir(tmp_path):
+    base = os.path.realpath(tmp_path)
+    assert output_path("archive/a.flv", str(tmp_path)) == os.path.join(base, "archive", "a.flv")
+    assert os.path.isdir(os.path.join(base, "archive"))
+    assert output_path("file:b.ts", str(tmp_path)) == os.path.join(base, "b.ts")
+    assert output_path(os.path.join(base, "c.mkv"), str(tmp_path)) == os.path.join(base, "c.mkv")
+
+
+@pytest.mark.parametrize("url", ["../escape.flv", "/etc/cron.d/x", "file:/tmp/x.flv", ".", "pipe:1",
+                                 "http://host/upload", "tee:a|b"])
+def test_output_path_rejects_escapes_and_protocols(url, tmp_path):
+    with pytest.raises(ValueError):
+        output_path(url, str(tmp_path))
+
+
+def test_output_path_rejects_symlink_escape(tmp_path):
+    base = tmp_path / "out"
+    base.mkdir()
+    (base / "link").symlink_to(tmp_path)
+    with pytest.raises(ValueError):
+        output_path("link/x.flv", str(base))
+
+
+def test_output_path_without_output_dir_rejects_files():
+    with pytest.raises(ValueError):
+        output_path("a.flv", "")
+
+
+@pytest.mark.parametrize("change", [{"rtmp_url": "file:/etc/passwd"}, {"rtmp_url": 5},
+                                    {"extra_outputs": ["/etc/cron.d/job"]}, {"extra_outputs": ["http://host/x"]}])
+def test_validate_spec_rejects_unsafe_urls(change):
+    spec = {"rtmp_url": "rtmp://host/live/a", "rtsp_server_host": "localhost", "rtsp_port": 8554, "rtsp_path": "a"}
+    spec.update(change)
+    with pytest.raises(ValueError):
+        validate_spec(spec)
+
+
+def test_single_output_goes_direct():
+    assert output_args(["rtsp://h:8554/a"]) == ["-c:v", "copy", "-c:a", "copy", "-f", "rtsp", "-rtsp_transport", "tcp",
+                                                "rtsp://h:8554/a"]
+    assert output_args(["/srv/out/a.mkv"], input_index=1)[:4] == ["-map", "1:v:0?", "-map", "1:a:0?"]
+    assert output_args(["/srv/out/a.mkv"])[-3:] == ["-f", "matroska", "/srv/out/a.mkv"]
+
+
+def test_tee_spec_for_several_outputs():
+    args = output_args(["rtsp://h:8554/a", "rtmp://h/live/a", "srt://h:9000"])
+    assert args[:4] == ["-map", "0:v:0?", "-map", "0:a:0?"] and args[-2] == "tee"
+    assert args[-1] == ("[f=rtsp:rtsp_transport=tcp:onfail=ignore]rtsp://h:8554/a"
+                        "|[f=flv:onfail=ignore]rtmp://h/live/a|[f=mpegts:onfail=ignore]srt://h:9000")
+
+
+def test_tee_escaping():
+    assert tee_spec(["/srv/a|b[1].ts"]) == r"[f=mpegts:onfail=ignore]/srv/a\|b\[1\].ts"
+    assert tee_option("segment_format_options", "movflags=+faststart:x") == r"segment_format_options=movflags=+faststart\\:x"
+    legs = tee_spec(["/srv/rec/%Y.mkv"], leg_options={"/srv/rec/%Y.mkv": ["f=segment", "segment_time=10"]})
+    assert legs == "[f=segment:segment_time=10:onfail=ignore]/srv/rec/%Y.mkv"
+
+
+@pytest.mark.parametrize("line, expected", [
+    ("[tee @ 0x5581] Slave muxer #1 failed: Broken pipe, continuing with 2/3 slaves.", 1),
+    ("[tee @ 0x5581] Slave muxer #7 failed: Connection refused", None),
+    ("[tee @ 0x5581] Slave 'rtmp://h/live/a': error writing header: I/O error", 1),
+    ("[tee @ 0x5581] Slave 'rtmp://other/x': error writing header", None),
+    ("Connection refused", None),
+])
+def test_parse_leg_failure(line, expected):
+    assert parse_leg_failure(line, ["rtsp://h:8554/a", "rtmp://h/live/a", "srt://h:9000"]) == expected
+
+
+def test_leg_bytes_unknown_until_exact():
+    leg = OutputLeg("rtsp://h:8554/a")
+    assert leg.as_dict()["bytes"] is None
+    leg.mark_started()
+    leg.bytes = 1234.0
+    leg.mark_failed("Broken pipe")
+    info = leg.as_dict()
+    assert (info["status"], info["error"], info["bytes"]) == ("ошибка", "Broken pipe", 1234)
@@ -0,0 +1,41 @@
+from rtmp_to_rtsp_converter.dedup import SharedIngestGroup
+from rtmp_to_rtsp_converter.packing import FIRST_OUTPUT_METRICS, PackedConverterGroup
+
+
+def _group(count):
+    specs = [{"stream_id": f"s{i}", "rtmp_url": f"rtmp://127.0.0.1/live/{i}", "rtsp_server_host": "127.0.0.1",
+              "rtsp_port": 8554, "rtsp_path": f"p{i}"} for i in range(count)]
+    group = PackedConverterGroup("pack_test", specs)
+    group._running_members = list(group.members)
+    group._metrics.set(group.metrics.replace(fps=25.0, bitrate_kbit=2000.0, total_size=4096, dropped_frames=3,
+                                             dup_frames=1, speed=1.0, out_time_us=2_000_000))
+    return group
+
+
+def test_first_output_metrics_only_for_first_member():
+    group = _group(3)
+    group._publish_system_metrics(30.0, 90.0, 100.0)
+    first, *others = [member.get_metrics() for member in group.members]
+    assert [first[key] for key in FIRST_OUTPUT_METRICS] == [25.0, 2000.0, 4096, 3, 1]
+    for metrics in others:
+        assert all(metrics[key] == "N/A" for key in FIRST_OUTPUT_METRICS)
+        assert metrics["out_time_us"] == 2_000_000 and metrics["speed"] == 1.0
+        assert metrics["cpu_percent"] == 10.0 and metrics["memory_mb"] == 30.0
+
+
+def test_group_health_uses_process_wide_metrics():
+    group = _group(2)
+    health = group._health_metrics(group.metrics)
+    assert all(health[key] == "N/A" for key in FIRST_OUTPUT_METRICS)
+    assert health["out_time_us"] == 2_000_000 and health["speed"] == 1.0
+
+    single = _group(1)
+    assert single._health_metrics(single.metrics) is single.metrics
+
+
+def test_shared_ingest_health_uses_all_metrics():
+    specs = [{"stream_id": f"d{i}", "rtmp_url": "rtmp://127.0.0.1/live/src", "rtsp_server_host": "127.0.0.1",
+              "rtsp_port": 8554, "rtsp_path": f"d{i}"} for i in range(2)]
+    group = SharedIngestGroup("shared_test", specs)
+    group._running_members = list(group.members)
+    assert group._health_metrics(group.metrics) is group.metrics
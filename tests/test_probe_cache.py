@@ -0,0 +1,67 @@
+from rtmp_to_rtsp_converter.probe_cache import (
+    CACHED_PROBE_OPTIONS, FULL_PROBE_OPTIONS, ProbeCache, StreamLayoutParser, layout_is_complete
+)
+
+URL = "rtmp://127.0.0.1/live/cam"
+
+STDERR = [
+    "[in#0/flv @ 0x55] [info] Input #0, flv, from 'rtmp://127.0.0.1/live/cam':",
+    "[in#0/flv @ 0x55] [info]   Stream #0:0: Video: h264 (High), yuv420p(progressive), 1920x1080, 25 fps",
+    "[in#0/flv @ 0x55] [info]   Stream #0:1: Audio: aac (LC), 48000 Hz, stereo, fltp",
+    "[out#0/rtsp @ 0x56] [info] Output #0, rtsp, to 'rtsp://127.0.0.1:8554/cam':",
+    "[out#0/rtsp @ 0x56] [info]   Stream #0:0: Video: h264 (High), yuv420p, 1920x1080",
+]
+LAYOUT = ((0, "video", "h264", "1920x1080"), (1, "audio", "aac", "48000Hz"))
+
+
+def _feed(session, lines):
+    for line in lines:
+        assert session.feed(line)
+
+
+def test_parser_reads_input_section_only():
+    parser = StreamLayoutParser()
+    for line in STDERR:
+        parser.feed(line)
+    assert parser.complete and parser.layout() == LAYOUT
+    assert layout_is_complete(LAYOUT)
+    assert not layout_is_complete(((0, "video", "h264", None),)) and not layout_is_complete(())
+
+
+def test_first_start_stores_layout_and_next_start_hits():
+    cache = ProbeCache(ttl=60, enabled=True)
+    session = cache.begin(URL)
+    assert not session.hit and session.input_options() == FULL_PROBE_OPTIONS
+    _feed(session, STDERR)
+    session.on_first_packet()
+    assert cache.stats() == {"entries": 1, "hits": 0, "misses": 1, "invalidations": 0}
+
+    again = cache.begin(URL)
+    assert again.hit and again.input_options() == CACHED_PROBE_OPTIONS
+    _feed(again, STDERR)
+    assert not again.needs_full_probe()
+
+
+def test_incomplete_layout_forces_full_probe():
+    cache = ProbeCache(ttl=60, enabled=True)
+    cache.store(URL, LAYOUT)
+    session = cache.begin(URL)
+    _feed(session, [STDERR[0], STDERR[1].replace(", 1920x1080", ""), STDERR[3]]) # Без аудио и размера кадра
+    assert session.needs_full_probe()
+    assert cache.stats()["entries"] == 0 and cache.stats()["invalidations"] == 1
+
+
+def test_failure_before_first_packet_and_ttl():
+    cache = ProbeCache(ttl=60, enabled=True)
+    cache.store(URL, LAYOUT)
+    cache.begin(URL).on_failed_before_first_packet()
+    assert cache.stats()["entries"] == 0
+    expired = ProbeCache(ttl=-1, enabled=True)
+    expired.store(URL, LAYOUT)
+    assert not expired.begin(URL).hit
+
+
+def test_other_lines_still_reach_the_log():
+    session = ProbeCache(ttl=60, enabled=True).begin(URL)
+    assert session.feed("[warning] Non-monotonous DTS") # Как при -loglevel error: warning в лог не идет
+    assert not session.feed("[error] Connection refused")
@@ -0,0 +1,42 @@
+import pytest
+
+from rtmp_to_rtsp_converter.outputs import output_args, tee_spec
+from rtmp_to_rtsp_converter.profiles import PROFILES, TransportProfile, get_profile
+
+
+def test_balanced_keeps_previous_command():
+    # Процессы прошлых версий узнаются при восстановлении только по совпадению команды (registry.py)
+    profile = PROFILES["balanced"]
+    assert profile.input_options("rtmp://h/live/a") == (
+        "-analyzeduration", "1000000", "-probesize", "1000000", "-fflags", "nobuffer+discardcorrupt")
+    assert output_args(["rtsp://h:8554/a"], rtsp_options=profile.rtsp_options())[-3:] == [
+        "-rtsp_transport", "tcp", "rtsp://h:8554/a"]
+
+
+def test_input_options():
+    profile = PROFILES["high_throughput"]
+    options = profile.input_options("RTMP://h/live/a", probe_options=("-analyzeduration", "200000", "-probesize", "65536"))
+    assert options == ("-analyzeduration", "200000", "-probesize", "65536", "-fflags", "discardcorrupt",
+                       "-rtmp_buffer", "3000", "-thread_queue_size", "1024")
+    assert "-rtmp_buffer" not in profile.input_options("srt://h:9000") # Буфер клиента RTMP - только для rtmp://
+
+
+def test_rtsp_options_on_direct_and_tee_legs():
+    options = PROFILES["low_latency"].rtsp_options()
+    assert options == (("rtsp_transport", "udp"), ("pkt_size", "1200"), ("max_delay", "0"))
+    assert output_args(["rtsp://h:8554/a"], rtsp_options=options)[-7:] == [
+        "-rtsp_transport", "udp", "-pkt_size", "1200", "-max_delay", "0", "rtsp://h:8554/a"]
+    assert tee_spec(["rtsp://h:8554/a", "rtmp://h/x"], rtsp_options=options).startswith(
+        "[f=rtsp:rtsp_transport=udp:pkt_size=1200:max_delay=0:onfail=ignore]rtsp://h:8554/a|")
+
+
+def test_get_profile():
+    assert get_profile("lossy_network") is PROFILES["lossy_network"]
+    assert get_profile(None).name in PROFILES
+    with pytest.raises(ValueError):
+        get_profile("nope")
+
+
+def test_multicast_transport_rejected():
+    with pytest.raises(ValueError):
+        TransportProfile("m", "m", "m", rtsp_transport="udp_multicast")
@@ -0,0 +1,56 @@
+import threading
+
+import pytest
+
+from rtmp_to_rtsp_converter.profiling import ContendedLock, Histogram, Instrumentation, SamplingProfiler
+
+
+def test_histogram_quantiles_and_buckets():
+    histogram = Histogram((0.1, 1.0))
+    for seconds in (0.05, 0.05, 0.5, 3.0):
+        histogram.observe(seconds)
+    assert histogram.quantile(0.5) == 0.1
+    assert histogram.quantile(0.75) == 1.0
+    assert histogram.quantile(0.99) == 3.0 # Последняя корзина - максимум
+    assert histogram.buckets() == [(0.1, 2), (1.0, 3), (float("inf"), 4)]
+    assert Histogram().quantile(0.5) is None and Histogram().summary()["mean_us"] is None
+
+
+def test_disabled_instrumentation_leaves_hot_path_untouched():
+    instrumentation = Instrumentation(enabled=False)
+    handler = lambda chunk: chunk
+    assert instrumentation.timed("stderr", handler) is handler
+    assert not isinstance(instrumentation.lock("state"), ContendedLock)
+    instrumentation.observe("popen", 0.5)
+    assert instrumentation.histograms() == {} and "paths" not in instrumentation.report()
+
+
+def test_timed_handler_counts_lines():
+    instrumentation = Instrumentation(enabled=True)
+    handler = instrumentation.timed("progress", lambda chunk: len(chunk), count_lines=True)
+    assert handler(b"fps=25\nbitrate=1\n") == 17
+    assert instrumentation.histograms()["progress"].count == 1
+    assert instrumentation.counters() == {"progress_lines": 2}
+
+
+def test_lock_stats_sum_same_name_locks():
+    instrumentation = Instrumentation(enabled=True)
+    first, second = instrumentation.lock("ref"), instrumentation.lock("ref")
+    with first:
+        waiter = threading.Thread(target=first.acquire, kwargs={"timeout": 0.01}) # Занята - ожидание и таймаут
+        waiter.start()
+        waiter.join()
+    with second:
+        pass
+    acquisitions, contended, wait = instrumentation.lock_stats()["ref"]
+    assert (acquisitions, contended, wait.count) == (2, 1, 1)
+    assert instrumentation.report()["locks"]["ref"]["contention_ratio"] == 0.5
+
+
+def test_profiler_rejects_bad_rate():
+    profiler = SamplingProfiler()
+    with pytest.raises(ValueError):
+        profiler.start(hz=0)
+    with pytest.raises(ValueError):
+        profiler.start(hz="fast")
+    assert not profiler.running
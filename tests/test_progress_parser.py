@@ -0,0 +1,85 @@
+import os
+
+import pytest
+
+from rtmp_to_rtsp_converter.progress_parser import ProgressParser
+
+CAPTURE_PATH = os.path.join(os.path.dirname(os.path.dirname(__file__)), "benchmarks", "data", "progress_capture.txt")
+
+BLOCK_1 = (b"frame=12\nfps=0.00\nstream_0_0_q=-1.0\nbitrate=N/A\ntotal_size=160000\nout_time_us=500000\n"
+           b"dup_frames=0\ndrop_frames=0\nspeed=  N/A\nprogress=continue\n")
+BLOCK_2 = (b"frame=24\nfps=24.00\nstream_0_0_q=-1.0\nbitrate=2560.0kbits/s\ntotal_size=320000\nout_time_us=1000000\n"
+           b"dup_frames=0\ndrop_frames=0\nspeed=1.01x\nprogress=end\n")
+
+
+def _parse(chunks):
+    snapshots = []
+    parser = ProgressParser(snapshots.append)
+    for chunk in chunks:
+        parser.feed(chunk)
+    return parser, snapshots
+
+
+def test_block_snapshot():
+    parser, snapshots = _parse([BLOCK_1 + BLOCK_2])
+    assert parser.blocks == 2
+    assert snapshots[0] == {"fps": 0.0, "total_size": 160000, "out_time_us": 500000, "dup_frames": 0,
+                            "dropped_frames": 0, "speed": "N/A"}
+    # Второй блок публикует только изменившиеся значения
+    assert snapshots[1] == {"fps": 24.0, "bitrate_kbit": 2560.0, "total_size": 320000, "out_time_us": 1000000, "speed": 1.01}
+
+
+@pytest.mark.parametrize("size", [1, 2, 3, 7, 13, 64])
+def test_chunk_boundaries_do_not_change_result(size):
+    data = BLOCK_1 + BLOCK_2
+    _, whole = _parse([data])
+    parser, split = _parse([data[i:i + size] for i in range(0, len(data), size)])
+    assert split == whole
+    assert parser.blocks == 2
+
+
+def test_incomplete_block_waits_for_newline():
+    parser, snapshots = _parse([BLOCK_1[:-1]])
+    assert parser.blocks == 0 and snapshots == []
+    parser.feed(b"\n")
+    assert parser.blocks == 1 and snapshots[0]["total_size"] == 160000
+
+
+def test_unknown_keys_and_lookalikes_ignored():
+    _, snapshots = _parse([b"xfps=99\nout_time_us_extra=1\ntotal_size=10\nmyprogress=end\nprogress=continue\n"])
+    assert snapshots == [{"total_size": 10}]
+
+
+def test_unchanged_block_publishes_nothing():
+    parser, snapshots = _parse([BLOCK_1, BLOCK_1])
+    assert parser.blocks == 2 and len(snapshots) == 1
+
+
+def test_reset_republishes_values():
+    parser, snapshots = _parse([BLOCK_1])
+    parser.feed(BLOCK_1[:20])
+    parser.reset()
+    parser.feed(BLOCK_1)
+    assert len(snapshots) == 2 and snapshots[1] == snapshots[0]
+
+
+def test_crlf_values():
+    _, snapshots = _parse([BLOCK_2.replace(b"\n", b"\r\n")])
+    assert snapshots[0]["fps"] == 24.0 and snapshots[0]["speed"] == 1.01 and snapshots[0]["total_size"] == 320000
+
+
+def test_capture_matches_line_by_line_reference():
+    with open(CAPTURE_PATH, "rb") as f:
+        raw = f.read()
+    expected, current = [], {}
+    for line in raw.splitlines():
+        key, _, value = line.partition(b"=")
+        if key == b"progress":
+            expected.append(current)
+            current = {}
+        elif key in (b"total_size", b"out_time_us"):
+            current[key.decode()] = int(value)
+    _, snapshots = _parse([raw[i:i + 4096] for i in range(0, len(raw), 4096)])
+    assert len(snapshots) == len(expected)
+    for snapshot, block in zip(snapshots, expected):
+        assert {key: snapshot.get(key, value) for key, value in block.items()} == block
@@ -0,0 +1,80 @@
+import os
+import sys
+import threading
+import subprocess
+
+import pytest
+
+from rtmp_to_rtsp_converter.reactor import MAX_LINE_BYTES, READ_CHUNK_SIZE, FFmpegIOReactor
+
+
+@pytest.fixture
+def reactor():
+    reactor = FFmpegIOReactor(name="test_reactor")
+    yield reactor
+    reactor.stop()
+
+
+def _pipe():
+    read_fd, write_fd = os.pipe()
+    return os.fdopen(read_fd, "rb", buffering=0), write_fd
+
+
+def test_lines_split_across_reads_and_tail_flushed_on_close(reactor):
+    pipe, write_fd = _pipe()
+    lines, closed = [], threading.Event()
+    reactor.add_pipe(pipe, lines.append, closed.set)
+    os.write(write_fd, b"frame=1\nfr")
+    os.write(write_fd, b"ame=2\nbroken")
+    os.close(write_fd)
+    assert closed.wait(2.0)
+    assert lines == [b"frame=1", b"frame=2", b"broken"]
+    assert reactor.watched_pipes_count() == 0
+
+
+def test_long_line_without_newline_is_split(reactor):
+    pipe, write_fd = _pipe()
+    lines, closed = [], threading.Event()
+    reactor.add_pipe(pipe, lines.append, closed.set)
+    writer = threading.Thread(target=lambda: (os.write(write_fd, b"x" * (4 * MAX_LINE_BYTES) + b"\nend\n"), os.close(write_fd)))
+    writer.start()
+    assert closed.wait(5.0)
+    writer.join()
+    assert b"".join(lines[:-1]) == b"x" * (4 * MAX_LINE_BYTES) and lines[-1] == b"end"
+    assert max(map(len, lines)) <= MAX_LINE_BYTES + READ_CHUNK_SIZE # Не больше лимита и одного прочитанного фрагмента
+
+
+def test_raw_pipe_gets_chunks(reactor):
+    pipe, write_fd = _pipe()
+    chunks, closed = [], threading.Event()
+    reactor.add_pipe(pipe, chunks.append, closed.set, raw=True)
+    os.write(write_fd, b"progress=continue\nfps=")
+    os.close(write_fd)
+    assert closed.wait(2.0)
+    assert b"".join(chunks) == b"progress=continue\nfps="
+
+
+def test_timers_and_failing_callback(reactor):
+    fired, ticks, done = [], [], threading.Event()
+    reactor.call_later(0.01, lambda: fired.append("cancelled")).cancel()
+    reactor.call_later(0.01, lambda: 1 / 0) # Ошибка обработчика не останавливает цикл
+
+    def tick():
+        ticks.append(1)
+        if len(ticks) == 3:
+            handle.cancel()
+            reactor.call_later(0.05, done.set) # Отмененный периодический таймер успел бы сработать еще раз
+
+    handle = reactor.call_every(0.01, tick)
+    reactor.call_soon(fired.append, "soon")
+    assert done.wait(2.0)
+    assert len(ticks) == 3 and fired == ["soon"]
+
+
+@pytest.mark.skipif(not hasattr(os, "pidfd_open"), reason="нужен pidfd (Linux 5.3+)")
+def test_process_exit_reported(reactor):
+    process = subprocess.Popen([sys.executable, "-c", "pass"])
+    exited = threading.Event()
+    assert reactor.add_process_exit(process.pid, exited.set)
+    assert exited.wait(5.0)
+    assert process.wait(1.0) == 0
@@ -0,0 +1,74 @@
+import os
+
+import pytest
+
+from rtmp_to_rtsp_converter import recording
+from rtmp_to_rtsp_converter.recording import INDEX_FILE, SegmentIndex, SegmentRecorder
+
+
+def _index(tmp_path, starts=(100, 106, 112, 130)):
+    index = SegmentIndex(str(tmp_path))
+    for start in starts:
+        assert index.add(float(start), 6.0, 1000, f"{start}.ts")
+    return index
+
+
+def test_find_and_between(tmp_path):
+    index = _index(tmp_path)
+    assert index.find(107.5)["path"] == os.path.join(str(tmp_path), "106.ts")
+    assert index.find(120.0) is None # Разрыв записи
+    assert index.find(99.0) is None
+    assert [s["start"] for s in index.between(104.0, 113.0)] == [100.0, 106.0, 112.0]
+    assert [s["start"] for s in index.between(118.0, 200.0)] == [130.0]
+    assert not index.add(100.0, 6.0, 1000, "100.ts") # Повтор не добавляется
+
+
+def test_reload_skips_truncated_row(tmp_path):
+    index = _index(tmp_path)
+    index.close()
+    with open(tmp_path / INDEX_FILE, "a", encoding="utf-8") as f:
+        f.write("136.000\t6.0") # Строка, недописанная при аварийном завершении
+    reloaded = SegmentIndex(str(tmp_path))
+    reloaded.load()
+    assert len(reloaded) == 4 and reloaded.total_bytes == 4000 and reloaded.oldest() == 100.0
+
+
+def test_expire_by_time_and_size_compacts_index(tmp_path):
+    index = _index(tmp_path)
+    expired = index.expire(now=160.0, retention_sec=50.0, retention_bytes=0)
+    assert expired == [os.path.join(str(tmp_path), "100.ts")]
+    expired = index.expire(now=160.0, retention_sec=0, retention_bytes=1500)
+    assert [os.path.basename(p) for p in expired] == ["106.ts", "112.ts"]
+    assert len(index) == 1 and index.total_bytes == 1000
+    index.close()
+    with open(tmp_path / INDEX_FILE, encoding="utf-8") as f:
+        assert f.read() == "130.000\t6.000\t1000\t130.ts\n" # Устаревших строк больше живых - файл переписан
+
+
+def test_recorder_reads_segment_list_incrementally(tmp_path, monkeypatch):
+    deleted = []
+
+    class _Deleter:
+        def delete(self, paths):
+            deleted.extend(paths)
+
+    monkeypatch.setattr(recording, "get_segment_deleter", lambda: _Deleter())
+    recorder = SegmentRecorder("cam", base_dir=str(tmp_path), retention_sec=0, retention_mb=0)
+    recorder.prepare()
+    for name in ("1000.ts", "1006.ts"):
+        (tmp_path / "cam" / name).write_bytes(b"x" * 188)
+    with open(recorder.list_path, "wb") as f:
+        f.write(b"1000.ts,0.000000,6.000000\n1006.ts,0.0000")
+    recorder.poll(1007.0)
+    assert recorder.metrics()["dvr_segments"] == 1 and recorder.last_latency == 1.0
+    with open(recorder.list_path, "ab") as f:
+        f.write(b"00,5.500000\n")
+    recorder.poll(1012.0)
+    assert recorder.find(1010.0)["duration"] == 5.5
+    assert (recorder.bytes_written, recorder.segments_written) == (376, 2)
+    assert "segment_list_type=csv" in recorder.leg_options() and not deleted
+
+
+def test_unknown_segment_format_rejected(tmp_path):
+    with pytest.raises(ValueError):
+        SegmentRecorder("cam", base_dir=str(tmp_path), segment_format="avi")
@@ -0,0 +1,62 @@
+import sqlite3
+
+import pytest
+
+from rtmp_to_rtsp_converter.registry import (
+    StreamRegistry, AdoptedProcess, matches_command, DESIRED_RUNNING, DESIRED_STOPPED, ADOPTED_EXIT_CODE
+)
+
+URL = "rtmp://127.0.0.1/live/a"
+TAIL = ["-map", "0:v:0?", "-c", "copy", "-f", "rtsp", "-rtsp_transport", "tcp", "rtsp://127.0.0.1:8554/a"]
+
+
+def _argv(inputs, tail=TAIL):
+    argv = ["ffmpeg", "-hide_banner", "-progress", "pipe:1"]
+    for url in inputs:
+        argv += ["-analyzeduration", "200000", "-i", url]
+    return argv + tail
+
+
+def test_matches_command_same_stream():
+    assert matches_command(_argv([URL]), URL, TAIL)
+
+
+@pytest.mark.parametrize("argv", [
+    _argv(["rtmp://127.0.0.1/live/b"]),
+    _argv([URL, "rtmp://127.0.0.1/live/b"]), # Упакованная группа с этим входом - другой процесс
+    _argv([URL], TAIL[:-1] + ["rtsp://127.0.0.1:8554/b"]),
+    _argv([URL], ["-f", "tee", "[f=rtsp]rtsp://127.0.0.1:8554/a|[f=flv]rtmp://x/y"]),
+    ["ffmpeg", "-progress", "pipe:1", "-i"], # Обрезанная команда
+])
+def test_matches_command_rejects_other_processes(argv):
+    assert not matches_command(argv, URL, TAIL)
+
+
+def test_registry_round_trip(tmp_path):
+    registry = StreamRegistry(str(tmp_path / "sub" / "registry.sqlite3"))
+    specs = [{"stream_id": f"s{i}", "rtmp_url": f"rtmp://h/live/{i}", "name": "камера"} for i in range(3)]
+    registry.put_many(specs)
+    registry.put_many([dict(specs[0], rtmp_url="rtmp://h/live/new")], desired=DESIRED_STOPPED)
+    registry.set_desired_many(["s1"], DESIRED_STOPPED)
+    registry.delete("s2")
+    registry.close()
+
+    loaded = StreamRegistry(str(tmp_path / "sub" / "registry.sqlite3")).load()
+    assert [(spec["stream_id"], desired) for spec, desired in loaded] == [("s0", DESIRED_STOPPED), ("s1", DESIRED_STOPPED)]
+    assert loaded[0][0]["rtmp_url"] == "rtmp://h/live/new" # Обновление не меняет порядок создания
+    assert loaded[1][0]["name"] == "камера"
+
+
+def test_registry_write_is_atomic(tmp_path):
+    registry = StreamRegistry(str(tmp_path / "registry.sqlite3"))
+    registry.put_many([{"stream_id": "a"}])
+    with pytest.raises(sqlite3.Error):
+        registry.put_many([{"stream_id": "b"}, {"stream_id": {"bad": 1}}]) # Вторую строку SQLite не примет
+    assert [spec["stream_id"] for spec, _ in registry.load()] == ["a"]
+    assert registry.load()[0][1] == DESIRED_RUNNING
+
+
+def test_adopted_process_detects_pid_reuse():
+    process = AdoptedProcess(1, starttime=-1) # PID 1 жив, но время запуска другое
+    assert process.poll() == ADOPTED_EXIT_CODE
+    process.kill() # Завершенному процессу сигналы не отправляются
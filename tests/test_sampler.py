@@ -0,0 +1,83 @@
+import os
+import sys
+import logging
+import subprocess
+
+import pytest
+
+from rtmp_to_rtsp_converter import sampler
+from rtmp_to_rtsp_converter.sampler import SystemMetricsSampler, read_proc_sample
+
+pytestmark = pytest.mark.skipif(not os.path.isdir("/proc/self"), reason="нужен /proc")
+
+
+class _Timer:
+    def __init__(self):
+        self.cancelled = False
+
+    def cancel(self):
+        self.cancelled = True
+
+
+class _Reactor:
+    def __init__(self):
+        self.timers = []
+
+    def call_every(self, interval, callback):
+        self.timers.append(_Timer())
+        return self.timers[-1]
+
+
+class _Converter:
+    def __init__(self):
+        self.published = []
+        self.lost = []
+
+    def _publish_system_metrics(self, cpu_percent, memory_mb, wall_time):
+        self.published.append((cpu_percent, memory_mb))
+
+    def _on_system_metrics_lost(self, pid):
+        self.lost.append(pid)
+
+
+def _exited_pid():
+    process = subprocess.Popen([sys.executable, "-c", "pass"])
+    process.wait()
+    return process.pid
+
+
+def test_read_proc_sample():
+    cpu_ticks, starttime, rss_bytes = read_proc_sample(os.getpid())
+    assert cpu_ticks >= 0 and starttime > 0 and rss_bytes > 0
+    assert read_proc_sample(_exited_pid()) is None
+
+
+def test_permission_denied_is_missing_sample(monkeypatch, caplog):
+    def denied(path):
+        raise PermissionError(13, "Permission denied", path)
+
+    monkeypatch.setattr(sampler, "_read_file", denied)
+    with caplog.at_level(logging.WARNING):
+        assert read_proc_sample(123456) is None
+        assert read_proc_sample(123456) is None
+    assert len([r for r in caplog.records if "123456" in r.getMessage()]) == 1 # Сообщение - один раз на PID
+
+
+def test_single_pass_publishes_and_drops_dead_processes():
+    reactor = _Reactor()
+    sampler = SystemMetricsSampler(reactor=reactor, period=1.0, use_proc=True)
+    alive, dead = _Converter(), _Converter()
+    passes = []
+    sampler.add_pass_listener(passes.append)
+    sampler.register(os.getpid(), alive)
+    dead_pid = _exited_pid()
+    sampler.register(dead_pid, dead)
+    assert len(reactor.timers) == 1 # Один таймер на все процессы
+    sampler._sample_all()
+    cpu_percent, memory_mb = alive.published[0]
+    assert isinstance(cpu_percent, float) and memory_mb > 0
+    assert dead.lost == [dead_pid] and sampler.tracked_pids() == [os.getpid()]
+    assert len(passes) == 1
+    sampler.unregister(os.getpid())
+    sampler._sample_all()
+    assert reactor.timers[0].cancelled and len(passes) == 1 # Без процессов таймер снимается
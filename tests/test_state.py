@@ -0,0 +1,81 @@
+import threading
+
+import pytest
+
+from rtmp_to_rtsp_converter.state import (
+    AtomicRef, ConverterState, MetricsSnapshot, TRANSITIONS, METRIC_FIELDS,
+    STATUS_IDLE, STATUS_STARTING, STATUS_RUNNING, STATUS_STOPPING, STATUS_STOPPED, STATUS_FAILED,
+    STATUS_START_FAILED, STATUS_RESTARTING
+)
+
+
+def test_transitions_table_is_closed():
+    for status, targets in TRANSITIONS.items():
+        assert targets <= set(TRANSITIONS), status
+
+
+@pytest.mark.parametrize("path", [
+    [STATUS_STARTING, STATUS_RUNNING, STATUS_STOPPING, STATUS_STOPPED],
+    [STATUS_STARTING, STATUS_START_FAILED, STATUS_RESTARTING, STATUS_STARTING],
+    [STATUS_RUNNING, STATUS_FAILED, STATUS_RESTARTING, STATUS_STOPPED],
+])
+def test_allowed_paths(path):
+    ref = AtomicRef(ConverterState(STATUS_IDLE))
+    for status in path:
+        assert ref.transition(status)
+    assert ref.get().status == path[-1]
+
+
+@pytest.mark.parametrize("start, target", [
+    (STATUS_STOPPED, STATUS_RUNNING),
+    (STATUS_STOPPING, STATUS_RUNNING),
+    (STATUS_STOPPED, STATUS_FAILED),
+])
+def test_invalid_transition_keeps_state(start, target):
+    ref = AtomicRef(ConverterState(start))
+    before = ref.get()
+    assert not ref.transition(target)
+    assert ref.get() is before
+
+
+def test_allowed_from_and_same_status():
+    ref = AtomicRef(ConverterState(STATUS_RUNNING))
+    assert not ref.transition(STATUS_STOPPING, allowed_from=(STATUS_STARTING,))
+    version = ref.version
+    assert ref.transition(STATUS_RUNNING) and ref.version == version # Тот же статус - без новой публикации
+
+
+def test_failed_label_includes_exit_code():
+    ref = AtomicRef(ConverterState(STATUS_RUNNING))
+    assert ref.transition(STATUS_FAILED, exit_code=1)
+    assert ref.get().label == f"{STATUS_FAILED} (код 1)"
+
+
+def test_snapshots_are_immutable():
+    snapshot = MetricsSnapshot(fps=25.0)
+    with pytest.raises(AttributeError):
+        snapshot.fps = 30.0
+    changed = snapshot.replace(fps=30.0)
+    assert snapshot.fps == 25.0 and changed["fps"] == 30.0
+    assert set(changed.as_dict()) == set(METRIC_FIELDS)
+    with pytest.raises(TypeError):
+        snapshot.replace(unknown=1)
+    with pytest.raises(AttributeError):
+        ConverterState(STATUS_IDLE).status = STATUS_RUNNING
+
+
+def test_concurrent_updates_of_different_fields_are_not_lost():
+    ref = AtomicRef(MetricsSnapshot())
+
+    def write(field):
+        for i in range(1, 5001):
+            ref.update(**{field: i})
+
+    threads = [threading.Thread(target=write, args=(field,)) for field in ("dropped_frames", "dup_frames", "total_size")]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    snapshot = ref.get()
+    assert (snapshot.dropped_frames, snapshot.dup_frames, snapshot.total_size) == (5000, 5000, 5000)
+    assert ref.version == 15000
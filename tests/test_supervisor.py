@@ -0,0 +1,122 @@
+import time
+import threading
+
+from rtmp_to_rtsp_converter.state import ConverterState, STATUS_FLAPPING, STATUS_RESTARTING, STATUS_RUNNING
+from rtmp_to_rtsp_converter.supervisor import RestartPolicy, RestartSupervisor
+
+
+class _Timer:
+    def __init__(self, delay, callback):
+        self.delay = delay
+        self.callback = callback
+        self.cancelled = False
+
+    def cancel(self):
+        self.cancelled = True
+
+
+class _Reactor:
+    """Таймеры без цикла: тест срабатывает их сам."""
+
+    def __init__(self):
+        self.timers = []
+
+    def call_later(self, delay, callback):
+        timer = _Timer(delay, callback)
+        self.timers.append(timer)
+        return timer
+
+    def fire(self, delay=None):
+        due = [t for t in self.timers if not t.cancelled and (delay is None or t.delay == delay)]
+        self.timers = [t for t in self.timers if t not in due]
+        for timer in due:
+            timer.callback()
+
+
+class _Converter:
+    def __init__(self, name, policy):
+        self.stream_id = name
+        self.restart_policy = policy
+        self._stop_event = threading.Event()
+        self.started_at = time.time()
+        self.auto_restarts = 0
+        self.statuses = []
+        self.state = ConverterState(STATUS_RUNNING)
+        self.started = threading.Event()
+
+    def transition(self, status):
+        self.statuses.append(status)
+
+    def start(self, restart=False):
+        self.started.set()
+
+
+def _policy(**changes):
+    values = dict(enabled=True, base_delay=1.0, max_delay=8.0, multiplier=2.0, jitter=0.0, flap_threshold=3)
+    values.update(changes)
+    return RestartPolicy(**values)
+
+
+def test_backoff_is_capped_and_jittered():
+    assert [_policy().delay(attempt) for attempt in range(6)] == [1.0, 2.0, 4.0, 8.0, 8.0, 8.0]
+    jittered = _policy(jitter=0.5)
+    assert all(1.0 < jittered.delay(1) <= 2.0 for _ in range(100)) # Джиттер только уменьшает задержку
+
+
+def test_restart_is_scheduled_and_run():
+    reactor = _Reactor()
+    supervisor = RestartSupervisor(reactor, max_concurrent=1)
+    converter = _Converter("a", _policy())
+    supervisor.on_exit(converter, 1)
+    assert converter.statuses == [STATUS_RESTARTING]
+    assert [t.delay for t in reactor.timers] == [1.0]
+    reactor.fire()
+    assert converter.started.wait(2)
+    assert converter.auto_restarts == 1 and supervisor.total_restarts == 1
+    supervisor.on_recovered(converter)
+    assert supervisor.stats()["in_flight"] == 0
+    assert converter.last_recovery_seconds >= 0
+
+
+def test_concurrent_restarts_are_limited():
+    reactor = _Reactor()
+    supervisor = RestartSupervisor(reactor, max_concurrent=2)
+    converters = [_Converter(name, _policy(settle_timeout=60.0)) for name in "abc"]
+    for converter in converters:
+        supervisor.on_exit(converter, 1)
+    reactor.fire(delay=1.0)
+    assert all(converter.started.wait(2) for converter in converters[:2])
+    assert supervisor.stats()["in_flight"] == 2 and supervisor.stats()["queued"] == 1
+    assert not converters[2].started.is_set()
+    supervisor.on_recovered(converters[0]) # Освободился слот - запускается ожидающий
+    assert converters[2].started.wait(2)
+
+
+def test_flapping_uses_cooldown():
+    reactor = _Reactor()
+    supervisor = RestartSupervisor(reactor, max_concurrent=1)
+    converter = _Converter("a", _policy(flap_cooldown=300.0))
+    for _ in range(3):
+        supervisor.on_exit(converter, 1)
+        reactor.fire()
+        assert converter.started.wait(2)
+        converter.started.clear()
+        supervisor.on_recovered(converter)
+    supervisor.on_exit(converter, 1)
+    assert converter.statuses[-1] == STATUS_FLAPPING and supervisor.is_flapping(converter)
+    assert reactor.timers[-1].delay == 300.0
+
+
+def test_cancel_and_disabled_policy():
+    reactor = _Reactor()
+    supervisor = RestartSupervisor(reactor)
+    converter = _Converter("a", _policy())
+    supervisor.on_exit(converter, 1)
+    supervisor.cancel(converter)
+    assert reactor.timers[0].cancelled and supervisor.stats()["scheduled"] == 0
+
+    disabled = _Converter("b", _policy(enabled=False))
+    supervisor.on_exit(disabled, 1)
+    clean = _Converter("c", _policy(restart_on_clean_exit=False))
+    supervisor.on_exit(clean, 0)
+    assert len(reactor.timers) == 1 and not disabled.statuses and not clean.statuses